@@ -0,0 +1,567 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import math
+import sys
+from concurrent.futures import Executor, Future
+from typing import Optional, List
+
+from market_maker_keeper.band import Bands
+from market_maker_keeper.feed import EmptyFeed
+from market_maker_keeper.limit import History
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.price_feed import Price
+from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.tick_file import TickFileReader, Tick
+from market_maker_keeper.util import setup_logging
+from pymaker.numeric import Wad
+
+
+class VirtualClock:
+    """Clock which only moves forward when told to, used instead of `time.time` when backtesting."""
+
+    def __init__(self, now: float):
+        assert(isinstance(now, float))
+
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance_to(self, timestamp: float):
+        assert(isinstance(timestamp, float))
+
+        self.now = max(self.now, timestamp)
+
+
+class SynchronousExecutor(Executor):
+    """Executor running each submitted function straight away, in the calling thread.
+
+    Used by the backtester so that `OrderBookManager` places and cancels orders deterministically,
+    without any background threads.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exception:
+            future.set_exception(exception)
+
+        return future
+
+
+class SimulatedOrder:
+    """Order resting on the simulated exchange.
+
+    Attributes:
+        order_id: Id of the order.
+        timestamp: Time when the order has been placed.
+        is_sell: `True` for sell orders, `False` for buy orders.
+        price: Price of the order (in buy tokens per one sell token).
+        amount: Amount of the order (in sell tokens, for both buy and sell orders).
+    """
+
+    def __init__(self, order_id: int, timestamp: float, is_sell: bool, price: Wad, amount: Wad):
+        assert(isinstance(order_id, int))
+        assert(isinstance(timestamp, float))
+        assert(isinstance(is_sell, bool))
+        assert(isinstance(price, Wad))
+        assert(isinstance(amount, Wad))
+
+        self.order_id = order_id
+        self.timestamp = timestamp
+        self.is_sell = is_sell
+        self.price = price
+        self.amount = amount
+
+    @property
+    def sell_to_buy_price(self) -> Wad:
+        return self.price
+
+    @property
+    def buy_to_sell_price(self) -> Wad:
+        return self.price
+
+    @property
+    def remaining_sell_amount(self) -> Wad:
+        return self.amount if self.is_sell else self.amount * self.price
+
+    def __repr__(self):
+        return f"SimulatedOrder({'sell' if self.is_sell else 'buy'} {self.amount} @ {self.price}, id={self.order_id})"
+
+
+class SimulatedExchange:
+    """Exchange with a simple matching engine, used for backtesting.
+
+    Our orders are matched against the market price fed by `match()`. A sell order gets filled
+    in full once the market buy price reaches its price, a buy order gets filled in full once
+    the market sell price drops to its price. Fills happen at the price of our orders, as we are
+    always the maker. The fee is charged on the received amount.
+
+    Order placement and cancellation take effect `latency` seconds after they have been requested,
+    so orders can still get filled while they are being cancelled. Funds get locked as soon as
+    placement is requested. Placement gets rejected if there are not enough free funds.
+
+    Attributes:
+        clock: Clock used to timestamp orders and fills.
+        buy_balance: Initial balance of the buy token.
+        sell_balance: Initial balance of the sell token.
+        latency: Delay (in seconds) after which placement and cancellation take effect.
+        fee: Fee charged on each fill, as a fraction of the received amount.
+    """
+
+    def __init__(self, clock, buy_balance: Wad, sell_balance: Wad, latency: float = 0.0, fee: float = 0.0):
+        assert(callable(clock))
+        assert(isinstance(buy_balance, Wad))
+        assert(isinstance(sell_balance, Wad))
+        assert(isinstance(latency, float))
+        assert(isinstance(fee, float))
+
+        self.clock = clock
+        self.buy_balance = buy_balance
+        self.sell_balance = sell_balance
+        self.latency = latency
+        self.fee = Wad.from_number(fee)
+
+        self.orders = {}
+        self.fills = []
+        self.api_calls = {'get_orders': 0, 'get_balances': 0, 'place_order': 0, 'cancel_order': 0}
+        self.orders_placed = 0
+        self.orders_cancelled = 0
+        self.orders_rejected = 0
+        self.fees_paid = {'buy': Wad(0), 'sell': Wad(0)}
+
+        self.version = 0  # incremented on each change of our orders
+
+        self._locked_buy = Wad(0)
+        self._locked_sell = Wad(0)
+        self._pending = []
+        self._sequence = itertools.count()
+        self._next_order_id = itertools.count(1)
+
+    def get_orders(self) -> List[SimulatedOrder]:
+        self.api_calls['get_orders'] += 1
+        return list(self.orders.values())
+
+    def get_balances(self) -> dict:
+        self.api_calls['get_balances'] += 1
+        return {'buy': self.buy_balance - self._locked_buy, 'sell': self.sell_balance - self._locked_sell}
+
+    def place_order(self, is_sell: bool, price: Wad, amount: Wad) -> Optional[SimulatedOrder]:
+        """Requests placement of a new order.
+
+        Args:
+            is_sell: `True` for sell orders, `False` for buy orders.
+            price: Price of the order (in buy tokens per one sell token).
+            amount: Amount of the order (in sell tokens, for both buy and sell orders).
+
+        Returns:
+            The new order, or `None` if there were not enough free funds to place it.
+        """
+        assert(isinstance(is_sell, bool))
+        assert(isinstance(price, Wad))
+        assert(isinstance(amount, Wad))
+
+        self.api_calls['place_order'] += 1
+
+        if is_sell:
+            if amount > self.sell_balance - self._locked_sell:
+                self.orders_rejected += 1
+                return None
+
+            self._locked_sell += amount
+        else:
+            if amount * price > self.buy_balance - self._locked_buy:
+                self.orders_rejected += 1
+                return None
+
+            self._locked_buy += amount * price
+
+        order = SimulatedOrder(next(self._next_order_id), self.clock(), is_sell, price, amount)
+        self._schedule(lambda: self._activate(order))
+        self.orders_placed += 1
+
+        return order
+
+    def cancel_order(self, order_id: int) -> bool:
+        assert(isinstance(order_id, int))
+
+        self.api_calls['cancel_order'] += 1
+        self._schedule(lambda: self._cancel(order_id))
+
+        return True
+
+    def next_pending_time(self) -> float:
+        """Returns the time when the next requested placement or cancellation takes effect."""
+        return self._pending[0][0] if len(self._pending) > 0 else float('inf')
+
+    def advance(self):
+        """Applies placements and cancellations which should have taken effect by now."""
+        now = self.clock()
+        while len(self._pending) > 0 and self._pending[0][0] <= now:
+            heapq.heappop(self._pending)[2]()
+
+    def match(self, price: Price):
+        """Fills our orders crossed by the market price."""
+        assert(isinstance(price, Price))
+
+        self.advance()
+
+        for order in list(self.orders.values()):
+            if order.is_sell and price.buy_price is not None and price.buy_price >= order.price:
+                self._fill(order)
+            elif not order.is_sell and price.sell_price is not None and price.sell_price <= order.price:
+                self._fill(order)
+
+    def _schedule(self, function):
+        self.version += 1
+        heapq.heappush(self._pending, (self.clock() + self.latency, next(self._sequence), function))
+
+    def _activate(self, order: SimulatedOrder):
+        self.orders[order.order_id] = order
+        self.version += 1
+
+    def _cancel(self, order_id: int):
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            self._unlock(order)
+            self.orders_cancelled += 1
+            self.version += 1
+
+    def _unlock(self, order: SimulatedOrder):
+        if order.is_sell:
+            self._locked_sell -= order.amount
+        else:
+            self._locked_buy -= order.amount * order.price
+
+    def _fill(self, order: SimulatedOrder):
+        self.version += 1
+        del self.orders[order.order_id]
+        self._unlock(order)
+
+        if order.is_sell:
+            received = order.amount * order.price
+            fee = received * self.fee
+            self.sell_balance -= order.amount
+            self.buy_balance += received - fee
+            self.fees_paid['buy'] += fee
+        else:
+            received = order.amount
+            fee = received * self.fee
+            self.buy_balance -= order.amount * order.price
+            self.sell_balance += received - fee
+            self.fees_paid['sell'] += fee
+
+        self.fills.append({'timestamp': self.clock(),
+                           'orderId': order.order_id,
+                           'isSell': order.is_sell,
+                           'price': float(order.price),
+                           'amount': float(order.amount),
+                           'fee': float(fee)})
+
+
+class Backtest:
+    """Drives the real `Bands`, `SideLimits` and `OrderBookManager` code against recorded prices.
+
+    Mirrors the order synchronization logic of the centralized exchange keepers (i.e. `OkexMarketMakerKeeper`),
+    but uses a `SimulatedExchange` instead of a real one and a `VirtualClock` instead of real time, so
+    months of recorded prices can be processed without any sleeping. Order book refreshes and order
+    synchronization take place every `refresh_frequency` and `synchronize_every` seconds of virtual time.
+    Once a synchronization finds nothing to do, and nothing can change until the next price tick,
+    the backtest fast-forwards to that tick.
+
+    Attributes:
+        reloadable_config: Bands configuration.
+        exchange: Simulated exchange to trade on.
+        clock: Virtual clock shared with `exchange`.
+        refresh_frequency: Frequency (in seconds of virtual time) of order book refreshes.
+        synchronize_every: Frequency (in seconds of virtual time) of order synchronization.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self,
+                 reloadable_config: ReloadableConfig,
+                 exchange: SimulatedExchange,
+                 clock: VirtualClock,
+                 refresh_frequency: int = 3,
+                 synchronize_every: float = 1.0):
+        assert(isinstance(reloadable_config, ReloadableConfig))
+        assert(isinstance(exchange, SimulatedExchange))
+        assert(isinstance(clock, VirtualClock))
+        assert(isinstance(refresh_frequency, int))
+        assert(isinstance(synchronize_every, float))
+
+        self.reloadable_config = reloadable_config
+        self.exchange = exchange
+        self.clock = clock
+        self.refresh_frequency = refresh_frequency
+        self.synchronize_every = synchronize_every
+
+        self.history = History()
+        self.spread_feed = EmptyFeed()
+        self.price = Price(buy_price=None, sell_price=None)
+        self.ticks = 0
+        self.synchronizations = 0
+
+        self.order_book_manager = OrderBookManager(refresh_frequency=refresh_frequency, executor=SynchronousExecutor())
+        self.order_book_manager.get_orders_with(lambda: self.exchange.get_orders())
+        self.order_book_manager.get_balances_with(lambda: self.exchange.get_balances())
+        self.order_book_manager.cancel_orders_with(lambda order: self.exchange.cancel_order(order.order_id))
+
+    def our_sell_orders(self, our_orders: list) -> list:
+        return list(filter(lambda order: order.is_sell, our_orders))
+
+    def our_buy_orders(self, our_orders: list) -> list:
+        return list(filter(lambda order: not order.is_sell, our_orders))
+
+    def run(self, ticks: List[Tick]) -> dict:
+        """Runs the backtest over `ticks` and returns the report (see `report()`)."""
+        assert(isinstance(ticks, list))
+
+        if len(ticks) == 0:
+            raise Exception("No ticks to backtest on")
+
+        self.clock.advance_to(ticks[0].timestamp)
+        self.order_book_manager.refresh_order_book()
+        self.initial_state = self._state(Price(buy_price=self._wad(ticks[0].buy_price),
+                                               sell_price=self._wad(ticks[0].sell_price)))
+
+        self._next_refresh = self.clock() + self.refresh_frequency
+        self._next_synchronization = self.clock()
+        self._refreshed_version = self.exchange.version
+        self._idle = False
+
+        for tick in ticks:
+            self._run_until(tick.timestamp)
+
+            self.clock.advance_to(tick.timestamp)
+            self.price = Price(buy_price=self._wad(tick.buy_price), sell_price=self._wad(tick.sell_price))
+            self.exchange.match(self.price)
+            self._idle = False
+            self.ticks += 1
+
+        return self.report()
+
+    def _run_until(self, timestamp: float):
+        """Runs all order book refreshes and synchronizations which should happen before `timestamp`."""
+        while True:
+            next_event = min(self._next_refresh, self._next_synchronization, self.exchange.next_pending_time())
+            if next_event >= timestamp:
+                return
+
+            # Nothing is going to change until the next tick, so we can fast-forward to it. We still
+            # account for the order book refreshes which would have happened in the meantime.
+            if self._idle and self.exchange.next_pending_time() == float('inf'):
+                refreshes = math.ceil((timestamp - self._next_refresh) / self.refresh_frequency)
+                synchronizations = math.ceil((timestamp - self._next_synchronization) / self.synchronize_every)
+
+                self.exchange.api_calls['get_orders'] += max(refreshes, 0)
+                self.exchange.api_calls['get_balances'] += max(refreshes, 0)
+                self._next_refresh += max(refreshes, 0) * self.refresh_frequency
+                self._next_synchronization += max(synchronizations, 0) * self.synchronize_every
+                return
+
+            self.clock.advance_to(next_event)
+            self.exchange.advance()
+
+            if self._next_refresh <= self.clock():
+                self.order_book_manager.refresh_order_book()
+                self._refreshed_version = self.exchange.version
+                self._next_refresh += self.refresh_frequency
+
+            if self._next_synchronization <= self.clock():
+                self._idle = self.synchronize_orders() and self._refreshed_version == self.exchange.version
+                self._next_synchronization += self.synchronize_every
+
+    def synchronize_orders(self) -> bool:
+        """Synchronizes our orders with the bands.
+
+        Returns:
+            `True` if nothing had to be done and nothing would have to be done until either the price
+            or our orders change, `False` otherwise.
+        """
+        bands = Bands.read(self.reloadable_config, self.spread_feed, self.history, clock=self.clock)
+        order_book = self.order_book_manager.get_order_book()
+        target_price = self.price
+        self.synchronizations += 1
+
+        # Cancel orders
+        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
+                                                      target_price=target_price)
+        if len(cancellable_orders) > 0:
+            self.order_book_manager.cancel_orders(cancellable_orders)
+            return False
+
+        # Do not place new orders if order book state is not confirmed
+        if order_book.orders_being_placed or order_book.orders_being_cancelled:
+            return False
+
+        # Place new orders
+        new_orders = bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                      our_sell_orders=self.our_sell_orders(order_book.orders),
+                                      our_buy_balance=order_book.balances['buy'],
+                                      our_sell_balance=order_book.balances['sell'],
+                                      target_price=target_price)[0]
+
+        def place_order_function(new_order_to_be_placed):
+            amount = new_order_to_be_placed.pay_amount if new_order_to_be_placed.is_sell else new_order_to_be_placed.buy_amount
+            order = self.exchange.place_order(is_sell=new_order_to_be_placed.is_sell,
+                                              price=new_order_to_be_placed.price,
+                                              amount=amount)
+
+            if order is not None:
+                new_order_to_be_placed.confirm()
+
+            return order
+
+        for new_order in new_orders:
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+
+        # Limits are time-based, so more amount may become available even if nothing else changes.
+        limits_apply = len(bands.buy_limits.side_limits) > 0 or len(bands.sell_limits.side_limits) > 0
+
+        return len(new_orders) == 0 and not limits_apply
+
+    def report(self) -> dict:
+        """Returns fills, inventory, P&L (marked to the last price), API call counts and order churn."""
+        final_state = self._state(self.price)
+        hours = max(self.clock() - self.initial_state['timestamp'], 1.0) / 3600
+
+        return {
+            'ticks': self.ticks,
+            'synchronizations': self.synchronizations,
+            'duration': self.clock() - self.initial_state['timestamp'],
+            'apiCalls': dict(self.exchange.api_calls),
+            'ordersPlaced': self.exchange.orders_placed,
+            'ordersCancelled': self.exchange.orders_cancelled,
+            'ordersRejected': self.exchange.orders_rejected,
+            'cancelsPerHour': self.exchange.orders_cancelled / hours,
+            'fills': len(self.exchange.fills),
+            'boughtAmount': sum(fill['amount'] for fill in self.exchange.fills if not fill['isSell']),
+            'soldAmount': sum(fill['amount'] for fill in self.exchange.fills if fill['isSell']),
+            'feesPaid': {'buy': float(self.exchange.fees_paid['buy']), 'sell': float(self.exchange.fees_paid['sell'])},
+            'initial': self.initial_state,
+            'final': final_state,
+            'pnl': final_state['value'] - self.initial_state['value']
+        }
+
+    def _state(self, price: Price) -> dict:
+        mark_price = self._mark_price(price)
+
+        return {'timestamp': self.clock(),
+                'buyBalance': float(self.exchange.buy_balance),
+                'sellBalance': float(self.exchange.sell_balance),
+                'price': mark_price,
+                'value': float(self.exchange.buy_balance) + float(self.exchange.sell_balance) * mark_price}
+
+    def _mark_price(self, price: Price) -> float:
+        if price.buy_price is not None and price.sell_price is not None:
+            return float((price.buy_price + price.sell_price) / Wad.from_number(2))
+        elif price.buy_price is not None or price.sell_price is not None:
+            return float(price.buy_price or price.sell_price)
+        else:
+            return self.initial_state['price'] if hasattr(self, 'initial_state') else 0.0
+
+    @staticmethod
+    def _wad(value: Optional[int]) -> Optional[Wad]:
+        return Wad(value) if value is not None else None
+
+
+class BacktestRunner:
+    """Command-line entry point of the backtester."""
+
+    def __init__(self, args: list):
+        parser = argparse.ArgumentParser(prog='market-maker-backtest')
+
+        parser.add_argument("--ticks", type=str, required=True,
+                            help="Tick file with recorded prices (see `--price-feed record:...`)")
+
+        parser.add_argument("--source", type=str,
+                            help="Name of the recorded price feed to use (default: the first one in the file)")
+
+        parser.add_argument("--config", type=str, required=True,
+                            help="Bands configuration file")
+
+        parser.add_argument("--buy-balance", type=float, required=True,
+                            help="Initial balance of the buy token")
+
+        parser.add_argument("--sell-balance", type=float, required=True,
+                            help="Initial balance of the sell token")
+
+        parser.add_argument("--latency", type=int, default=0,
+                            help="Order placement and cancellation latency (in milliseconds, default: 0)")
+
+        parser.add_argument("--fee", type=float, default=0.0,
+                            help="Fee charged on each fill, as a fraction of the received amount (default: 0)")
+
+        parser.add_argument("--refresh-frequency", type=int, default=3,
+                            help="Order book refresh frequency (in seconds, default: 3)")
+
+        parser.add_argument("--synchronize-every", type=float, default=1.0,
+                            help="Order synchronization frequency (in seconds, default: 1)")
+
+        parser.add_argument("--fills-file", type=str,
+                            help="File to write all the fills to (in JSON format)")
+
+        parser.add_argument("--debug", dest='debug', action='store_true',
+                            help="Enable debug output")
+
+        self.arguments = parser.parse_args(args)
+        setup_logging(self.arguments)
+
+    def main(self):
+        reader = TickFileReader(self.arguments.ticks)
+        source = self.arguments.source
+        if source is None:
+            sources = reader.sources()
+            source = sources[min(sources)] if len(sources) > 0 else None
+
+        ticks = [tick for tick in reader.ticks(source) if tick.data is None]
+
+        clock = VirtualClock(ticks[0].timestamp if len(ticks) > 0 else 0.0)
+        exchange = SimulatedExchange(clock=clock,
+                                     buy_balance=Wad.from_number(self.arguments.buy_balance),
+                                     sell_balance=Wad.from_number(self.arguments.sell_balance),
+                                     latency=self.arguments.latency / 1000,
+                                     fee=self.arguments.fee)
+
+        backtest = Backtest(reloadable_config=ReloadableConfig(self.arguments.config),
+                            exchange=exchange,
+                            clock=clock,
+                            refresh_frequency=self.arguments.refresh_frequency,
+                            synchronize_every=self.arguments.synchronize_every)
+
+        report = backtest.run(ticks)
+
+        if self.arguments.fills_file:
+            with open(self.arguments.fills_file, "w") as file:
+                json.dump(exchange.fills, file, indent=4)
+
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    BacktestRunner(sys.argv[1:]).main()
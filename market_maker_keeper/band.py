@@ -160,9 +160,10 @@ class Bands:
     logger = logging.getLogger()
 
     @staticmethod
-    def read(reloadable_config: ReloadableConfig, spread_feed: Feed, history: History):
+    def read(reloadable_config: ReloadableConfig, spread_feed: Feed, history: History, clock=time.time):
         assert(isinstance(reloadable_config, ReloadableConfig))
         assert(isinstance(history, History))
+        assert(callable(clock))
 
         try:
             config = reloadable_config.get_config(spread_feed.get()[0])
@@ -179,18 +180,20 @@ class Bands:
             sell_bands = []
             sell_limits = SideLimits([], history.buy_history)
 
-        return Bands(buy_bands=buy_bands, buy_limits=buy_limits, sell_bands=sell_bands, sell_limits=sell_limits)
+        return Bands(buy_bands=buy_bands, buy_limits=buy_limits, sell_bands=sell_bands, sell_limits=sell_limits, clock=clock)
 
-    def __init__(self, buy_bands: list, buy_limits: SideLimits, sell_bands: list, sell_limits: SideLimits):
+    def __init__(self, buy_bands: list, buy_limits: SideLimits, sell_bands: list, sell_limits: SideLimits, clock=time.time):
         assert(isinstance(buy_bands, list))
         assert(isinstance(buy_limits, SideLimits))
         assert(isinstance(sell_bands, list))
         assert(isinstance(sell_limits, SideLimits))
+        assert(callable(clock))
 
         self.buy_bands = buy_bands
         self.buy_limits = buy_limits
         self.sell_bands = sell_bands
         self.sell_limits = sell_limits
+        self.clock = clock
 
         if self._bands_overlap(self.buy_bands) or self._bands_overlap(self.sell_bands):
             self.logger.warning("Bands in the config file overlap. Treating the config file as it has no bands.")
@@ -277,7 +280,7 @@ class Bands:
         assert(isinstance(target_price, Wad))
 
         new_orders = []
-        limit_amount = self.sell_limits.available_limit(time.time())
+        limit_amount = self.sell_limits.available_limit(self.clock())
         missing_amount = Wad(0)
 
         for band in self.sell_bands:
@@ -299,7 +302,7 @@ class Bands:
                                                amount=pay_amount,
                                                pay_amount=pay_amount,
                                                buy_amount=buy_amount,
-                                               confirm_function=lambda: self.sell_limits.use_limit(time.time(), pay_amount)))
+                                               confirm_function=lambda: self.sell_limits.use_limit(self.clock(), pay_amount)))
 
         return new_orders, missing_amount
 
@@ -310,7 +313,7 @@ class Bands:
         assert(isinstance(target_price, Wad))
 
         new_orders = []
-        limit_amount = self.buy_limits.available_limit(time.time())
+        limit_amount = self.buy_limits.available_limit(self.clock())
         missing_amount = Wad(0)
 
         for band in self.buy_bands:
@@ -332,7 +335,7 @@ class Bands:
                                                amount=buy_amount,
                                                pay_amount=pay_amount,
                                                buy_amount=buy_amount,
-                                               confirm_function=lambda: self.buy_limits.use_limit(time.time(), pay_amount)))
+                                               confirm_function=lambda: self.buy_limits.use_limit(self.clock(), pay_amount)))
 
         return new_orders, missing_amount
 
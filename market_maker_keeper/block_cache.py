@@ -0,0 +1,142 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.util import eth_balance
+
+
+class BlockCache:
+    """Memoises read-only calls (contract calls, balances) for the duration of one block.
+
+    Results of read-only calls can only change when a new block gets mined, so within one block each
+    of them only needs to be made once, however many times the keeper and the `OrderBookManager`
+    callbacks need the value. The current block number itself is cached for `block_number_ttl`
+    seconds, so values get invalidated at most that long after a new block arrives.
+
+    As the keeper's own transactions only affect the state once they get mined, the cache does not
+    need to be invalidated after sending them. `invalidate()` should be called straight after a receipt
+    has been received though, as the block the transaction got mined in might have arrived less than
+    `block_number_ttl` seconds ago.
+
+    Attributes:
+        web3: `Web3` instance.
+        block_number_ttl: Time (in seconds) the current block number is cached for.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, web3, block_number_ttl: float = 1.0):
+        assert(isinstance(block_number_ttl, float))
+
+        self.web3 = web3
+        self.block_number_ttl = block_number_ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._block_number = None
+        self._block_number_checked = 0.0
+        self._values = {}
+        self._block_hits = 0
+        self._block_misses = 0
+
+    def block_number(self) -> int:
+        """Returns the current block number, checking it with the node at most every `block_number_ttl` seconds."""
+        with self._lock:
+            if time.time() - self._block_number_checked >= self.block_number_ttl:
+                block_number = self.web3.eth.blockNumber
+                self._block_number_checked = time.time()
+
+                if block_number != self._block_number:
+                    if self._block_number is not None:
+                        self.logger.debug(f"Block cache in block #{self._block_number}: {self._block_hits} hits,"
+                                          f" {self._block_misses} misses")
+
+                    self._block_number = block_number
+                    self._values = {}
+                    self._block_hits = 0
+                    self._block_misses = 0
+
+            return self._block_number
+
+    def check_block(self) -> int:
+        """Checks the current block number with the node straight away, ignoring `block_number_ttl`.
+
+        Keepers call it at the beginning of each synchronization, so they never act on values
+        from a previous block, while the values still get read only once per block.
+        """
+        with self._lock:
+            self._block_number_checked = 0.0
+            return self.block_number()
+
+    def get(self, key, function):
+        """Returns the value of `function()` as of the current block, calling it only once per block.
+
+        Args:
+            key: Hashable key identifying the call, i.e. a tuple of the contract address,
+                the method name and the arguments.
+            function: Function making the call.
+        """
+        assert(callable(function))
+
+        with self._lock:
+            block_number = self.block_number()
+
+            if key in self._values:
+                self.hits += 1
+                self._block_hits += 1
+                return self._values[key]
+
+        # the call itself is made outside the lock, so slow calls do not block each other
+        value = function()
+
+        with self._lock:
+            self.misses += 1
+            self._block_misses += 1
+
+            # a new block might have arrived in the meantime
+            if self._block_number == block_number:
+                self._values[key] = value
+
+        return value
+
+    def invalidate(self):
+        """Forgets all cached values and the current block number."""
+        with self._lock:
+            self._block_number = None
+            self._block_number_checked = 0.0
+            self._values = {}
+
+    def hit_rate(self) -> float:
+        """Returns the ratio of calls served from the cache since the cache has been created."""
+        with self._lock:
+            return self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0.0
+
+    def eth_balance(self, address: Address) -> Wad:
+        assert(isinstance(address, Address))
+
+        return self.get(('eth_balance', address), lambda: eth_balance(self.web3, address))
+
+    def balance_of(self, token, address: Address) -> Wad:
+        assert(isinstance(address, Address))
+
+        return self.get((token.address, 'balance_of', address), lambda: token.balance_of(address))
@@ -0,0 +1,233 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+from pymaker import Address
+from pymaker.numeric import Wad
+
+
+class FillRate:
+    """Exponentially weighted estimate of the rate at which a deposited balance gets consumed by fills.
+
+    Only decreases of the observed balance count as consumption. Increases (deposits, proceeds
+    of fills of orders on the other side of the book) are ignored.
+
+    Attributes:
+        half_life: Time (in seconds) after which an observed consumption weighs half as much.
+    """
+
+    def __init__(self, half_life: float, clock=time.time):
+        assert(isinstance(half_life, float))
+        assert(half_life > 0)
+
+        self.half_life = half_life
+        self.clock = clock
+
+        self._decay = math.log(2) / half_life
+        self._consumed = 0.0
+        self._last_balance = None
+        self._last_time = None
+        self._start_time = None
+
+    def observe(self, balance: Wad):
+        assert(isinstance(balance, Wad))
+
+        now = self.clock()
+        if self._last_time is None:
+            self._start_time = now
+        else:
+            self._consumed *= math.exp(-self._decay * (now - self._last_time))
+            if balance < self._last_balance:
+                self._consumed += float(self._last_balance - balance)
+
+        self._last_balance = balance
+        self._last_time = now
+
+    def rate(self) -> float:
+        """Returns the estimated consumption rate (in tokens per second)."""
+        if self._last_time is None or self._last_time == self._start_time:
+            return 0.0
+
+        # for a constant rate `r` the decayed sum approaches `r / decay`, the denominator
+        # corrects for the observation period being shorter than that
+        return self._consumed * self._decay / (1 - math.exp(-self._decay * (self._last_time - self._start_time)))
+
+
+class DepositManager:
+    """Tops up balances deposited on an exchange ahead of time, so quoting never stalls waiting for funds.
+
+    For each token, the balance needed on the exchange is projected from the bands using it, plus
+    the amount expected to be consumed by fills within `lead_time` at the recent fill rate. Once the
+    deposited balance (plus pending deposits) drops below the total `avgAmount` of the bands plus that
+    projection, a deposit is made bringing it up to the total `maxAmount` of the bands plus the same
+    projection, but never less than the minimum deposit of the token. The gap between the two
+    levels means a deposit does not get made each time a small order gets filled.
+
+    Deposits of all tokens get submitted together by `synchronize()`, without waiting for any of them
+    to get mined. Until a deposit is visible in the deposited balances passed to `synchronize()`
+    its amount is counted as already deposited, so the same shortfall never gets deposited twice.
+
+    Attributes:
+        lead_time: Time (in seconds) of fills to deposit ahead for.
+        half_life: Half-life (in seconds) of observed fills in the fill rate estimate.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, lead_time: float = 300.0, half_life: float = 600.0, clock=time.time):
+        assert(isinstance(lead_time, float))
+        assert(isinstance(half_life, float))
+
+        self.lead_time = lead_time
+        self.half_life = half_life
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._pending = []
+
+    def add_token(self, token: Address, min_deposit: Wad, deposit_function):
+        """Adds a token to keep deposited.
+
+        Args:
+            token: Address of the token.
+            min_deposit: Minimum amount of the token that can be deposited in one transaction.
+            deposit_function: Function making a deposit of the amount passed to it. It can either
+                return whether the deposit succeeded, or a `Future` resolving to it.
+        """
+        assert(isinstance(token, Address))
+        assert(isinstance(min_deposit, Wad))
+        assert(callable(deposit_function))
+
+        self._tokens[token] = {'min_deposit': min_deposit,
+                               'deposit_function': deposit_function,
+                               'fill_rate': FillRate(self.half_life, self.clock)}
+
+    def fill_rate(self, token: Address) -> float:
+        assert(isinstance(token, Address))
+
+        return self._tokens[token]['fill_rate'].rate()
+
+    def pending_amount(self, token: Address) -> Wad:
+        """Returns the total amount of deposits of `token` which are not reflected in the deposited balance yet."""
+        assert(isinstance(token, Address))
+
+        with self._lock:
+            return sum([pending['amount'] for pending in self._pending if pending['token'] == token], Wad(0))
+
+    def synchronize(self, bands, buy_token: Address, sell_token: Address,
+                    deposited: dict, depositable: dict, timestamp: float = None) -> list:
+        """Makes deposits of the tokens of which the deposited balance is projected to run short.
+
+        Args:
+            bands: Current `Bands`.
+            buy_token: Address of the token amounts of buy bands are denominated in.
+            sell_token: Address of the token amounts of sell bands are denominated in.
+            deposited: Balances currently deposited on the exchange, keyed by the token.
+            depositable: Balances which can be deposited, keyed by the token.
+            timestamp: Time at which `deposited` balances have been read. Deposits which completed
+                before that are assumed to be included in them. Defaults to the current time.
+
+        Returns:
+            Tokens for which deposits have been made.
+        """
+        assert(isinstance(buy_token, Address))
+        assert(isinstance(sell_token, Address))
+        assert(isinstance(deposited, dict))
+        assert(isinstance(depositable, dict))
+
+        self._forget_deposits(timestamp if timestamp is not None else self.clock())
+
+        deposits = []
+        for token, token_bands in [(buy_token, bands.buy_bands), (sell_token, bands.sell_bands)]:
+            balance = deposited[token]
+            fill_rate = self._tokens[token]['fill_rate']
+            fill_rate.observe(balance)
+
+            projected_fills = Wad.from_number(fill_rate.rate() * self.lead_time)
+            low_level = self._total(token_bands, 'avg_amount') + projected_fills
+            high_level = self._total(token_bands, 'max_amount') + projected_fills
+
+            current_level = balance + self.pending_amount(token)
+            if current_level >= low_level:
+                continue
+
+            amount = Wad.max(high_level - current_level, self._tokens[token]['min_deposit'])
+            amount = Wad.min(amount, depositable[token])
+            if amount > Wad(0) and amount >= self._tokens[token]['min_deposit']:
+                deposits.append((token, amount))
+
+        for token, amount in deposits:
+            self._deposit(token, amount)
+
+        return [token for token, _ in deposits]
+
+    @staticmethod
+    def _total(bands: list, field: str) -> Wad:
+        return sum([getattr(band, field) for band in bands], Wad(0))
+
+    def wait_for_deposits(self):
+        """Wait until no deposit is being made."""
+        while True:
+            with self._lock:
+                if not any(pending['completed'] is None for pending in self._pending):
+                    break
+
+            time.sleep(0.1)
+
+    def _deposit(self, token: Address, amount: Wad):
+        self.logger.info(f"Depositing {amount} of {token} ahead of time")
+
+        pending = {'token': token, 'amount': amount, 'completed': None}
+        with self._lock:
+            self._pending.append(pending)
+
+        try:
+            result = self._tokens[token]['deposit_function'](amount)
+        except BaseException as exception:
+            self.logger.exception(exception)
+            result = False
+
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._deposit_done(pending, self._future_result(future)))
+        else:
+            self._deposit_done(pending, result)
+
+    def _future_result(self, future: Future):
+        try:
+            return future.result()
+        except BaseException as exception:
+            self.logger.exception(exception)
+            return False
+
+    def _deposit_done(self, pending: dict, successful: bool):
+        with self._lock:
+            if successful:
+                pending['completed'] = self.clock()
+            else:
+                self.logger.warning(f"Failed to deposit {pending['amount']} of {pending['token']}")
+                self._pending.remove(pending)
+
+    def _forget_deposits(self, timestamp: float):
+        with self._lock:
+            self._pending = [pending for pending in self._pending
+                             if pending['completed'] is None or pending['completed'] >= timestamp]
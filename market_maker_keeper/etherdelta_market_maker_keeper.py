@@ -18,27 +18,35 @@
 import argparse
 import logging
 import sys
-from typing import Iterable
+import threading
+import time
 
 from retry import retry
-from web3 import Web3, HTTPProvider
+from web3 import Web3
 
 from market_maker_keeper.band import Bands
+from market_maker_keeper.deposit_manager import DepositManager
+from market_maker_keeper.etherdelta_order_tracker import EtherDeltaOrderTracker, TrackedOrder
+from market_maker_keeper.etherdelta_publisher import EtherDeltaPublisher
 from market_maker_keeper.gas import GasPriceFactory
 from market_maker_keeper.limit import History
+from market_maker_keeper.local_signing import register_keys
+from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.receipt_tracker import ReceiptTracker
 from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.rpc_batch import JsonRpcBatch
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
-from pymaker import Address, synchronize
+from market_maker_keeper.web3_provider import create_provider, create_block_watcher
+from pymaker import Address
 from pymaker.approval import directly
-from pymaker.etherdelta import EtherDelta, EtherDeltaApi, Order
+from pymaker.etherdelta import EtherDelta, Order
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
 from pymaker.sai import Tub
 from pymaker.token import ERC20Token
-from pymaker.util import eth_balance
 
 
 class EtherDeltaMarketMakerKeeper:
@@ -58,9 +66,20 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--rpc-timeout", type=int, default=10,
                             help="JSON-RPC timeout (in seconds, default: 10)")
 
+        parser.add_argument("--rpc-ipc-path", type=str,
+                            help="Path to the IPC socket of the Ethereum node, to use instead of JSON-RPC over HTTP")
+
+        parser.add_argument("--rpc-ws-url", type=str,
+                            help="WebSocket URL of the Ethereum node (i.e. `ws://localhost:8546'),"
+                                 " to use instead of JSON-RPC over HTTP")
+
         parser.add_argument("--eth-from", type=str, required=True,
                             help="Ethereum account from which to send transactions")
 
+        parser.add_argument("--eth-key", type=str, nargs='*',
+                            help="Ethereum private key(s) to sign transactions with locally,"
+                                 " in the `key_file=<keystore file>,pass_file=<password file>' format")
+
         parser.add_argument("--tub-address", type=str, required=True,
                             help="Ethereum address of the Tub contract")
 
@@ -71,7 +90,7 @@ class EtherDeltaMarketMakerKeeper:
                             help="Ethereum address of the EtherDelta API socket")
 
         parser.add_argument("--etherdelta-number-of-attempts", type=int, default=3,
-                            help="Number of attempts of running the tool to talk to the EtherDelta API socket")
+                            help="Number of attempts of publishing each order to the EtherDelta API socket")
 
         parser.add_argument("--etherdelta-retry-interval", type=int, default=10,
                             help="Retry interval for sending orders over the EtherDelta API socket")
@@ -94,6 +113,17 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--spread-feed-expiry", type=int, default=3600,
                             help="Maximum age of the spread feed (in seconds, default: 3600)")
 
+        parser.add_argument("--spread-feed-step", type=float,
+                            help="Step to round spread feed values to, so configs evaluated for them can be reused"
+                                 " (default: no rounding)")
+
+        parser.add_argument("--websocket-hot-standby", dest='websocket_hot_standby', action='store_true',
+                            help="Keep a hot-standby connection for WebSocket price and spread feeds")
+
+        parser.add_argument("--websocket-stall-timeout", type=int, default=5000,
+                            help="Time without any messages after which a price or spread feed WebSocket connection"
+                                 " is considered stalled (in milliseconds, default: 5000)")
+
         parser.add_argument("--order-history", type=str,
                             help="Endpoint to report active orders to")
 
@@ -123,6 +153,10 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--min-sai-deposit", type=float, required=True,
                             help="Minimum amount of SAI that can be deposited in one transaction")
 
+        parser.add_argument("--deposit-lead-time", type=float, default=300.0,
+                            help="Time (in seconds) of fills at the recent fill rate to deposit ahead for"
+                                 " (default: 300)")
+
         parser.add_argument('--cancel-on-shutdown', dest='cancel_on_shutdown', action='store_true',
                             help="Whether should cancel all open orders on EtherDelta on keeper shutdown")
 
@@ -135,6 +169,15 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--smart-gas-price", dest='smart_gas_price', action='store_true',
                             help="Use smart gas pricing strategy, based on the ethgasstation.info feed")
 
+        parser.add_argument("--node-gas-price", dest='node_gas_price', action='store_true',
+                            help="Use smart gas pricing strategy, based on recent blocks seen by the Ethereum node")
+
+        parser.add_argument("--gas-config", type=str, required=False,
+                            help="Gas price configuration file, with separate strategies per operation class")
+
+        parser.add_argument("--refresh-frequency", type=int, default=3,
+                            help="Order book refresh frequency (in seconds, default: 3)")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -143,20 +186,21 @@ class EtherDeltaMarketMakerKeeper:
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
-        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
-                                                                              request_kwargs={"timeout": self.arguments.rpc_timeout}))
+        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(create_provider(self.arguments))
         self.web3.eth.defaultAccount = self.arguments.eth_from
+        register_keys(self.web3, self.arguments.eth_key or [])
+        self.block_watcher = create_block_watcher(self.web3, self.synchronize_orders)
         self.our_address = Address(self.arguments.eth_from)
         self.tub = Tub(web3=self.web3, address=Address(self.arguments.tub_address))
         self.sai = ERC20Token(web3=self.web3, address=self.tub.sai())
         self.gem = ERC20Token(web3=self.web3, address=self.tub.gem())
 
-        self.bands_config = ReloadableConfig(self.arguments.config)
+        self.bands_config = ReloadableConfig(self.arguments.config, spread_feed_step=self.arguments.spread_feed_step)
         self.eth_reserve = Wad.from_number(self.arguments.eth_reserve)
         self.min_eth_balance = Wad.from_number(self.arguments.min_eth_balance)
         self.min_eth_deposit = Wad.from_number(self.arguments.min_eth_deposit)
         self.min_sai_deposit = Wad.from_number(self.arguments.min_sai_deposit)
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.gas_prices = GasPriceFactory().create_gas_prices(self.arguments, self.web3)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments, self.tub)
         self.spread_feed = create_spread_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
@@ -169,42 +213,67 @@ class EtherDeltaMarketMakerKeeper:
 
         self.history = History()
         self.etherdelta = EtherDelta(web3=self.web3, address=Address(self.arguments.etherdelta_address))
-        self.etherdelta_api = EtherDeltaApi(client_tool_directory="lib/pymaker/utils/etherdelta-client",
-                                            client_tool_command="node main.js",
-                                            api_server=self.arguments.etherdelta_socket,
-                                            number_of_attempts=self.arguments.etherdelta_number_of_attempts,
-                                            retry_interval=self.arguments.etherdelta_retry_interval,
-                                            timeout=self.arguments.etherdelta_timeout)
-
-        self.our_orders = list()
+        self.etherdelta_api = EtherDeltaPublisher(api_server=self.arguments.etherdelta_socket,
+                                                  number_of_attempts=self.arguments.etherdelta_number_of_attempts,
+                                                  retry_interval=self.arguments.etherdelta_retry_interval,
+                                                  timeout=self.arguments.etherdelta_timeout)
+        self.order_tracker = EtherDeltaOrderTracker(self.web3, self.etherdelta.address, self.our_address)
+        self.receipt_tracker = ReceiptTracker(web3=self.web3, gas_prices=self.gas_prices)
+
+        self.deposit_manager = DepositManager(lead_time=self.arguments.deposit_lead_time)
+        self.deposit_manager.add_token(self.token_sell(), self.min_eth_deposit,
+                                       lambda amount: self.deposit_function(self.etherdelta.deposit(amount)))
+        self.deposit_manager.add_token(self.token_buy(), self.min_sai_deposit,
+                                       lambda amount: self.deposit_function(self.etherdelta.deposit_token(self.token_buy(), amount)))
+
+        # EtherDelta orders are placed off-chain, so the list of them is kept locally
+        self.local_orders = list()
+        self._lock = threading.Lock()
+        self._withdrawal = None
+
+        self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.get_orders_with(lambda: self.our_orders())
+        self.order_book_manager.get_balances_with(lambda: self.our_balances())
+        self.order_book_manager.place_orders_with(self.place_order_function)
+        self.order_book_manager.cancel_orders_with(self.cancel_order_function)
+        self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
+        self.order_book_manager.start()
 
     def main(self):
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.initial_delay(10)
             lifecycle.on_startup(self.startup)
-            lifecycle.on_block(self.synchronize_orders)
+            lifecycle.on_block(self.synchronize_orders if self.block_watcher is None else self.on_block)
             lifecycle.on_shutdown(self.shutdown)
 
     def startup(self):
         self.approve()
 
+        if self.block_watcher is not None:
+            self.block_watcher.start()
+
     @retry(delay=5, logger=logger)
     def shutdown(self):
+        if self.block_watcher is not None:
+            self.block_watcher.stop()
+
         if self.arguments.cancel_on_shutdown:
-            self.cancel_all_orders()
+            self.order_book_manager.cancel_all_orders()
 
         if self.arguments.withdraw_on_shutdown:
             self.withdraw_everything()
 
+    def on_block(self):
+        # With `--rpc-ipc-path` or `--rpc-ws-url` orders get synchronized by the `newHeads` block watcher.
+        # This method is present only so the lifecycle binds the new block listener, which makes
+        # it then terminate the keeper if no new blocks have been arriving for 300 seconds.
+        pass
+
     def approve(self):
         token_addresses = filter(lambda address: address != EtherDelta.ETH_TOKEN, [self.token_sell(), self.token_buy()])
         tokens = list(map(lambda address: ERC20Token(web3=self.web3, address=address), token_addresses))
 
-        self.etherdelta.approve(tokens, directly(gas_price=self.gas_price))
-
-    def place_order(self, order: Order):
-        self.our_orders.append(order)
-        self.etherdelta_api.publish_order(order)
+        self.etherdelta.approve(tokens, directly(gas_price=self.gas_prices.approve))
 
     def token_sell(self) -> Address:
         return EtherDelta.ETH_TOKEN
@@ -212,77 +281,134 @@ class EtherDeltaMarketMakerKeeper:
     def token_buy(self) -> Address:
         return self.sai.address
 
-    def our_total_balance(self, token: Address) -> Wad:
+    def our_balances(self) -> dict:
+        # Balances held by the EtherDelta contract and in our account get read in one batch request,
+        # along with the number of the block they have been read in.
+        timestamp = time.time()
+
+        batch = JsonRpcBatch(self.web3)
+        for token in [EtherDelta.ETH_TOKEN, self.sai.address]:
+            batch.call(self.etherdelta.address, 'balanceOf(address,address)', [token.address, self.our_address.address], ['uint256'])
+        batch.call(self.sai.address, 'balanceOf(address)', [self.our_address.address], ['uint256'])
+        batch.eth_balance(self.our_address)
+
+        block_number = self.web3.eth.blockNumber
+        eth_deposited, sai_deposited, sai_balance, eth_balance = batch.execute()
+
+        return {'timestamp': timestamp,
+                'block_number': block_number,
+                'eth_deposited': Wad(eth_deposited),
+                'sai_deposited': Wad(sai_deposited),
+                'sai_balance': Wad(sai_balance),
+                'eth_balance': eth_balance}
+
+    def our_deposited_balance(self, our_balances: dict, token: Address) -> Wad:
         if token == EtherDelta.ETH_TOKEN:
-            return self.etherdelta.balance_of(self.our_address)
+            return our_balances['eth_deposited']
+        elif token == self.sai.address:
+            return our_balances['sai_deposited']
         else:
-            return self.etherdelta.balance_of_token(token, self.our_address)
+            raise Exception("Unknown token")
+
+    def our_orders(self) -> list:
+        block_number = self.web3.eth.blockNumber
+
+        with self._lock:
+            orders = list(self.local_orders)
 
-    def our_sell_orders(self):
+        # Expired, fully filled and cancelled orders get removed from the local order list,
+        # so their bands can get replenished
+        open_orders = list(filter(lambda order: not self.is_expired(order, block_number), orders))
+        open_orders = self.order_tracker.update(open_orders, block_number)
+
+        with self._lock:
+            closed_orders = set(orders) - set(open_orders)
+            self.local_orders = list(filter(lambda order: order not in closed_orders, self.local_orders))
+
+        return self.order_tracker.with_remaining_amounts(open_orders)
+
+    def our_sell_orders(self, our_orders: list):
         return list(filter(lambda order: order.buy_token == self.token_buy() and
-                                         order.pay_token == self.token_sell(), self.our_orders))
+                                         order.pay_token == self.token_sell(), our_orders))
 
-    def our_buy_orders(self):
+    def our_buy_orders(self, our_orders: list):
         return list(filter(lambda order: order.buy_token == self.token_sell() and
-                                         order.pay_token == self.token_buy(), self.our_orders))
+                                         order.pay_token == self.token_buy(), our_orders))
 
     def synchronize_orders(self):
+        # Orders and balances get refreshed in background by the order book manager, so all
+        # decisions here are made using its latest snapshot, without waiting for the node.
+        bands = Bands.read(self.bands_config, self.spread_feed, self.history)
+        order_book = self.order_book_manager.get_order_book()
+        target_price = self.price_feed.get_price()
+
         # If keeper balance is below `--min-eth-balance`, cancel all orders but do not terminate
         # the keeper, keep processing blocks as the moment the keeper gets a top-up it should
         # resume activity straight away, without the need to restart it.
         #
         # The exception is when we can withdraw some ETH from EtherDelta. Then we do it and carry on.
-        if eth_balance(self.web3, self.our_address) < self.min_eth_balance:
-            if self.etherdelta.balance_of(self.our_address) > self.eth_reserve:
+        if order_book.balances['eth_balance'] < self.min_eth_balance:
+            if self.withdrawal_in_progress(order_book.balances):
+                self.logger.debug("Withdrawal in progress, waiting for it to complete")
+            elif order_book.balances['eth_deposited'] > self.eth_reserve:
                 self.logger.warning(f"Keeper ETH balance below minimum, withdrawing {self.eth_reserve}.")
-                self.etherdelta.withdraw(self.eth_reserve).transact()
+                self._withdrawal = self.receipt_tracker.transact(self.etherdelta.withdraw(self.eth_reserve),
+                                                                 result_function=lambda receipt: time.time(),
+                                                                 operation='deposit')
             else:
                 self.logger.warning(f"Keeper ETH balance below minimum, cannot withdraw. Cancelling all orders.")
-                self.cancel_all_orders()
+                self.order_book_manager.cancel_all_orders()
 
             return
 
-        bands = Bands.read(self.bands_config, self.spread_feed, self.history)
-        block_number = self.web3.eth.blockNumber
-        target_price = self.price_feed.get_price()
-
-        # Remove expired orders from the local order list
-        self.remove_expired_orders(block_number)
-
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(self.our_buy_orders(), self.our_sell_orders(), target_price)
+        # Cancel orders, apart from the ones which will probably expire before the cancellation gets mined
+        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
+                                                      target_price=target_price)
         if len(cancellable_orders) > 0:
-            self.cancel_orders(cancellable_orders, block_number)
+            self.order_book_manager.cancel_orders(list(filter(lambda order: not self.is_non_cancellable(order, order_book.balances['block_number']),
+                                                              cancellable_orders)))
             return
 
-        # In case of EtherDelta, balances returned by `our_total_balance` still contain amounts "locked"
-        # by currently open orders, so we need to explicitly subtract these amounts.
-        our_buy_balance = self.our_total_balance(self.token_buy()) - Bands.total_amount(self.our_buy_orders())
-        our_sell_balance = self.our_total_balance(self.token_sell()) - Bands.total_amount(self.our_sell_orders())
-
-        # Evaluate if we need to create new orders, and how much do we need to deposit
-        new_orders, missing_buy_amount, missing_sell_amount = bands.new_orders(our_buy_orders=self.our_buy_orders(),
-                                                                               our_sell_orders=self.our_sell_orders(),
-                                                                               our_buy_balance=our_buy_balance,
-                                                                               our_sell_balance=our_sell_balance,
-                                                                               target_price=target_price)
-
-        # If deposited amount too low for placing buy orders, try to deposit.
-        # If deposited amount too low for placing sell orders, try to deposit.
-        made_deposit = False
-
-        if missing_buy_amount > Wad(0):
-            if self.deposit_for_buy_order():
-                made_deposit = True
-
-        if missing_sell_amount > Wad(0):
-            if self.deposit_for_sell_order():
-                made_deposit = True
+        # Do not place new orders if order book state is not confirmed
+        if order_book.orders_being_placed or order_book.orders_being_cancelled:
+            self.logger.debug("Order book is in progress, not placing new orders")
+            return
 
-        # If we managed to deposit something, do not do anything so we can reevaluate new orders to be created.
-        # Otherwise, create new orders.
-        if not made_deposit:
-            self.place_orders(new_orders)
+        # Deposits get made ahead of time and do not hold off placing orders.
+        self.deposit_manager.synchronize(bands=bands,
+                                         buy_token=self.token_buy(),
+                                         sell_token=self.token_sell(),
+                                         deposited={self.token_buy(): order_book.balances['sai_deposited'],
+                                                    self.token_sell(): order_book.balances['eth_deposited']},
+                                         depositable={self.token_buy(): order_book.balances['sai_balance'],
+                                                      self.token_sell(): Wad.max(order_book.balances['eth_balance'] - self.eth_reserve, Wad(0))},
+                                         timestamp=order_book.balances['timestamp'])
+
+        # In case of EtherDelta, deposited balances still contain amounts "locked"
+        # by currently open orders, so we need to explicitly subtract these amounts.
+        our_buy_balance = self.our_deposited_balance(order_book.balances, self.token_buy()) - \
+                          Bands.total_amount(self.our_buy_orders(order_book.orders))
+        our_sell_balance = self.our_deposited_balance(order_book.balances, self.token_sell()) - \
+                           Bands.total_amount(self.our_sell_orders(order_book.orders))
+
+        # Place new orders
+        self.order_book_manager.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                                              our_sell_orders=self.our_sell_orders(order_book.orders),
+                                                              our_buy_balance=our_buy_balance,
+                                                              our_sell_balance=our_sell_balance,
+                                                              target_price=target_price)[0])
+
+    def withdrawal_in_progress(self, our_balances: dict) -> bool:
+        # The withdrawal future resolves to the time it completed at, balances read before that
+        # time do not reflect it yet.
+        return self._withdrawal is not None and (not self._withdrawal.done()
+                                                 or our_balances['timestamp'] < self._withdrawal.result())
+
+    def wait_for_withdrawal(self):
+        """Wait until the withdrawal made when the keeper went low on ETH (if any) gets mined."""
+        if self._withdrawal is not None:
+            self._withdrawal.result()
 
     @staticmethod
     def is_order_age_above_threshold(order: Order, block_number: int, threshold: int):
@@ -296,66 +422,62 @@ class EtherDeltaMarketMakerKeeper:
     def is_non_cancellable(self, order: Order, block_number: int):
         return self.is_order_age_above_threshold(order, block_number, self.arguments.order_no_cancel_threshold)
 
-    def remove_expired_orders(self, block_number: int):
-        self.our_orders = list(filter(lambda order: not self.is_expired(order, block_number), self.our_orders))
-
-    def cancel_orders(self, orders: Iterable, block_number: int):
-        cancellable_orders = list(filter(lambda order: not self.is_non_cancellable(order, block_number), orders))
-        synchronize([self.etherdelta.cancel_order(order).transact_async(gas_price=self.gas_price) for order in cancellable_orders])
-        self.our_orders = list(set(self.our_orders) - set(cancellable_orders))
+    def place_order_function(self, new_order):
+        expires = self.web3.eth.blockNumber + self.arguments.order_age
 
-    def cancel_all_orders(self):
-        self.cancel_orders(self.our_orders, self.web3.eth.blockNumber)
+        if new_order.is_sell:
+            pay_token = self.token_sell()
+            buy_token = self.token_buy()
+        else:
+            pay_token = self.token_buy()
+            buy_token = self.token_sell()
 
-    def place_orders(self, new_orders):
         # EtherDelta sometimes rejects orders when the amounts are not rounded. Choice of choosing
         # rounding to 9 decimal digits is completely arbitrary as it's not documented anywhere.
-        for new_order in new_orders:
-            if new_order.is_sell:
-                order = self.etherdelta.create_order(pay_token=self.token_sell(),
-                                                     pay_amount=round(new_order.pay_amount, 9),
-                                                     buy_token=self.token_buy(),
-                                                     buy_amount=round(new_order.buy_amount, 9),
-                                                     expires=self.web3.eth.blockNumber + self.arguments.order_age)
-            else:
-                order = self.etherdelta.create_order(pay_token=self.token_buy(),
-                                                     pay_amount=round(new_order.pay_amount, 9),
-                                                     buy_token=self.token_sell(),
-                                                     buy_amount=round(new_order.buy_amount, 9),
-                                                     expires=self.web3.eth.blockNumber + self.arguments.order_age)
+        order = self.etherdelta.create_order(pay_token=pay_token,
+                                             pay_amount=round(new_order.pay_amount, 9),
+                                             buy_token=buy_token,
+                                             buy_amount=round(new_order.buy_amount, 9),
+                                             expires=expires)
+
+        with self._lock:
+            self.local_orders.append(order)
 
-            self.place_order(order)
+        new_order.confirm()
 
-            new_order.confirm()
+        # orders queued at the same time get written to the EtherDelta API socket in one go
+        self.etherdelta_api.publish_orders([order])
+
+        return TrackedOrder(order, order.buy_amount)
+
+    def cancel_order_function(self, order):
+        return self.receipt_tracker.transact(self.etherdelta.cancel_order(TrackedOrder.unwrap(order)),
+                                             result_function=lambda receipt: self.order_cancelled(order, receipt),
+                                             operation='cancel')
+
+    def order_cancelled(self, order, receipt) -> bool:
+        if receipt is not None and receipt.successful:
+            with self._lock:
+                self.local_orders = list(filter(lambda local_order: local_order != TrackedOrder.unwrap(order),
+                                                self.local_orders))
+
+            return True
+        else:
+            return False
 
     def withdraw_everything(self):
         eth_balance = self.etherdelta.balance_of(self.our_address)
         if eth_balance > Wad(0):
-            self.etherdelta.withdraw(eth_balance).transact(gas_price=self.gas_price)
+            self.etherdelta.withdraw(eth_balance).transact(gas_price=self.gas_prices.deposit)
 
         sai_balance = self.etherdelta.balance_of_token(self.sai.address, self.our_address)
         if sai_balance > Wad(0):
-            self.etherdelta.withdraw_token(self.sai.address, sai_balance).transact()
-
-    def depositable_balance(self, token: Address) -> Wad:
-        if token == EtherDelta.ETH_TOKEN:
-            return Wad.max(eth_balance(self.web3, self.our_address) - self.eth_reserve, Wad(0))
-        else:
-            return ERC20Token(web3=self.web3, address=token).balance_of(self.our_address)
+            self.etherdelta.withdraw_token(self.sai.address, sai_balance).transact(gas_price=self.gas_prices.deposit)
 
-    def deposit_for_sell_order(self):
-        depositable_eth = self.depositable_balance(self.token_sell())
-        if depositable_eth > self.min_eth_deposit:
-            return self.etherdelta.deposit(depositable_eth).transact(gas_price=self.gas_price).successful
-        else:
-            return False
-
-    def deposit_for_buy_order(self):
-        depositable_sai = self.depositable_balance(self.token_buy())
-        if depositable_sai > self.min_sai_deposit:
-            return self.etherdelta.deposit_token(self.token_buy(), depositable_sai).transact(gas_price=self.gas_price).successful
-        else:
-            return False
+    def deposit_function(self, transact):
+        return self.receipt_tracker.transact(transact,
+                                             result_function=lambda receipt: receipt is not None and receipt.successful,
+                                             operation='deposit')
 
 
 if __name__ == '__main__':
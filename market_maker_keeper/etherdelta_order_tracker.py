@@ -0,0 +1,218 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from collections import deque
+
+from eth_abi import decode_abi
+from eth_utils import decode_hex, encode_hex, event_signature_to_log_topic
+
+from market_maker_keeper.rpc_batch import JsonRpcBatch
+from pymaker import Address
+from pymaker.numeric import Wad
+
+
+class TrackedOrder:
+    """EtherDelta order with the remaining amounts tracked by `EtherDeltaOrderTracker`.
+
+    All the other attributes are the ones of the wrapped `order`, so it can be passed to `Bands`
+    and to `OrderBookManager` in place of it. It has to be unwrapped before being passed
+    to `EtherDelta` though.
+
+    Attributes:
+        order: The wrapped order.
+        order_id: Identifier of the order, made of all the order fields signed by the maker.
+        remaining_buy_amount: Amount of the buy token still available in the order.
+        remaining_sell_amount: Amount of the pay token still available in the order.
+    """
+
+    def __init__(self, order, remaining_buy_amount: Wad):
+        assert(isinstance(remaining_buy_amount, Wad))
+
+        self.order = order
+        self.order_id = EtherDeltaOrderTracker.order_key(order)
+        self.remaining_buy_amount = remaining_buy_amount
+        self.remaining_sell_amount = order.pay_amount * remaining_buy_amount / order.buy_amount
+
+    def __getattr__(self, name):
+        return getattr(self.order, name)
+
+    @staticmethod
+    def unwrap(order):
+        return order.order if isinstance(order, TrackedOrder) else order
+
+
+class EtherDeltaOrderTracker:
+    """Tracks fills and cancellations of our EtherDelta orders, using `Trade` and `Cancel` events.
+
+    EtherDelta orders are placed off-chain, so the keeper keeps the list of them locally. Without
+    the tracker orders would leave this list only when they expire or when we cancel them, so a fully
+    filled order would keep occupying its band until it expires. Each time `update()` is called
+    with a new block number, events from the blocks mined since the previous call are fetched
+    with one `eth_getLogs` call. Our orders which have been cancelled get removed straight away.
+
+    `Trade` events do not identify the order which has been filled, only the tokens traded, so the amounts
+    filled of all our orders for these tokens get read from the contract in one JSON-RPC batch request.
+    Fully filled orders get removed, for partially filled ones the amounts still available are kept
+    in `remaining_buy_amounts` and applied to orders by `with_remaining_amounts()`. All our `Trade`
+    events (our fills) are kept in `fills`.
+
+    The tracker is not thread-safe, `update()` and `with_remaining_amounts()` should be called
+    from one thread only, i.e. from the `OrderBookManager` refresh thread.
+
+    Attributes:
+        web3: `Web3` instance.
+        etherdelta_address: Address of the EtherDelta contract.
+        our_address: Address of the maker to track the orders of.
+    """
+
+    TRADE_TOPIC = encode_hex(event_signature_to_log_topic('Trade(address,uint256,address,uint256,address,address)'))
+    TRADE_TYPES = ['address', 'uint256', 'address', 'uint256', 'address', 'address']
+
+    CANCEL_TOPIC = encode_hex(event_signature_to_log_topic('Cancel(address,uint256,address,uint256,uint256,uint256,'
+                                                           'address,uint8,bytes32,bytes32)'))
+    CANCEL_TYPES = ['address', 'uint256', 'address', 'uint256', 'uint256', 'uint256', 'address', 'uint8', 'bytes32', 'bytes32']
+
+    # events of a few extra blocks are fetched each time, as cancellations can be applied twice,
+    # fills are de-duplicated and filled amounts are read from the contract, it is safe to do so
+    OVERLAP_BLOCKS = 10
+
+    logger = logging.getLogger()
+
+    def __init__(self, web3, etherdelta_address: Address, our_address: Address):
+        assert(isinstance(etherdelta_address, Address))
+        assert(isinstance(our_address, Address))
+
+        self.web3 = web3
+        self.etherdelta_address = etherdelta_address
+        self.our_address = our_address
+        self.fills = deque(maxlen=1000)
+        self.remaining_buy_amounts = {}
+
+        self._last_block = None
+
+    def update(self, orders: list, block_number: int) -> list:
+        """Returns those of `orders` which are still open, after applying events from the blocks mined since the last call.
+
+        Args:
+            orders: Our local list of orders.
+            block_number: Number of the latest block.
+
+        Returns:
+            Orders from `orders` which have not been fully filled nor cancelled.
+        """
+        assert(isinstance(orders, list))
+        assert(isinstance(block_number, int))
+
+        if self._last_block is None or block_number < self._last_block:
+            self._last_block = block_number
+
+        if block_number > self._last_block:
+            orders = self._apply_events(orders, block_number)
+            self._last_block = block_number
+
+        return orders
+
+    def with_remaining_amounts(self, orders: list) -> list:
+        """Returns `orders` wrapped in `TrackedOrder`, with the remaining amounts of the partially filled ones applied."""
+        assert(isinstance(orders, list))
+
+        return [TrackedOrder(order, self.remaining_buy_amounts.get(self.order_key(order), order.buy_amount))
+                for order in orders]
+
+    @staticmethod
+    def _key(token_get: Address, amount_get: int, token_give: Address, amount_give: int, expires: int, nonce: int):
+        return token_get, amount_get, token_give, amount_give, expires, nonce
+
+    @staticmethod
+    def order_key(order):
+        return EtherDeltaOrderTracker._key(order.buy_token, order.buy_amount.value, order.pay_token, order.pay_amount.value,
+                                           order.expires, order.nonce)
+
+    def _apply_events(self, orders: list, block_number: int) -> list:
+        closed_keys = set()
+        traded_pairs = set()
+
+        for log in self._get_logs(max(self._last_block - self.OVERLAP_BLOCKS + 1, 0), block_number):
+            data = decode_hex(log['data']) if isinstance(log['data'], str) else log['data']
+
+            if log['topics'][0] == self.CANCEL_TOPIC:
+                token_get, amount_get, token_give, amount_give, expires, nonce, user, _, _, _ = decode_abi(self.CANCEL_TYPES, data)
+                if Address(user) == self.our_address:
+                    closed_keys.add(self._key(Address(token_get), amount_get, Address(token_give), amount_give, expires, nonce))
+
+            elif log['topics'][0] == self.TRADE_TOPIC:
+                token_get, amount_get, token_give, amount_give, get, give = decode_abi(self.TRADE_TYPES, data)
+                if Address(get) == self.our_address:
+                    self._record_fill(log, Address(token_get), Wad(amount_get), Address(token_give), Wad(amount_give))
+                    traded_pairs.add((Address(token_get), Address(token_give)))
+
+        for order in orders:
+            if self.order_key(order) in closed_keys:
+                self.logger.info(f"Our order (nonce: {order.nonce}) has been cancelled")
+
+        open_orders = [order for order in orders if self.order_key(order) not in closed_keys]
+
+        traded_orders = [order for order in open_orders if (order.buy_token, order.pay_token) in traded_pairs]
+        for order, filled_amount in zip(traded_orders, self._filled_amounts(traded_orders)):
+            remaining_buy_amount = order.buy_amount - filled_amount
+            if remaining_buy_amount <= Wad(0):
+                self.logger.info(f"Our order (nonce: {order.nonce}) has been fully filled")
+                closed_keys.add(self.order_key(order))
+            elif filled_amount > Wad(0):
+                self.remaining_buy_amounts[self.order_key(order)] = remaining_buy_amount
+
+        for key in closed_keys:
+            self.remaining_buy_amounts.pop(key, None)
+
+        return [order for order in open_orders if self.order_key(order) not in closed_keys]
+
+    def _get_logs(self, from_block: int, to_block: int) -> list:
+        logs = self.web3.manager.request_blocking("eth_getLogs", [{'address': self.etherdelta_address.address,
+                                                                   'fromBlock': hex(from_block),
+                                                                   'toBlock': hex(to_block),
+                                                                   'topics': [[self.TRADE_TOPIC, self.CANCEL_TOPIC]]}])
+
+        def number(value):
+            return int(value, 16) if isinstance(value, str) else value
+
+        return sorted(logs, key=lambda log: (number(log['blockNumber']), number(log['logIndex'])))
+
+    def _filled_amounts(self, orders: list) -> list:
+        batch = JsonRpcBatch(self.web3)
+        for order in orders:
+            batch.call(self.etherdelta_address,
+                       'amountFilled(address,uint256,address,uint256,uint256,uint256,address,uint8,bytes32,bytes32)',
+                       [order.buy_token.address, order.buy_amount.value, order.pay_token.address, order.pay_amount.value,
+                        order.expires, order.nonce, order.maker.address, order.v, order.r, order.s],
+                       ['uint256'])
+
+        return [Wad(amount) for amount in batch.execute()]
+
+    def _record_fill(self, log: dict, token_get: Address, amount_get: Wad, token_give: Address, amount_give: Wad):
+        fill_id = (log['transactionHash'], log['logIndex'])
+        if any(fill['id'] == fill_id for fill in self.fills):
+            return
+
+        self.fills.append({'id': fill_id,
+                           'buy_token': token_get,
+                           'buy_amount': amount_get,
+                           'pay_token': token_give,
+                           'pay_amount': amount_give})
+
+        self.logger.info(f"Our order has been taken (bought {amount_get} of {token_get},"
+                         f" paid {amount_give} of {token_give})")
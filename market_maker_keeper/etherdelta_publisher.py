@@ -0,0 +1,249 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+import websocket
+
+from market_maker_keeper.supervised_websocket import Backoff
+
+
+def socket_io_url(api_server: str) -> str:
+    """Returns the socket.io WebSocket endpoint of an API server, i.e. `https://socket.etherdelta.com`."""
+    url = urlparse(api_server)
+    scheme = 'ws' if url.scheme in ['http', 'ws'] else 'wss'
+    return f"{scheme}://{url.netloc}/socket.io/?EIO=3&transport=websocket"
+
+
+class _Publication:
+    def __init__(self, order, attempt: int, ready_at: float):
+        self.order = order
+        self.attempt = attempt
+        self.ready_at = ready_at
+        self.sent_at = None
+
+
+class EtherDeltaPublisher:
+    """Publishes signed orders to the EtherDelta API over one persistent socket.io connection.
+
+    Unlike `EtherDeltaApi`, which starts the `etherdelta-client` Node tool (and does a new socket.io
+    handshake) for each order, the publisher keeps one connection open for the lifetime of the keeper.
+    It speaks the socket.io protocol (Engine.IO v3 over WebSocket) directly, so Node is not needed.
+
+    Orders passed to one `publish_orders()` call are written to the connection back to back, without
+    waiting for the results of the previous ones. The API answers each order with a `messageResult`
+    event, in the order they have been sent. Orders rejected by the API or not answered within `timeout`
+    seconds are published again after `retry_interval` seconds, up to `number_of_attempts` times.
+    Publishing is asynchronous, the same as with `EtherDeltaApi`.
+
+    Attributes:
+        api_server: Address of the EtherDelta API socket, i.e. `https://socket.etherdelta.com`.
+        number_of_attempts: Number of attempts to publish each order.
+        retry_interval: Time (in seconds) to wait before publishing a rejected order again.
+        timeout: Time (in seconds) to wait for the result of publishing an order.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, api_server: str, number_of_attempts: int = 3, retry_interval: int = 10, timeout: int = 120):
+        assert(isinstance(api_server, str))
+        assert(isinstance(number_of_attempts, int))
+        assert(isinstance(retry_interval, int))
+        assert(isinstance(timeout, int))
+
+        self.api_server = api_server
+        self.number_of_attempts = number_of_attempts
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._ws = None
+        self._connected = False
+        self._ping_interval = 25.0
+        self._last_ping = 0.0
+        self._queue = deque()
+        self._in_flight = deque()
+
+    def publish_order(self, order):
+        self.publish_orders([order])
+
+    def publish_orders(self, orders: list):
+        """Publishes orders asynchronously, all of them get written to the connection in one go."""
+        assert(isinstance(orders, list))
+
+        with self._lock:
+            for order in orders:
+                self._queue.append(_Publication(order, 1, 0.0))
+
+        self._start()
+        self._wakeup.set()
+
+    def pending_count(self) -> int:
+        """Returns the number of orders either waiting to be sent or waiting for their results."""
+        with self._lock:
+            return len(self._queue) + len(self._in_flight)
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+
+            self._started = True
+
+        threading.Thread(target=self._background_connection, daemon=True).start()
+        threading.Thread(target=self._background_sender, daemon=True).start()
+
+    def _background_connection(self):
+        backoff = Backoff(1.0, 30.0)
+
+        while True:
+            ws = websocket.WebSocketApp(url=socket_io_url(self.api_server),
+                                        on_message=lambda ws, message: self._on_message(ws, message, backoff),
+                                        on_error=lambda ws, error: self.logger.info(f"EtherDelta API socket error: '{error}'"),
+                                        on_close=lambda ws: self._on_close())
+            ws.run_forever()
+            self._on_close()
+
+            delay = backoff.next_delay()
+            self.logger.debug(f"EtherDelta API socket reconnecting in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _background_sender(self):
+        while True:
+            self._wakeup.wait(1.0)
+            self._wakeup.clear()
+
+            try:
+                self._process(time.time())
+            except Exception as e:
+                self.logger.warning(f"Failed to publish orders to EtherDelta ({e})")
+
+    def _on_message(self, ws, message: str, backoff: Backoff = None):
+        # Engine.IO handshake, it tells us how often we are supposed to ping
+        if message.startswith('0'):
+            self._ping_interval = json.loads(message[1:]).get('pingInterval', 25000) / 1000
+
+        # socket.io connection established
+        elif message == '40':
+            with self._lock:
+                self._ws = ws
+                self._connected = True
+                self._last_ping = time.time()
+
+            if backoff is not None:
+                backoff.reset()
+
+            self.logger.info(f"Connected to the EtherDelta API socket at {self.api_server}")
+            self._wakeup.set()
+
+        # socket.io event
+        elif message.startswith('42'):
+            event = json.loads(message[2:])
+            if event[0] == 'messageResult':
+                self._on_message_result(event[1] if len(event) > 1 else None)
+
+    def _on_close(self):
+        with self._lock:
+            if self._connected:
+                self.logger.info(f"Disconnected from the EtherDelta API socket at {self.api_server}")
+
+            self._connected = False
+            self._ws = None
+
+            # orders sent over the lost connection get sent again, it does not count as an attempt
+            while self._in_flight:
+                publication = self._in_flight.pop()
+                publication.sent_at = None
+                self._queue.appendleft(publication)
+
+    def _on_message_result(self, result):
+        with self._lock:
+            if not self._in_flight:
+                self.logger.debug(f"Unexpected result from the EtherDelta API: {result}")
+                return
+
+            publication = self._in_flight.popleft()
+
+        if isinstance(result, list) and len(result) > 0 and result[0] == 'success':
+            self.logger.info(f"Published order {publication.order} to EtherDelta")
+        else:
+            self._failed(publication, f"rejected: {result}", time.time())
+
+    def _failed(self, publication: _Publication, reason: str, now: float):
+        if publication.attempt < self.number_of_attempts:
+            self.logger.info(f"Publishing order {publication.order} to EtherDelta failed ({reason}),"
+                             f" will try again in {self.retry_interval}s")
+
+            with self._lock:
+                self._queue.append(_Publication(publication.order, publication.attempt + 1, now + self.retry_interval))
+
+            self._wakeup.set()
+
+        else:
+            self.logger.warning(f"Publishing order {publication.order} to EtherDelta failed ({reason}),"
+                                f" giving up after {publication.attempt} attempts")
+
+    def _close(self):
+        try:
+            self._ws.close()
+        except Exception as e:
+            self.logger.debug(f"Failed to close the EtherDelta API socket ({e})")
+
+        self._on_close()
+
+    def _process(self, now: float):
+        with self._lock:
+            timed_out = []
+            while self._in_flight and self._in_flight[0].sent_at + self.timeout <= now:
+                timed_out.append(self._in_flight.popleft())
+
+            # results are matched to orders by their order, so after a timeout we can not
+            # tell which result belongs to which order anymore and have to start over
+            if len(timed_out) > 0 and self._ws is not None:
+                self._close()
+
+            if self._connected:
+                ready = [publication for publication in self._queue if publication.ready_at <= now]
+                try:
+                    # publications become in flight before being sent, so if sending fails they get
+                    # put back at the front of the queue by `_on_close()` and are not lost
+                    for publication in ready:
+                        self._queue.remove(publication)
+                        publication.sent_at = now
+                        self._in_flight.append(publication)
+                        self._ws.send('42' + json.dumps(['message', publication.order.to_json()]))
+
+                    if len(ready) > 0:
+                        self.logger.debug(f"Sent {len(ready)} order(s) to the EtherDelta API socket")
+
+                    if now - self._last_ping >= self._ping_interval:
+                        self._ws.send('2')
+                        self._last_ping = now
+
+                except Exception as e:
+                    self.logger.warning(f"Failed to send to the EtherDelta API socket ({e}), reconnecting")
+                    self._close()
+
+        for publication in timed_out:
+            self._failed(publication, "timed out", now)
@@ -15,18 +15,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import logging
 import threading
 import time
 from base64 import b64encode
-from typing import Tuple
+from typing import Tuple, Optional
 
 import re
 from urllib.parse import urlparse
 
-import websocket
-
+from market_maker_keeper.supervised_websocket import SupervisedWebSocket
+from market_maker_keeper.tick_file import TickFileWriter, TickFileReader, TickReplay
 from market_maker_keeper.util import sanitize_url
 
 
@@ -46,9 +45,11 @@ class EmptyFeed(Feed):
 class WebSocketFeed(Feed):
     logger = logging.getLogger()
 
-    def __init__(self, ws_url: str, reconnect_delay: int):
+    def __init__(self, ws_url: str, reconnect_delay: int, hot_standby: bool = False, stall_timeout: Optional[float] = None):
         assert(isinstance(ws_url, str))
         assert(isinstance(reconnect_delay, int))
+        assert(isinstance(hot_standby, bool))
+        assert(isinstance(stall_timeout, float) or stall_timeout is None)
 
         self.ws_url = ws_url
         self.reconnect_delay = reconnect_delay
@@ -59,7 +60,18 @@ class WebSocketFeed(Feed):
         self._lock = threading.Lock()
         self._on_update_function = None
 
-        threading.Thread(target=self._background_run, daemon=True).start()
+        # messages received over the hot-standby connection are de-duplicated by their timestamps
+        self._websocket = SupervisedWebSocket(name=f"'{self._sanitized_url}'",
+                                              url=ws_url,
+                                              header=self._header,
+                                              on_open_function=lambda ws: None,
+                                              on_message_function=self._on_message,
+                                              key_function=lambda message_obj: float(message_obj['timestamp']),
+                                              connections=2 if hot_standby else 1,
+                                              stall_timeout=stall_timeout,
+                                              initial_reconnect_delay=float(reconnect_delay),
+                                              max_reconnect_delay=float(max(reconnect_delay, 60)))
+        self._websocket.start()
 
     @staticmethod
     def _get_header(ws_url: str):
@@ -68,27 +80,8 @@ class WebSocketFeed(Feed):
 
         return ["Authorization: Basic %s" % basic_header]
 
-    def _background_run(self):
-        while True:
-            ws = websocket.WebSocketApp(url=self.ws_url,
-                                        header=self._header,
-                                        on_message=self._on_message,
-                                        on_error=self._on_error,
-                                        on_open=self._on_open,
-                                        on_close=self._on_close)
-            ws.run_forever(ping_interval=15, ping_timeout=10)
-            time.sleep(self.reconnect_delay)
-
-    def _on_open(self, ws):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' connected")
-
-    def _on_close(self, ws):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' disconnected")
-
-    def _on_message(self, ws, message):
+    def _on_message(self, message_obj: dict):
         try:
-            message_obj = json.loads(message)
-
             data = dict(message_obj['data'])
             timestamp = float(message_obj['timestamp'])
             with self._lock:
@@ -97,12 +90,9 @@ class WebSocketFeed(Feed):
             if self._on_update_function is not None:
                 self._on_update_function()
 
-            self.logger.debug(f"WebSocket '{self._sanitized_url}' received message: '{message}'")
+            self.logger.debug(f"WebSocket '{self._sanitized_url}' received message: '{message_obj}'")
         except:
-            self.logger.warning(f"WebSocket '{self._sanitized_url}' received invalid message: '{message}'")
-
-    def _on_error(self, ws, error):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' error: '{error}'")
+            self.logger.warning(f"WebSocket '{self._sanitized_url}' received invalid message: '{message_obj}'")
 
     def get(self) -> Tuple[dict, float]:
         with self._lock:
@@ -132,3 +122,86 @@ class ExpiringFeed(Feed):
 
     def on_update(self, on_update_function):
         self.feed.on_update(on_update_function)
+
+
+class RecordingFeed(Feed):
+    """Records every update of the underlying feed into a tick file (see `TickFile`).
+
+    If the underlying feed notifies about its updates (like `WebSocketFeed` does), each update gets
+    recorded as soon as it arrives. Otherwise updates get recorded when they are read. Either way each
+    update gets recorded only once (distinguished by its timestamp).
+    """
+
+    def __init__(self, feed: Feed, writer: TickFileWriter, source: str):
+        assert(isinstance(feed, Feed))
+        assert(isinstance(writer, TickFileWriter))
+        assert(isinstance(source, str))
+
+        self.feed = feed
+        self.writer = writer
+        self.source = source
+        self._lock = threading.Lock()
+        self._last_timestamp = None
+        self._on_update_function = None
+
+        try:
+            self.feed.on_update(self._on_update)
+        except NotImplementedError:
+            pass
+
+    def _on_update(self):
+        self._record(*self.feed.get())
+
+        if self._on_update_function is not None:
+            self._on_update_function()
+
+    def _record(self, data: dict, timestamp: float):
+        with self._lock:
+            if timestamp != self._last_timestamp:
+                self.writer.write_data(self.source, data, timestamp)
+                self._last_timestamp = timestamp
+
+    def get(self) -> Tuple[dict, float]:
+        data, timestamp = self.feed.get()
+        self._record(data, timestamp)
+
+        return data, timestamp
+
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_function = on_update_function
+
+
+class ReplayFeed(Feed):
+    """Plays back feed updates recorded in a tick file (see `TickFile` and `TickReplay`).
+
+    Timestamps of the updates are shifted to the current time, so `ExpiringFeed` sees them
+    as fresh as they were when they were recorded (scaled by the replay speed).
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, path: str, source: Optional[str], speed: Optional[float], clock=time.time):
+        assert(isinstance(path, str))
+        assert(isinstance(source, str) or source is None)
+        assert(isinstance(speed, float) or speed is None)
+
+        reader = TickFileReader(path)
+        if source is None:
+            sources = reader.sources()
+            source = sources[min(sources)] if len(sources) > 0 else None
+
+        self.clock = clock
+        self.replay = TickReplay([tick for tick in reader.ticks(source) if tick.data is not None], speed, clock)
+
+        self.logger.info(f"Replaying {len(self.replay.ticks)} feed updates of '{source}' from '{path}'"
+                         f" at {f'{speed}x speed' if speed is not None else 'maximum speed'}")
+
+    def get(self) -> Tuple[dict, float]:
+        tick = self.replay.current()
+
+        if tick is None:
+            return {}, 0.0
+
+        return tick.data, self.clock() - self.replay.age(tick)
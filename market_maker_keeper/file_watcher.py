@@ -0,0 +1,155 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import threading
+import time
+
+
+class FileWatcher:
+    """Watches a file for changes and calls a function each time it changes.
+
+    Uses Linux _inotify_ (via `ctypes`, so no third-party packages are needed) to get notified
+    about changes straight away. As editors often save files by writing a new file and renaming it
+    over the old one, the directory containing the file is watched rather than the file itself.
+    If the file is a symlink, the directory of the file it points to gets watched as well, and on each
+    notification the target, inode and modification time of the file get compared with the previous
+    ones. This way swapping a symlink somewhere up the chain (like Kubernetes does with the `..data`
+    symlink of mounted ConfigMaps) gets noticed as well. If _inotify_ is not available (i.e. on macOS),
+    falls back to polling the same properties of the file.
+
+    Attributes:
+        filename: Name of the file to watch.
+        on_change_function: Function called (from a background thread) each time the file changes.
+        poll_interval: Interval (in seconds) of polling the modification time if _inotify_ is not available.
+    """
+
+    logger = logging.getLogger()
+
+    # We do not listen to `IN_MODIFY` or `IN_CREATE` as they would let us see half-written files.
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, filename: str, on_change_function, poll_interval: float = 1.0):
+        assert(isinstance(filename, str))
+        assert(callable(on_change_function))
+        assert(isinstance(poll_interval, float))
+
+        self.filename = filename
+        self.on_change_function = on_change_function
+        self.poll_interval = poll_interval
+
+        self._libc = None
+        self._inotify_fd = None
+        self._watched_directories = set()
+
+    @property
+    def using_inotify(self) -> bool:
+        return self._inotify_fd is not None
+
+    def start(self):
+        """Starts watching the file. Changes made after this method returns are guaranteed to be noticed."""
+        self._inotify_fd = self._create_inotify()
+
+        if self._inotify_fd is not None:
+            threading.Thread(target=self._background_inotify, daemon=True).start()
+        else:
+            self.logger.debug(f"inotify not available, polling '{self.filename}' for changes instead")
+            threading.Thread(target=self._background_poll, args=(self._signature(),), daemon=True).start()
+
+    def _create_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return None
+
+            self._libc = libc
+            if not self._add_watch(fd, os.path.dirname(os.path.abspath(self.filename))):
+                os.close(fd)
+                return None
+
+            self._add_watch(fd, os.path.dirname(os.path.realpath(self.filename)))
+            return fd
+        except (OSError, AttributeError, TypeError):
+            return None
+
+    def _add_watch(self, fd: int, directory: str) -> bool:
+        if directory in self._watched_directories:
+            return True
+
+        if self._libc.inotify_add_watch(fd, directory.encode('utf-8'), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            return False
+
+        self._watched_directories.add(directory)
+        return True
+
+    def _background_inotify(self):
+        signature = self._signature()
+
+        while True:
+            buffer = os.read(self._inotify_fd, 65536)
+
+            # the file can be written to directly, or through the symlink pointing to it
+            basenames = {os.path.basename(self.filename).encode('utf-8'),
+                         os.path.basename(os.path.realpath(self.filename)).encode('utf-8')}
+
+            changed = False
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, length = self.EVENT.unpack_from(buffer, offset)
+                name = buffer[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0')
+                changed = changed or name in basenames
+                offset += self.EVENT.size + length
+
+            new_signature = self._signature()
+            if changed or new_signature != signature:
+                signature = new_signature
+
+                # the symlink might point to a file in another directory now
+                self._add_watch(self._inotify_fd, os.path.dirname(os.path.realpath(self.filename)))
+                self._notify()
+
+    def _background_poll(self, signature):
+        while True:
+            time.sleep(self.poll_interval)
+
+            new_signature = self._signature()
+            if new_signature != signature:
+                signature = new_signature
+                self._notify()
+
+    def _signature(self):
+        # `os.stat()` follows symlinks, so it describes the file they eventually point to
+        try:
+            stat = os.stat(self.filename)
+            return os.path.realpath(self.filename), stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _notify(self):
+        try:
+            self.on_change_function()
+        except Exception as e:
+            self.logger.warning(f"Failed to process change of '{self.filename}' ({e})")
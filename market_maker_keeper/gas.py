@@ -15,46 +15,284 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 from typing import Optional
 
-from market_maker_keeper.gas_station import EthGasStation
+from market_maker_keeper.gas_station import EthGasStation, NodeGasStation
 from pymaker.gas import GasPrice, IncreasingGasPrice, FixedGasPrice, DefaultGasPrice
 
 
-class SmartGasPrice(GasPrice):
-    """Simple and smart gas price scenario.
+class StationGasPrice(GasPrice):
+    """Gas price scenario following a gas station, with a configurable escalation curve.
+
+    Starts with the gas station price of the chosen `level` multiplied by `multiplier`, adding
+    `increase_by` every `every_secs` seconds, up to `max_increase` above the starting price.
+    Falls back to an incremental default scenario if the gas station feed becomes unavailable.
 
-    Uses an EthGasStation feed. Starts with fast+10GWei, adding another 10GWei each 60 seconds
-    up to fast+50GWei maximum. Falls back to a default scenario (incremental as well) if
-    the EthGasStation feed unavailable for more than 10 minutes.
+    Attributes:
+        gas_station: `EthGasStation` or `NodeGasStation` to take the prices from.
+        level: Gas station price level (`safe_low`, `standard`, `fast` or `fastest`).
+        multiplier: Multiplier applied to the gas station price to get the starting price.
+        increase_by: Increase of the gas price (in Wei) every `every_secs` seconds.
+        every_secs: Interval of gas price increases (in seconds).
+        max_increase: Maximum increase above the starting price (in Wei).
     """
 
     GWEI = 1000000000
+    LEVELS = ['safe_low', 'standard', 'fast', 'fastest']
+
+    def __init__(self,
+                 gas_station,
+                 level: str = 'fast',
+                 multiplier: float = 1.1,
+                 increase_by: int = 10*GWEI,
+                 every_secs: int = 60,
+                 max_increase: int = 50*GWEI):
+        assert(level in self.LEVELS)
+        assert(isinstance(multiplier, float))
+        assert(isinstance(increase_by, int))
+        assert(isinstance(every_secs, int))
+        assert(every_secs > 0)
+        assert(isinstance(max_increase, int))
 
-    def __init__(self):
-        self.gas_station = EthGasStation(refresh_interval=60, expiry=600)
+        self.gas_station = gas_station
+        self.level = level
+        self.multiplier = multiplier
+        self.increase_by = increase_by
+        self.every_secs = every_secs
+        self.max_increase = max_increase
 
     def get_gas_price(self, time_elapsed: int) -> Optional[int]:
-        fast_price = self.gas_station.fast_price()
-        if fast_price is not None:
-            # start from fast_price + 10 GWei
-            # increase by 10 GWei every 60 seconds
-            # max is fast_price + 50 GWei
-            return min(int(fast_price*1.1) + int(time_elapsed/60)*(10*self.GWEI), int(fast_price*1.1)+(50*self.GWEI))
+        station_price = getattr(self.gas_station, f"{self.level}_price")()
+        if station_price is not None:
+            start_price = int(station_price*self.multiplier)
+            return min(start_price + int(time_elapsed/self.every_secs)*self.increase_by, start_price + self.max_increase)
         else:
-            # default gas pricing when EthGasStation feed is down
+            # default gas pricing when the gas station feed is down
             return IncreasingGasPrice(initial_price=50*self.GWEI,
                                       increase_by=10*self.GWEI,
                                       every_secs=60,
                                       max_price=100*self.GWEI).get_gas_price(time_elapsed)
 
 
+class SmartGasPrice(StationGasPrice):
+    """Simple and smart gas price scenario.
+
+    Uses an EthGasStation feed. Starts with fast+10%, adding another 10GWei each 60 seconds
+    up to 50GWei above the starting price. Falls back to a default scenario (incremental as well)
+    if the EthGasStation feed unavailable for more than 10 minutes.
+    """
+
+    def __init__(self, gas_station: Optional[EthGasStation] = None):
+        assert(isinstance(gas_station, EthGasStation) or gas_station is None)
+
+        super().__init__(gas_station if gas_station is not None else EthGasStation(refresh_interval=60, expiry=600))
+
+
+class NodeGasPrice(StationGasPrice):
+    """Smart gas price scenario based on the recent blocks seen by our own node.
+
+    Follows exactly the same scenario as `SmartGasPrice`, but takes the 'fast' gas price
+    from a `NodeGasStation` instead of from ethgasstation.info.
+    """
+
+    def __init__(self, web3):
+        super().__init__(NodeGasStation(web3=web3, expiry=600))
+
+
+class ReplacementPolicy:
+    """Policy of replacing transactions stuck pending with ones paying more for gas.
+
+    Attributes:
+        after_blocks: Number of blocks after which a pending transaction gets replaced.
+        multiplier: Multiplier applied to the gas price with each replacement. Nodes only accept
+            replacements paying at least 10% more, so it has to be at least 1.1.
+        max_replacements: Maximum number of replacements of one transaction.
+    """
+
+    def __init__(self, after_blocks: int, multiplier: float = 1.125, max_replacements: int = 5):
+        assert(isinstance(after_blocks, int))
+        assert(after_blocks > 0)
+        assert(isinstance(multiplier, float))
+        assert(multiplier >= 1.1)
+        assert(isinstance(max_replacements, int))
+
+        self.after_blocks = after_blocks
+        self.multiplier = multiplier
+        self.max_replacements = max_replacements
+
+
+class ReplacingGasPrice(GasPrice):
+    """Gas price of one transaction, raised each time it gets replaced.
+
+    Wraps the gas price scenario of the operation class, multiplying its prices by
+    `multiplier` for each replacement. As a changed gas price makes `Transact` resend the
+    transaction with the same nonce, calling `replace()` replaces a pending transaction.
+
+    Attributes:
+        gas_price: Gas price scenario of the operation class.
+        multiplier: Multiplier applied with each replacement.
+        default_price_function: Function returning the node default gas price, used if
+            the scenario leaves the gas price to the node.
+    """
+
+    def __init__(self, gas_price: GasPrice, multiplier: float, default_price_function):
+        assert(isinstance(gas_price, GasPrice))
+        assert(isinstance(multiplier, float))
+        assert(callable(default_price_function))
+
+        self.gas_price = gas_price
+        self.multiplier = multiplier
+        self.default_price_function = default_price_function
+        self.replacements = 0
+        self._default_price = None
+
+    def replace(self):
+        if self.replacements == 0 and self.gas_price.get_gas_price(0) is None:
+            self._default_price = self.default_price_function()
+
+        self.replacements += 1
+
+    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
+        gas_price = self.gas_price.get_gas_price(time_elapsed)
+        if self.replacements == 0:
+            return gas_price
+
+        if gas_price is None:
+            gas_price = self._default_price
+
+        return int(gas_price * (self.multiplier ** self.replacements))
+
+
+class OperationGasPrices:
+    """Gas price scenarios for each class of operations a keeper sends transactions for.
+
+    Attributes:
+        cancel: Gas price for order cancellations.
+        place: Gas price for order placements.
+        deposit: Gas price for deposits and withdrawals.
+        approve: Gas price for token approvals.
+        replacement_policies: Replacement policies of operation classes for which stuck transactions
+            should get replaced.
+    """
+
+    OPERATIONS = ['cancel', 'place', 'deposit', 'approve']
+
+    def __init__(self, cancel: GasPrice, place: GasPrice, deposit: GasPrice, approve: GasPrice,
+                 replacement_policies: Optional[dict] = None):
+        assert(isinstance(cancel, GasPrice))
+        assert(isinstance(place, GasPrice))
+        assert(isinstance(deposit, GasPrice))
+        assert(isinstance(approve, GasPrice))
+        assert(isinstance(replacement_policies, dict) or replacement_policies is None)
+
+        self.cancel = cancel
+        self.place = place
+        self.deposit = deposit
+        self.approve = approve
+        self.replacement_policies = replacement_policies or {}
+
+    def gas_price(self, operation: str) -> GasPrice:
+        assert(operation in self.OPERATIONS)
+
+        return getattr(self, operation)
+
+    def replacement_policy(self, operation: str) -> Optional[ReplacementPolicy]:
+        assert(operation in self.OPERATIONS)
+
+        return self.replacement_policies.get(operation)
+
+
 class GasPriceFactory:
     @staticmethod
-    def create_gas_price(arguments) -> GasPrice:
-        if arguments.smart_gas_price:
+    def create_gas_price(arguments, web3=None) -> GasPrice:
+        if arguments.node_gas_price:
+            return NodeGasPrice(web3=web3)
+        elif arguments.smart_gas_price:
             return SmartGasPrice()
         elif arguments.gas_price:
             return FixedGasPrice(arguments.gas_price)
         else:
             return DefaultGasPrice()
+
+    def create_gas_prices(self, arguments, web3=None) -> OperationGasPrices:
+        """Creates gas price scenarios for all operation classes.
+
+        Operation classes configured in the `--gas-config` file get their own scenarios, all the other
+        ones (and the ones configured without a `strategy`) share the scenario selected with `--gas-price`,
+        `--smart-gas-price` or `--node-gas-price`. Scenarios following the node need `web3`, the node
+        gets queried through its provider.
+        """
+        default_gas_prices = []
+
+        def default_gas_price():
+            # the default scenario can start a gas station, so it only gets created if some class uses it
+            if not default_gas_prices:
+                default_gas_prices.append(self.create_gas_price(arguments, web3))
+
+            return default_gas_prices[0]
+
+        if arguments.gas_config is None:
+            return OperationGasPrices(**{operation: default_gas_price() for operation in OperationGasPrices.OPERATIONS})
+
+        with open(arguments.gas_config) as file:
+            config = json.load(file)
+
+        for operation in config:
+            if operation not in OperationGasPrices.OPERATIONS:
+                raise Exception(f"Unknown operation class '{operation}' in the gas configuration,"
+                                f" should be one of: {', '.join(OperationGasPrices.OPERATIONS)}")
+
+        gas_stations = {}
+
+        def gas_station(strategy: str):
+            # gas stations run background threads, so they are shared between operation classes
+            if strategy not in gas_stations:
+                if strategy == 'node':
+                    gas_stations[strategy] = NodeGasStation(web3=web3, expiry=600)
+                else:
+                    gas_stations[strategy] = EthGasStation(refresh_interval=60, expiry=600)
+
+            return gas_stations[strategy]
+
+        gas_prices = {operation: self._create_operation_gas_price(config[operation], gas_station, default_gas_price)
+                      if operation in config else default_gas_price()
+                      for operation in OperationGasPrices.OPERATIONS}
+
+        replacement_policies = {operation: ReplacementPolicy(after_blocks=int(config[operation]['replaceAfterBlocks']),
+                                                             multiplier=float(config[operation].get('replaceMultiplier', 1.125)),
+                                                             max_replacements=int(config[operation].get('maxReplacements', 5)))
+                                for operation in config if 'replaceAfterBlocks' in config[operation]}
+
+        return OperationGasPrices(**gas_prices, replacement_policies=replacement_policies)
+
+    @staticmethod
+    def _create_operation_gas_price(config: dict, gas_station, default_gas_price) -> GasPrice:
+        strategy = config.get('strategy')
+
+        if strategy is None:
+            return default_gas_price()
+
+        elif strategy == 'default':
+            return DefaultGasPrice()
+
+        elif strategy == 'fixed':
+            return FixedGasPrice(int(config['price']))
+
+        elif strategy == 'increasing':
+            return IncreasingGasPrice(initial_price=int(config['initialPrice']),
+                                      increase_by=int(config['increaseBy']),
+                                      every_secs=int(config['everySecs']),
+                                      max_price=int(config['maxPrice']))
+
+        elif strategy in ['smart', 'node']:
+            return StationGasPrice(gas_station=gas_station(strategy),
+                                   level=config.get('level', 'fast'),
+                                   multiplier=float(config.get('multiplier', 1.1)),
+                                   increase_by=int(config.get('increaseBy', 10*StationGasPrice.GWEI)),
+                                   every_secs=int(config.get('everySecs', 60)),
+                                   max_increase=int(config.get('maxIncrease', 50*StationGasPrice.GWEI)))
+
+        else:
+            raise Exception(f"Unknown gas price strategy '{strategy}', should be one of:"
+                            f" default, fixed, increasing, smart, node")
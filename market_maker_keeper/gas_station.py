@@ -18,6 +18,7 @@
 import logging
 import threading
 import time
+from collections import OrderedDict
 from typing import Optional
 
 import requests
@@ -40,6 +41,7 @@ class EthGasStation:
     Attributes:
         refresh_interval: Refresh frequency (in seconds).
         expiry: Expiration time (in seconds).
+        timeout: HTTP request timeout (in seconds).
     """
 
     URL = "https://ethgasstation.info/json/ethgasAPI.json"
@@ -47,12 +49,15 @@ class EthGasStation:
 
     logger = logging.getLogger()
 
-    def __init__(self, refresh_interval: int, expiry: int):
+    def __init__(self, refresh_interval: int, expiry: int, timeout: float = 10.0):
         assert(isinstance(refresh_interval, int))
         assert(isinstance(expiry, int))
+        assert(isinstance(timeout, float))
 
         self.refresh_interval = refresh_interval
         self.expiry = expiry
+        self.timeout = timeout
+        self.session = requests.Session()
         self._safe_low_price = None
         self._standard_price = None
         self._fast_price = None
@@ -68,7 +73,7 @@ class EthGasStation:
 
     def _fetch_price(self):
         try:
-            data = requests.get(self.URL).json()
+            data = self.session.get(self.URL, timeout=self.timeout).json()
             self._safe_low_price = int(data['safeLow']*self.SCALE)
             self._standard_price = int(data['average']*self.SCALE)
             self._fast_price = int(data['fast']*self.SCALE)
@@ -133,3 +138,226 @@ class EthGasStation:
             feed has expired.
         """
         return self._return_value_if_valid(self._fastest_price)
+
+
+class RpcError(Exception):
+    pass
+
+
+class NodeGasStation:
+    """Gas price oracle computed from the recent blocks seen by our own Ethereum node.
+
+    The node is queried through the provider of the keeper's `Web3` instance, so it works over HTTP,
+    IPC and WebSocket connections alike. Creating an instance of this class runs a background thread,
+    which polls the node for the latest block number every `refresh_interval` seconds. Gas prices
+    are recalculated only when a new block arrives, using the last `blocks` blocks:
+
+    * if the node supports `eth_feeHistory`, the price is the base fee of the next block plus
+      the median (across blocks) of the priority fees paid at the given percentile,
+    * otherwise the transactions of these blocks are fetched with `eth_getBlockByNumber` (each block
+      only once, they are cached) and the price is the given percentile of their gas prices.
+
+    The four `percentiles` correspond to the `safe_low`, `standard`, `fast` and `fastest` prices.
+    Apart from legacy gas prices, `eip1559_fees()` returns `maxFeePerGas` and `maxPriorityFeePerGas`
+    for each of these levels, as long as the node reports base fees.
+
+    If no new prices have been calculated for `expiry` seconds, all `*_price()` methods start
+    returning `None` until the node becomes available again.
+
+    All gas prices are returned in Wei.
+
+    Attributes:
+        web3: `Web3` instance connected to the node.
+        refresh_interval: Block number polling frequency (in seconds).
+        expiry: Expiration time (in seconds).
+        blocks: Number of recent blocks to calculate the prices from.
+        percentiles: Percentiles used for the `safe_low`, `standard`, `fast` and `fastest` prices.
+    """
+
+    LEVELS = ['safe_low', 'standard', 'fast', 'fastest']
+
+    logger = logging.getLogger()
+
+    def __init__(self,
+                 web3,
+                 refresh_interval: float = 1.0,
+                 expiry: int = 600,
+                 blocks: int = 20,
+                 percentiles: tuple = (25, 50, 75, 95)):
+        assert(web3 is not None)
+        assert(isinstance(refresh_interval, float))
+        assert(isinstance(expiry, int))
+        assert(isinstance(blocks, int))
+        assert(blocks > 0)
+        assert(isinstance(percentiles, tuple))
+        assert(len(percentiles) == len(self.LEVELS))
+        assert(all(0 <= percentile <= 100 for percentile in percentiles))
+
+        self.web3 = web3
+        self.refresh_interval = refresh_interval
+        self.expiry = expiry
+        self.blocks = blocks
+        self.percentiles = percentiles
+
+        self._fee_history_supported = True
+        self._block_cache = OrderedDict()
+        self._last_block_number = None
+        self._prices = {}
+        self._fees = {}
+        self._last_refresh = 0
+        self._expired = True
+        threading.Thread(target=self._background_run, daemon=True).start()
+
+    def _background_run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.refresh_interval)
+
+    def _rpc(self, method: str, params: list):
+        # goes straight to the provider, so the results do not get reformatted by `web3` middlewares
+        response = self.web3.providers[0].make_request(method, params)
+
+        if 'error' in response:
+            raise RpcError(response['error'])
+
+        return response['result']
+
+    def refresh(self):
+        """Recalculates the gas prices if a new block has arrived since the last call."""
+        try:
+            block_number = int(self._rpc("eth_blockNumber", []), 16)
+
+            if block_number != self._last_block_number:
+                self._prices, self._fees = self._calculate(block_number)
+                self._last_block_number = block_number
+
+                self.logger.debug(f"Calculated gas prices as of block #{block_number}: {self._prices}")
+
+            self._last_refresh = int(time.time())
+
+            if self._expired:
+                self.logger.info(f"Current gas prices information from the node became available")
+                self._expired = False
+        except:
+            self.logger.warning(f"Failed to calculate current gas prices from the node")
+
+    def _calculate(self, block_number: int) -> tuple:
+        if self._fee_history_supported:
+            try:
+                return self._calculate_from_fee_history()
+            except RpcError as e:
+                self.logger.info(f"Node does not support 'eth_feeHistory' ({e}),"
+                                 f" calculating gas prices from recent transactions instead")
+                self._fee_history_supported = False
+
+        return self._calculate_from_blocks(block_number)
+
+    def _calculate_from_fee_history(self) -> tuple:
+        fee_history = self._rpc("eth_feeHistory", [hex(self.blocks), "latest", list(self.percentiles)])
+
+        # `baseFeePerGas` has one more element than there are blocks, the base fee of the next block
+        next_base_fee = int(fee_history['baseFeePerGas'][-1], 16)
+        rewards = [reward for reward, gas_used_ratio in zip(fee_history['reward'], fee_history['gasUsedRatio'])
+                   if gas_used_ratio > 0]
+
+        prices, fees = {}, {}
+        for index, level in enumerate(self.LEVELS):
+            priority_fee = self._median([int(reward[index], 16) for reward in rewards]) if rewards else 0
+            prices[level] = next_base_fee + priority_fee
+            fees[level] = self._eip1559_fees(next_base_fee, priority_fee)
+
+        return prices, fees
+
+    def _calculate_from_blocks(self, block_number: int) -> tuple:
+        first_block_number = max(block_number - self.blocks + 1, 0)
+
+        for number in list(self._block_cache.keys()):
+            if number < first_block_number or number > block_number:
+                del self._block_cache[number]
+
+        for number in range(first_block_number, block_number + 1):
+            if number not in self._block_cache:
+                block = self._rpc("eth_getBlockByNumber", [hex(number), True])
+                if block is None:
+                    continue
+
+                base_fee = int(block['baseFeePerGas'], 16) if block.get('baseFeePerGas') is not None else None
+                gas_prices = [int(transaction['gasPrice'], 16) for transaction in block['transactions']]
+                self._block_cache[number] = (base_fee, gas_prices)
+
+        gas_prices = sorted(gas_price for _, block_gas_prices in self._block_cache.values()
+                            for gas_price in block_gas_prices)
+        if len(gas_prices) == 0:
+            raise Exception(f"No transactions in blocks #{first_block_number}-#{block_number}")
+
+        base_fee = self._block_cache[max(self._block_cache.keys())][0]
+
+        prices, fees = {}, {}
+        for percentile, level in zip(self.percentiles, self.LEVELS):
+            prices[level] = self._percentile(gas_prices, percentile)
+            if base_fee is not None:
+                fees[level] = self._eip1559_fees(base_fee, max(prices[level] - base_fee, 0))
+
+        return prices, fees
+
+    @staticmethod
+    def _eip1559_fees(base_fee: int, priority_fee: int) -> dict:
+        # leaves room for the base fee to keep on rising for a few full blocks
+        return {'maxFeePerGas': 2*base_fee + priority_fee, 'maxPriorityFeePerGas': priority_fee}
+
+    @staticmethod
+    def _median(values: list) -> int:
+        values = sorted(values)
+        middle = len(values) // 2
+        return values[middle] if len(values) % 2 == 1 else (values[middle - 1] + values[middle]) // 2
+
+    @staticmethod
+    def _percentile(sorted_values: list, percentile: float) -> int:
+        # nearest-rank method
+        rank = max(int(-(-percentile * len(sorted_values) // 100)), 1)
+        return sorted_values[rank - 1]
+
+    def _return_value_if_valid(self, value):
+        if int(time.time()) - self._last_refresh <= self.expiry:
+            return value
+
+        else:
+            if self._last_refresh == 0:
+                self.logger.warning(f"Current gas prices information from the node is unavailable")
+                self._last_refresh = 1
+
+            if not self._expired:
+                self.logger.warning(f"Current gas prices information from the node has expired")
+                self._expired = True
+
+            return None
+
+    def safe_low_price(self) -> Optional[int]:
+        """Returns the current gas price at the `safe_low` percentile (in Wei)."""
+        return self._return_value_if_valid(self._prices.get('safe_low'))
+
+    def standard_price(self) -> Optional[int]:
+        """Returns the current gas price at the `standard` percentile (in Wei)."""
+        return self._return_value_if_valid(self._prices.get('standard'))
+
+    def fast_price(self) -> Optional[int]:
+        """Returns the current gas price at the `fast` percentile (in Wei)."""
+        return self._return_value_if_valid(self._prices.get('fast'))
+
+    def fastest_price(self) -> Optional[int]:
+        """Returns the current gas price at the `fastest` percentile (in Wei)."""
+        return self._return_value_if_valid(self._prices.get('fastest'))
+
+    def eip1559_fees(self, level: str = 'fast') -> Optional[dict]:
+        """Returns the current EIP-1559 fee fields for one of the price levels.
+
+        Args:
+            level: One of `safe_low`, `standard`, `fast` or `fastest`.
+
+        Returns:
+            A dictionary with `maxFeePerGas` and `maxPriorityFeePerGas` (in Wei), or `None` if
+            the prices have expired or the node does not report base fees.
+        """
+        assert(level in self.LEVELS)
+
+        return self._return_value_if_valid(self._fees.get(level))
@@ -75,6 +75,17 @@ class GateIOMarketMakerKeeper:
         parser.add_argument("--spread-feed-expiry", type=int, default=3600,
                             help="Maximum age of the spread feed (in seconds, default: 3600)")
 
+        parser.add_argument("--spread-feed-step", type=float,
+                            help="Step to round spread feed values to, so configs evaluated for them can be reused"
+                                 " (default: no rounding)")
+
+        parser.add_argument("--websocket-hot-standby", dest='websocket_hot_standby', action='store_true',
+                            help="Keep a hot-standby connection for WebSocket price and spread feeds")
+
+        parser.add_argument("--websocket-stall-timeout", type=int, default=5000,
+                            help="Time without any messages after which a price or spread feed WebSocket connection"
+                                 " is considered stalled (in milliseconds, default: 5000)")
+
         parser.add_argument("--order-history", type=str,
                             help="Endpoint to report active orders to")
 
@@ -90,7 +101,7 @@ class GateIOMarketMakerKeeper:
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
-        self.bands_config = ReloadableConfig(self.arguments.config)
+        self.bands_config = ReloadableConfig(self.arguments.config, spread_feed_step=self.arguments.spread_feed_step)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments)
         self.spread_feed = create_spread_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
@@ -0,0 +1,177 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from bisect import bisect_left
+from typing import Optional, Tuple
+
+
+class GdaxOrderBook:
+    """Incrementally maintained level-2 order book, as published by the GDAX `level2` channel.
+
+    Each side of the book is kept as two parallel, sorted arrays (prices and sizes). Price levels
+    are located with a binary search, so applying a single `l2update` change costs O(log n) to find
+    the level plus a `memmove` of the array tail in case a level gets inserted or removed. As most
+    of the updates happen close to the top of the book, bids are stored in ascending order and asks
+    are stored with negated prices (so in descending order of the actual price). This way the best
+    level of each side is always the last element of its array.
+
+    All prices and sizes are kept as floats, they get converted to `Wad` only when read
+    by the price feed.
+    """
+
+    def __init__(self):
+        self._bid_prices = []
+        self._bid_sizes = []
+        self._ask_prices = []
+        self._ask_sizes = []
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def initialized(self) -> bool:
+        """`True` if at least one snapshot has been applied to the book, `False` otherwise."""
+        return self._initialized
+
+    def apply_snapshot(self, bids: list, asks: list):
+        """Replaces the whole content of the book with a snapshot.
+
+        Args:
+            bids: List of `[price, size]` pairs, as received in the GDAX `snapshot` message.
+            asks: List of `[price, size]` pairs, as received in the GDAX `snapshot` message.
+        """
+        assert(isinstance(bids, list))
+        assert(isinstance(asks, list))
+
+        bid_levels = sorted((float(price), float(size)) for price, size in bids)
+        ask_levels = sorted(((-float(price), float(size)) for price, size in asks))
+
+        with self._lock:
+            self._bid_prices = [price for price, size in bid_levels if size > 0]
+            self._bid_sizes = [size for price, size in bid_levels if size > 0]
+            self._ask_prices = [price for price, size in ask_levels if size > 0]
+            self._ask_sizes = [size for price, size in ask_levels if size > 0]
+            self._initialized = True
+
+    def apply_update(self, changes: list):
+        """Applies changes received in a single GDAX `l2update` message.
+
+        Args:
+            changes: List of `[side, price, size]` triples. Size of zero means the price level
+                has to be removed from the book.
+        """
+        assert(isinstance(changes, list))
+
+        with self._lock:
+            for side, price, size in changes:
+                if side == 'buy':
+                    self._set_level(self._bid_prices, self._bid_sizes, float(price), float(size))
+                else:
+                    self._set_level(self._ask_prices, self._ask_sizes, -float(price), float(size))
+
+    @staticmethod
+    def _set_level(prices: list, sizes: list, price: float, size: float):
+        index = bisect_left(prices, price)
+        exists = index < len(prices) and prices[index] == price
+
+        if size > 0:
+            if exists:
+                sizes[index] = size
+            else:
+                prices.insert(index, price)
+                sizes.insert(index, size)
+
+        elif exists:
+            del prices[index]
+            del sizes[index]
+
+    def best_bid(self) -> Optional[Tuple[float, float]]:
+        """Returns the best bid as a `(price, size)` tuple, or `None` if there are no bids."""
+        with self._lock:
+            return (self._bid_prices[-1], self._bid_sizes[-1]) if len(self._bid_prices) > 0 else None
+
+    def best_ask(self) -> Optional[Tuple[float, float]]:
+        """Returns the best ask as a `(price, size)` tuple, or `None` if there are no asks."""
+        with self._lock:
+            return (-self._ask_prices[-1], self._ask_sizes[-1]) if len(self._ask_prices) > 0 else None
+
+    def depth(self) -> Tuple[int, int]:
+        """Returns the number of bid and ask price levels present in the book."""
+        with self._lock:
+            return len(self._bid_prices), len(self._ask_prices)
+
+    def mid_price(self) -> Optional[float]:
+        """Returns the arithmetic average of the best bid and the best ask."""
+        with self._lock:
+            if len(self._bid_prices) == 0 or len(self._ask_prices) == 0:
+                return None
+
+            return (self._bid_prices[-1] - self._ask_prices[-1]) / 2
+
+    def microprice(self) -> Optional[float]:
+        """Returns the size-weighted mid price.
+
+        The best bid is weighted with the size of the best ask and vice versa, so the price
+        leans towards the side of the book which is more likely to be taken out first.
+        """
+        with self._lock:
+            if len(self._bid_prices) == 0 or len(self._ask_prices) == 0:
+                return None
+
+            bid_price, bid_size = self._bid_prices[-1], self._bid_sizes[-1]
+            ask_price, ask_size = -self._ask_prices[-1], self._ask_sizes[-1]
+
+            return (bid_price * ask_size + ask_price * bid_size) / (bid_size + ask_size)
+
+    def depth_weighted_prices(self, depth: float) -> Tuple[Optional[float], Optional[float]]:
+        """Returns the average price of selling (bid side) and buying (ask side) `depth` units.
+
+        If there is not enough liquidity on one side of the book, the average price of all
+        the liquidity available on that side is returned.
+
+        Args:
+            depth: Amount (in base units) for which the average prices should be calculated.
+
+        Returns:
+            A `(bid_price, ask_price)` tuple. Each of the prices can be `None` if that side
+            of the book is empty.
+        """
+        assert(isinstance(depth, float))
+        assert(depth > 0)
+
+        with self._lock:
+            bid_price = self._weighted_price(self._bid_prices, self._bid_sizes, depth)
+            ask_price = self._weighted_price(self._ask_prices, self._ask_sizes, depth)
+
+        return bid_price, -ask_price if ask_price is not None else None
+
+    @staticmethod
+    def _weighted_price(prices: list, sizes: list, depth: float) -> Optional[float]:
+        remaining = depth
+        total_value = 0.0
+        total_size = 0.0
+
+        for index in range(len(prices) - 1, -1, -1):
+            size = min(sizes[index], remaining)
+            total_value += prices[index] * size
+            total_size += size
+            remaining -= size
+
+            if remaining <= 0:
+                break
+
+        return total_value / total_size if total_size > 0 else None
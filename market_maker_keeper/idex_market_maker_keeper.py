@@ -18,18 +18,25 @@
 import argparse
 import logging
 import sys
+import time
 
 from retry import retry
-from web3 import Web3, HTTPProvider
+from web3 import Web3
 
 from market_maker_keeper.band import Bands
+from market_maker_keeper.deposit_manager import DepositManager
 from market_maker_keeper.gas import GasPriceFactory
 from market_maker_keeper.limit import History
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.local_signing import register_keys
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.receipt_tracker import ReceiptTracker
 from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.rpc_batch import JsonRpcBatch
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
+from market_maker_keeper.web3_provider import create_provider, create_block_watcher
 from pyexchange.idex import IDEX, IDEXApi
 from pymaker import Address
 from pymaker.approval import directly
@@ -38,7 +45,6 @@ from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
 from pymaker.sai import Tub
 from pymaker.token import ERC20Token
-from pymaker.util import eth_balance
 
 
 class IdexMarketMakerKeeper:
@@ -58,9 +64,20 @@ class IdexMarketMakerKeeper:
         parser.add_argument("--rpc-timeout", type=int, default=10,
                             help="JSON-RPC timeout (in seconds, default: 10)")
 
+        parser.add_argument("--rpc-ipc-path", type=str,
+                            help="Path to the IPC socket of the Ethereum node, to use instead of JSON-RPC over HTTP")
+
+        parser.add_argument("--rpc-ws-url", type=str,
+                            help="WebSocket URL of the Ethereum node (i.e. `ws://localhost:8546'),"
+                                 " to use instead of JSON-RPC over HTTP")
+
         parser.add_argument("--eth-from", type=str, required=True,
                             help="Ethereum account from which to send transactions")
 
+        parser.add_argument("--eth-key", type=str, nargs='*',
+                            help="Ethereum private key(s) to sign transactions with locally,"
+                                 " in the `key_file=<keystore file>,pass_file=<password file>' format")
+
         parser.add_argument("--tub-address", type=str, required=True,
                             help="Ethereum address of the Tub contract")
 
@@ -88,6 +105,17 @@ class IdexMarketMakerKeeper:
         parser.add_argument("--spread-feed-expiry", type=int, default=3600,
                             help="Maximum age of the spread feed (in seconds, default: 3600)")
 
+        parser.add_argument("--spread-feed-step", type=float,
+                            help="Step to round spread feed values to, so configs evaluated for them can be reused"
+                                 " (default: no rounding)")
+
+        parser.add_argument("--websocket-hot-standby", dest='websocket_hot_standby', action='store_true',
+                            help="Keep a hot-standby connection for WebSocket price and spread feeds")
+
+        parser.add_argument("--websocket-stall-timeout", type=int, default=5000,
+                            help="Time without any messages after which a price or spread feed WebSocket connection"
+                                 " is considered stalled (in milliseconds, default: 5000)")
+
         parser.add_argument("--order-history", type=str,
                             help="Endpoint to report active orders to")
 
@@ -106,12 +134,25 @@ class IdexMarketMakerKeeper:
         parser.add_argument("--min-sai-deposit", type=float, required=True,
                             help="Minimum amount of SAI that can be deposited in one transaction")
 
+        parser.add_argument("--deposit-lead-time", type=float, default=300.0,
+                            help="Time (in seconds) of fills at the recent fill rate to deposit ahead for"
+                                 " (default: 300)")
+
         parser.add_argument("--gas-price", type=int, default=0,
                             help="Gas price (in Wei)")
 
         parser.add_argument("--smart-gas-price", dest='smart_gas_price', action='store_true',
                             help="Use smart gas pricing strategy, based on the ethgasstation.info feed")
 
+        parser.add_argument("--node-gas-price", dest='node_gas_price', action='store_true',
+                            help="Use smart gas pricing strategy, based on recent blocks seen by the Ethereum node")
+
+        parser.add_argument("--gas-config", type=str, required=False,
+                            help="Gas price configuration file, with separate strategies per operation class")
+
+        parser.add_argument("--refresh-frequency", type=int, default=3,
+                            help="Order book refresh frequency (in seconds, default: 3)")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -120,20 +161,21 @@ class IdexMarketMakerKeeper:
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
-        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
-                                                                              request_kwargs={"timeout": self.arguments.rpc_timeout}))
+        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(create_provider(self.arguments))
         self.web3.eth.defaultAccount = self.arguments.eth_from
+        register_keys(self.web3, self.arguments.eth_key or [])
+        self.block_watcher = create_block_watcher(self.web3, self.synchronize_orders)
         self.our_address = Address(self.arguments.eth_from)
         self.tub = Tub(web3=self.web3, address=Address(self.arguments.tub_address))
         self.sai = ERC20Token(web3=self.web3, address=self.tub.sai())
         self.gem = ERC20Token(web3=self.web3, address=self.tub.gem())
 
-        self.bands_config = ReloadableConfig(self.arguments.config)
+        self.bands_config = ReloadableConfig(self.arguments.config, spread_feed_step=self.arguments.spread_feed_step)
         self.eth_reserve = Wad.from_number(self.arguments.eth_reserve)
         self.min_eth_balance = Wad.from_number(self.arguments.min_eth_balance)
         self.min_eth_deposit = Wad.from_number(self.arguments.min_eth_deposit)
         self.min_sai_deposit = Wad.from_number(self.arguments.min_sai_deposit)
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.gas_prices = GasPriceFactory().create_gas_prices(self.arguments, self.web3)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments, self.tub)
         self.spread_feed = create_spread_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
@@ -144,26 +186,53 @@ class IdexMarketMakerKeeper:
         self.history = History()
         self.idex = IDEX(self.web3, Address(self.arguments.idex_address))
         self.idex_api = IDEXApi(self.idex, self.arguments.idex_api_server, self.arguments.idex_timeout)
+        self.receipt_tracker = ReceiptTracker(web3=self.web3, gas_prices=self.gas_prices)
+
+        self.deposit_manager = DepositManager(lead_time=self.arguments.deposit_lead_time)
+        self.deposit_manager.add_token(self.token_sell(), self.min_eth_deposit,
+                                       lambda amount: self.deposit_function(self.idex.deposit(amount)))
+        self.deposit_manager.add_token(self.token_buy(), self.min_sai_deposit,
+                                       lambda amount: self.deposit_function(self.idex.deposit_token(self.sai.address, amount)))
+
+        self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.get_orders_with(lambda: self.our_orders())
+        self.order_book_manager.get_balances_with(lambda: self.our_balances())
+        self.order_book_manager.place_orders_with(self.place_order_function)
+        self.order_book_manager.cancel_orders_with(lambda order: self.idex_api.cancel_order(order))
+        self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
+        self.order_book_manager.start()
 
     def main(self):
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.initial_delay(10)
             lifecycle.on_startup(self.startup)
-            lifecycle.on_block(self.synchronize_orders)
+            lifecycle.on_block(self.synchronize_orders if self.block_watcher is None else self.on_block)
             lifecycle.on_shutdown(self.shutdown)
 
     def startup(self):
         self.approve()
 
+        if self.block_watcher is not None:
+            self.block_watcher.start()
+
     @retry(delay=5, logger=logger)
     def shutdown(self):
-        self.cancel_all_orders()
+        if self.block_watcher is not None:
+            self.block_watcher.stop()
+
+        self.order_book_manager.cancel_all_orders()
+
+    def on_block(self):
+        # With `--rpc-ipc-path` or `--rpc-ws-url` orders get synchronized by the `newHeads` block watcher.
+        # This method is present only so the lifecycle binds the new block listener, which makes
+        # it then terminate the keeper if no new blocks have been arriving for 300 seconds.
+        pass
 
     def approve(self):
         token_addresses = filter(lambda address: address != IDEX.ETH_TOKEN, [self.token_sell(), self.token_buy()])
         tokens = list(map(lambda address: ERC20Token(web3=self.web3, address=address), token_addresses))
 
-        self.idex.approve(tokens, directly(gas_price=self.gas_price))
+        self.idex.approve(tokens, directly(gas_price=self.gas_prices.approve))
 
     def pair(self):
         # IDEX is inconsistent here. They call the pair `DAI_ETH`, but in reality all prices are
@@ -176,20 +245,38 @@ class IdexMarketMakerKeeper:
     def token_buy(self) -> Address:
         return self.sai.address
 
-    def our_balances(self):
-        return self.idex_api.get_balances()
+    def our_balances(self) -> dict:
+        # Balances reported by the API and balances held by the IDEX contract get fetched together.
+        # All on-chain balances get read in one batch request.
+        timestamp = time.time()
+
+        batch = JsonRpcBatch(self.web3)
+        for token in [Address('0x0000000000000000000000000000000000000000'), self.sai.address]:
+            batch.call(self.idex.address, 'balanceOf(address,address)', [token.address, self.our_address.address], ['uint256'])
+        batch.call(self.sai.address, 'balanceOf(address)', [self.our_address.address], ['uint256'])
+        batch.eth_balance(self.our_address)
+
+        api_balances = self.idex_api.get_balances()
+        eth_deposited, dai_deposited, sai_balance, eth_balance = batch.execute()
 
-    def our_available_balance(self, our_balances, token: Address) -> Wad:
+        return {'timestamp': timestamp,
+                'api': api_balances,
+                'eth_deposited': Wad(eth_deposited),
+                'dai_deposited': Wad(dai_deposited),
+                'sai_balance': Wad(sai_balance),
+                'eth_balance': eth_balance}
+
+    def our_api_balance(self, our_balances: dict, symbol: str, field: str) -> Wad:
+        try:
+            return Wad.from_number(our_balances['api'][symbol][field])
+        except KeyError:
+            return Wad(0)
+
+    def our_available_balance(self, our_balances: dict, token: Address) -> Wad:
         if token == EtherDelta.ETH_TOKEN:
-            try:
-                return Wad.from_number(our_balances['ETH']['available'])
-            except KeyError:
-                return Wad(0)
+            return self.our_api_balance(our_balances, 'ETH', 'available')
         elif token == self.sai.address:
-            try:
-                return Wad.from_number(our_balances['DAI']['available'])
-            except KeyError:
-                return Wad(0)
+            return self.our_api_balance(our_balances, 'DAI', 'available')
         else:
             raise Exception("Unknown token")
 
@@ -203,139 +290,69 @@ class IdexMarketMakerKeeper:
         return list(filter(lambda order: not order.is_sell, our_orders))
 
     def synchronize_orders(self):
+        # Orders and balances get refreshed in background by the order book manager, so all
+        # decisions here are made using its latest snapshot, without waiting for the IDEX API.
+        bands = Bands.read(self.bands_config, self.spread_feed, self.history)
+        order_book = self.order_book_manager.get_order_book()
+        target_price = self.price_feed.get_price()
+
         # If keeper balance is below `--min-eth-balance`, cancel all orders but do not terminate
         # the keeper, keep processing blocks as the moment the keeper gets a top-up it should
         # resume activity straight away, without the need to restart it.
-        if eth_balance(self.web3, self.our_address) < self.min_eth_balance:
+        if order_book.balances['eth_balance'] < self.min_eth_balance:
             self.logger.warning(f"Keeper ETH balance below minimum, cancelling all orders.")
-            self.cancel_all_orders()
+            self.order_book_manager.cancel_all_orders()
 
             return
 
-        bands = Bands.read(self.bands_config, self.spread_feed, self.history)
-        our_balances = self.our_balances()
-        our_orders = self.our_orders()
-        target_price = self.price_feed.get_price()
-
         # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(our_orders),
-                                                      our_sell_orders=self.our_sell_orders(our_orders),
+        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
                                                       target_price=target_price)
         if len(cancellable_orders) > 0:
-            self.cancel_orders(cancellable_orders)
+            self.order_book_manager.cancel_orders(cancellable_orders)
             return
 
-        # If we detect that our total balance reported by the API is not equal to the
-        # total balance reported by the Ethereum contract, it probably means that some
-        # deposits are still pending being credited to our account. In this case
-        # we also do not create any new orders, but at the same time existing orders
-        # can still be cancelled.
-        if not self.balances_match(our_balances):
-            self.logger.info("Balances do not match, probably deposits are in progress, waiting.")
+        # Do not place new orders if order book state is not confirmed
+        if order_book.orders_being_placed or order_book.orders_being_cancelled:
+            self.logger.debug("Order book is in progress, not placing new orders")
             return
 
-        # Evaluate if we need to create new orders, and how much do we need to deposit
-        new_orders, missing_buy_amount, missing_sell_amount = bands.new_orders(our_buy_orders=self.our_buy_orders(our_orders),
-                                                                               our_sell_orders=self.our_sell_orders(our_orders),
-                                                                               our_buy_balance=self.our_available_balance(our_balances, self.token_buy()),
-                                                                               our_sell_balance=self.our_available_balance(our_balances, self.token_sell()),
-                                                                               target_price=target_price)
-
-        # If deposited amount too low for placing buy orders, try to deposit.
-        # If deposited amount too low for placing sell orders, try to deposit.
-        made_deposit = False
-
-        if missing_buy_amount > Wad(0):
-            if self.deposit_for_buy_order(missing_buy_amount):
-                made_deposit = True
-
-        if missing_sell_amount > Wad(0):
-            if missing_sell_amount > Wad(0):
-                if self.deposit_for_sell_order(missing_sell_amount):
-                    made_deposit = True
-
-        # If we managed to deposit something, do not do anything so we can reevaluate new orders to be placed.
-        # Otherwise, place new orders.
-        if not made_deposit:
-            self.place_orders(new_orders)
-
-    def cancel_orders(self, orders: list):
-        for order in orders:
-            self.idex_api.cancel_order(order)
-
-    def cancel_all_orders(self):
-        self.cancel_orders(self.our_orders())
-
-    def place_orders(self, new_orders):
-        for new_order in new_orders:
-            if new_order.is_sell:
-                self.idex_api.place_order(pay_token=self.token_sell(),
-                                          pay_amount=new_order.pay_amount,
-                                          buy_token=self.token_buy(),
-                                          buy_amount=new_order.buy_amount)
-            else:
-                self.idex_api.place_order(pay_token=self.token_buy(),
-                                          pay_amount=new_order.pay_amount,
-                                          buy_token=self.token_sell(),
-                                          buy_amount=new_order.buy_amount)
-
-    def deposit_for_sell_order(self, missing_sell_amount: Wad):
-        # We always want to deposit at least `min_eth_deposit`. If `missing_sell_amount` is less
-        # than that, we deposit `min_eth_deposit` anyway.
-        if Wad(0) < missing_sell_amount < self.min_eth_deposit:
-            missing_sell_amount = self.min_eth_deposit
-
-        # We can never deposit more than our available ETH balance minus `eth_reserve` (reserve for gas).
-        depositable_eth = Wad.max(eth_balance(self.web3, self.our_address) - self.eth_reserve, Wad(0))
-        missing_sell_amount = Wad.min(missing_sell_amount, depositable_eth)
-
-        # If we still can deposit something, and it's at least `min_eth_deposit`, then we do deposit.
-        if missing_sell_amount > Wad(0) and missing_sell_amount >= self.min_eth_deposit:
-            receipt = self.idex.deposit(missing_sell_amount).transact(gas_price=self.gas_price)
-            return receipt is not None and receipt.successful
+        # Deposits get made ahead of time and do not hold off placing orders. Balances reported by
+        # the API only include deposits which have already been credited, so orders placed now
+        # never exceed the funds available.
+        self.deposit_manager.synchronize(bands=bands,
+                                         buy_token=self.token_buy(),
+                                         sell_token=self.token_sell(),
+                                         deposited={self.token_buy(): order_book.balances['dai_deposited'],
+                                                    self.token_sell(): order_book.balances['eth_deposited']},
+                                         depositable={self.token_buy(): order_book.balances['sai_balance'],
+                                                      self.token_sell(): Wad.max(order_book.balances['eth_balance'] - self.eth_reserve, Wad(0))},
+                                         timestamp=order_book.balances['timestamp'])
+
+        # Place new orders
+        self.order_book_manager.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                                              our_sell_orders=self.our_sell_orders(order_book.orders),
+                                                              our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
+                                                              our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
+                                                              target_price=target_price)[0])
+
+    def place_order_function(self, new_order):
+        if new_order.is_sell:
+            return self.idex_api.place_order(pay_token=self.token_sell(),
+                                             pay_amount=new_order.pay_amount,
+                                             buy_token=self.token_buy(),
+                                             buy_amount=new_order.buy_amount)
         else:
-            return False
-
-    def deposit_for_buy_order(self, missing_buy_amount: Wad):
-        # We always want to deposit at least `min_sai_deposit`. If `missing_buy_amount` is less
-        # than that, we deposit `min_sai_deposit` anyway.
-        if Wad(0) < missing_buy_amount < self.min_sai_deposit:
-            missing_buy_amount = self.min_sai_deposit
-
-        # We can never deposit more than our available SAI balance.
-        depositable_sai = self.sai.balance_of(self.our_address)
-        missing_buy_amount = Wad.min(missing_buy_amount, depositable_sai)
-
-        # If we still can deposit something, and it's at least `min_sai_deposit`, then we do deposit.
-        if missing_buy_amount > Wad(0) and missing_buy_amount >= self.min_sai_deposit:
-            receipt = self.idex.deposit_token(self.sai.address, missing_buy_amount).transact(gas_price=self.gas_price)
-            return receipt is not None and receipt.successful
-        else:
-            return False
-
-    def balances_match(self, our_balances) -> bool:
-        try:
-            eth_available = Wad.from_number(our_balances['ETH']['available'])
-        except KeyError:
-            eth_available = Wad(0)
-
-        try:
-            eth_on_orders = Wad.from_number(our_balances['ETH']['onOrders'])
-        except KeyError:
-            eth_on_orders = Wad(0)
-
-        try:
-            dai_available = Wad.from_number(our_balances['DAI']['available'])
-        except KeyError:
-            dai_available = Wad(0)
-
-        try:
-            dai_on_orders = Wad.from_number(our_balances['DAI']['onOrders'])
-        except KeyError:
-            dai_on_orders = Wad(0)
-
-        return self.idex.balance_of(self.our_address) == eth_available + eth_on_orders and \
-               self.idex.balance_of_token(self.sai.address, self.our_address) == dai_available + dai_on_orders
+            return self.idex_api.place_order(pay_token=self.token_buy(),
+                                             pay_amount=new_order.pay_amount,
+                                             buy_token=self.token_sell(),
+                                             buy_amount=new_order.buy_amount)
+
+    def deposit_function(self, transact):
+        return self.receipt_tracker.transact(transact,
+                                             result_function=lambda receipt: receipt is not None and receipt.successful,
+                                             operation='deposit')
 
 
 if __name__ == '__main__':
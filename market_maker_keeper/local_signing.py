@@ -0,0 +1,250 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import threading
+import time
+
+import rlp
+from bitcoin import ecdsa_raw_sign
+from ethereum.keys import decode_keystore_json
+from ethereum.utils import privtoaddr, sha3
+
+from market_maker_keeper.nonce_manager import NonceManager
+
+
+class LocalAccount:
+    """Ethereum account with its private key held by the keeper, used to sign transactions locally.
+
+    Attributes:
+        address: Address of the account.
+        private_key: Private key of the account (32 bytes).
+    """
+
+    def __init__(self, private_key: bytes):
+        assert(isinstance(private_key, bytes))
+
+        self.private_key = private_key
+        self.address = '0x' + privtoaddr(private_key).hex()
+
+    @staticmethod
+    def from_keystore(key_file: str, pass_file: str):
+        assert(isinstance(key_file, str))
+        assert(isinstance(pass_file, str))
+
+        with open(key_file) as file:
+            keystore = json.load(file)
+
+        with open(pass_file) as file:
+            password = file.read().rstrip('\n')
+
+        return LocalAccount(decode_keystore_json(keystore, password))
+
+    def sign_transaction(self, transaction: dict, chain_id: int) -> str:
+        """Signs a transaction, with replay protection (EIP-155).
+
+        Args:
+            transaction: Transaction, in the format passed by `web3` to `eth_sendTransaction`.
+                Has to have the `nonce`, `gas` and `gasPrice` fields set.
+            chain_id: Id of the chain the transaction is only valid on.
+
+        Returns:
+            The signed transaction, in the format accepted by `eth_sendRawTransaction`.
+        """
+        assert(isinstance(chain_id, int))
+
+        data = transaction.get('data', '0x')
+        fields = [as_int(transaction['nonce']),
+                  as_int(transaction['gasPrice']),
+                  as_int(transaction['gas']),
+                  bytes.fromhex(transaction['to'][2:]) if transaction.get('to') else b'',
+                  as_int(transaction.get('value', 0)),
+                  bytes.fromhex(data[2:] if data.startswith('0x') else data)]
+
+        # with EIP-155 the chain id is signed along with the transaction and encoded in `v`
+        v, r, s = ecdsa_raw_sign(sha3(rlp.encode(fields + [chain_id, 0, 0])), self.private_key)
+
+        return '0x' + rlp.encode(fields + [v - 27 + 35 + 2*chain_id, r, s]).hex()
+
+    def sign_message(self, message: str) -> str:
+        """Signs a message the same way the node does in `eth_sign`.
+
+        Args:
+            message: Hex-encoded message to sign.
+
+        Returns:
+            Hex-encoded signature (`r`, `s` and `v` concatenated).
+        """
+        data = bytes.fromhex(message[2:] if message.startswith('0x') else message)
+        v, r, s = ecdsa_raw_sign(sha3(b"\x19Ethereum Signed Message:\n" + str(len(data)).encode() + data), self.private_key)
+
+        return '0x' + r.to_bytes(32, 'big').hex() + s.to_bytes(32, 'big').hex() + bytes([v]).hex()
+
+
+class SigningMiddleware:
+    """`web3` middleware signing transactions of local accounts in-process.
+
+    Intercepts `eth_sendTransaction` and `eth_sign` calls for any of the local `accounts`, signs them
+    locally and sends them using `eth_sendRawTransaction`. Transactions are signed for the chain id
+    returned by `net_version`, so they can not be replayed on other chains. Nonces are assigned by a `NonceManager`
+    (one per account) unless the transaction already has one, i.e. when it is a replacement of
+    a pending transaction. Calls for other accounts are passed to the node unchanged.
+
+    A background thread checks for nonce gaps every `gap_check_interval` seconds and fills them
+    with empty transactions, so transactions sent after a lost one do not get stuck forever.
+
+    Attributes:
+        accounts: Local accounts.
+        gap_check_interval: Frequency of checking for nonce gaps (in seconds).
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, accounts: list, gap_check_interval: int = 30):
+        assert(isinstance(accounts, list))
+        assert(isinstance(gap_check_interval, int))
+
+        self.accounts = {account.address.lower(): account for account in accounts}
+        self.gap_check_interval = gap_check_interval
+        self.nonce_managers = {}
+
+        self._lock = threading.Lock()
+        self._make_request = None
+        self._chain_id = None
+        threading.Thread(target=self._background_run, daemon=True).start()
+
+    def __call__(self, make_request, web3):
+        def middleware(method, params):
+            if method == 'eth_sendTransaction' and self._account(params[0].get('from')) is not None:
+                return self._send_transaction(make_request, params[0])
+
+            if method == 'eth_sign' and self._account(params[0]) is not None:
+                return {'jsonrpc': '2.0', 'id': 0, 'result': self._account(params[0]).sign_message(params[1])}
+
+            return make_request(method, params)
+
+        self._make_request = make_request
+        return middleware
+
+    def _account(self, address):
+        return self.accounts.get(address.lower()) if isinstance(address, str) else None
+
+    def _nonce_manager(self, make_request, address: str) -> NonceManager:
+        with self._lock:
+            if address not in self.nonce_managers:
+                def get_transaction_count(block_identifier: str) -> int:
+                    return as_int(self._result(make_request('eth_getTransactionCount', [address, block_identifier])))
+
+                self.nonce_managers[address] = NonceManager(get_transaction_count)
+
+            return self.nonce_managers[address]
+
+    def _get_chain_id(self, make_request) -> int:
+        if self._chain_id is None:
+            self._chain_id = int(self._result(make_request('net_version', [])))
+
+        return self._chain_id
+
+    @staticmethod
+    def _result(response: dict):
+        if 'error' in response:
+            raise ValueError(response['error'])
+
+        return response['result']
+
+    def _send_transaction(self, make_request, transaction: dict) -> dict:
+        account = self._account(transaction['from'])
+        nonce_manager = self._nonce_manager(make_request, account.address)
+
+        transaction = dict(transaction)
+        if 'gasPrice' not in transaction:
+            transaction['gasPrice'] = as_int(self._result(make_request('eth_gasPrice', [])))
+
+        chain_id = self._get_chain_id(make_request)
+
+        # replacements of pending transactions come with their own nonce
+        managed_nonce = 'nonce' not in transaction
+        if managed_nonce:
+            transaction['nonce'] = nonce_manager.next_nonce()
+
+        try:
+            response = make_request('eth_sendRawTransaction', [account.sign_transaction(transaction, chain_id)])
+        except:
+            if managed_nonce:
+                nonce_manager.failed(transaction['nonce'])
+            raise
+
+        if managed_nonce:
+            if 'error' not in response:
+                nonce_manager.sent(transaction['nonce'])
+            elif 'nonce' in str(response['error']).lower():
+                self.logger.warning(f"Transaction nonce {transaction['nonce']} rejected by the node"
+                                    f" ({response['error']}), fetching the next nonce from the node")
+                nonce_manager.failed(transaction['nonce'])
+                nonce_manager.reset()
+            else:
+                nonce_manager.failed(transaction['nonce'])
+
+        return response
+
+    def _background_run(self):
+        while True:
+            time.sleep(self.gap_check_interval)
+            self.fill_nonce_gaps()
+
+    def fill_nonce_gaps(self):
+        """Fills nonce gaps of all local accounts with empty transactions."""
+        with self._lock:
+            nonce_managers = list(self.nonce_managers.items())
+
+        for address, nonce_manager in nonce_managers:
+            try:
+                nonce = nonce_manager.find_gap()
+                if nonce is not None:
+                    self.logger.warning(f"Nonce {nonce} of {address} has been lost, filling the gap")
+                    response = self._send_transaction(self._make_request, {'from': address, 'to': address, 'value': 0,
+                                                                           'gas': 21000, 'nonce': nonce})
+                    self._result(response)
+            except Exception as e:
+                self.logger.warning(f"Failed to fill nonce gaps of {address} ({e})")
+
+
+def as_int(value) -> int:
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+def register_keys(web3, keys: list):
+    """Makes `web3` sign transactions of the given accounts locally.
+
+    Args:
+        web3: `Web3` instance.
+        keys: List of key specifications, each of them in the `key_file=<file>,pass_file=<file>` format,
+            `key_file` being an Ethereum keystore file and `pass_file` a file with its password.
+    """
+    assert(isinstance(keys, list))
+
+    accounts = []
+    for key in keys:
+        parameters = dict(parameter.split('=', 1) for parameter in key.split(','))
+        if 'key_file' not in parameters or 'pass_file' not in parameters:
+            raise Exception(f"Invalid key specification '{key}', should be 'key_file=<file>,pass_file=<file>'")
+
+        accounts.append(LocalAccount.from_keystore(parameters['key_file'], parameters['pass_file']))
+
+    if len(accounts) > 0:
+        web3.middleware_stack.add(SigningMiddleware(accounts))
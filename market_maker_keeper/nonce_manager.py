@@ -0,0 +1,122 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+from typing import Optional
+
+
+class NonceManager:
+    """Hands out nonces for transactions sent from one account, without asking the node each time.
+
+    The first nonce is taken from the pending transaction count of the account, all the subsequent
+    ones are handed out atomically from a local counter, so many transactions can be signed and sent
+    concurrently. Nonces of transactions which did not make it to the node get released and are
+    handed out again before any new ones, so they do not leave gaps.
+
+    Attributes:
+        get_transaction_count: Function returning the transaction count of the account,
+            takes the block identifier (`latest` or `pending`) as its only argument.
+    """
+
+    def __init__(self, get_transaction_count):
+        assert(callable(get_transaction_count))
+
+        self.get_transaction_count = get_transaction_count
+
+        self._lock = threading.Lock()
+        self._next_nonce = None
+        self._released = []
+        self._in_flight = set()
+        self._gap = None
+
+    def next_nonce(self) -> int:
+        """Hands out the next nonce, which has to be then either marked as `sent()` or `failed()`."""
+        with self._lock:
+            if self._next_nonce is None:
+                self._next_nonce = self.get_transaction_count('pending')
+
+            if len(self._released) > 0:
+                nonce = heapq.heappop(self._released)
+            else:
+                nonce = self._next_nonce
+                self._next_nonce += 1
+
+            self._in_flight.add(nonce)
+            return nonce
+
+    def sent(self, nonce: int):
+        """Marks the nonce as used by a transaction which has been accepted by the node."""
+        assert(isinstance(nonce, int))
+
+        with self._lock:
+            self._in_flight.discard(nonce)
+
+    def failed(self, nonce: int):
+        """Marks the nonce as not used, as the transaction has not been accepted by the node."""
+        assert(isinstance(nonce, int))
+
+        with self._lock:
+            self._in_flight.discard(nonce)
+            if nonce not in self._released:
+                heapq.heappush(self._released, nonce)
+
+    def reset(self):
+        """Makes the manager take the next nonce from the node again.
+
+        Should be called if the node rejected a transaction because of its nonce, i.e. because
+        some other process has sent transactions from the same account in the meantime.
+        """
+        with self._lock:
+            self._next_nonce = None
+            self._released = []
+
+    def find_gap(self) -> Optional[int]:
+        """Finds the lowest nonce handed out, but unknown to the node.
+
+        Transactions with nonces above a gap will never get mined, so the gap needs to be filled.
+        Nonces handed out but not sent yet (still in flight) are not considered gaps. As the pending
+        transaction count reported by the node can lag behind transactions just sent, a gap is only
+        returned if it has been found by two consecutive checks. The nonce returned is not handed out
+        again, the caller is responsible for sending a transaction with it.
+
+        Returns:
+            The nonce of the gap, or `None` if there is no gap.
+        """
+        pending_count = self.get_transaction_count('pending')
+
+        with self._lock:
+            if self._next_nonce is None:
+                return None
+
+            # other processes might have sent transactions from the same account
+            if pending_count > self._next_nonce:
+                self._next_nonce = pending_count
+
+            self._released = [nonce for nonce in self._released if nonce > pending_count]
+            heapq.heapify(self._released)
+
+            if pending_count < self._next_nonce and pending_count not in self._in_flight:
+                if self._gap == pending_count:
+                    self._gap = None
+                    return pending_count
+
+                self._gap = pending_count
+                return None
+
+            self._gap = None
+            return None
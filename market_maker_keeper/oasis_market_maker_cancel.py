@@ -16,52 +16,203 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import json
 import logging
+import os
 import sys
+import time
 
-from web3 import Web3, HTTPProvider
+from eth_utils import encode_hex, event_signature_to_log_topic
+from web3 import Web3
 
+from market_maker_keeper.gas import GasPriceFactory, ReplacementPolicy
+from market_maker_keeper.local_signing import register_keys
+from market_maker_keeper.oasis_order_index import OasisOrderReader
+from market_maker_keeper.receipt_tracker import ReceiptTracker
+from market_maker_keeper.web3_provider import create_provider
 from pymaker import Address
-from pymaker.gas import FixedGasPrice, DefaultGasPrice
+from pymaker.numeric import Wad
 from pymaker.oasis import MatchingMarket
-from pymaker.util import synchronize
 
 
 class OasisMarketMakerCancel:
-    """Tool to cancel all our open orders on OasisDEX."""
+    """Tool to cancel all our open orders on OasisDEX.
+
+    Our orders are found using our `LogMake` events, fetched in ranges of at most `--scan-blocks` blocks
+    so no single `eth_getLogs` call has to cover the whole chain. Then the current state of all of them
+    gets read in one JSON-RPC batch request, so the tool does not have to walk the whole market. Cancellations
+    are sent in waves of at most `--wave-size` transactions, the next wave only once all transactions
+    of the previous one got mined, so the node never gets flooded. Cancellations which stay pending
+    for `--replace-after-blocks` blocks get replaced with a higher gas price.
+
+    If `--state-file` is passed, the block up to which our events have been scanned and the orders
+    still to cancel get saved after each range of blocks scanned and after each wave. Running the tool again then only scans the blocks mined
+    since then, and as the state of all orders gets read again, orders which have already been
+    cancelled are skipped.
+    """
+
+    LOG_MAKE_TOPIC = encode_hex(event_signature_to_log_topic('LogMake(bytes32,bytes32,address,address,address,'
+                                                             'uint128,uint128,uint64)'))
+
+    # when resuming, events of a few extra blocks are scanned in order to cover chain reorganizations,
+    # as orders found twice are only read once it is safe to do so
+    OVERLAP_BLOCKS = 10
+
+    logger = logging.getLogger()
 
     def __init__(self, args: list, **kwargs):
         parser = argparse.ArgumentParser(prog='oasis-market-maker-cancel')
         parser.add_argument("--rpc-host", help="JSON-RPC host (default: `localhost')", default="localhost", type=str)
         parser.add_argument("--rpc-port", help="JSON-RPC port (default: `8545')", default=8545, type=int)
         parser.add_argument("--rpc-timeout", help="JSON-RPC timeout (in seconds, default: 10)", default=10, type=int)
+        parser.add_argument("--rpc-ipc-path", help="Path to the IPC socket of the Ethereum node, to use instead of JSON-RPC over HTTP", type=str)
+        parser.add_argument("--rpc-ws-url", help="WebSocket URL of the Ethereum node, to use instead of JSON-RPC over HTTP", type=str)
         parser.add_argument("--eth-from", help="Ethereum account from which to send transactions", required=True, type=str)
+        parser.add_argument("--eth-key", help="Ethereum private key(s) to sign transactions with locally, in the `key_file=<keystore file>,pass_file=<password file>' format", nargs='*', type=str)
         parser.add_argument("--oasis-address", help="Ethereum address of the OasisDEX contract", required=True, type=str)
+        parser.add_argument("--from-block", help="Block to look for our orders from (default: 0)", default=0, type=int)
+        parser.add_argument("--scan-blocks", help="Maximum number of blocks to look for our orders in with one eth_getLogs call (default: 10000)", default=10000, type=int)
+        parser.add_argument("--wave-size", help="Maximum number of cancellations sent at once (default: 20)", default=20, type=int)
+        parser.add_argument("--state-file", help="File to save the progress to, so an interrupted run can be resumed", type=str)
         parser.add_argument("--gas-price", help="Gas price in Wei (default: node default)", default=0, type=int)
+        parser.add_argument("--smart-gas-price", help="Use smart gas pricing strategy, based on the ethgasstation.info feed", dest='smart_gas_price', action='store_true')
+        parser.add_argument("--node-gas-price", help="Use smart gas pricing strategy, based on recent blocks seen by the Ethereum node", dest='node_gas_price', action='store_true')
+        parser.add_argument("--gas-config", help="Gas price configuration file, with separate strategies per operation class", type=str)
+        parser.add_argument("--replace-after-blocks", help="Number of blocks after which a pending cancellation gets replaced with a higher gas price, unless configured in `--gas-config` (default: 5, 0 disables replacements)", default=5, type=int)
         self.arguments = parser.parse_args(args)
 
-        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
-                                                                              request_kwargs={"timeout": self.arguments.rpc_timeout}))
+        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(create_provider(self.arguments))
         self.web3.eth.defaultAccount = self.arguments.eth_from
+        register_keys(self.web3, self.arguments.eth_key or [])
         self.our_address = Address(self.arguments.eth_from)
         self.otc = MatchingMarket(web3=self.web3, address=Address(self.arguments.oasis_address))
+        self.reader = OasisOrderReader(self.web3, self.otc)
+
+        self.gas_prices = GasPriceFactory().create_gas_prices(self.arguments, self.web3)
+        if self.arguments.replace_after_blocks > 0 and self.gas_prices.replacement_policy('cancel') is None:
+            self.gas_prices.replacement_policies['cancel'] = ReplacementPolicy(after_blocks=self.arguments.replace_after_blocks)
+
+        self.receipt_tracker = ReceiptTracker(web3=self.web3, gas_prices=self.gas_prices)
 
         logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s', level=logging.INFO)
 
     def main(self):
-        self.cancel_orders(self.our_orders(self.otc.get_orders()))
+        start_time = time.time()
+
+        # the state always records the block up to which events have been scanned, so orders
+        # made while cancellations are in progress get found when the tool is run again
+        block_number = self.web3.eth.blockNumber
+        orders = self.our_orders(block_number)
+        self.logger.info(f"Found {len(orders)} open orders to cancel")
 
-    def our_orders(self, orders: list):
-        return list(filter(lambda order: order.maker == self.our_address, orders))
+        cancelled = 0
+        failed_orders = []
+        for index in range(0, len(orders), self.arguments.wave_size):
+            wave = orders[index:index + self.arguments.wave_size]
+            results = self.cancel_orders(wave)
 
-    def cancel_orders(self, orders: list):
-        synchronize([self.otc.kill(order.order_id).transact_async(gas_price=self.gas_price()) for order in orders])
+            cancelled += results.count(True)
+            failed_orders += [order for order, result in zip(wave, results) if not result]
 
-    def gas_price(self):
-        if self.arguments.gas_price > 0:
-            return FixedGasPrice(self.arguments.gas_price)
+            self.save_state(block_number, [order.order_id for order in failed_orders + orders[index + self.arguments.wave_size:]])
+            self.logger.info(f"Cancelled {cancelled} out of {len(orders)} orders so far")
+
+        elapsed = max(time.time() - start_time, 0.001)
+        self.logger.info(f"Cancelled {cancelled} orders in {elapsed:.1f}s"
+                         f" ({cancelled / elapsed * 60:.1f} orders/minute), {len(failed_orders)} cancellations failed")
+        self.logger.info(f"Transaction statistics: {self.receipt_tracker.statistics()}")
+
+    def our_orders(self, block_number: int) -> list:
+        """Finds our open orders using our `LogMake` events up to `block_number`, resuming from the state file if there is one."""
+        assert(isinstance(block_number, int))
+
+        state = self.load_state()
+
+        if state is not None:
+            from_block = max(state['lastBlock'] + 1 - self.OVERLAP_BLOCKS, 0)
+            order_ids = set(state['orderIds'])
         else:
-            return DefaultGasPrice()
+            from_block = self.arguments.from_block
+            order_ids = set()
+
+        for range_start in range(from_block, block_number + 1, self.arguments.scan_blocks):
+            range_end = min(range_start + self.arguments.scan_blocks - 1, block_number)
+            order_ids.update(self.our_order_ids(range_start, range_end))
+
+            # a long scan can be interrupted too, so the progress gets saved after each range
+            self.save_state(range_end, sorted(order_ids))
+            self.logger.debug(f"Scanned blocks #{range_start}-#{range_end}, found {len(order_ids)} orders so far")
+
+        orders = [order for order in self.reader.get_orders_by_id(sorted(order_ids))
+                  if order is not None and order.maker == self.our_address and order.pay_amount > Wad(0)]
+
+        self.save_state(block_number, [order.order_id for order in orders])
+        return orders
+
+    def our_order_ids(self, from_block: int, to_block: int) -> set:
+        """Returns ids of orders made by us between `from_block` and `to_block` (inclusive)."""
+        assert(isinstance(from_block, int))
+        assert(isinstance(to_block, int))
+
+        # `id` is the first and `maker` the third indexed argument of `LogMake`
+        logs = self.web3.manager.request_blocking("eth_getLogs", [{'address': self.otc.address.address,
+                                                                   'fromBlock': hex(from_block),
+                                                                   'toBlock': hex(to_block),
+                                                                   'topics': [self.LOG_MAKE_TOPIC, None, None,
+                                                                              '0x' + self.our_address.address[2:].lower().rjust(64, '0')]}])
+
+        def order_id(log):
+            topic = log['topics'][1]
+            return int(topic, 16) if isinstance(topic, str) else int.from_bytes(topic, 'big')
+
+        return set(order_id(log) for log in logs)
+
+    def cancel_orders(self, orders: list) -> list:
+        """Cancels the orders and waits for all the cancellations to finish, returns whether each of them succeeded."""
+        futures = [self.receipt_tracker.transact(self.otc.kill(order.order_id),
+                                                 result_function=lambda receipt: receipt is not None and receipt.successful,
+                                                 operation='cancel') for order in orders]
+
+        results = []
+        for order, future in zip(orders, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                self.logger.warning(f"Failed to cancel order #{order.order_id} ({e})")
+                results.append(False)
+
+        return results
+
+    def load_state(self):
+        if self.arguments.state_file is None or not os.path.isfile(self.arguments.state_file):
+            return None
+
+        with open(self.arguments.state_file) as file:
+            state = json.load(file)
+
+        if Address(state['oasisAddress']) != self.otc.address or Address(state['ourAddress']) != self.our_address:
+            self.logger.warning(f"State file '{self.arguments.state_file}' is for a different market or account,"
+                                f" ignoring it")
+            return None
+
+        self.logger.info(f"Resuming from block #{state['lastBlock']} with {len(state['orderIds'])} orders left to cancel")
+        return state
+
+    def save_state(self, block_number: int, order_ids: list):
+        if self.arguments.state_file is None:
+            return
+
+        state = {'oasisAddress': self.otc.address.address,
+                 'ourAddress': self.our_address.address,
+                 'lastBlock': block_number,
+                 'orderIds': sorted(order_ids)}
+
+        # the state gets written to a temporary file first, so an interrupted write does not corrupt it
+        temporary_file = self.arguments.state_file + '.tmp'
+        with open(temporary_file, 'w') as file:
+            json.dump(state, file)
+
+        os.replace(temporary_file, self.arguments.state_file)
 
 
 if __name__ == '__main__':
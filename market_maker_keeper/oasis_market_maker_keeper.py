@@ -19,17 +19,22 @@ import argparse
 import logging
 import sys
 
-from web3 import Web3, HTTPProvider
+from web3 import Web3
 
 from market_maker_keeper.band import Bands, NewOrder
+from market_maker_keeper.block_cache import BlockCache
 from market_maker_keeper.gas import GasPriceFactory
 from market_maker_keeper.limit import History
+from market_maker_keeper.local_signing import register_keys
+from market_maker_keeper.oasis_order_index import OasisOrderIndex
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.receipt_tracker import ReceiptTracker
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
+from market_maker_keeper.web3_provider import create_provider
 from pymaker import Address
 from pymaker.approval import directly
 from pymaker.lifecycle import Lifecycle
@@ -38,7 +43,6 @@ from pymaker.oasis import Order, MatchingMarket
 from pymaker.sai import Tub
 from pymaker.token import ERC20Token
 from pymaker.transactional import TxManager
-from pymaker.util import eth_balance
 
 
 class OasisMarketMakerKeeper:
@@ -58,9 +62,20 @@ class OasisMarketMakerKeeper:
         parser.add_argument("--rpc-timeout", type=int, default=10,
                             help="JSON-RPC timeout (in seconds, default: 10)")
 
+        parser.add_argument("--rpc-ipc-path", type=str,
+                            help="Path to the IPC socket of the Ethereum node, to use instead of JSON-RPC over HTTP")
+
+        parser.add_argument("--rpc-ws-url", type=str,
+                            help="WebSocket URL of the Ethereum node (i.e. `ws://localhost:8546'),"
+                                 " to use instead of JSON-RPC over HTTP")
+
         parser.add_argument("--eth-from", type=str, required=True,
                             help="Ethereum account from which to send transactions")
 
+        parser.add_argument("--eth-key", type=str, nargs='*',
+                            help="Ethereum private key(s) to sign transactions with locally,"
+                                 " in the `key_file=<keystore file>,pass_file=<password file>' format")
+
         parser.add_argument("--tub-address", type=str, required=False,
                             help="Ethereum address of the Tub contract")
 
@@ -88,6 +103,17 @@ class OasisMarketMakerKeeper:
         parser.add_argument("--spread-feed-expiry", type=int, default=3600,
                             help="Maximum age of the spread feed (in seconds, default: 3600)")
 
+        parser.add_argument("--spread-feed-step", type=float,
+                            help="Step to round spread feed values to, so configs evaluated for them can be reused"
+                                 " (default: no rounding)")
+
+        parser.add_argument("--websocket-hot-standby", dest='websocket_hot_standby', action='store_true',
+                            help="Keep a hot-standby connection for WebSocket price and spread feeds")
+
+        parser.add_argument("--websocket-stall-timeout", type=int, default=5000,
+                            help="Time without any messages after which a price or spread feed WebSocket connection"
+                                 " is considered stalled (in milliseconds, default: 5000)")
+
         parser.add_argument("--order-history", type=str,
                             help="Endpoint to report active orders to")
 
@@ -106,6 +132,12 @@ class OasisMarketMakerKeeper:
         parser.add_argument("--smart-gas-price", dest='smart_gas_price', action='store_true',
                             help="Use smart gas pricing strategy, based on the ethgasstation.info feed")
 
+        parser.add_argument("--node-gas-price", dest='node_gas_price', action='store_true',
+                            help="Use smart gas pricing strategy, based on recent blocks seen by the Ethereum node")
+
+        parser.add_argument("--gas-config", type=str, required=False,
+                            help="Gas price configuration file, with separate strategies per operation class")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
@@ -115,9 +147,10 @@ class OasisMarketMakerKeeper:
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
-        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
-                                                                              request_kwargs={"timeout": self.arguments.rpc_timeout}))
+        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(create_provider(self.arguments))
         self.web3.eth.defaultAccount = self.arguments.eth_from
+        register_keys(self.web3, self.arguments.eth_key or [])
+        self.block_cache = BlockCache(self.web3)
         self.our_address = Address(self.arguments.eth_from)
         self.otc = MatchingMarket(web3=self.web3, address=Address(self.arguments.oasis_address))
 
@@ -127,12 +160,19 @@ class OasisMarketMakerKeeper:
         self.token_buy = ERC20Token(web3=self.web3, address=Address(self.arguments.buy_token_address))
         self.token_sell = ERC20Token(web3=self.web3, address=Address(self.arguments.sell_token_address))
         self.min_eth_balance = Wad.from_number(self.arguments.min_eth_balance)
-        self.bands_config = ReloadableConfig(self.arguments.config)
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.bands_config = ReloadableConfig(self.arguments.config, spread_feed_step=self.arguments.spread_feed_step)
+        self.gas_prices = GasPriceFactory().create_gas_prices(self.arguments, self.web3)
+        self.receipt_tracker = ReceiptTracker(web3=self.web3, gas_prices=self.gas_prices)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments, tub)
         self.spread_feed = create_spread_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
+        self.order_index = OasisOrderIndex(web3=self.web3,
+                                           otc=self.otc,
+                                           our_address=self.our_address,
+                                           token_a=self.token_buy.address,
+                                           token_b=self.token_sell.address)
+
         self.history = History()
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
         self.order_book_manager.get_orders_with(lambda: self.our_orders())
@@ -154,6 +194,7 @@ class OasisMarketMakerKeeper:
 
     def shutdown(self):
         self.order_book_manager.cancel_all_orders(final_wait_time=60)
+        self.logger.info(f"Transaction statistics: {self.receipt_tracker.statistics()}")
 
     def on_block(self):
         # This method is present only so the lifecycle binds the new block listener, which makes
@@ -162,15 +203,13 @@ class OasisMarketMakerKeeper:
 
     def approve(self):
         """Approve OasisDEX to access our balances, so we can place orders."""
-        self.otc.approve([self.token_sell, self.token_buy], directly(gas_price=self.gas_price))
+        self.otc.approve([self.token_sell, self.token_buy], directly(gas_price=self.gas_prices.approve))
 
     def our_available_balance(self, token: ERC20Token) -> Wad:
-        return token.balance_of(self.our_address)
+        return self.block_cache.balance_of(token, self.our_address)
 
     def our_orders(self):
-        return list(filter(lambda order: order.maker == self.our_address,
-                           self.otc.get_orders(self.token_sell.address, self.token_buy.address) +
-                           self.otc.get_orders(self.token_buy.address, self.token_sell.address)))
+        return self.order_index.get_orders()
 
     def our_sell_orders(self, our_orders: list):
         return list(filter(lambda order: order.buy_token == self.token_buy.address and
@@ -181,8 +220,10 @@ class OasisMarketMakerKeeper:
                                          order.pay_token == self.token_buy.address, our_orders))
 
     def synchronize_orders(self):
+        self.block_cache.check_block()
+
         # If market is closed, cancel all orders but do not terminate the keeper.
-        if self.otc.is_closed():
+        if self.block_cache.get((self.otc.address, 'is_closed'), self.otc.is_closed):
             self.logger.warning("Market is closed. Cancelling all orders.")
             self.order_book_manager.cancel_all_orders()
             return
@@ -190,7 +231,7 @@ class OasisMarketMakerKeeper:
         # If keeper balance is below `--min-eth-balance`, cancel all orders but do not terminate
         # the keeper, keep processing blocks as the moment the keeper gets a top-up it should
         # resume activity straight away, without the need to restart it.
-        if eth_balance(self.web3, self.our_address) < self.min_eth_balance:
+        if self.block_cache.eth_balance(self.our_address) < self.min_eth_balance:
             self.logger.warning("Keeper ETH balance below minimum. Cancelling all orders.")
             self.order_book_manager.cancel_all_orders()
             return
@@ -232,24 +273,41 @@ class OasisMarketMakerKeeper:
             pay_token = self.token_buy.address
             buy_token = self.token_sell.address
 
-        transact = self.otc.make(pay_token=pay_token, pay_amount=new_order.pay_amount,
-                                 buy_token=buy_token, buy_amount=new_order.buy_amount).transact(gas_price=self.gas_price)
-
-        if transact is not None and transact.successful and transact.result is not None:
-            return Order(market=self.otc,
-                         order_id=transact.result,
-                         maker=self.our_address,
-                         pay_token=pay_token,
-                         pay_amount=new_order.pay_amount,
-                         buy_token=buy_token,
-                         buy_amount=new_order.buy_amount,
-                         timestamp=0)
-        else:
-            return None
+        def order_placed(receipt):
+            self.block_cache.invalidate()
+
+            if receipt is not None and receipt.successful and receipt.result is not None:
+                return Order(market=self.otc,
+                             order_id=receipt.result,
+                             maker=self.our_address,
+                             pay_token=pay_token,
+                             pay_amount=new_order.pay_amount,
+                             buy_token=buy_token,
+                             buy_amount=new_order.buy_amount,
+                             timestamp=0)
+            else:
+                return None
+
+        # the position hint saves the contract walking the sorted list of offers from the top
+        pos = self.order_index.insertion_position(pay_token=pay_token, pay_amount=new_order.pay_amount,
+                                                  buy_token=buy_token, buy_amount=new_order.buy_amount)
+
+        return self.receipt_tracker.transact(self.otc.make(pay_token=pay_token, pay_amount=new_order.pay_amount,
+                                                           buy_token=buy_token, buy_amount=new_order.buy_amount,
+                                                           pos=pos),
+                                             result_function=order_placed,
+                                             operation='place')
 
     def cancel_order_function(self, order):
-        transact = self.otc.kill(order.order_id).transact(gas_price=self.gas_price)
-        return transact is not None and transact.successful
+        # OasisDEX only lets the owner of an offer cancel it, so offers made from our account cannot be
+        # cancelled in a batch by a helper contract. Each of them gets cancelled in its own transaction.
+        return self.receipt_tracker.transact(self.otc.kill(order.order_id),
+                                             result_function=self.order_cancelled,
+                                             operation='cancel')
+
+    def order_cancelled(self, receipt) -> bool:
+        self.block_cache.invalidate()
+        return receipt is not None and receipt.successful
 
 
 if __name__ == '__main__':
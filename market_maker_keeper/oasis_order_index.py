@@ -0,0 +1,287 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from collections import deque
+
+from market_maker_keeper.rpc_batch import JsonRpcBatch
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import Order, LogMake, LogKill, LogTake
+
+
+class OasisOrderReader:
+    """Reads OasisDEX orders, fetching the details of many of them in one JSON-RPC batch request.
+
+    `MatchingMarket.get_orders()` makes two `eth_call`s per offer: one to find the next offer in
+    the sorted list and one to read its details. Only the former have to be made one after another,
+    the details of all the offers found get read in one batch request afterwards.
+
+    Attributes:
+        web3: `Web3` instance.
+        otc: `MatchingMarket` to read the orders from.
+    """
+
+    OFFER_TYPES = ['uint256', 'address', 'uint256', 'address', 'address', 'uint64']
+
+    def __init__(self, web3, otc):
+        self.web3 = web3
+        self.otc = otc
+
+    def get_orders(self, pay_token: Address, buy_token: Address) -> list:
+        assert(isinstance(pay_token, Address))
+        assert(isinstance(buy_token, Address))
+
+        order_ids = []
+        order_id = self._call('getBestOffer(address,address)', [pay_token.address, buy_token.address])
+        while order_id != 0:
+            order_ids.append(order_id)
+            order_id = self._call('getWorseOffer(uint256)', [order_id])
+
+        return list(filter(lambda order: order is not None, self.get_orders_by_id(order_ids)))
+
+    def get_orders_by_id(self, order_ids: list) -> list:
+        """Returns the orders with the given ids, with `None` in place of the ones which do not exist anymore."""
+        assert(isinstance(order_ids, list))
+
+        batch = JsonRpcBatch(self.web3)
+        for order_id in order_ids:
+            batch.call(self.otc.address, 'offers(uint256)', [order_id], self.OFFER_TYPES)
+
+        return [self._order(order_id, offer) for order_id, offer in zip(order_ids, batch.execute())]
+
+    def _call(self, signature: str, args: list):
+        batch = JsonRpcBatch(self.web3)
+        batch.call(self.otc.address, signature, args, ['uint256'])
+        return batch.execute()[0]
+
+    def _order(self, order_id: int, offer: tuple):
+        pay_amount, pay_token, buy_amount, buy_token, maker, timestamp = offer
+        if timestamp == 0:
+            return None
+
+        return Order(market=self.otc,
+                     order_id=order_id,
+                     maker=Address(maker),
+                     pay_token=Address(pay_token),
+                     pay_amount=Wad(pay_amount),
+                     buy_token=Address(buy_token),
+                     buy_amount=Wad(buy_amount),
+                     timestamp=timestamp)
+
+
+class OasisOrderIndex:
+    """Index of our own OasisDEX orders, kept up to date using `MatchingMarket` events.
+
+    Listing orders walks every offer in both directions of the market with a few `eth_call`s per offer,
+    so its cost grows with the whole market. The index does such a full scan only
+    once at the start, then every `resync_blocks` blocks and whenever the last block it has seen
+    is not part of the chain anymore, which it notices by comparing its hash with the parent hash
+    of the latest block (or with the hash of the block at the same height, if more than one block
+    has been mined in the meantime). This way chain reorganizations get recovered from straight away.
+    In between, it applies our `LogMake`, `LogKill` and `LogTake` events from the blocks mined since
+    the last refresh, which costs three `eth_getLogs` calls plus one batch request reading all of
+    our orders which got taken.
+
+    Orders are only tracked for the two directions of the `token_a`/`token_b` pair. All our
+    `LogTake` events for these orders (our fills) are kept in `fills`. Our orders are also used
+    to calculate insertion position hints for new orders, see `insertion_position()`.
+
+    Attributes:
+        web3: `Web3` instance.
+        otc: `MatchingMarket` to track the orders on.
+        our_address: Address of the maker to track the orders of.
+        token_a: Address of one token of the pair.
+        token_b: Address of the other token of the pair.
+        resync_blocks: Number of blocks after which a full scan is performed again.
+        reader: Object to read the orders with, `OasisOrderReader` by default.
+    """
+
+    # events of a few extra blocks are fetched each time, as events get applied in order
+    # and the list of our orders is rebuilt from them it is safe to apply them twice
+    OVERLAP_BLOCKS = 10
+
+    logger = logging.getLogger()
+
+    def __init__(self, web3, otc, our_address: Address, token_a: Address, token_b: Address,
+                 resync_blocks: int = 1000, reader=None):
+        assert(isinstance(our_address, Address))
+        assert(isinstance(token_a, Address))
+        assert(isinstance(token_b, Address))
+        assert(isinstance(resync_blocks, int))
+
+        self.web3 = web3
+        self.otc = otc
+        self.our_address = our_address
+        self.token_a = token_a
+        self.token_b = token_b
+        self.resync_blocks = resync_blocks
+        self.reader = reader if reader is not None else OasisOrderReader(web3, otc)
+        self.fills = deque(maxlen=1000)
+
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._last_block = None
+        self._last_block_hash = None
+        self._last_full_scan = None
+
+    def get_orders(self) -> list:
+        """Returns our current orders, after applying events from the blocks mined since the last call."""
+        block = self.web3.eth.getBlock('latest')
+        block_number = block['number']
+
+        with self._lock:
+            if self._last_block is None \
+                    or block_number - self._last_full_scan >= self.resync_blocks \
+                    or self._reorganized(block):
+                self._full_scan(block_number)
+
+            elif block_number > self._last_block:
+                self._apply_events(block_number)
+
+            self._last_block_hash = block['hash']
+
+            return list(self._orders.values())
+
+    def insertion_position(self, pay_token: Address, pay_amount: Wad, buy_token: Address, buy_amount: Wad) -> int:
+        """Returns the `pos` hint to make a new order with, calculated from our current orders.
+
+        `MatchingMarket` keeps the offers of each direction in a sorted list and inserts a new offer
+        by walking this list, starting from the offer passed as `pos` (or from the best offer if `pos`
+        is zero). The hint is our order in the same direction which is the closest in price to the new
+        one, preferably priced at least as high as it, as that is where the walk ends straight away.
+        As market maker orders sit close to each other near the top of the book, the walk then only
+        passes the orders of other makers placed in between, however deep the book is. A stale hint
+        (i.e. an order which has been taken in the meantime) is still handled correctly by the contract.
+
+        Returns:
+            Id of one of our orders, or zero if we have no orders in that direction.
+        """
+        assert(isinstance(pay_token, Address))
+        assert(isinstance(pay_amount, Wad))
+        assert(isinstance(buy_token, Address))
+        assert(isinstance(buy_amount, Wad))
+
+        with self._lock:
+            orders = [order for order in self._orders.values()
+                      if order.pay_token == pay_token and order.buy_token == buy_token]
+
+        # `_isPricedLtOrEq(new, order)` of the contract, with the same integer arithmetic
+        def priced_at_least_as_high(order):
+            return buy_amount.value * order.pay_amount.value >= order.buy_amount.value * pay_amount.value
+
+        def price(order):
+            return order.pay_amount / order.buy_amount
+
+        higher_orders = [order for order in orders if priced_at_least_as_high(order)]
+        if len(higher_orders) > 0:
+            return min(higher_orders, key=lambda order: (price(order), -order.order_id)).order_id
+
+        lower_orders = [order for order in orders if not priced_at_least_as_high(order)]
+        if len(lower_orders) > 0:
+            return max(lower_orders, key=price).order_id
+
+        return 0
+
+    def _reorganized(self, block) -> bool:
+        if block['number'] < self._last_block:
+            return True
+
+        if block['number'] == self._last_block:
+            last_block_hash = block['hash']
+        elif block['number'] == self._last_block + 1:
+            last_block_hash = block['parentHash']
+        else:
+            last_block_hash = self.web3.eth.getBlock(self._last_block)['hash']
+
+        if last_block_hash != self._last_block_hash:
+            self.logger.info(f"Block #{self._last_block} is not part of the chain anymore,"
+                             f" scanning all orders again")
+            return True
+
+        return False
+
+    def _full_scan(self, block_number: int):
+        orders = self.reader.get_orders(self.token_a, self.token_b) + self.reader.get_orders(self.token_b, self.token_a)
+
+        self._orders = {order.order_id: order for order in orders if order.maker == self.our_address}
+        self._last_block = block_number
+        self._last_full_scan = block_number
+
+        self.logger.debug(f"Scanned all orders as of block #{block_number},"
+                          f" found {len(self._orders)} orders of ours")
+
+    def _apply_events(self, block_number: int):
+        number_of_past_blocks = block_number - self._last_block + self.OVERLAP_BLOCKS
+        event_filter = {'maker': self.our_address.address}
+
+        events = self.otc.past_make(number_of_past_blocks, event_filter) + \
+                 self.otc.past_kill(number_of_past_blocks, event_filter) + \
+                 self.otc.past_take(number_of_past_blocks, event_filter)
+
+        taken_order_ids = set()
+        for event in sorted(events, key=lambda event: (event.raw['blockNumber'], event.raw['logIndex'])):
+            if not self._is_our_pair(event.pay_token, event.buy_token):
+                continue
+
+            if isinstance(event, LogMake):
+                self._orders[event.order_id] = Order(market=self.otc,
+                                                     order_id=event.order_id,
+                                                     maker=event.maker,
+                                                     pay_token=event.pay_token,
+                                                     pay_amount=event.pay_amount,
+                                                     buy_token=event.buy_token,
+                                                     buy_amount=event.buy_amount,
+                                                     timestamp=event.timestamp)
+
+            elif isinstance(event, LogKill):
+                self._orders.pop(event.order_id, None)
+                taken_order_ids.discard(event.order_id)
+
+            elif isinstance(event, LogTake) and event.order_id in self._orders:
+                self._record_fill(event)
+                taken_order_ids.add(event.order_id)
+
+        # amounts left in taken orders are read from the contract, as they can not be
+        # calculated from the events if some of them get applied twice
+        self._refresh_orders(sorted(taken_order_ids))
+
+        self._last_block = block_number
+
+    def _is_our_pair(self, pay_token: Address, buy_token: Address) -> bool:
+        return (pay_token == self.token_a and buy_token == self.token_b) or \
+               (pay_token == self.token_b and buy_token == self.token_a)
+
+    def _record_fill(self, event):
+        if any(fill.raw['transactionHash'] == event.raw['transactionHash'] and fill.raw['logIndex'] == event.raw['logIndex']
+               for fill in self.fills):
+            return
+
+        self.fills.append(event)
+        self.logger.info(f"Our order #{event.order_id} has been taken"
+                         f" (take amount: {event.take_amount}, give amount: {event.give_amount})")
+
+    def _refresh_orders(self, order_ids: list):
+        if len(order_ids) == 0:
+            return
+
+        for order_id, order in zip(order_ids, self.reader.get_orders_by_id(order_ids)):
+            if order is None or order.pay_amount.value == 0:
+                self._orders.pop(order_id, None)
+            else:
+                self._orders[order_id] = order
@@ -19,8 +19,9 @@ import logging
 import threading
 
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Executor, Future
 from functools import partial
+from typing import Optional
 
 from market_maker_keeper.order_history_reporter import OrderHistoryReporter
 
@@ -91,21 +92,24 @@ class OrderBookManager:
 
     logger = logging.getLogger()
 
-    def __init__(self, refresh_frequency: int, max_workers: int = 5):
+    def __init__(self, refresh_frequency: int, max_workers: int = 5, executor: Optional[Executor] = None):
         assert(isinstance(refresh_frequency, int))
         assert(isinstance(max_workers, int))
+        assert(isinstance(executor, Executor) or executor is None)
 
         self.refresh_frequency = refresh_frequency
         self.get_orders_function = None
         self.get_balances_function = None
         self.place_order_function = None
         self.cancel_order_function = None
+        self.cancel_orders_in_batch_function = None
+        self.max_batch_size = None
         self.order_history_reporter = None
         self.buy_filter_function = None
         self.sell_filter_function = None
         self.on_update_function = None
 
-        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._executor = executor if executor is not None else ThreadPoolExecutor(max_workers=max_workers)
         self._lock = threading.Lock()
         self._state = None
         self._refresh_count = 0
@@ -142,6 +146,8 @@ class OrderBookManager:
 
         Args:
             place_order_function: The function which will be called in order to place new orders.
+                It can either return the newly placed order (or `None` if placement failed), or a `Future`
+                resolving to it, so the worker thread does not wait i.e. for the transaction to get mined.
         """
         assert(callable(place_order_function))
 
@@ -152,11 +158,30 @@ class OrderBookManager:
 
         Args:
             cancel_order_function: The function which will be called in order to cancel orders.
+                It can either return whether the cancellation succeeded, or a `Future` resolving to it.
         """
         assert(callable(cancel_order_function))
 
         self.cancel_order_function = cancel_order_function
 
+    def cancel_orders_in_batch_with(self, cancel_orders_function, max_batch_size: int = 20):
+        """Configures the function used to cancel many orders at once, i.e. in one transaction.
+
+        If configured, it gets used instead of the function configured with `cancel_orders_with()`.
+
+        Args:
+            cancel_orders_function: The function which will be called with a list of at most `max_batch_size`
+                orders to cancel. It can either return whether the cancellation of all of them succeeded,
+                or a `Future` resolving to it.
+            max_batch_size: Maximum number of orders to cancel in one call.
+        """
+        assert(callable(cancel_orders_function))
+        assert(isinstance(max_batch_size, int))
+        assert(max_batch_size > 0)
+
+        self.cancel_orders_in_batch_function = cancel_orders_function
+        self.max_batch_size = max_batch_size
+
     def enable_history_reporting(self, order_history_reporter: OrderHistoryReporter, buy_filter_function, sell_filter_function):
         assert(isinstance(order_history_reporter, OrderHistoryReporter) or (order_history_reporter is None))
         assert(callable(buy_filter_function))
@@ -258,16 +283,14 @@ class OrderBookManager:
             orders: List of orders to cancel.
         """
         assert(isinstance(orders, list))
-        assert(callable(self.cancel_order_function))
+        assert(callable(self.cancel_order_function) or callable(self.cancel_orders_in_batch_function))
 
         with self._lock:
             for order in orders:
                 self._order_ids_cancelling.add(order.order_id)
 
         self._report_order_book_updated()
-
-        for order in orders:
-            self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order)))
+        self._submit_cancellations(orders)
 
     def replace_orders(self, orders: list, new_orders: list):
         """Replaces existing orders with new ones.
@@ -279,7 +302,7 @@ class OrderBookManager:
         assert(isinstance(orders, list))
         assert(isinstance(new_orders, list))
         assert(callable(self.place_order_function))
-        assert(callable(self.cancel_order_function))
+        assert(callable(self.cancel_order_function) or callable(self.cancel_orders_in_batch_function))
 
         with self._lock:
             for order in orders:
@@ -288,9 +311,7 @@ class OrderBookManager:
             self._currently_placing_orders += len(new_orders)
 
         self._report_order_book_updated()
-
-        for order in orders:
-            self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order)))
+        self._submit_cancellations(orders)
 
         for new_order in new_orders:
             self._executor.submit(self._thread_place_order(partial(self.place_order_function, new_order)))
@@ -369,45 +390,52 @@ class OrderBookManager:
                 break
             time.sleep(0.1)
 
-    def _report_order_book_updated(self):
-        if self.on_update_function is not None:
-            self.on_update_function()
+    def refresh_order_book(self):
+        """Fetches the active keeper orders (and balances) and updates the internal snapshot.
 
-    def _thread_refresh_order_book(self):
-        while True:
-            try:
-                with self._lock:
-                    orders_already_cancelled_before = set(self._order_ids_cancelled)
-                    orders_already_placed_before = set(self._orders_placed)
+        Normally called periodically by the background thread started by `start()`, only has to be
+        called directly if the order book manager has not been started (i.e. when backtesting).
+        """
+        try:
+            with self._lock:
+                orders_already_cancelled_before = set(self._order_ids_cancelled)
+                orders_already_placed_before = set(self._orders_placed)
 
-                # get orders, get balances
-                orders = self.get_orders_function()
-                balances = self.get_balances_function() if self.get_balances_function is not None else None
+            # get orders, get balances
+            orders = self.get_orders_function()
+            balances = self.get_balances_function() if self.get_balances_function is not None else None
 
-                if self.order_history_reporter:
-                    orders_buy = self.buy_filter_function(orders)
-                    orders_sell = self.sell_filter_function(orders)
+            if self.order_history_reporter:
+                orders_buy = self.buy_filter_function(orders)
+                orders_sell = self.sell_filter_function(orders)
 
-                    self.order_history_reporter.report_orders(orders_buy, orders_sell)
+                self.order_history_reporter.report_orders(orders_buy, orders_sell)
 
-                with self._lock:
-                    self._order_ids_cancelled = self._order_ids_cancelled - orders_already_cancelled_before
-                    for order in orders_already_placed_before:
-                        self._orders_placed.remove(order)
+            with self._lock:
+                self._order_ids_cancelled = self._order_ids_cancelled - orders_already_cancelled_before
+                for order in orders_already_placed_before:
+                    self._orders_placed.remove(order)
 
-                    if self._state is None:
-                        self.logger.info("Order book became available")
+                if self._state is None:
+                    self.logger.info("Order book became available")
 
-                    self._state = {'orders': orders, 'balances': balances}
-                    self._refresh_count += 1
+                self._state = {'orders': orders, 'balances': balances}
+                self._refresh_count += 1
 
-                self._report_order_book_updated()
+            self._report_order_book_updated()
 
-                self.logger.debug(f"Fetched the order book"
-                                  f" (orders: {[order.order_id for order in orders]})")
-            except Exception as e:
-                self.logger.info(f"Failed to fetch the order book ({e})")
+            self.logger.debug(f"Fetched the order book"
+                              f" (orders: {[order.order_id for order in orders]})")
+        except Exception as e:
+            self.logger.info(f"Failed to fetch the order book ({e})")
 
+    def _report_order_book_updated(self):
+        if self.on_update_function is not None:
+            self.on_update_function()
+
+    def _thread_refresh_order_book(self):
+        while True:
+            self.refresh_order_book()
             time.sleep(self.refresh_frequency)
 
     def _thread_place_order(self, place_order_function):
@@ -415,39 +443,72 @@ class OrderBookManager:
 
         def func():
             try:
-                new_order = place_order_function()
-
-                if new_order is not None:
-                    with self._lock:
-                        self._orders_placed.append(new_order)
+                result = place_order_function()
             except BaseException as exception:
                 self.logger.exception(exception)
-            finally:
-                with self._lock:
-                    self._currently_placing_orders -= 1
+                result = None
 
-                self._report_order_book_updated()
+            self._when_done(result, self._order_placed)
 
         return func
 
-    def _thread_cancel_order(self, order_id, cancel_order_function):
+    def _submit_cancellations(self, orders: list):
+        if self.cancel_orders_in_batch_function is not None:
+            for index in range(0, len(orders), self.max_batch_size):
+                batch = orders[index:index + self.max_batch_size]
+                self._executor.submit(self._thread_cancel_orders([order.order_id for order in batch],
+                                                                partial(self.cancel_orders_in_batch_function, batch)))
+
+        else:
+            for order in orders:
+                self._executor.submit(self._thread_cancel_orders([order.order_id],
+                                                                partial(self.cancel_order_function, order)))
+
+    def _thread_cancel_orders(self, order_ids: list, cancel_order_function):
+        assert(isinstance(order_ids, list))
         assert(callable(cancel_order_function))
 
         def func():
             try:
-                if cancel_order_function():
-                    with self._lock:
-                        self._order_ids_cancelled.add(order_id)
-                        self._order_ids_cancelling.remove(order_id)
+                result = cancel_order_function()
             except BaseException as exception:
                 self.logger.exception(exception)
-            finally:
-                with self._lock:
-                    try:
-                        self._order_ids_cancelling.remove(order_id)
-                    except KeyError:
-                        pass
+                result = False
 
-                self._report_order_book_updated()
+            self._when_done(result, partial(self._orders_cancelled, order_ids))
 
         return func
+
+    def _when_done(self, result, function):
+        # place and cancel functions may return futures, i.e. if they only submit transactions and
+        # do not wait for them to get mined. in this case we do not block the worker thread.
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: function(self._future_result(future)))
+        else:
+            function(result)
+
+    def _future_result(self, future: Future):
+        try:
+            return future.result()
+        except BaseException as exception:
+            self.logger.exception(exception)
+            return None
+
+    def _order_placed(self, new_order):
+        with self._lock:
+            if new_order is not None:
+                self._orders_placed.append(new_order)
+
+            self._currently_placing_orders -= 1
+
+        self._report_order_book_updated()
+
+    def _orders_cancelled(self, order_ids: list, cancelled):
+        with self._lock:
+            for order_id in order_ids:
+                if cancelled:
+                    self._order_ids_cancelled.add(order_id)
+
+                self._order_ids_cancelling.discard(order_id)
+
+        self._report_order_book_updated()
@@ -20,17 +20,20 @@ import logging
 import sys
 
 from retry import retry
-from web3 import Web3, HTTPProvider
+from web3 import Web3
 
 from market_maker_keeper.band import Bands
+from market_maker_keeper.block_cache import BlockCache
 from market_maker_keeper.gas import GasPriceFactory
 from market_maker_keeper.limit import History
+from market_maker_keeper.local_signing import register_keys
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
+from market_maker_keeper.web3_provider import create_provider
 from pyexchange.paradex import ParadexApi, Order
 from pymaker import Address
 from pymaker.approval import directly
@@ -58,9 +61,20 @@ class ParadexMarketMakerKeeper:
         parser.add_argument("--rpc-timeout", type=int, default=10,
                             help="JSON-RPC timeout (in seconds, default: 10)")
 
+        parser.add_argument("--rpc-ipc-path", type=str,
+                            help="Path to the IPC socket of the Ethereum node, to use instead of JSON-RPC over HTTP")
+
+        parser.add_argument("--rpc-ws-url", type=str,
+                            help="WebSocket URL of the Ethereum node (i.e. `ws://localhost:8546'),"
+                                 " to use instead of JSON-RPC over HTTP")
+
         parser.add_argument("--eth-from", type=str, required=True,
                             help="Ethereum account from which to send transactions")
 
+        parser.add_argument("--eth-key", type=str, nargs='*',
+                            help="Ethereum private key(s) to sign transactions with locally,"
+                                 " in the `key_file=<keystore file>,pass_file=<password file>' format")
+
         parser.add_argument("--exchange-address", type=str, required=True,
                             help="Ethereum address of the 0x Exchange contract")
 
@@ -97,6 +111,17 @@ class ParadexMarketMakerKeeper:
         parser.add_argument("--spread-feed-expiry", type=int, default=3600,
                             help="Maximum age of the spread feed (in seconds, default: 3600)")
 
+        parser.add_argument("--spread-feed-step", type=float,
+                            help="Step to round spread feed values to, so configs evaluated for them can be reused"
+                                 " (default: no rounding)")
+
+        parser.add_argument("--websocket-hot-standby", dest='websocket_hot_standby', action='store_true',
+                            help="Keep a hot-standby connection for WebSocket price and spread feeds")
+
+        parser.add_argument("--websocket-stall-timeout", type=int, default=5000,
+                            help="Time without any messages after which a price or spread feed WebSocket connection"
+                                 " is considered stalled (in milliseconds, default: 5000)")
+
         parser.add_argument("--order-history", type=str,
                             help="Endpoint to report active orders to")
 
@@ -112,6 +137,12 @@ class ParadexMarketMakerKeeper:
         parser.add_argument("--smart-gas-price", dest='smart_gas_price', action='store_true',
                             help="Use smart gas pricing strategy, based on the ethgasstation.info feed")
 
+        parser.add_argument("--node-gas-price", dest='node_gas_price', action='store_true',
+                            help="Use smart gas pricing strategy, based on recent blocks seen by the Ethereum node")
+
+        parser.add_argument("--gas-config", type=str, required=False,
+                            help="Gas price configuration file, with separate strategies per operation class")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
@@ -121,18 +152,19 @@ class ParadexMarketMakerKeeper:
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
-        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
-                                                                              request_kwargs={"timeout": self.arguments.rpc_timeout}))
+        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(create_provider(self.arguments))
         self.web3.eth.defaultAccount = self.arguments.eth_from
+        register_keys(self.web3, self.arguments.eth_key or [])
+        self.block_cache = BlockCache(self.web3)
         self.our_address = Address(self.arguments.eth_from)
 
         self.pair = self.arguments.pair.upper()
         self.token_buy = ERC20Token(web3=self.web3, address=Address(self.arguments.buy_token_address))
         self.token_sell = ERC20Token(web3=self.web3, address=Address(self.arguments.sell_token_address))
-        self.bands_config = ReloadableConfig(self.arguments.config)
+        self.bands_config = ReloadableConfig(self.arguments.config, spread_feed_step=self.arguments.spread_feed_step)
         self.price_max_decimals = None
         self.amount_max_decimals = None
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.gas_prices = GasPriceFactory().create_gas_prices(self.arguments, self.web3)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments)
         self.spread_feed = create_spread_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
@@ -173,10 +205,10 @@ class ParadexMarketMakerKeeper:
         self.order_book_manager.cancel_all_orders()
 
     def approve(self):
-        self.zrx_exchange.approve([self.token_sell, self.token_buy], directly(gas_price=self.gas_price))
+        self.zrx_exchange.approve([self.token_sell, self.token_buy], directly(gas_price=self.gas_prices.approve))
 
     def get_balances(self):
-        return self.token_sell.balance_of(self.our_address), self.token_buy.balance_of(self.our_address)
+        return self.block_cache.balance_of(self.token_sell, self.our_address), self.block_cache.balance_of(self.token_buy, self.our_address)
 
     def our_total_sell_balance(self, balances) -> Wad:
         return balances[0]
@@ -191,6 +223,8 @@ class ParadexMarketMakerKeeper:
         return list(filter(lambda order: not order.is_sell, our_orders))
 
     def synchronize_orders(self):
+        self.block_cache.check_block()
+
         bands = Bands.read(self.bands_config, self.spread_feed, self.history)
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
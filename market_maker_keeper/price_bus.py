@@ -0,0 +1,166 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import mmap
+import os
+import re
+import struct
+import tempfile
+from typing import Optional, Tuple
+
+
+class PriceBusSegment:
+    """Shared-memory segment holding the most recent price snapshot published on the price bus.
+
+    The segment is a small file, by default located in `/dev/shm`, mapped into memory by
+    the publisher and by all the consumers. There is exactly one writer per segment. Consistency
+    of reads is guaranteed with a sequence lock: the writer increments the sequence number before
+    and after each write, so it is odd while the write is in progress. Readers retry if they
+    see an odd sequence number, or if the sequence number has changed while they were reading.
+
+    Prices are stored as raw `Wad` values (256-bit unsigned integers), so no precision gets lost.
+
+    Attributes:
+        name: Name of the price bus segment.
+        directory: Directory in which the segment file lives.
+    """
+
+    SEQUENCE = struct.Struct('<Q')
+    RECORD = struct.Struct('<dBB32s32s')
+    SIZE = 128
+
+    def __init__(self, name: str, directory: Optional[str] = None):
+        assert(isinstance(name, str))
+        assert(isinstance(directory, str) or directory is None)
+
+        if not re.match("^[A-Za-z0-9_.-]+$", name):
+            raise Exception(f"Invalid price bus name '{name}'")
+
+        self.name = name
+        self.directory = directory if directory is not None else self.default_directory()
+
+    @staticmethod
+    def default_name(price_feed: str) -> str:
+        """Derives a valid price bus name from a price feed, i.e. `ws://host:8080/eth` becomes `ws___host_8080_eth`."""
+        assert(isinstance(price_feed, str))
+
+        return re.sub("[^A-Za-z0-9_.-]", "_", price_feed)
+
+    @staticmethod
+    def default_directory() -> str:
+        return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"market-maker-keeper-price-bus-{self.name}")
+
+
+class PriceBusWriter(PriceBusSegment):
+    """Publishing side of a price bus segment. Creates the segment file if it does not exist yet."""
+
+    def __init__(self, name: str, directory: Optional[str] = None):
+        super().__init__(name, directory)
+
+        # We create the file under a temporary name and rename it afterwards, so readers
+        # never see a file which has not been truncated to its final size yet.
+        if not os.path.exists(self.path):
+            temporary_path = f"{self.path}.{os.getpid()}"
+            with open(temporary_path, "wb") as file:
+                file.truncate(self.SIZE)
+            os.rename(temporary_path, self.path)
+
+        self._file = open(self.path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), self.SIZE, access=mmap.ACCESS_WRITE)
+
+        # If we are restarting, carry on with the sequence left by the previous writer.
+        sequence = self.SEQUENCE.unpack_from(self._mmap, 0)[0]
+        self._sequence = sequence + 1 if sequence % 2 == 1 else sequence
+
+    def write(self, buy_price: Optional[int], sell_price: Optional[int], timestamp: float):
+        """Publishes a new snapshot.
+
+        Args:
+            buy_price: Raw `Wad` value of the buy price, or `None` if not available.
+            sell_price: Raw `Wad` value of the sell price, or `None` if not available.
+            timestamp: Time of the snapshot (as returned by `time.time()`).
+        """
+        assert(isinstance(buy_price, int) or buy_price is None)
+        assert(isinstance(sell_price, int) or sell_price is None)
+        assert(isinstance(timestamp, float))
+
+        self.SEQUENCE.pack_into(self._mmap, 0, self._sequence + 1)
+        self.RECORD.pack_into(self._mmap, self.SEQUENCE.size,
+                              timestamp,
+                              buy_price is not None,
+                              sell_price is not None,
+                              (buy_price or 0).to_bytes(32, 'big'),
+                              (sell_price or 0).to_bytes(32, 'big'))
+        self.SEQUENCE.pack_into(self._mmap, 0, self._sequence + 2)
+        self._sequence += 2
+
+
+class PriceBusReader(PriceBusSegment):
+    """Consuming side of a price bus segment.
+
+    The segment gets mapped lazily, so consumers can be started before the publisher.
+    """
+
+    MAX_ATTEMPTS = 1000
+
+    def __init__(self, name: str, directory: Optional[str] = None):
+        super().__init__(name, directory)
+
+        self._mmap = None
+
+    def _map(self) -> bool:
+        if self._mmap is None:
+            try:
+                with open(self.path, "rb") as file:
+                    self._mmap = mmap.mmap(file.fileno(), self.SIZE, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return False
+
+        return True
+
+    def read(self) -> Optional[Tuple[Optional[int], Optional[int], float]]:
+        """Reads the most recent snapshot.
+
+        Returns:
+            A `(buy_price, sell_price, timestamp)` tuple, with prices being raw `Wad` values
+            or `None`s. Returns `None` if the segment does not exist or nothing has been
+            published to it yet.
+        """
+        if not self._map():
+            return None
+
+        for _ in range(self.MAX_ATTEMPTS):
+            sequence_before = self.SEQUENCE.unpack_from(self._mmap, 0)[0]
+            if sequence_before % 2 == 1:
+                continue
+
+            timestamp, has_buy, has_sell, buy_price, sell_price = self.RECORD.unpack_from(self._mmap, self.SEQUENCE.size)
+
+            sequence_after = self.SEQUENCE.unpack_from(self._mmap, 0)[0]
+            if sequence_before == sequence_after:
+                if sequence_before == 0:
+                    return None
+
+                return int.from_bytes(buy_price, 'big') if has_buy else None, \
+                       int.from_bytes(sell_price, 'big') if has_sell else None, \
+                       timestamp
+
+        return None
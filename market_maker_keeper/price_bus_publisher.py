@@ -0,0 +1,122 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import logging
+import sys
+import time
+
+from market_maker_keeper.price_bus import PriceBusWriter
+from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.util import setup_logging
+
+
+class PriceBusPublisher:
+    """Publishes a price feed on the host-local price bus, so many keepers can share it.
+
+    Keepers consume the published prices with `--price-feed bus:<name>`. This way only the publisher
+    maintains the upstream connections (GDAX WebSockets, `setzer` invocations, `Tub` reads etc.),
+    however many keepers are running on the same host.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, args: list, **kwargs):
+        parser = argparse.ArgumentParser(prog='price-bus-publisher')
+
+        parser.add_argument("--rpc-host", type=str, default="localhost",
+                            help="JSON-RPC host (default: `localhost')")
+
+        parser.add_argument("--rpc-port", type=int, default=8545,
+                            help="JSON-RPC port (default: `8545')")
+
+        parser.add_argument("--rpc-timeout", type=int, default=10,
+                            help="JSON-RPC timeout (in seconds, default: 10)")
+
+        parser.add_argument("--rpc-ipc-path", type=str,
+                            help="Path to the IPC socket of the Ethereum node, to use instead of JSON-RPC over HTTP")
+
+        parser.add_argument("--rpc-ws-url", type=str,
+                            help="WebSocket URL of the Ethereum node (i.e. `ws://localhost:8546'),"
+                                 " to use instead of JSON-RPC over HTTP")
+
+        parser.add_argument("--tub-address", type=str, required=False,
+                            help="Ethereum address of the Tub contract")
+
+        parser.add_argument("--price-feed", type=str, required=True,
+                            help="Source of price feed")
+
+        parser.add_argument("--price-feed-expiry", type=int, default=120,
+                            help="Maximum age of the price feed (in seconds, default: 120)")
+
+        parser.add_argument("--websocket-hot-standby", dest='websocket_hot_standby', action='store_true',
+                            help="Keep a hot-standby connection for WebSocket price and spread feeds")
+
+        parser.add_argument("--websocket-stall-timeout", type=int, default=5000,
+                            help="Time without any messages after which a price or spread feed WebSocket connection"
+                                 " is considered stalled (in milliseconds, default: 5000)")
+
+        parser.add_argument("--name", type=str, required=False,
+                            help="Name of the price bus to publish on (default: `--price-feed` with all characters"
+                                 " other than letters, digits, `_', `.' and `-' replaced with `_')")
+
+        parser.add_argument("--publish-interval", type=int, default=100,
+                            help="Publish interval (in milliseconds, default: 100)")
+
+        parser.add_argument("--debug", dest='debug', action='store_true',
+                            help="Enable debug output")
+
+        self.arguments = parser.parse_args(args)
+        setup_logging(self.arguments)
+
+        tub = self._create_tub() if self.arguments.tub_address is not None else None
+
+        self.price_feed = PriceFeedFactory().create_price_feed(self.arguments, tub)
+        self.writer = PriceBusWriter(self.arguments.name or PriceBusWriter.default_name(self.arguments.price_feed))
+
+    def _create_tub(self):
+        from web3 import Web3
+        from market_maker_keeper.web3_provider import create_provider
+        from pymaker import Address
+        from pymaker.sai import Tub
+
+        web3 = Web3(create_provider(self.arguments))
+
+        return Tub(web3=web3, address=Address(self.arguments.tub_address))
+
+    def main(self):
+        self.logger.info(f"Publishing '{self.arguments.price_feed}' price feed on '{self.writer.path}'"
+                         f" (consume it with `--price-feed bus:{self.writer.name}`)")
+
+        while True:
+            self.publish()
+            time.sleep(self.arguments.publish_interval / 1000)
+
+    def publish(self):
+        try:
+            price = self.price_feed.get_price()
+            self.writer.write(buy_price=price.buy_price.value if price.buy_price is not None else None,
+                              sell_price=price.sell_price.value if price.sell_price is not None else None,
+                              timestamp=time.time())
+        except Exception as e:
+            # We do not publish anything in this case, consumers will see the last published
+            # price until it expires.
+            self.logger.warning(f"Failed to publish the price ({e})")
+
+
+if __name__ == '__main__':
+    PriceBusPublisher(sys.argv[1:]).main()
@@ -15,17 +15,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import logging
 import threading
 import time
 from typing import Optional, List, Tuple
 
 import os
-import websocket
 
 from market_maker_keeper.feed import ExpiringFeed, WebSocketFeed, Feed
+from market_maker_keeper.gdax_order_book import GdaxOrderBook
+from market_maker_keeper.price_bus import PriceBusReader
 from market_maker_keeper.setzer import Setzer
+from market_maker_keeper.supervised_websocket import SupervisedWebSocket
+from market_maker_keeper.tick_file import TickFileWriter, TickFileReader, TickReplay, parse_replay_argument
+from market_maker_keeper.util import sanitize_url
 from pymaker.feed import DSValue
 from pymaker.numeric import Wad
 from pymaker.sai import Tub
@@ -44,6 +47,24 @@ class PriceFeed(object):
     def get_price(self) -> Price:
         raise NotImplementedError("Please implement this method")
 
+    def on_update(self, on_update_function):
+        """Makes the feed call `on_update_function` (from a background thread) each time its price
+        might have changed. Raises `NotImplementedError` if the feed is not able to notify about updates."""
+        raise NotImplementedError()
+
+
+def _on_update_of_any(price_feeds: list, on_update_function):
+    supported = False
+    for price_feed in price_feeds:
+        try:
+            price_feed.on_update(on_update_function)
+            supported = True
+        except NotImplementedError:
+            pass
+
+    if not supported:
+        raise NotImplementedError()
+
 
 class FixedPriceFeed(PriceFeed):
     logger = logging.getLogger()
@@ -123,10 +144,12 @@ class SetzerPriceFeed(PriceFeed):
 class GdaxPriceFeed(PriceFeed):
     logger = logging.getLogger()
 
-    def __init__(self, ws_url: str, product_id: str, expiry: int):
+    def __init__(self, ws_url: str, product_id: str, expiry: int, hot_standby: bool = False, stall_timeout: Optional[float] = None):
         assert(isinstance(ws_url, str))
         assert(isinstance(product_id, str))
         assert(isinstance(expiry, int))
+        assert(isinstance(hot_standby, bool))
+        assert(isinstance(stall_timeout, float) or stall_timeout is None)
 
         self.ws_url = ws_url
         self.product_id = product_id
@@ -134,20 +157,20 @@ class GdaxPriceFeed(PriceFeed):
         self._last_price = None
         self._last_timestamp = 0
         self._expired = True
-        threading.Thread(target=self._background_run, daemon=True).start()
-
-    def _background_run(self):
-        while True:
-            ws = websocket.WebSocketApp(url=self.ws_url,
-                                        on_message=self._on_message,
-                                        on_error=self._on_error,
-                                        on_open=self._on_open,
-                                        on_close=self._on_close)
-            ws.run_forever(ping_interval=15, ping_timeout=10)
-            time.sleep(1)
+        self._on_update_function = None
+
+        # ticker messages received over the hot-standby connection are de-duplicated by their sequence numbers,
+        # heartbeats are always delivered as each of them keeps the feed alive
+        self._websocket = SupervisedWebSocket(name=f"GDAX {self.product_id}",
+                                              url=self.ws_url,
+                                              on_open_function=self._on_open,
+                                              on_message_function=self._on_message,
+                                              key_function=lambda message_obj: int(message_obj['sequence']) if message_obj['type'] == 'ticker' else None,
+                                              connections=2 if hot_standby else 1,
+                                              stall_timeout=stall_timeout)
+        self._websocket.start()
 
     def _on_open(self, ws):
-        self.logger.info(f"GDAX {self.product_id} WebSocket connected")
         ws.send("""{
             "type": "subscribe",
             "channels": [
@@ -155,25 +178,21 @@ class GdaxPriceFeed(PriceFeed):
                 { "name": "heartbeat", "product_ids": ["%s"] }
             ]}""" % (self.product_id, self.product_id))
 
-    def _on_close(self, ws):
-        self.logger.info(f"GDAX {self.product_id} WebSocket disconnected")
-
-    def _on_message(self, ws, message):
+    def _on_message(self, message_obj: dict):
         try:
-            message_obj = json.loads(message)
             if message_obj['type'] == 'subscriptions':
                 pass
             elif message_obj['type'] == 'ticker':
                 self._process_ticker(message_obj)
+
+                if self._on_update_function is not None:
+                    self._on_update_function()
             elif message_obj['type'] == 'heartbeat':
                 self._process_heartbeat()
             else:
-                self.logger.warning(f"GDAX {self.product_id} WebSocket received unknown message type: '{message}'")
+                self.logger.warning(f"GDAX {self.product_id} WebSocket received unknown message type: '{message_obj}'")
         except:
-            self.logger.warning(f"GDAX {self.product_id} WebSocket received invalid message: '{message}'")
-
-    def _on_error(self, ws, error):
-        self.logger.info(f"GDAX {self.product_id} WebSocket error: '{error}'")
+            self.logger.warning(f"GDAX {self.product_id} WebSocket received invalid message: '{message_obj}'")
 
     def get_price(self) -> Price:
         if time.time() - self._last_timestamp > self.expiry:
@@ -187,6 +206,11 @@ class GdaxPriceFeed(PriceFeed):
             value = self._last_price
             return Price(buy_price=value, sell_price=value)
 
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_function = on_update_function
+
     def _process_ticker(self, message_obj):
         self._last_price = Wad.from_number(message_obj['price'])
         self._last_timestamp = time.time()
@@ -201,6 +225,249 @@ class GdaxPriceFeed(PriceFeed):
         self._last_timestamp = time.time()
 
 
+class GdaxOrderBookPriceFeed(PriceFeed):
+    """Price feed based on the GDAX `level2` WebSocket channel.
+
+    Unlike `GdaxPriceFeed`, which uses the last trade price, this feed maintains the whole order book
+    (see `GdaxOrderBook`) and derives the price from it. Supported modes are:
+    * `mid` - average of the best bid and the best ask,
+    * `microprice` - size-weighted average of the best bid and the best ask,
+    * `depth` - average price of selling `depth` units to the bids (used as the buy price)
+                and of buying `depth` units from the asks (used as the sell price).
+    """
+
+    logger = logging.getLogger()
+
+    MODES = ['mid', 'microprice', 'depth']
+
+    def __init__(self, ws_url: str, product_id: str, mode: str, depth: float, expiry: int, stall_timeout: Optional[float] = None):
+        assert(isinstance(ws_url, str))
+        assert(isinstance(product_id, str))
+        assert(isinstance(mode, str))
+        assert(isinstance(depth, float))
+        assert(isinstance(expiry, int))
+        assert(isinstance(stall_timeout, float) or stall_timeout is None)
+
+        if mode not in self.MODES:
+            raise Exception(f"Unknown GDAX order book price mode '{mode}'")
+
+        self.ws_url = ws_url
+        self.product_id = product_id
+        self.mode = mode
+        self.depth = depth
+        self.expiry = expiry
+        self.order_book = GdaxOrderBook()
+        self._last_timestamp = 0
+        self._expired = True
+        self._on_update_function = None
+
+        # `l2update` messages do not carry sequence numbers, so they can not be de-duplicated across
+        # two connections. This feed always uses one connection, but still benefits from stall detection.
+        self._websocket = SupervisedWebSocket(name=f"GDAX {self.product_id} order book",
+                                              url=self.ws_url,
+                                              on_open_function=self._on_open,
+                                              on_message_function=self._on_message,
+                                              stall_timeout=stall_timeout)
+        self._websocket.start()
+
+    def _on_open(self, ws):
+        ws.send("""{
+            "type": "subscribe",
+            "channels": [
+                { "name": "level2", "product_ids": ["%s"] },
+                { "name": "heartbeat", "product_ids": ["%s"] }
+            ]}""" % (self.product_id, self.product_id))
+
+    def _on_message(self, message_obj: dict):
+        try:
+            if message_obj['type'] == 'l2update':
+                self.order_book.apply_update(message_obj['changes'])
+                self._last_timestamp = time.time()
+                self._notify_update()
+            elif message_obj['type'] == 'snapshot':
+                self._process_snapshot(message_obj)
+                self._notify_update()
+            elif message_obj['type'] == 'heartbeat':
+                self._last_timestamp = time.time()
+            elif message_obj['type'] == 'subscriptions':
+                pass
+            else:
+                self.logger.warning(f"GDAX {self.product_id} order book WebSocket received unknown message type: '{message_obj}'")
+        except:
+            self.logger.warning(f"GDAX {self.product_id} order book WebSocket received invalid message: '{message_obj}'")
+
+    def _process_snapshot(self, message_obj):
+        self.order_book.apply_snapshot(message_obj['bids'], message_obj['asks'])
+        self._last_timestamp = time.time()
+
+        bid_levels, ask_levels = self.order_book.depth()
+        self.logger.info(f"GDAX {self.product_id} order book snapshot received"
+                         f" ({bid_levels} bid levels, {ask_levels} ask levels)")
+
+        if self._expired:
+            self.logger.info(f"Price feed from GDAX order book ({self.product_id}) became available")
+            self._expired = False
+
+    def _notify_update(self):
+        if self._on_update_function is not None:
+            self._on_update_function()
+
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_function = on_update_function
+
+    def get_price(self) -> Price:
+        if time.time() - self._last_timestamp > self.expiry or not self.order_book.initialized:
+            if not self._expired:
+                self.logger.warning(f"Price feed from GDAX order book ({self.product_id}) has expired")
+                self._expired = True
+
+            return Price(buy_price=None, sell_price=None)
+
+        if self.mode == 'depth':
+            buy_price, sell_price = self.order_book.depth_weighted_prices(self.depth)
+        elif self.mode == 'microprice':
+            buy_price = sell_price = self.order_book.microprice()
+        else:
+            buy_price = sell_price = self.order_book.mid_price()
+
+        return Price(buy_price=Wad.from_number(buy_price) if buy_price is not None else None,
+                     sell_price=Wad.from_number(sell_price) if sell_price is not None else None)
+
+
+class BusPriceFeed(PriceFeed):
+    """Price feed reading prices published on the host-local price bus by `price-bus-publisher`.
+
+    Reading the price is just a read from a shared memory segment, so it does not involve
+    any I/O or system calls once the segment has been mapped.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, name: str, expiry: int, directory: Optional[str] = None):
+        assert(isinstance(name, str))
+        assert(isinstance(expiry, int))
+        assert(isinstance(directory, str) or directory is None)
+
+        self.name = name
+        self.expiry = expiry
+        self._reader = PriceBusReader(name, directory)
+        self._expired = True
+
+    def get_price(self) -> Price:
+        snapshot = self._reader.read()
+
+        if snapshot is None or time.time() - snapshot[2] > self.expiry:
+            if not self._expired:
+                self.logger.warning(f"Price feed from price bus '{self.name}' has expired")
+                self._expired = True
+
+            return Price(buy_price=None, sell_price=None)
+
+        if self._expired:
+            self.logger.info(f"Price feed from price bus '{self.name}' became available")
+            self._expired = False
+
+        buy_price, sell_price, _ = snapshot
+        return Price(buy_price=Wad(buy_price) if buy_price is not None else None,
+                     sell_price=Wad(sell_price) if sell_price is not None else None)
+
+
+class RecordingPriceFeed(PriceFeed):
+    """Records every price change of the underlying price feed into a tick file (see `TickFile`).
+
+    If the underlying price feed notifies about its updates (WebSocket and GDAX feeds do), the price gets
+    recorded on each update, so the file captures every change as it arrives and not just one price
+    per keeper tick. The price also gets recorded whenever it is read, which catches changes nobody
+    notifies about, i.e. the feed expiring. Either way only prices differing from the previously
+    recorded one get recorded.
+    """
+
+    def __init__(self, price_feed: PriceFeed, writer: TickFileWriter, source: str):
+        assert(isinstance(price_feed, PriceFeed))
+        assert(isinstance(writer, TickFileWriter))
+        assert(isinstance(source, str))
+
+        self.price_feed = price_feed
+        self.writer = writer
+        self.source = source
+        self._lock = threading.Lock()
+        self._last = None
+        self._on_update_function = None
+
+        try:
+            self.price_feed.on_update(self._on_update)
+        except NotImplementedError:
+            pass
+
+    def _on_update(self):
+        self._record(self.price_feed.get_price())
+
+        if self._on_update_function is not None:
+            self._on_update_function()
+
+    def _record(self, price: Price):
+        recorded = (price.buy_price.value if price.buy_price is not None else None,
+                    price.sell_price.value if price.sell_price is not None else None)
+
+        with self._lock:
+            if recorded != self._last:
+                self.writer.write_price(self.source, recorded[0], recorded[1], time.time())
+                self._last = recorded
+
+    def get_price(self) -> Price:
+        price = self.price_feed.get_price()
+        self._record(price)
+
+        return price
+
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_function = on_update_function
+
+
+class ReplayPriceFeed(PriceFeed):
+    """Plays back prices recorded in a tick file (see `TickFile` and `TickReplay`).
+
+    Once the replay is finished, the last recorded price stays in place.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, path: str, source: Optional[str], speed: Optional[float], clock=time.time):
+        assert(isinstance(path, str))
+        assert(isinstance(source, str) or source is None)
+        assert(isinstance(speed, float) or speed is None)
+
+        reader = TickFileReader(path)
+        if source is None:
+            sources = reader.sources()
+            source = sources[min(sources)] if len(sources) > 0 else None
+
+        self.path = path
+        self.source = source
+        self.replay = TickReplay([tick for tick in reader.ticks(source) if tick.data is None], speed, clock)
+        self._finished = False
+
+        self.logger.info(f"Replaying {len(self.replay.ticks)} price ticks of '{source}' from '{path}'"
+                         f" at {f'{speed}x speed' if speed is not None else 'maximum speed'}")
+
+    def get_price(self) -> Price:
+        tick = self.replay.current()
+
+        if self.replay.finished and not self._finished:
+            self.logger.info(f"Replay of '{self.source}' from '{self.path}' finished")
+            self._finished = True
+
+        if tick is None:
+            return Price(buy_price=None, sell_price=None)
+
+        return Price(buy_price=Wad(tick.buy_price) if tick.buy_price is not None else None,
+                     sell_price=Wad(tick.sell_price) if tick.sell_price is not None else None)
+
+
 class WebSocketPriceFeed(PriceFeed):
     def __init__(self, feed: Feed):
         assert(isinstance(feed, Feed))
@@ -236,6 +503,9 @@ class WebSocketPriceFeed(PriceFeed):
 
         return Price(buy_price=buy_price, sell_price=sell_price)
 
+    def on_update(self, on_update_function):
+        self.feed.on_update(on_update_function)
+
 
 class AveragePriceFeed(PriceFeed):
     def __init__(self, feeds: List[PriceFeed]):
@@ -264,6 +534,9 @@ class AveragePriceFeed(PriceFeed):
 
         return Price(buy_price=buy_price, sell_price=sell_price)
 
+    def on_update(self, on_update_function):
+        _on_update_of_any(self.feeds, on_update_function)
+
 
 class ReversePriceFeed(PriceFeed):
     def __init__(self, price_feed: PriceFeed):
@@ -277,6 +550,9 @@ class ReversePriceFeed(PriceFeed):
         sell_price = Wad.from_number(1) / parent_price.sell_price if parent_price.sell_price is not None else None
         return Price(buy_price=buy_price, sell_price=sell_price)
 
+    def on_update(self, on_update_function):
+        self.price_feed.on_update(on_update_function)
+
 
 class BackupPriceFeed(PriceFeed):
     logger = logging.getLogger()
@@ -293,17 +569,25 @@ class BackupPriceFeed(PriceFeed):
 
         return Price(buy_price=None, sell_price=None)
 
+    def on_update(self, on_update_function):
+        _on_update_of_any(self.feeds, on_update_function)
+
 
 class PriceFeedFactory:
     @staticmethod
     def create_price_feed(arguments, tub: Tub = None) -> PriceFeed:
-        return PriceFeedFactory._create_price_feed(arguments.price_feed, arguments.price_feed_expiry, tub)
+        return PriceFeedFactory._create_price_feed(arguments.price_feed, arguments.price_feed_expiry, tub,
+                                                   hot_standby=arguments.websocket_hot_standby,
+                                                   stall_timeout=arguments.websocket_stall_timeout / 1000)
 
     @staticmethod
-    def _create_price_feed(price_feed_argument: str, price_feed_expiry_argument: int, tub: Optional[Tub]):
+    def _create_price_feed(price_feed_argument: str, price_feed_expiry_argument: int, tub: Optional[Tub],
+                           hot_standby: bool = False, stall_timeout: Optional[float] = None):
         assert(isinstance(price_feed_argument, str))
         assert(isinstance(price_feed_expiry_argument, int))
         assert(isinstance(tub, Tub) or tub is None)
+        assert(isinstance(hot_standby, bool))
+        assert(isinstance(stall_timeout, float) or stall_timeout is None)
 
         gdax_ws_url = "wss://ws-feed.gdax.com"
 
@@ -311,7 +595,9 @@ class PriceFeedFactory:
             # main price feed
             main_price_feed = GdaxPriceFeed(ws_url=gdax_ws_url,
                                             product_id="ETH-USD",
-                                            expiry=price_feed_expiry_argument)
+                                            expiry=price_feed_expiry_argument,
+                                            hot_standby=hot_standby,
+                                            stall_timeout=stall_timeout)
 
             # emergency price feed
             emergency_price_feed = AveragePriceFeed([SetzerPriceFeed('kraken', expiry=price_feed_expiry_argument),
@@ -327,13 +613,17 @@ class PriceFeedFactory:
         elif price_feed_argument == 'btc_dai':
             return GdaxPriceFeed(ws_url=gdax_ws_url,
                                  product_id="BTC-USD",
-                                 expiry=price_feed_expiry_argument)
+                                 expiry=price_feed_expiry_argument,
+                                 hot_standby=hot_standby,
+                                 stall_timeout=stall_timeout)
 
         elif price_feed_argument == 'dai_eth':
-            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai', price_feed_expiry_argument, tub))
+            return ReversePriceFeed(PriceFeedFactory._create_price_feed('eth_dai', price_feed_expiry_argument, tub,
+                                                                        hot_standby, stall_timeout))
 
         elif price_feed_argument == 'dai_btc':
-            return ReversePriceFeed(PriceFeedFactory._create_price_feed('btc_dai', price_feed_expiry_argument, tub))
+            return ReversePriceFeed(PriceFeedFactory._create_price_feed('btc_dai', price_feed_expiry_argument, tub,
+                                                                        hot_standby, stall_timeout))
 
         elif price_feed_argument == 'tub':
             if tub is not None:
@@ -341,11 +631,39 @@ class PriceFeedFactory:
             else:
                 raise Exception(f"'--price-feed tub' cannot be used as this keeper does not know about 'Tub'")
 
+        elif price_feed_argument.startswith("gdax_book:"):
+            # syntax: `gdax_book:<product_id>[:<mode>[:<depth>]]`, i.e. `gdax_book:ETH-USD:depth:25`
+            parameters = price_feed_argument[10:].split(":")
+            price_feed = GdaxOrderBookPriceFeed(ws_url=gdax_ws_url,
+                                                product_id=parameters[0],
+                                                mode=parameters[1] if len(parameters) > 1 else 'microprice',
+                                                depth=float(parameters[2]) if len(parameters) > 2 else 10.0,
+                                                expiry=price_feed_expiry_argument,
+                                                stall_timeout=stall_timeout)
+
+        elif price_feed_argument.startswith("record:"):
+            # syntax: `record:<file>:<price_feed>`, i.e. `record:eth_dai.ticks:eth_dai`
+            path, recorded_price_feed_argument = price_feed_argument[7:].split(":", 1)
+            price_feed = RecordingPriceFeed(PriceFeedFactory._create_price_feed(recorded_price_feed_argument,
+                                                                                price_feed_expiry_argument, tub,
+                                                                                hot_standby, stall_timeout),
+                                            writer=TickFileWriter.shared(path),
+                                            source=sanitize_url(recorded_price_feed_argument))
+
+        elif price_feed_argument.startswith("replay:"):
+            # syntax: `replay:<file>[:<source>[:<speed>]]`, i.e. `replay:eth_dai.ticks:eth_dai:10`,
+            # where `<speed>` can be either a multiplier or `max`
+            path, source, speed = parse_replay_argument(price_feed_argument[7:])
+            price_feed = ReplayPriceFeed(path=path, source=source, speed=speed)
+
+        elif price_feed_argument.startswith("bus:"):
+            price_feed = BusPriceFeed(price_feed_argument[4:], expiry=price_feed_expiry_argument)
+
         elif price_feed_argument.startswith("fixed:"):
             price_feed = FixedPriceFeed(Wad.from_number(price_feed_argument[6:]))
 
         elif price_feed_argument.startswith("ws://") or price_feed_argument.startswith("wss://"):
-            socket_feed = WebSocketFeed(price_feed_argument, 5)
+            socket_feed = WebSocketFeed(price_feed_argument, 5, hot_standby=hot_standby, stall_timeout=stall_timeout)
             socket_feed = ExpiringFeed(socket_feed, price_feed_expiry_argument)
 
             price_feed = WebSocketPriceFeed(socket_feed)
@@ -0,0 +1,219 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from market_maker_keeper.gas import OperationGasPrices, ReplacingGasPrice
+
+
+class OperationStatistics:
+    """Inclusion statistics of transactions of one operation class.
+
+    Attributes:
+        count: Number of transactions which got mined (or failed).
+        replacements: Total number of replacements of these transactions.
+        total_seconds: Total time it took them to get mined (in seconds).
+        max_seconds: Longest time it took one of them to get mined (in seconds).
+        total_blocks: Total number of blocks it took them to get mined.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.replacements = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_blocks = 0
+
+    def to_dict(self) -> dict:
+        return {'count': self.count,
+                'replacements': self.replacements,
+                'averageSeconds': self.total_seconds / self.count if self.count > 0 else None,
+                'maxSeconds': self.max_seconds,
+                'averageBlocks': self.total_blocks / self.count if self.count > 0 else None}
+
+
+class TrackedTransaction:
+    def __init__(self, operation: Optional[str]):
+        self.operation = operation
+        self.gas_price = None
+        self.policy = None
+        self.start_time = time.time()
+        self.start_block = None
+
+
+class ReceiptTracker:
+    """Sends transactions and waits for their receipts without blocking the calling thread.
+
+    `Transact.transact()` blocks the calling thread until the transaction gets mined, which usually
+    takes from 15 to 60 seconds. The receipt tracker runs `transact_async()` of all the submitted
+    transactions concurrently on one event loop, running in a single background thread, so the receipts
+    of any number of pending transactions are awaited by that one thread.
+
+    `transact()` returns a `Future`, which `OrderBookManager` place and cancel functions can return
+    instead of a result, so the manager worker threads are released as soon as transactions
+    get submitted.
+
+    If `gas_prices` are passed, transactions can be submitted for an operation class (`cancel`, `place`
+    etc.). They then use the gas price of that class and, if the class has a replacement policy
+    configured, a watchdog replaces them with the same nonce and a higher gas price each time
+    they stay pending for the number of blocks set by the policy. Replacement counts and inclusion
+    times are collected per operation class, see `statistics()`.
+
+    Attributes:
+        web3: `Web3` instance, only needed if `gas_prices` are passed.
+        gas_prices: Gas prices and replacement policies of operation classes.
+        watchdog_interval: Frequency of checking for stuck transactions (in seconds).
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, web3=None, gas_prices: Optional[OperationGasPrices] = None, watchdog_interval: float = 1.0):
+        assert(isinstance(gas_prices, OperationGasPrices) or gas_prices is None)
+        assert(web3 is not None or gas_prices is None)
+        assert(isinstance(watchdog_interval, float))
+
+        self.web3 = web3
+        self.gas_prices = gas_prices
+        self.watchdog_interval = watchdog_interval
+
+        self._loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+        self._tracked = set()
+        self._statistics = {}
+
+        threading.Thread(target=self._background_run, daemon=True).start()
+
+    def _background_run(self):
+        asyncio.set_event_loop(self._loop)
+        if self.gas_prices is not None and len(self.gas_prices.replacement_policies) > 0:
+            self._loop.create_task(self._watchdog())
+
+        self._loop.run_forever()
+
+    def transact(self, transact, result_function=None, operation: Optional[str] = None, **kwargs) -> Future:
+        """Sends a transaction and tracks it until its receipt arrives.
+
+        Args:
+            transact: `Transact` instance representing the transaction.
+            result_function: Optional function applied to the receipt (or to `None`, if the transaction
+                failed) in order to calculate the result of the returned future.
+            operation: Operation class of the transaction (`cancel`, `place`, `deposit` or `approve`),
+                only allowed if `gas_prices` have been passed to the constructor.
+            kwargs: Parameters passed to `transact_async()`, i.e. `gas_price`.
+
+        Returns:
+            A `Future` resolving to the receipt (or `None` if the transaction failed), or to the result
+            of `result_function` if it has been passed.
+        """
+        assert(callable(result_function) or result_function is None)
+        assert(operation is None or self.gas_prices is not None)
+
+        tracked = TrackedTransaction(operation)
+        if operation is not None:
+            tracked.policy = self.gas_prices.replacement_policy(operation)
+
+            if tracked.policy is not None:
+                tracked.gas_price = ReplacingGasPrice(gas_price=self.gas_prices.gas_price(operation),
+                                                      multiplier=tracked.policy.multiplier,
+                                                      default_price_function=lambda: self.web3.eth.gasPrice)
+                kwargs['gas_price'] = tracked.gas_price
+            else:
+                kwargs['gas_price'] = self.gas_prices.gas_price(operation)
+
+        async def track():
+            if operation is not None:
+                tracked.start_block = self.web3.eth.blockNumber
+
+            with self._lock:
+                self._tracked.add(tracked)
+
+            try:
+                receipt = await transact.transact_async(**kwargs)
+            finally:
+                with self._lock:
+                    self._tracked.discard(tracked)
+
+                if operation is not None:
+                    self._record(tracked)
+
+            return result_function(receipt) if result_function is not None else receipt
+
+        return asyncio.run_coroutine_threadsafe(track(), self._loop)
+
+    async def _watchdog(self):
+        while True:
+            await asyncio.sleep(self.watchdog_interval)
+
+            try:
+                self.replace_stuck_transactions(self.web3.eth.blockNumber)
+            except Exception as e:
+                self.logger.warning(f"Failed to check for stuck transactions ({e})")
+
+    def replace_stuck_transactions(self, block_number: int):
+        """Replaces transactions which have been pending for too many blocks according to their policies."""
+        assert(isinstance(block_number, int))
+
+        with self._lock:
+            tracked_transactions = list(self._tracked)
+
+        for tracked in tracked_transactions:
+            if tracked.policy is None or tracked.start_block is None:
+                continue
+
+            blocks_pending = block_number - tracked.start_block
+            if blocks_pending >= tracked.policy.after_blocks * (tracked.gas_price.replacements + 1) \
+                    and tracked.gas_price.replacements < tracked.policy.max_replacements:
+                tracked.gas_price.replace()
+
+                self.logger.warning(f"Transaction ({tracked.operation}) pending for {blocks_pending} blocks,"
+                                    f" replacing it for the {tracked.gas_price.replacements}. time"
+                                    f" with gas price {tracked.gas_price.get_gas_price(int(time.time() - tracked.start_time))}")
+
+    def _record(self, tracked: TrackedTransaction):
+        seconds = time.time() - tracked.start_time
+        replacements = tracked.gas_price.replacements if tracked.gas_price is not None else 0
+
+        try:
+            blocks = self.web3.eth.blockNumber - tracked.start_block if tracked.start_block is not None else 0
+        except:
+            blocks = 0
+
+        with self._lock:
+            statistics = self._statistics.setdefault(tracked.operation, OperationStatistics())
+            statistics.count += 1
+            statistics.replacements += replacements
+            statistics.total_seconds += seconds
+            statistics.max_seconds = max(statistics.max_seconds, seconds)
+            statistics.total_blocks += blocks
+
+        self.logger.info(f"Transaction ({tracked.operation}) finished after {seconds:.1f}s ({blocks} blocks,"
+                         f" {replacements} replacements)")
+
+    def pending_count(self) -> int:
+        """Returns the number of transactions currently being awaited."""
+        with self._lock:
+            return len(self._tracked)
+
+    def statistics(self) -> dict:
+        """Returns replacement counts and inclusion times of transactions, per operation class."""
+        with self._lock:
+            return {operation: statistics.to_dict() for operation, statistics in self._statistics.items()}
@@ -18,89 +18,185 @@
 import _jsonnet
 import json
 import logging
-import os
+import threading
 import zlib
+from collections import OrderedDict
+from decimal import Decimal, ROUND_HALF_UP
 from typing import Optional
 
+from market_maker_keeper.file_watcher import FileWatcher
+
 
 class ReloadableConfig:
     """Reloadable JSON config file reader, capable of using jsonnet expressions.
 
-    This reader will always read most up-to-date version of the config file from disk
-    on each call to `get_config()`. In addition to that, whenever the config file changes,
-    a log event is emitted.
+    The config file gets watched for changes (see `FileWatcher`). Whenever it changes, it gets
+    re-read and evaluated in a background thread, and the new config gets swapped in atomically.
+    Thanks to it `get_config()` does not touch the disk at all, it only evaluates the config
+    synchronously if the spread feed has changed. Whenever the config file changes, a log event
+    is emitted. If the config file becomes invalid, an error gets logged and the last valid config
+    stays in use.
+
+    Configs evaluated for different spread feed values are kept in an LRU cache, keyed on the checksum
+    of the config file and the spread feed values. As the spread feed tends to oscillate between
+    a handful of levels, its values can optionally be rounded to a multiple of `spread_feed_step`
+    before evaluating the config, so oscillating values hit the cache instead of causing
+    the config to be evaluated again.
 
     This reader uses _jsonnet_ data templating language, so the JSON config files can use
     some advanced expressions documented here: <https://github.com/google/jsonnet>.
 
     Attributes:
         filename: Filename of the configuration file.
+        spread_feed_step: Step to round spread feed values to, `None` means no rounding.
+        cache_size: Maximum number of evaluated configs kept in the cache.
+        cache_hits: Number of times an evaluated config has been found in the cache.
+        cache_misses: Number of times a config had to be evaluated as it has not been found in the cache.
     """
 
     logger = logging.getLogger()
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, spread_feed_step: Optional[float] = None, cache_size: int = 64):
         assert(isinstance(filename, str))
+        assert(isinstance(spread_feed_step, float) or spread_feed_step is None)
+        assert(isinstance(cache_size, int))
+        assert(cache_size > 0)
 
         self.filename = filename
+        self.spread_feed_step = spread_feed_step
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
         self._checksum_file = None
         self._checksum_config = None
-        self._config = None
-        self._mtime = None
-        self._spread_feed = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._cache = OrderedDict()
+
+        # (content_file, spread_feed, config) tuple, always replaced as a whole
+        self._state = None
 
     @staticmethod
-    def _spread_feed_import_callback(spread_feed: dict):
-        assert(isinstance(spread_feed, dict))
+    def _spread_feed_import_callback(spread_values: dict):
+        assert(isinstance(spread_values, dict))
 
         def callback(path, file):
             if file == "spread-feed":
-                return path, json.dumps(dict(map(lambda kv: (kv[0], float(kv[1])), spread_feed.items())))
+                return path, json.dumps(spread_values)
 
         return callback
 
+    def _spread_values(self, spread_feed: dict) -> dict:
+        if self.spread_feed_step is None:
+            return {key: float(value) for key, value in spread_feed.items()}
+
+        step = Decimal(repr(self.spread_feed_step))
+        return {key: float((Decimal(str(value)) / step).quantize(Decimal(1), rounding=ROUND_HALF_UP) * step)
+                for key, value in spread_feed.items()}
+
     def get_config(self, spread_feed: dict):
-        """Reads the JSON config file from disk and returns it as a Python object.
+        """Returns the current configuration.
 
         Returns:
             Current configuration as a `dict` or `list` object.
         """
         assert(isinstance(spread_feed, dict))
 
-        mtime = os.path.getmtime(self.filename)
+        state = self._state
+        if state is not None and state[1] == spread_feed:
+            return state[2]
+
+        with self._lock:
+            # The watcher gets started before the file is read for the first time,
+            # so we can not miss any change.
+            if self._watcher is None:
+                self._watcher = FileWatcher(self.filename, self._reload)
+                self._watcher.start()
+
+            state = self._state
+            if state is not None and state[1] == spread_feed:
+                return state[2]
 
-        # If the modification time has not changed since the last time we have read the file,
-        # we return the last content without opening and parsing it. It saves us around ~ 30ms.
-        #
-        # Ultimately something like `watchdog` (<https://pythonhosted.org/watchdog/index.html>)
-        # should be used to watch the filesystem changes asynchronously.
-        if self._config is not None and self._mtime is not None:
-            if mtime == self._mtime and spread_feed == self._spread_feed:
-                return self._config
+        content_file = state[0] if state is not None else self._read()
+        return self._evaluate_cached(content_file, spread_feed)
 
+    def _read(self) -> str:
         with open(self.filename) as data_file:
-            content_file = data_file.read()
-            content_config = _jsonnet.evaluate_snippet("snippet", content_file, ext_vars={},
-                                                       import_callback=self._spread_feed_import_callback(spread_feed))
-            result = json.loads(content_config)
-
-            # Report if file has been newly loaded or reloaded
-            checksum_file = zlib.crc32(content_file.encode('utf-8'))
-            checksum_config = zlib.crc32(content_config.encode('utf-8'))
-            if self._checksum_file is None:
-                self.logger.info(f"Loaded configuration from '{self.filename}'")
-                self.logger.debug(f"Config file is: " + json.dumps(result, indent=4))
-            elif self._checksum_file != checksum_file:
-                self.logger.info(f"Reloaded configuration from '{self.filename}'")
-                self.logger.debug(f"Reloaded config file is: " + json.dumps(result, indent=4))
-            elif self._checksum_config != checksum_config:
-                self.logger.debug(f"Parsed configuration from '{self.filename}'")
-                self.logger.debug(f"Parsed config file is: " + json.dumps(result, indent=4))
-
-            self._checksum_file = checksum_file
-            self._checksum_config = checksum_config
-            self._config = result
-            self._mtime = mtime
-            self._spread_feed = spread_feed
-
-            return result
+            return data_file.read()
+
+    def _reload(self):
+        state = self._state
+
+        # If the config has not been loaded successfully yet, `get_config()` will keep trying.
+        if state is None:
+            return
+
+        content_file = self._read()
+        if content_file == state[0]:
+            return
+
+        try:
+            self._evaluate_cached(content_file, state[1], reloaded=True)
+        except Exception as e:
+            self.logger.error(f"Config file '{self.filename}' is invalid ({e}). Keeping the previous configuration.")
+
+    def _evaluate_cached(self, content_file: str, spread_feed: dict, reloaded: bool = False):
+        checksum_file = zlib.crc32(content_file.encode('utf-8'))
+        spread_values = self._spread_values(spread_feed)
+        key = (checksum_file, tuple(sorted(spread_values.items())))
+
+        with self._lock:
+            if key in self._cache:
+                self.cache_hits += 1
+
+                result = self._cache[key]
+                self._swap(key, content_file, spread_feed, result, reloaded)
+
+                return result
+
+            self.cache_misses += 1
+
+        # jsonnet evaluation is the slow part, so it runs without holding the lock
+        content_config = _jsonnet.evaluate_snippet("snippet", content_file, ext_vars={},
+                                                   import_callback=self._spread_feed_import_callback(spread_values))
+        result = json.loads(content_config)
+
+        with self._lock:
+            if self._swap(key, content_file, spread_feed, result, reloaded):
+                self._report(checksum_file, content_config, result)
+
+        return result
+
+    def _swap(self, key: tuple, content_file: str, spread_feed: dict, result, reloaded: bool) -> bool:
+        # Has to be called with `self._lock` held. Returns `False` if the config file has been reloaded
+        # while `result` was being evaluated, in which case the reloaded config stays in use.
+        if reloaded:
+            # configs evaluated from the previous file are only dropped once the new one has been evaluated
+            self._cache.clear()
+        elif self._state is not None and self._state[0] != content_file:
+            return False
+
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        self._state = (content_file, dict(spread_feed), result)
+        return True
+
+    def _report(self, checksum_file: int, content_config: str, result):
+        # Report if file has been newly loaded or reloaded
+        checksum_config = zlib.crc32(content_config.encode('utf-8'))
+        if self._checksum_file is None:
+            self.logger.info(f"Loaded configuration from '{self.filename}'")
+            self.logger.debug(f"Config file is: " + json.dumps(result, indent=4))
+        elif self._checksum_file != checksum_file:
+            self.logger.info(f"Reloaded configuration from '{self.filename}'")
+            self.logger.debug(f"Reloaded config file is: " + json.dumps(result, indent=4))
+        elif self._checksum_config != checksum_config:
+            self.logger.debug(f"Parsed configuration from '{self.filename}'")
+            self.logger.debug(f"Parsed config file is: " + json.dumps(result, indent=4))
+
+        self._checksum_file = checksum_file
+        self._checksum_config = checksum_config
@@ -0,0 +1,155 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import json
+import logging
+
+import requests
+from eth_abi import encode_abi, decode_abi
+from eth_utils import decode_hex, encode_hex, function_signature_to_4byte_selector
+
+from market_maker_keeper.gas_station import RpcError
+from pymaker import Address
+from pymaker.numeric import Wad
+
+
+class JsonRpcBatch:
+    """Collects independent read-only calls and makes all of them in one JSON-RPC batch request.
+
+    Calls get added with `call()` (an `eth_call` of a contract function, identified by its signature)
+    and `eth_balance()` (an `eth_getBalance`), each of them returning the index of its result.
+    `execute()` sends them all to the node in one HTTP request (or in a few of them, not larger than
+    `max_batch_size` each) and returns the decoded results in the order the calls have been added,
+    so making ten calls costs one round-trip to the node instead of ten.
+
+    Batch requests can be sent by `HTTPProvider` and by the persistent IPC and WebSocket providers.
+    With any other provider the calls are made one by one, so the results are the same either way.
+
+    Attributes:
+        web3: `Web3` instance.
+        max_batch_size: Maximum number of calls sent in one batch request.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, web3, max_batch_size: int = 100):
+        assert(isinstance(max_batch_size, int))
+        assert(max_batch_size > 0)
+
+        self.web3 = web3
+        self.max_batch_size = max_batch_size
+
+        self._calls = []
+        self._decoders = []
+
+    def __len__(self):
+        return len(self._calls)
+
+    def call(self, address: Address, signature: str, args: list, output_types: list) -> int:
+        """Adds an `eth_call` of a contract function.
+
+        Args:
+            address: Address of the contract.
+            signature: Signature of the function, i.e. `balanceOf(address,address)`.
+            args: Arguments of the function call.
+            output_types: ABI types of the values returned by the function, i.e. `['uint256']`.
+
+        Returns:
+            Index of the result in the list returned by `execute()`. The result is the returned value
+            if the function returns one value, or a tuple of the returned values otherwise.
+        """
+        assert(isinstance(address, Address))
+        assert(isinstance(signature, str))
+        assert(isinstance(args, list))
+        assert(isinstance(output_types, list))
+
+        input_types = signature[signature.index('(') + 1:-1].split(',') if not signature.endswith('()') else []
+        data = function_signature_to_4byte_selector(signature) + encode_abi(input_types, args)
+
+        def decode(result):
+            values = decode_abi(output_types, decode_hex(result) if isinstance(result, str) else result)
+            return values[0] if len(output_types) == 1 else values
+
+        return self._add("eth_call", [{'to': address.address, 'data': encode_hex(data)}, 'latest'], decode)
+
+    def eth_balance(self, address: Address) -> int:
+        """Adds an `eth_getBalance` of an account, its result will be a `Wad`."""
+        assert(isinstance(address, Address))
+
+        return self._add("eth_getBalance", [address.address, 'latest'],
+                         lambda result: Wad(int(result, 16) if isinstance(result, str) else result))
+
+    def execute(self) -> list:
+        """Makes all the calls added so far and returns their results, in the order they have been added."""
+        calls, decoders = self._calls, self._decoders
+        self._calls, self._decoders = [], []
+
+        if len(calls) == 0:
+            return []
+
+        provider = self.web3.providers[0]
+        if hasattr(provider, 'make_batch_request') or hasattr(provider, 'endpoint_uri'):
+            results = []
+            for index in range(0, len(calls), self.max_batch_size):
+                results += self._send_batch(calls[index:index + self.max_batch_size])
+
+        else:
+            results = [self._send_one(method, params) for method, params in calls]
+
+        return [decode(result) for decode, result in zip(decoders, results)]
+
+    def _add(self, method: str, params: list, decoder) -> int:
+        self._calls.append((method, params))
+        self._decoders.append(decoder)
+        return len(self._calls) - 1
+
+    def _send_batch(self, batch: list) -> list:
+        provider = self.web3.providers[0]
+
+        # persistent providers (IPC, WebSocket) send batches over their own connection
+        if hasattr(provider, 'make_batch_request'):
+            responses = provider.make_batch_request(batch)
+
+        else:
+            request_ids = itertools.count()
+            payload = [{"jsonrpc": "2.0", "method": method, "params": params, "id": next(request_ids)}
+                       for method, params in batch]
+
+            response = requests.post(provider.endpoint_uri, data=json.dumps(payload), **provider.get_request_kwargs())
+            response.raise_for_status()
+
+            # responses in a batch can come back in any order
+            responses_by_id = {item['id']: item for item in response.json()}
+            if len(responses_by_id) != len(batch):
+                raise RpcError(f"Expected {len(batch)} responses to the batch request, got {len(responses_by_id)}")
+
+            responses = [responses_by_id[request_id] for request_id in range(len(batch))]
+
+        for item in responses:
+            if 'error' in item:
+                raise RpcError(item['error'])
+
+        self.logger.debug(f"Made {len(batch)} calls in one batch request")
+
+        return [item['result'] for item in responses]
+
+    def _send_one(self, method: str, params: list):
+        if method == "eth_call":
+            return self.web3.eth.call(params[0])
+        else:
+            return self.web3.eth.getBalance(params[0])
@@ -15,14 +15,36 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from market_maker_keeper.feed import Feed, ExpiringFeed, WebSocketFeed, EmptyFeed
+from typing import Optional
+
+from market_maker_keeper.feed import Feed, ExpiringFeed, WebSocketFeed, EmptyFeed, RecordingFeed, ReplayFeed
+from market_maker_keeper.tick_file import TickFileWriter, parse_replay_argument
+from market_maker_keeper.util import sanitize_url
 
 
 def create_spread_feed(arguments) -> Feed:
     if arguments.spread_feed:
-        web_socket_feed = WebSocketFeed(arguments.spread_feed, 5)
+        web_socket_feed = _create_feed(arguments.spread_feed, arguments.websocket_hot_standby,
+                                       arguments.websocket_stall_timeout / 1000)
         expiring_web_socket_feed = ExpiringFeed(web_socket_feed, arguments.spread_feed_expiry)
 
         return expiring_web_socket_feed
     else:
         return EmptyFeed()
+
+
+def _create_feed(feed_argument: str, hot_standby: bool, stall_timeout: Optional[float] = None) -> Feed:
+    if feed_argument.startswith("record:"):
+        # syntax: `record:<file>:<feed>`, i.e. `record:spread.ticks:wss://...`
+        path, recorded_feed_argument = feed_argument[7:].split(":", 1)
+        return RecordingFeed(_create_feed(recorded_feed_argument, hot_standby, stall_timeout),
+                             writer=TickFileWriter.shared(path),
+                             source=sanitize_url(recorded_feed_argument))
+
+    elif feed_argument.startswith("replay:"):
+        # syntax: `replay:<file>[:<source>[:<speed>]]`, where `<speed>` can be either a multiplier or `max`
+        path, source, speed = parse_replay_argument(feed_argument[7:])
+        return ReplayFeed(path=path, source=source, speed=speed)
+
+    else:
+        return WebSocketFeed(feed_argument, 5, hot_standby=hot_standby, stall_timeout=stall_timeout)
@@ -0,0 +1,210 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+import websocket
+
+
+class Backoff:
+    """Jittered exponential backoff.
+
+    Each consecutive delay is twice as long as the previous one, up to `maximum`. The actual delay
+    is picked randomly from the upper half of the current range, so many connections dropped
+    at the same moment do not reconnect in lockstep.
+
+    Attributes:
+        initial: First delay (in seconds).
+        maximum: Maximum delay (in seconds).
+    """
+
+    def __init__(self, initial: float, maximum: float):
+        assert(isinstance(initial, float))
+        assert(isinstance(maximum, float))
+        assert(0 < initial <= maximum)
+
+        self.initial = initial
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        delay = min(self.initial * (2 ** self.attempts), self.maximum)
+        self.attempts += 1
+
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class SupervisedWebSocket:
+    """Supervised WebSocket connection, optionally backed by hot-standby connections.
+
+    Maintains `connections` parallel connections to the same endpoint, all of them subscribed
+    in the same way (`on_open_function` gets called for each of them). Messages are parsed and passed
+    to `on_message_function`, but each message is delivered only once. Which message is a duplicate
+    is decided by `key_function`, which should return a monotonically increasing key of a message
+    (its sequence number or its timestamp). Messages for which it returns `None` (i.e. heartbeats)
+    are always delivered. Messages with a key not greater than the key of the last delivered
+    message are dropped, so whichever connection delivers a message first wins. With only one
+    connection there is nothing to de-duplicate, so all messages get delivered.
+
+    If `stall_timeout` is set, each connection which has not received any message for that long
+    is considered stalled and gets closed, and as the other connections are already subscribed
+    the feed carries on without interruption. Closed connections reconnect using a jittered
+    exponential backoff.
+
+    Attributes:
+        name: Name of the feed, used in log messages.
+        url: WebSocket URL to connect to.
+        connections: Number of parallel connections to maintain.
+        stall_timeout: Time (in seconds) without any message after which a connection is considered
+            stalled, `None` disables stall detection.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self,
+                 name: str,
+                 url: str,
+                 on_open_function,
+                 on_message_function,
+                 key_function=None,
+                 header: Optional[list] = None,
+                 connections: int = 1,
+                 stall_timeout: Optional[float] = None,
+                 initial_reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 30.0):
+        assert(isinstance(name, str))
+        assert(isinstance(url, str))
+        assert(callable(on_open_function))
+        assert(callable(on_message_function))
+        assert(callable(key_function) or key_function is None)
+        assert(isinstance(header, list) or header is None)
+        assert(isinstance(connections, int))
+        assert(connections >= 1)
+        assert(isinstance(stall_timeout, float) or stall_timeout is None)
+
+        self.name = name
+        self.url = url
+        self.connections = connections
+        self.stall_timeout = stall_timeout
+        self.on_open_function = on_open_function
+        self.on_message_function = on_message_function
+        self.key_function = key_function
+        self.header = header
+        self.initial_reconnect_delay = initial_reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._lock = threading.Lock()
+        self._last_key = None
+        self._active_connection = None
+        self._websockets = [None] * connections
+        self._last_message = [0.0] * connections
+
+    def start(self):
+        for index in range(self.connections):
+            threading.Thread(target=self._background_run, args=(index,), daemon=True).start()
+
+        if self.stall_timeout is not None:
+            threading.Thread(target=self._background_watchdog, daemon=True).start()
+
+    def _connection_name(self, index: int) -> str:
+        return f"{self.name} (connection #{index})" if self.connections > 1 else self.name
+
+    def _background_run(self, index: int):
+        backoff = Backoff(self.initial_reconnect_delay, self.max_reconnect_delay)
+
+        while True:
+            ws = websocket.WebSocketApp(url=self.url,
+                                        header=self.header,
+                                        on_message=lambda ws, message: self._on_message(index, backoff, message),
+                                        on_error=lambda ws, error: self._on_error(index, error),
+                                        on_open=lambda ws: self._on_open(index, ws),
+                                        on_close=lambda ws: self._on_close(index))
+
+            with self._lock:
+                self._websockets[index] = ws
+                self._last_message[index] = time.time()
+
+            ws.run_forever(ping_interval=15, ping_timeout=10)
+
+            with self._lock:
+                self._websockets[index] = None
+
+            delay = backoff.next_delay()
+            self.logger.debug(f"WebSocket {self._connection_name(index)} reconnecting in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _background_watchdog(self):
+        while True:
+            time.sleep(self.stall_timeout / 4)
+
+            with self._lock:
+                stalled = [(index, ws) for index, ws in enumerate(self._websockets)
+                           if ws is not None and time.time() - self._last_message[index] > self.stall_timeout]
+
+            for index, ws in stalled:
+                self.logger.warning(f"WebSocket {self._connection_name(index)} stalled, no messages"
+                                    f" for {self.stall_timeout}s. Reconnecting.")
+                ws.close()
+
+    def _on_open(self, index: int, ws):
+        self.logger.info(f"WebSocket {self._connection_name(index)} connected")
+        self.on_open_function(ws)
+
+    def _on_close(self, index: int):
+        self.logger.info(f"WebSocket {self._connection_name(index)} disconnected")
+
+    def _on_error(self, index: int, error):
+        self.logger.info(f"WebSocket {self._connection_name(index)} error: '{error}'")
+
+    def _on_message(self, index: int, backoff: Backoff, message: str):
+        try:
+            message_obj = json.loads(message)
+        except:
+            self.logger.warning(f"WebSocket {self._connection_name(index)} received invalid message: '{message}'")
+            return
+
+        backoff.reset()
+
+        try:
+            key = self.key_function(message_obj) if self.key_function is not None else None
+        except:
+            key = None
+
+        with self._lock:
+            self._last_message[index] = time.time()
+
+            if key is not None and self.connections > 1:
+                if self._last_key is not None and key <= self._last_key:
+                    return
+
+                self._last_key = key
+
+            if self._active_connection != index:
+                if self._active_connection is not None:
+                    self.logger.info(f"WebSocket {self.name} failed over to connection #{index}")
+
+                self._active_connection = index
+
+        self.on_message_function(message_obj)
@@ -0,0 +1,344 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Optional, Dict, List, Iterator
+
+
+class Tick:
+    """Single price feed update read from a tick file.
+
+    Attributes:
+        timestamp: Time of the update (as returned by `time.time()` when it was recorded).
+        source: Name of the feed the update comes from.
+        buy_price: Raw `Wad` value of the buy price, or `None` if not available. Only for price feeds.
+        sell_price: Raw `Wad` value of the sell price, or `None` if not available. Only for price feeds.
+        data: Data dictionary. Only for generic (i.e. spread) feeds.
+    """
+
+    def __init__(self, timestamp: float, source: str,
+                 buy_price: Optional[int] = None, sell_price: Optional[int] = None, data: Optional[dict] = None):
+        self.timestamp = timestamp
+        self.source = source
+        self.buy_price = buy_price
+        self.sell_price = sell_price
+        self.data = data
+
+    def __eq__(self, other):
+        assert(isinstance(other, Tick))
+        return self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return f"Tick({self.__dict__})"
+
+
+class TickFile:
+    """Append-only binary file holding recorded price feed updates.
+
+    The file starts with an 8-byte magic header, followed by fixed-size 80-byte records, so it can be
+    memory-mapped and scanned without any parsing state. Each record holds a timestamp, a source id,
+    flags and a 64-byte payload. The lowest four bits of the flags denote the record kind:
+    * `SOURCE` - defines the name of a source id, the payload holds the UTF-8 encoded name,
+    * `PRICE` - price feed update, the payload holds the buy and the sell price as raw `Wad` values
+                (256-bit big-endian unsigned integers), `HAS_BUY` and `HAS_SELL` flags tell
+                whether each of them is available,
+    * `DATA` - generic feed update, the payload holds a chunk of the JSON-encoded data dictionary,
+               chunks of the same update are written in consecutive records, all but the last one
+               having the `CONTINUED` flag set.
+
+    Attributes:
+        path: Path of the tick file.
+    """
+
+    MAGIC = b'MMKTICK1'
+    RECORD = struct.Struct('<dHB5x64s')
+    PAYLOAD_SIZE = 64
+
+    SOURCE = 0
+    PRICE = 1
+    DATA = 2
+
+    KIND_MASK = 0x0f
+    HAS_BUY = 0x10
+    HAS_SELL = 0x20
+    CONTINUED = 0x40
+
+    def __init__(self, path: str):
+        assert(isinstance(path, str))
+
+        self.path = path
+
+
+class TickFileWriter(TickFile):
+    """Appends records to a tick file, creating it if it does not exist yet.
+
+    If the file already exists, source ids defined in it are reused. If the last record of the file
+    has been written only partially (i.e. the previous writer crashed), it gets truncated.
+    Each update is appended with a single `write` system call.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        super().__init__(path)
+
+        self._lock = threading.Lock()
+        self._sources = {}
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            reader = TickFileReader(path)
+            self._sources = {name: source_id for source_id, name in reader.sources().items()}
+            os.truncate(path, len(self.MAGIC) + reader.record_count() * self.RECORD.size)
+
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, self.MAGIC)
+
+    @staticmethod
+    def shared(path: str) -> 'TickFileWriter':
+        """Returns a writer for `path` shared by all feeds of this process recording to the same file."""
+        assert(isinstance(path, str))
+
+        with TickFileWriter._shared_lock:
+            key = os.path.realpath(path)
+            if key not in TickFileWriter._shared:
+                TickFileWriter._shared[key] = TickFileWriter(path)
+
+            return TickFileWriter._shared[key]
+
+    def _source_id(self, source: str, timestamp: float) -> (int, bytes):
+        if source in self._sources:
+            return self._sources[source], b''
+
+        encoded_name = source.encode('utf-8')
+        if len(encoded_name) > self.PAYLOAD_SIZE:
+            raise Exception(f"Source name '{source}' too long")
+
+        source_id = len(self._sources)
+        self._sources[source] = source_id
+
+        return source_id, self.RECORD.pack(timestamp, source_id, self.SOURCE, encoded_name)
+
+    def write_price(self, source: str, buy_price: Optional[int], sell_price: Optional[int], timestamp: float):
+        """Appends a price feed update.
+
+        Args:
+            source: Name of the price feed.
+            buy_price: Raw `Wad` value of the buy price, or `None` if not available.
+            sell_price: Raw `Wad` value of the sell price, or `None` if not available.
+            timestamp: Time of the update (as returned by `time.time()`).
+        """
+        assert(isinstance(source, str))
+        assert(isinstance(buy_price, int) or buy_price is None)
+        assert(isinstance(sell_price, int) or sell_price is None)
+        assert(isinstance(timestamp, float))
+
+        flags = self.PRICE \
+                | (self.HAS_BUY if buy_price is not None else 0) \
+                | (self.HAS_SELL if sell_price is not None else 0)
+        payload = (buy_price or 0).to_bytes(32, 'big') + (sell_price or 0).to_bytes(32, 'big')
+
+        with self._lock:
+            source_id, definition = self._source_id(source, timestamp)
+            os.write(self._fd, definition + self.RECORD.pack(timestamp, source_id, flags, payload))
+
+    def write_data(self, source: str, data: dict, timestamp: float):
+        """Appends a generic feed update.
+
+        Args:
+            source: Name of the feed.
+            data: Data dictionary, has to be serializable to JSON.
+            timestamp: Time of the update (as returned by `time.time()`).
+        """
+        assert(isinstance(source, str))
+        assert(isinstance(data, dict))
+        assert(isinstance(timestamp, float))
+
+        encoded_data = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        chunks = [encoded_data[index:index + self.PAYLOAD_SIZE]
+                  for index in range(0, len(encoded_data), self.PAYLOAD_SIZE)]
+
+        with self._lock:
+            source_id, definition = self._source_id(source, timestamp)
+            records = [self.RECORD.pack(timestamp, source_id,
+                                        self.DATA | (self.CONTINUED if index < len(chunks) - 1 else 0),
+                                        chunk) for index, chunk in enumerate(chunks)]
+            os.write(self._fd, definition + b''.join(records))
+
+
+class TickFileReader(TickFile):
+    """Reads records from a tick file by memory-mapping it."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+
+        with open(path, "rb") as file:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                raise Exception(f"'{path}' is not a tick file")
+
+            size = os.fstat(file.fileno()).st_size
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size > len(self.MAGIC) else b''
+            self._size = size
+
+    def record_count(self) -> int:
+        return (self._size - len(self.MAGIC)) // self.RECORD.size
+
+    def _records(self):
+        end = len(self.MAGIC) + self.record_count() * self.RECORD.size
+        return self.RECORD.iter_unpack(memoryview(self._mmap)[len(self.MAGIC):end])
+
+    def sources(self) -> Dict[int, str]:
+        """Returns names of all sources defined in the file, keyed by their ids."""
+        return {source_id: payload.rstrip(b'\0').decode('utf-8')
+                for _, source_id, flags, payload in self._records()
+                if flags & self.KIND_MASK == self.SOURCE}
+
+    def ticks(self, source: Optional[str] = None) -> Iterator[Tick]:
+        """Iterates over all updates recorded in the file, in the order they were recorded.
+
+        Args:
+            source: Name of the source to return the updates of, `None` returns updates of all sources.
+        """
+        assert(isinstance(source, str) or source is None)
+
+        sources = {}
+        pending_data = {}
+
+        for timestamp, source_id, flags, payload in self._records():
+            kind = flags & self.KIND_MASK
+
+            if kind == self.SOURCE:
+                sources[source_id] = payload.rstrip(b'\0').decode('utf-8')
+                continue
+
+            source_name = sources.get(source_id)
+            if source is not None and source_name != source:
+                continue
+
+            if kind == self.PRICE:
+                yield Tick(timestamp=timestamp,
+                           source=source_name,
+                           buy_price=int.from_bytes(payload[:32], 'big') if flags & self.HAS_BUY else None,
+                           sell_price=int.from_bytes(payload[32:], 'big') if flags & self.HAS_SELL else None)
+
+            elif kind == self.DATA:
+                pending_data[source_id] = pending_data.get(source_id, b'') + payload.rstrip(b'\0')
+                if not flags & self.CONTINUED:
+                    yield Tick(timestamp=timestamp,
+                               source=source_name,
+                               data=json.loads(pending_data.pop(source_id).decode('utf-8')))
+
+
+class TickReplay:
+    """Plays back ticks against a clock.
+
+    With `speed` set, a virtual clock starts at the timestamp of the first tick and advances `speed` times
+    faster than `clock`, and `current()` returns the most recent tick due by the virtual clock. With `speed`
+    set to `None` the ticks are replayed as fast as possible, i.e. each call to `current()` advances
+    to the next tick.
+
+    Attributes:
+        ticks: Ticks to replay, in chronological order.
+        speed: Replay speed (`1.0` being real-time), or `None` to replay as fast as possible.
+        clock: Function returning the current time, `time.time` by default.
+    """
+
+    def __init__(self, ticks: List[Tick], speed: Optional[float], clock=time.time):
+        assert(isinstance(ticks, list))
+        assert(isinstance(speed, float) or speed is None)
+        assert(callable(clock))
+
+        self.ticks = ticks
+        self.speed = speed
+        self.clock = clock
+
+        self._index = -1
+        self._started_at = clock()
+
+    @property
+    def finished(self) -> bool:
+        """Tells whether the last tick has already been returned by `current()`."""
+        return self._index == len(self.ticks) - 1
+
+    def virtual_time(self) -> float:
+        if len(self.ticks) == 0:
+            return self.clock()
+
+        if self.speed is None:
+            return self.ticks[max(self._index, 0)].timestamp
+
+        return self.ticks[0].timestamp + (self.clock() - self._started_at) * self.speed
+
+    def current(self) -> Optional[Tick]:
+        """Returns the most recent tick due, or `None` if none is due yet."""
+        if self.speed is None:
+            self._index = min(self._index + 1, len(self.ticks) - 1)
+
+        else:
+            virtual_time = self.virtual_time()
+            while self._index + 1 < len(self.ticks) and self.ticks[self._index + 1].timestamp <= virtual_time:
+                self._index += 1
+
+        return self.ticks[self._index] if self._index >= 0 else None
+
+    def age(self, tick: Tick) -> float:
+        """Returns how long ago (in `clock` time, not in virtual time) the tick has become due."""
+        assert(isinstance(tick, Tick))
+
+        if self.speed is None:
+            return 0.0
+
+        return max(self.virtual_time() - tick.timestamp, 0.0) / self.speed
+
+
+def parse_replay_argument(argument: str) -> (str, Optional[str], Optional[float]):
+    """Parses the `<file>[:<source>[:<speed>]]` replay feed syntax.
+
+    `<speed>` can be either a multiplier (`1` by default) or `max`, standing for replaying as fast
+    as possible. `<source>` can contain colons itself (i.e. if it is an URL), but then `<speed>`
+    has to be specified explicitly, as otherwise a port number would be taken for it.
+
+    Returns:
+        A `(path, source, speed)` tuple, with `source` being `None` if not specified
+        and `speed` being `None` for `max`.
+    """
+    assert(isinstance(argument, str))
+
+    path, _, rest = argument.partition(":")
+    parameters = rest.split(":") if rest != '' else []
+    speed = 1.0
+
+    if len(parameters) > 1:
+        if parameters[-1] == 'max':
+            speed = None
+            parameters.pop()
+        else:
+            try:
+                speed = float(parameters[-1])
+                parameters.pop()
+            except ValueError:
+                pass
+
+    source = ":".join(parameters)
+    return path, source if source != '' else None, speed
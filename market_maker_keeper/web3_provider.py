@@ -0,0 +1,472 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import codecs
+import json
+import logging
+import socket
+import threading
+import time
+from collections import deque
+
+import websocket
+from eth_utils import force_obj_to_text
+from web3 import HTTPProvider
+from web3.providers.base import JSONBaseProvider
+
+from market_maker_keeper.supervised_websocket import Backoff
+
+
+def create_provider(arguments):
+    """Creates the `Web3` provider for the `--rpc-*` keeper arguments.
+
+    `--rpc-ipc-path` and `--rpc-ws-url` select a persistent IPC or WebSocket connection,
+    otherwise each call is a separate HTTP request to `--rpc-host`:`--rpc-port`.
+    """
+    rpc_ipc_path = getattr(arguments, 'rpc_ipc_path', None)
+    rpc_ws_url = getattr(arguments, 'rpc_ws_url', None)
+
+    if rpc_ipc_path is not None and rpc_ws_url is not None:
+        raise Exception("Only one of `--rpc-ipc-path` and `--rpc-ws-url` can be used at a time")
+
+    if rpc_ipc_path is not None:
+        return IpcProvider(rpc_ipc_path, timeout=float(arguments.rpc_timeout))
+
+    elif rpc_ws_url is not None:
+        return WebSocketProvider(rpc_ws_url, timeout=float(arguments.rpc_timeout))
+
+    else:
+        return HTTPProvider(endpoint_uri=f"http://{arguments.rpc_host}:{arguments.rpc_port}",
+                            request_kwargs={"timeout": arguments.rpc_timeout})
+
+
+def create_block_watcher(web3, function):
+    """Creates a `NewBlockWatcher` calling `function` for every new block, if the `web3` provider
+    can deliver `newHeads` notifications. Returns `None` otherwise."""
+    provider = web3.providers[0]
+    return NewBlockWatcher(provider, function) if isinstance(provider, PersistentProvider) else None
+
+
+class _PendingRequest:
+    def __init__(self, request_ids: list):
+        self.request_ids = request_ids
+        self.responses = {}
+        self.error = None
+        self.event = threading.Event()
+
+    def respond(self, response: dict):
+        self.responses[response['id']] = response
+        if len(self.responses) == len(self.request_ids):
+            self.event.set()
+
+    def fail(self, error: Exception):
+        self.error = error
+        self.event.set()
+
+
+class PersistentProvider(JSONBaseProvider):
+    """JSON-RPC provider keeping one persistent connection to the node.
+
+    Unlike with `HTTPProvider`, calls do not pay for a new connection each time, and the node can
+    push notifications of subscriptions (i.e. `newHeads`) through the same connection. All messages
+    are read by a background thread, which matches responses to the requests waiting for them
+    and passes notifications to the subscription callbacks.
+
+    If the connection drops, requests waiting for responses fail straight away. The provider reconnects
+    using a jittered exponential backoff and creates all the subscriptions again. As a half-open
+    connection would never report being dropped, the node gets pinged (with `net_version`) if nothing
+    has been received for half of `stall_timeout`, and the connection is considered stalled and gets
+    closed if nothing has been received for the whole `stall_timeout`.
+
+    Attributes:
+        timeout: Time (in seconds) to wait for a response.
+        stall_timeout: Time (in seconds) without any message after which the connection is considered stalled.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, timeout: float = 10.0, stall_timeout: float = 60.0):
+        assert(isinstance(timeout, float))
+        assert(isinstance(stall_timeout, float))
+
+        super().__init__()
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._pending = {}
+        self._subscriptions = []
+        self._subscription_requests = {}
+        self._subscription_callbacks = {}
+
+    def make_request(self, method, params):
+        request = {"jsonrpc": "2.0", "method": method, "params": params or [], "id": next(self.request_counter)}
+        return self._request([request], json.dumps(force_obj_to_text(request)))[0]
+
+    def make_batch_request(self, calls: list) -> list:
+        """Sends `(method, params)` calls in one JSON-RPC batch request, returns the responses in the same order."""
+        assert(isinstance(calls, list))
+
+        requests = [{"jsonrpc": "2.0", "method": method, "params": params or [], "id": next(self.request_counter)}
+                    for method, params in calls]
+        return self._request(requests, json.dumps(force_obj_to_text(requests)))
+
+    def subscribe(self, params: list, callback):
+        """Subscribes to notifications (i.e. `['newHeads']`), calling `callback` with each of them.
+
+        The subscription gets created again every time the provider reconnects. Callbacks are called
+        from the thread reading the connection, so they should return quickly.
+        """
+        assert(isinstance(params, list))
+        assert(callable(callback))
+
+        self._start()
+
+        with self._lock:
+            self._subscriptions.append((params, callback))
+            if self._connected.is_set():
+                self._send_subscribe(params, callback)
+
+    def stop(self):
+        self._stopped = True
+        self._disconnect()
+
+    def _connect(self):
+        raise NotImplementedError()
+
+    def _disconnect(self):
+        raise NotImplementedError()
+
+    def _send(self, data: str):
+        raise NotImplementedError()
+
+    def _receive(self) -> list:
+        """Waits for messages from the node and returns them, raises an exception if the connection has been closed.
+
+        Reads time out after half of `stall_timeout`, in which case an empty list is returned.
+        """
+        raise NotImplementedError()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _request(self, requests: list, data: str) -> list:
+        self._start()
+
+        if not self._connected.wait(self.timeout):
+            raise ConnectionError(f"Not connected to {self}")
+
+        pending_request = _PendingRequest([request['id'] for request in requests])
+        with self._lock:
+            for request_id in pending_request.request_ids:
+                self._pending[request_id] = pending_request
+
+        try:
+            with self._send_lock:
+                self._send(data)
+
+            if not pending_request.event.wait(self.timeout):
+                raise TimeoutError(f"No response from {self} in {self.timeout}s")
+
+            if pending_request.error is not None:
+                raise pending_request.error
+
+            return [pending_request.responses[request_id] for request_id in pending_request.request_ids]
+
+        finally:
+            with self._lock:
+                for request_id in pending_request.request_ids:
+                    self._pending.pop(request_id, None)
+
+    def _send_subscribe(self, params: list, callback):
+        request_id = next(self.request_counter)
+        self._subscription_requests[request_id] = callback
+
+        with self._send_lock:
+            self._send(json.dumps({"jsonrpc": "2.0", "method": "eth_subscribe", "params": params, "id": request_id}))
+
+    def _run(self):
+        backoff = Backoff(1.0, 30.0)
+
+        while not self._stopped:
+            try:
+                self._connect()
+                self.logger.info(f"Connected to {self}")
+                backoff.reset()
+
+                with self._lock:
+                    self._connected.set()
+                    for params, callback in self._subscriptions:
+                        self._send_subscribe(params, callback)
+
+                last_received = time.time()
+                while True:
+                    messages = self._receive()
+                    if len(messages) > 0:
+                        last_received = time.time()
+                        for message in messages:
+                            self._dispatch(message)
+
+                    elif time.time() - last_received >= self.stall_timeout:
+                        raise ConnectionError(f"Connection stalled, no messages for {self.stall_timeout}s")
+
+                    else:
+                        self._ping()
+
+            except Exception as e:
+                if not self._stopped:
+                    self.logger.warning(f"Connection to {self} lost ({e})")
+
+            with self._lock:
+                self._connected.clear()
+                self._subscription_requests = {}
+                self._subscription_callbacks = {}
+
+                for pending_request in set(self._pending.values()):
+                    pending_request.fail(ConnectionError(f"Connection to {self} lost"))
+
+            try:
+                self._disconnect()
+            except:
+                pass
+
+            if not self._stopped:
+                time.sleep(backoff.next_delay())
+
+    def _ping(self):
+        # the response does not match any pending request, it only proves the connection is alive
+        with self._send_lock:
+            self._send(json.dumps({"jsonrpc": "2.0", "method": "net_version", "params": [], "id": next(self.request_counter)}))
+
+    def _dispatch(self, message):
+        # responses to batch requests come as one array
+        if isinstance(message, list):
+            for item in message:
+                self._dispatch(item)
+            return
+
+        if message.get('method') == 'eth_subscription':
+            with self._lock:
+                callback = self._subscription_callbacks.get(message['params']['subscription'])
+
+            if callback is not None:
+                try:
+                    callback(message['params']['result'])
+                except:
+                    self.logger.exception("Subscription callback failed")
+
+            return
+
+        with self._lock:
+            pending_request = self._pending.get(message.get('id'))
+            subscription_callback = self._subscription_requests.pop(message.get('id'), None)
+
+            if subscription_callback is not None:
+                if 'result' in message:
+                    self._subscription_callbacks[message['result']] = subscription_callback
+                else:
+                    self.logger.warning(f"Failed to subscribe on {self} ({message.get('error')})")
+
+        if pending_request is not None:
+            pending_request.respond(message)
+
+
+class WebSocketProvider(PersistentProvider):
+    """`PersistentProvider` connected to the node over WebSocket, i.e. `ws://localhost:8546`."""
+
+    def __init__(self, endpoint_uri: str, timeout: float = 10.0, stall_timeout: float = 60.0):
+        assert(isinstance(endpoint_uri, str))
+
+        super().__init__(timeout, stall_timeout)
+        self.endpoint_uri = endpoint_uri
+        self._ws = None
+
+    def __str__(self):
+        return f"WebSocket connection {self.endpoint_uri}"
+
+    def _connect(self):
+        self._ws = websocket.create_connection(self.endpoint_uri, timeout=self.timeout)
+        self._ws.settimeout(self.stall_timeout / 2)
+
+    def _disconnect(self):
+        if self._ws is not None:
+            self._ws.close()
+
+    def _send(self, data: str):
+        self._ws.send(data)
+
+    def _receive(self) -> list:
+        try:
+            message = self._ws.recv()
+        except websocket.WebSocketTimeoutException:
+            return []
+
+        if not message:
+            raise ConnectionError("Connection closed")
+
+        return [json.loads(message)]
+
+
+class IpcProvider(PersistentProvider):
+    """`PersistentProvider` connected to the node over its IPC socket, i.e. `~/.ethereum/geth.ipc`."""
+
+    def __init__(self, ipc_path: str, timeout: float = 10.0, stall_timeout: float = 60.0):
+        assert(isinstance(ipc_path, str))
+
+        super().__init__(timeout, stall_timeout)
+        self.ipc_path = ipc_path
+        self._socket = None
+        self._buffer = ""
+        self._decoder = None
+
+    def __str__(self):
+        return f"IPC connection {self.ipc_path}"
+
+    def _connect(self):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        self._socket.connect(self.ipc_path)
+        self._socket.settimeout(self.stall_timeout / 2)
+        self._buffer = ""
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+
+    def _send(self, data: str):
+        self._socket.sendall(data.encode('utf-8'))
+
+    def _receive(self) -> list:
+        # messages are sent one after another with no framing, so they get cut out
+        # of the stream by decoding as many complete JSON values as possible
+        messages = []
+        while len(messages) == 0:
+            try:
+                chunk = self._socket.recv(65536)
+            except socket.timeout:
+                return []
+
+            if not chunk:
+                raise ConnectionError("Connection closed")
+
+            self._buffer += self._decoder.decode(chunk)
+
+            while True:
+                self._buffer = self._buffer.lstrip()
+                if len(self._buffer) == 0:
+                    break
+
+                try:
+                    message, end = json.JSONDecoder().raw_decode(self._buffer)
+                except json.JSONDecodeError:
+                    break
+
+                messages.append(message)
+                self._buffer = self._buffer[end:]
+
+        return messages
+
+
+class NewBlockWatcher:
+    """Calls a function for every new block, the moment the node announces it with a `newHeads` subscription.
+
+    Block-driven keepers can react to new blocks as soon as they arrive, instead of waiting for the next
+    poll of a block filter. If new blocks arrive while the function is still running, it gets called
+    only once afterwards, for the latest of them. For each block the latency between the block header
+    arriving and the function finishing gets measured, `latency_statistics()` summarizes the recent ones.
+
+    Attributes:
+        provider: `PersistentProvider` to subscribe with.
+        function: Function to call for every new block.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, provider: PersistentProvider, function):
+        assert(isinstance(provider, PersistentProvider))
+        assert(callable(function))
+
+        self.provider = provider
+        self.function = function
+        self.latencies = deque(maxlen=1000)
+
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._head = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.provider.subscribe(['newHeads'], self._on_new_head)
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stopped = True
+        self._event.set()
+        self._thread.join()
+        self._thread = None
+
+        self.logger.info(f"Block-to-action latency: {self.latency_statistics()}")
+
+    def latency_statistics(self) -> dict:
+        """Returns the number of recent blocks handled and their mean and maximum latency (in seconds)."""
+        latencies = list(self.latencies)
+        return {'blocks': len(latencies),
+                'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'max': round(max(latencies), 3) if latencies else None}
+
+    def _on_new_head(self, head: dict):
+        with self._lock:
+            self._head = (int(head['number'], 16), int(head['timestamp'], 16), time.time())
+
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+
+            if self._stopped:
+                return
+
+            with self._lock:
+                block_number, block_timestamp, received = self._head
+
+            started = time.time()
+            try:
+                self.function()
+            except:
+                self.logger.exception(f"Failed to process block #{block_number}")
+
+            finished = time.time()
+            self.latencies.append(finished - received)
+
+            self.logger.debug(f"Processed block #{block_number} {finished - received:.3f}s after its header"
+                              f" has arrived (waited {started - received:.3f}s, header arrived"
+                              f" {received - block_timestamp:.1f}s after the block timestamp)")
@@ -0,0 +1,223 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import threading
+import time
+
+from eth_utils import decode_hex, encode_hex, keccak
+
+from pymaker import Address, Transact
+from pymaker.numeric import Wad
+from pymaker.zrx import ZrxExchange
+
+
+class LocalZrxExchange(ZrxExchange):
+    """`ZrxExchange` which does order hashing and signing without calling the exchange contract.
+
+    Order hashes get calculated locally, the same way `getOrderHash` of the 0x exchange contract
+    does. Orders get signed with `eth_sign`, which does not leave the process if the account key has
+    been registered with `--eth-key`. Unavailable amounts of orders can also be served from memory:
+    the ones set with `set_unavailable_amounts()` (i.e. read in one batch request) and zero for orders
+    we have just placed, so building an `Order` for them does not need an `eth_call` for each.
+
+    Many orders can also be cancelled in one transaction, see `cancel_orders()`.
+    """
+
+    def __init__(self, web3, address: Address):
+        super().__init__(web3=web3, address=address)
+
+        self._lock = threading.Lock()
+        self._unavailable_amounts = {}
+
+    def get_order_hash(self, order) -> str:
+        # tightly packed, like `keccak256(...)` with many arguments in Solidity
+        addresses = [self.address, order.maker, order.taker, order.pay_token, order.buy_token, order.fee_recipient]
+        values = [order.pay_amount.value, order.buy_amount.value, order.maker_fee.value, order.taker_fee.value,
+                  order.expiration, order.salt]
+
+        data = b''.join(decode_hex(address.address) for address in addresses) + \
+               b''.join(value.to_bytes(32, 'big') for value in values)
+
+        return encode_hex(keccak(data))
+
+    def sign_order(self, order):
+        signature = decode_hex(self.web3.manager.request_blocking("eth_sign", [self.web3.eth.defaultAccount,
+                                                                               self.get_order_hash(order)]))
+
+        signed_order = copy.copy(order)
+        signed_order.ec_signature_r = encode_hex(signature[0:32])
+        signed_order.ec_signature_s = encode_hex(signature[32:64])
+        signed_order.ec_signature_v = signature[64] if signature[64] >= 27 else signature[64] + 27
+        return signed_order
+
+    def cancel_orders(self, orders: list) -> Transact:
+        """Cancels the whole remaining amounts of all `orders` in one `batchCancelOrders` transaction.
+
+        Args:
+            orders: Orders to cancel.
+
+        Returns:
+            A :py:class:`pymaker.Transact` instance, which can be used to trigger the transaction.
+        """
+        assert(isinstance(orders, list))
+        assert(len(orders) > 0)
+
+        order_addresses = [[order.maker.address, order.taker.address, order.pay_token.address,
+                            order.buy_token.address, order.fee_recipient.address] for order in orders]
+        order_values = [[order.pay_amount.value, order.buy_amount.value, order.maker_fee.value,
+                         order.taker_fee.value, order.expiration, order.salt] for order in orders]
+        cancel_amounts = [order.buy_amount.value for order in orders]
+
+        return Transact(self, self.web3, self.abi, self.address, self._contract, 'batchCancelOrders',
+                        [order_addresses, order_values, cancel_amounts])
+
+    def get_unavailable_buy_amount(self, order) -> Wad:
+        order_hash = self.get_order_hash(order)
+
+        with self._lock:
+            if order_hash in self._unavailable_amounts:
+                return self._unavailable_amounts[order_hash]
+
+        return super().get_unavailable_buy_amount(order)
+
+    def set_unavailable_amounts(self, unavailable_amounts: dict):
+        """Replaces the unavailable amounts served from memory, keyed by the order hash."""
+        assert(isinstance(unavailable_amounts, dict))
+
+        with self._lock:
+            self._unavailable_amounts = dict(unavailable_amounts)
+
+    def order_placed(self, order):
+        """Records that nothing of a just placed order can have been filled or cancelled yet."""
+        with self._lock:
+            self._unavailable_amounts[self.get_order_hash(order)] = Wad(0)
+
+
+class RelayerFeeCache:
+    """Caches fees returned by the relayer, so they do not have to be requested for each order placed.
+
+    Fees get requested for the first order placed for each token pair and then again at most every
+    `ttl` seconds. Only zero fees get reused, as non-zero ones can depend on the amounts of the order,
+    so orders placed with a relayer charging fees still get their fees calculated by the relayer.
+
+    Attributes:
+        relayer_api: `ZrxRelayerApi` to calculate the fees with.
+        ttl: Time (in seconds) for which fees returned by the relayer get reused.
+    """
+
+    def __init__(self, relayer_api, ttl: int = 600, clock=time.time):
+        assert(isinstance(ttl, int))
+
+        self.relayer_api = relayer_api
+        self.ttl = ttl
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._fee_recipients = {}
+
+    def calculate_fees(self, order):
+        key = (order.pay_token, order.buy_token)
+
+        with self._lock:
+            cached = self._fee_recipients.get(key)
+
+        if cached is not None and self.clock() - cached[1] < self.ttl:
+            order_with_fees = copy.copy(order)
+            order_with_fees.fee_recipient = cached[0]
+            order_with_fees.maker_fee = Wad(0)
+            order_with_fees.taker_fee = Wad(0)
+            return order_with_fees
+
+        order_with_fees = self.relayer_api.calculate_fees(order)
+
+        with self._lock:
+            if order_with_fees.maker_fee == Wad(0) and order_with_fees.taker_fee == Wad(0):
+                self._fee_recipients[key] = (order_with_fees.fee_recipient, self.clock())
+            else:
+                self._fee_recipients.pop(key, None)
+
+        return order_with_fees
+
+
+class PresignedOrders:
+    """Orders signed ahead of time, so placing them only takes submitting them to the relayer.
+
+    Orders are kept under `(is_sell, price, amount, expiration)` keys. Expirations get rounded up
+    to a multiple of `expiration_step` seconds (see `expiration()`), so an order signed now can still
+    be placed if the keeper decides to place the very same order a bit later. Orders of expirations
+    which have already passed get discarded by `remove_expired()`.
+
+    Attributes:
+        expiration_step: Step (in seconds) to round order expirations up to.
+    """
+
+    def __init__(self, expiration_step: int = 60, clock=time.time):
+        assert(isinstance(expiration_step, int))
+        assert(expiration_step > 0)
+
+        self.expiration_step = expiration_step
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._orders = {}
+
+    def expiration(self, order_expiry: int) -> int:
+        """Returns the expiration of orders placed now, which will be valid for at least `order_expiry` seconds."""
+        assert(isinstance(order_expiry, int))
+
+        return -(-(int(self.clock()) + order_expiry) // self.expiration_step) * self.expiration_step
+
+    @staticmethod
+    def key(is_sell: bool, price: Wad, amount: Wad, expiration: int) -> tuple:
+        return is_sell, price.value, amount.value, expiration
+
+    def reserve(self, key: tuple) -> bool:
+        """Reserves `key` for an order about to be signed, returns `False` if it has been reserved before."""
+        with self._lock:
+            if key in self._orders:
+                return False
+
+            self._orders[key] = None
+            return True
+
+    def add(self, key: tuple, zrx_order):
+        """Stores a signed order, or releases the reservation if `zrx_order` is `None`."""
+        with self._lock:
+            if zrx_order is not None:
+                self._orders[key] = zrx_order
+            else:
+                self._orders.pop(key, None)
+
+    def take(self, key: tuple):
+        """Returns the signed order stored under `key` and forgets it, or `None` if there is none (yet)."""
+        with self._lock:
+            if self._orders.get(key) is None:
+                return None
+
+            return self._orders.pop(key)
+
+    def remove_expired(self, expiration: int):
+        """Forgets all orders (and reservations) with expirations earlier than `expiration`."""
+        assert(isinstance(expiration, int))
+
+        with self._lock:
+            self._orders = {key: zrx_order for key, zrx_order in self._orders.items() if key[3] >= expiration}
+
+    def __len__(self):
+        with self._lock:
+            return len(list(filter(lambda zrx_order: zrx_order is not None, self._orders.values())))
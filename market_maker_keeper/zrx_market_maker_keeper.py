@@ -19,27 +19,32 @@ import argparse
 import logging
 import sys
 import time
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
-from web3 import Web3, HTTPProvider
+from web3 import Web3
 
 from market_maker_keeper.band import Bands, NewOrder, BuyBand
+from market_maker_keeper.block_cache import BlockCache
 from market_maker_keeper.gas import GasPriceFactory
 from market_maker_keeper.limit import History
+from market_maker_keeper.local_signing import register_keys
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory, Price
+from market_maker_keeper.receipt_tracker import ReceiptTracker
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
+from market_maker_keeper.web3_provider import create_provider
+from market_maker_keeper.zrx_exchange import LocalZrxExchange, RelayerFeeCache, PresignedOrders
+from market_maker_keeper.zrx_order_tracker import ZrxOrderTracker
 from pyexchange.zrx import ZrxApi, Pair
 from pymaker import Address
 from pymaker.approval import directly
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
 from pymaker.token import ERC20Token
-from pymaker.util import eth_balance
-from pymaker.zrx import ZrxExchange, ZrxRelayerApi
+from pymaker.zrx import ZrxRelayerApi
 
 
 class ZrxMarketMakerKeeper:
@@ -59,9 +64,20 @@ class ZrxMarketMakerKeeper:
         parser.add_argument("--rpc-timeout", type=int, default=10,
                             help="JSON-RPC timeout (in seconds, default: 10)")
 
+        parser.add_argument("--rpc-ipc-path", type=str,
+                            help="Path to the IPC socket of the Ethereum node, to use instead of JSON-RPC over HTTP")
+
+        parser.add_argument("--rpc-ws-url", type=str,
+                            help="WebSocket URL of the Ethereum node (i.e. `ws://localhost:8546'),"
+                                 " to use instead of JSON-RPC over HTTP")
+
         parser.add_argument("--eth-from", type=str, required=True,
                             help="Ethereum account from which to send transactions")
 
+        parser.add_argument("--eth-key", type=str, nargs='*',
+                            help="Ethereum private key(s) to sign transactions with locally,"
+                                 " in the `key_file=<keystore file>,pass_file=<password file>' format")
+
         parser.add_argument("--exchange-address", type=str, required=True,
                             help="Ethereum address of the 0x Exchange contract")
 
@@ -71,6 +87,10 @@ class ZrxMarketMakerKeeper:
         parser.add_argument("--relayer-per-page", type=int, default=100,
                             help="Number of orders to fetch per one page from the 0x Relayer API (default: 100)")
 
+        parser.add_argument("--relayer-refresh-frequency", type=int, default=60,
+                            help="How often to check the 0x Relayer API for our orders placed by other keeper instances"
+                                 " (in seconds, default: 60)")
+
         parser.add_argument("--buy-token-address", type=str, required=True,
                             help="Ethereum address of the buy token")
 
@@ -98,6 +118,17 @@ class ZrxMarketMakerKeeper:
         parser.add_argument("--spread-feed-expiry", type=int, default=3600,
                             help="Maximum age of the spread feed (in seconds, default: 3600)")
 
+        parser.add_argument("--spread-feed-step", type=float,
+                            help="Step to round spread feed values to, so configs evaluated for them can be reused"
+                                 " (default: no rounding)")
+
+        parser.add_argument("--websocket-hot-standby", dest='websocket_hot_standby', action='store_true',
+                            help="Keep a hot-standby connection for WebSocket price and spread feeds")
+
+        parser.add_argument("--websocket-stall-timeout", type=int, default=5000,
+                            help="Time without any messages after which a price or spread feed WebSocket connection"
+                                 " is considered stalled (in milliseconds, default: 5000)")
+
         parser.add_argument("--order-history", type=str,
                             help="Endpoint to report active orders to")
 
@@ -110,6 +141,9 @@ class ZrxMarketMakerKeeper:
         parser.add_argument("--order-expiry-threshold", type=int, default=0,
                             help="How long before order expiration it is considered already expired (in seconds)")
 
+        parser.add_argument("--cancel-batch-size", type=int, default=20,
+                            help="Maximum number of orders to cancel in one transaction (default: 20)")
+
         parser.add_argument("--min-eth-balance", type=float, default=0,
                             help="Minimum ETH balance below which keeper will cease operation")
 
@@ -122,6 +156,12 @@ class ZrxMarketMakerKeeper:
         parser.add_argument("--smart-gas-price", dest='smart_gas_price', action='store_true',
                             help="Use smart gas pricing strategy, based on the ethgasstation.info feed")
 
+        parser.add_argument("--node-gas-price", dest='node_gas_price', action='store_true',
+                            help="Use smart gas pricing strategy, based on recent blocks seen by the Ethereum node")
+
+        parser.add_argument("--gas-config", type=str, required=False,
+                            help="Gas price configuration file, with separate strategies per operation class")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
@@ -131,21 +171,24 @@ class ZrxMarketMakerKeeper:
         self.arguments = parser.parse_args(args)
         setup_logging(self.arguments)
 
-        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(HTTPProvider(endpoint_uri=f"http://{self.arguments.rpc_host}:{self.arguments.rpc_port}",
-                                                                              request_kwargs={"timeout": self.arguments.rpc_timeout}))
+        self.web3 = kwargs['web3'] if 'web3' in kwargs else Web3(create_provider(self.arguments))
         self.web3.eth.defaultAccount = self.arguments.eth_from
+        register_keys(self.web3, self.arguments.eth_key or [])
+        self.block_cache = BlockCache(self.web3)
         self.our_address = Address(self.arguments.eth_from)
 
         self.min_eth_balance = Wad.from_number(self.arguments.min_eth_balance)
-        self.bands_config = ReloadableConfig(self.arguments.config)
-        self.gas_price = GasPriceFactory().create_gas_price(self.arguments)
+        self.bands_config = ReloadableConfig(self.arguments.config, spread_feed_step=self.arguments.spread_feed_step)
+        self.gas_prices = GasPriceFactory().create_gas_prices(self.arguments, self.web3)
+        self.receipt_tracker = ReceiptTracker(web3=self.web3, gas_prices=self.gas_prices)
         self.price_feed = PriceFeedFactory().create_price_feed(self.arguments)
         self.spread_feed = create_spread_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
         self.history = History()
-        self.zrx_exchange = ZrxExchange(web3=self.web3, address=Address(self.arguments.exchange_address))
+        self.zrx_exchange = LocalZrxExchange(web3=self.web3, address=Address(self.arguments.exchange_address))
         self.zrx_relayer_api = ZrxRelayerApi(exchange=self.zrx_exchange, api_server=self.arguments.relayer_api_server)
+        self.relayer_fees = RelayerFeeCache(self.zrx_relayer_api)
         self.zrx_api = ZrxApi(zrx_exchange=self.zrx_exchange)
 
         self.pair = Pair(sell_token_address=Address(self.arguments.sell_token_address),
@@ -153,14 +196,18 @@ class ZrxMarketMakerKeeper:
                          buy_token_address=Address(self.arguments.buy_token_address),
                          buy_token_decimals=self.arguments.buy_token_decimals)
 
-        self.placed_zrx_orders = []
-        self.placed_zrx_orders_lock = Lock()
+        self.order_tracker = ZrxOrderTracker(web3=self.web3, zrx_exchange=self.zrx_exchange, our_address=self.our_address)
+        self.last_relayer_refresh = 0.0
+
+        self.presigned_orders = PresignedOrders()
+        self.presigning_executor = ThreadPoolExecutor(max_workers=1)
 
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
         self.order_book_manager.get_orders_with(lambda: self.get_orders())
         self.order_book_manager.get_balances_with(lambda: self.get_balances())
         self.order_book_manager.place_orders_with(self.place_order_function)
-        self.order_book_manager.cancel_orders_with(self.cancel_order_function)
+        self.order_book_manager.cancel_orders_in_batch_with(self.cancel_orders_function,
+                                                            max_batch_size=self.arguments.cancel_batch_size)
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
         self.order_book_manager.start()
 
@@ -176,41 +223,34 @@ class ZrxMarketMakerKeeper:
 
     def shutdown(self):
         self.order_book_manager.cancel_all_orders(final_wait_time=60)
+        self.logger.info(f"Transaction statistics: {self.receipt_tracker.statistics()}")
 
     def approve(self):
         token_buy = ERC20Token(web3=self.web3, address=Address(self.pair.buy_token_address))
         token_sell = ERC20Token(web3=self.web3, address=Address(self.pair.sell_token_address))
 
-        self.zrx_exchange.approve([token_sell, token_buy], directly(gas_price=self.gas_price))
+        self.zrx_exchange.approve([token_sell, token_buy], directly(gas_price=self.gas_prices.approve))
 
     def remove_expired_orders(self, orders: list) -> list:
         current_timestamp = int(time.time())
         return list(filter(lambda order: order.zrx_order.expiration > current_timestamp - self.arguments.order_expiry_threshold, orders))
 
-    def remove_expired_zrx_orders(self, zrx_orders: list) -> list:
-        current_timestamp = int(time.time())
-        return list(filter(lambda order: order.expiration > current_timestamp - self.arguments.order_expiry_threshold, zrx_orders))
-
-    def remove_filled_or_cancelled_zrx_orders(self, zrx_orders: list) -> list:
-        return list(filter(lambda order: self.zrx_exchange.get_unavailable_buy_amount(order) < order.buy_amount, zrx_orders))
-
     def get_orders(self) -> list:
-        def remove_old_zrx_orders(zrx_orders: list) -> list:
-            return self.remove_filled_or_cancelled_zrx_orders(self.remove_expired_zrx_orders(zrx_orders))
-
-        with self.placed_zrx_orders_lock:
-            self.placed_zrx_orders = remove_old_zrx_orders(self.placed_zrx_orders)
+        # the relayer only needs to be checked for orders we have not placed ourselves, i.e. placed
+        # before a restart, so it gets polled much less frequently than the order book gets refreshed
+        if time.time() - self.last_relayer_refresh >= self.arguments.relayer_refresh_frequency:
+            self.order_tracker.add_orders(self.zrx_relayer_api.get_orders_by_maker(self.our_address,
+                                                                                   self.arguments.relayer_per_page))
+            self.last_relayer_refresh = time.time()
 
-        api_zrx_orders = remove_old_zrx_orders(self.zrx_relayer_api.get_orders_by_maker(self.our_address, self.arguments.relayer_per_page))
-
-        with self.placed_zrx_orders_lock:
-            zrx_orders = list(set(self.placed_zrx_orders + api_zrx_orders))
+        zrx_orders = self.order_tracker.update(block_number=self.block_cache.block_number(),
+                                               min_expiration=int(time.time()) - self.arguments.order_expiry_threshold)
 
         return self.zrx_api.get_orders(self.pair, zrx_orders)
 
     def get_balances(self):
         balances = self.zrx_api.get_balances(self.pair)
-        return balances[0], balances[1], eth_balance(self.web3, self.our_address)
+        return balances[0], balances[1], self.block_cache.eth_balance(self.our_address)
 
     def our_total_sell_balance(self, balances) -> Wad:
         return balances[0]
@@ -228,6 +268,8 @@ class ZrxMarketMakerKeeper:
         return list(filter(lambda order: not order.is_sell, our_orders))
 
     def synchronize_orders(self):
+        self.block_cache.check_block()
+
         bands = Bands.read(self.bands_config, self.spread_feed, self.history)
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
@@ -272,32 +314,72 @@ class ZrxMarketMakerKeeper:
                                                               our_sell_balance=our_sell_balance,
                                                               target_price=target_price)[0])
 
-    def place_order_function(self, new_order: NewOrder):
-        assert(isinstance(new_order, NewOrder))
-
+        # Pre-sign the orders the bands would place if all our orders were gone, i.e. the orders
+        # which will most likely be needed once some of our current orders get taken or cancelled
+        self.presign_orders(bands.new_orders(our_buy_orders=[],
+                                             our_sell_orders=[],
+                                             our_buy_balance=self.our_total_buy_balance(order_book.balances),
+                                             our_sell_balance=self.our_total_sell_balance(order_book.balances),
+                                             target_price=target_price)[0])
+
+    def presign_orders(self, new_orders: list):
+        assert(isinstance(new_orders, list))
+
+        expiration = self.presigned_orders.expiration(self.arguments.order_expiry)
+        self.presigned_orders.remove_expired(expiration)
+
+        for new_order in new_orders:
+            key = PresignedOrders.key(new_order.is_sell, new_order.price, new_order.amount, expiration)
+            if self.presigned_orders.reserve(key):
+                self.presigning_executor.submit(self.presign_order, new_order, key, expiration)
+
+    def presign_order(self, new_order: NewOrder, key: tuple, expiration: int):
+        zrx_order = None
+        try:
+            zrx_order = self.sign_order(new_order, expiration)
+        except Exception as e:
+            self.logger.warning(f"Failed to pre-sign order {new_order}: {e}")
+        finally:
+            self.presigned_orders.add(key, zrx_order)
+
+    def sign_order(self, new_order: NewOrder, expiration: int):
         zrx_order = self.zrx_api.place_order(pair=self.pair,
                                              is_sell=new_order.is_sell,
                                              price=new_order.price,
                                              amount=new_order.amount,
-                                             expiration=int(time.time()) + self.arguments.order_expiry)
+                                             expiration=expiration)
 
-        zrx_order = self.zrx_relayer_api.calculate_fees(zrx_order)
-        zrx_order = self.zrx_exchange.sign_order(zrx_order)
+        # fees usually come from the cache and the order gets hashed locally
+        zrx_order = self.relayer_fees.calculate_fees(zrx_order)
+        return self.zrx_exchange.sign_order(zrx_order)
 
-        if self.zrx_relayer_api.submit_order(zrx_order):
-            with self.placed_zrx_orders_lock:
-                self.placed_zrx_orders.append(zrx_order)
+    def place_order_function(self, new_order: NewOrder):
+        assert(isinstance(new_order, NewOrder))
 
-            order = self.zrx_api.get_orders(self.pair, [zrx_order])[0]
+        # expirations are rounded up to whole minutes, so orders pre-signed during the last
+        # `synchronize_orders` ticks can be reused and submitting is the only round-trip left
+        expiration = self.presigned_orders.expiration(self.arguments.order_expiry)
+        key = PresignedOrders.key(new_order.is_sell, new_order.price, new_order.amount, expiration)
+
+        zrx_order = self.presigned_orders.take(key)
+        if zrx_order is None:
+            zrx_order = self.sign_order(new_order, expiration)
+
+        if self.zrx_relayer_api.submit_order(zrx_order):
+            self.order_tracker.order_placed(zrx_order)
 
-            return order
+            # does not hit the node: the order hash is calculated locally and unavailable
+            # amounts of orders we have just placed are served from memory by `LocalZrxExchange`
+            return self.zrx_api.get_orders(self.pair, [zrx_order])[0]
 
         else:
             return None
 
-    def cancel_order_function(self, order):
-        transact = self.zrx_exchange.cancel_order(order.zrx_order).transact(gas_price=self.gas_price)
-        return transact is not None and transact.successful
+    def cancel_orders_function(self, orders: list):
+        # all the orders get cancelled in one `batchCancelOrders` transaction
+        return self.receipt_tracker.transact(self.zrx_exchange.cancel_orders([order.zrx_order for order in orders]),
+                                             result_function=lambda receipt: receipt is not None and receipt.successful,
+                                             operation='cancel')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,198 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+
+from eth_utils import decode_hex, encode_hex, event_signature_to_log_topic
+
+from market_maker_keeper.rpc_batch import JsonRpcBatch
+from market_maker_keeper.zrx_exchange import LocalZrxExchange
+from pymaker import Address
+from pymaker.numeric import Wad
+
+
+class ZrxOrderTracker:
+    """Keeps the set of our 0x orders incrementally, with their unavailable amounts cached per order hash.
+
+    Orders get added either when we place them (`order_placed()`, they are known to be fully available)
+    or when they get discovered in the relayer (`add_orders()`, only orders with hashes we have not seen
+    before get added). Unavailable amounts of newly discovered orders get read from the exchange contract
+    once. After that they only get read again if a `LogFill` or `LogCancel` event for that order hash has
+    been emitted. Each time `update()` is called with a new block number, events from the blocks mined
+    since the previous call are fetched with one `eth_getLogs` call, and all the amounts which need
+    to be read get read in one JSON-RPC batch request.
+
+    Fully filled or cancelled orders get dropped, but their hashes are remembered until they expire
+    so they do not get added again if the relayer still returns them. All cached amounts are passed
+    to `zrx_exchange`, so building `Order`s from tracked orders does not need any calls.
+
+    Attributes:
+        web3: `Web3` instance.
+        zrx_exchange: The 0x exchange to track the orders on.
+        our_address: Address of the maker to track the orders of.
+    """
+
+    LOG_FILL_TOPIC = encode_hex(event_signature_to_log_topic('LogFill(address,address,address,address,address,'
+                                                             'uint256,uint256,uint256,uint256,bytes32,bytes32)'))
+
+    LOG_CANCEL_TOPIC = encode_hex(event_signature_to_log_topic('LogCancel(address,address,address,address,'
+                                                               'uint256,uint256,bytes32,bytes32)'))
+
+    # events of a few extra blocks are fetched each time, as they only make amounts get read again,
+    # it is safe to do so and it covers short chain reorganizations
+    OVERLAP_BLOCKS = 10
+
+    logger = logging.getLogger()
+
+    def __init__(self, web3, zrx_exchange: LocalZrxExchange, our_address: Address):
+        assert(isinstance(zrx_exchange, LocalZrxExchange))
+        assert(isinstance(our_address, Address))
+
+        self.web3 = web3
+        self.zrx_exchange = zrx_exchange
+        self.our_address = our_address
+
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._closed_orders = {}
+        self._unavailable_amounts = {}
+        self._stale_hashes = set()
+        self._last_block = None
+
+    def add_orders(self, zrx_orders: list):
+        """Adds orders we have not seen before, i.e. orders returned by the relayer.
+
+        Their unavailable amounts get read from the exchange contract during the next `update()`.
+        """
+        assert(isinstance(zrx_orders, list))
+
+        order_hashes = [self.zrx_exchange.get_order_hash(zrx_order) for zrx_order in zrx_orders]
+
+        with self._lock:
+            for order_hash, zrx_order in zip(order_hashes, zrx_orders):
+                if order_hash not in self._orders and order_hash not in self._closed_orders:
+                    self._orders[order_hash] = zrx_order
+                    self._stale_hashes.add(order_hash)
+
+    def order_placed(self, zrx_order):
+        """Adds an order we have just placed, which is known to be fully available."""
+        order_hash = self.zrx_exchange.get_order_hash(zrx_order)
+
+        with self._lock:
+            self._orders[order_hash] = zrx_order
+            self._unavailable_amounts[order_hash] = Wad(0)
+            self.zrx_exchange.order_placed(zrx_order)
+
+    def update(self, block_number: int, min_expiration: int) -> list:
+        """Returns our open orders, reading only the amounts which could have changed since the last call.
+
+        Args:
+            block_number: Number of the latest block.
+            min_expiration: Orders expiring at or before this timestamp get dropped.
+
+        Returns:
+            Our orders which have not been fully filled nor cancelled, and which have not expired.
+        """
+        assert(isinstance(block_number, int))
+        assert(isinstance(min_expiration, int))
+
+        with self._lock:
+            last_block = self._last_block
+            self._last_block = block_number
+
+        if last_block is not None and block_number > last_block:
+            changed_hashes = self._changed_order_hashes(max(last_block - self.OVERLAP_BLOCKS + 1, 0), block_number)
+        elif last_block is not None and block_number < last_block:
+            changed_hashes = None
+        else:
+            changed_hashes = set()
+
+        with self._lock:
+            self._remove_expired(min_expiration)
+
+            if changed_hashes is None:
+                self._stale_hashes.update(self._orders.keys())
+            else:
+                self._stale_hashes.update(changed_hashes.intersection(self._orders.keys()))
+
+            stale_orders = [(order_hash, self._orders[order_hash]) for order_hash in self._stale_hashes]
+            self._stale_hashes = set()
+
+        # amounts get read outside the lock, so placing orders does not have to wait for them
+        try:
+            unavailable_amounts = self._unavailable_buy_amounts([order_hash for order_hash, _ in stale_orders])
+        except:
+            with self._lock:
+                self._stale_hashes.update(order_hash for order_hash, _ in stale_orders)
+            raise
+
+        with self._lock:
+            for (order_hash, zrx_order), unavailable_amount in zip(stale_orders, unavailable_amounts):
+                if order_hash not in self._orders:
+                    continue
+
+                if unavailable_amount >= zrx_order.buy_amount:
+                    self.logger.info(f"Our 0x order {order_hash} has been fully filled or cancelled")
+                    self._close(order_hash)
+                else:
+                    self._unavailable_amounts[order_hash] = unavailable_amount
+
+            self.zrx_exchange.set_unavailable_amounts(self._unavailable_amounts)
+
+            return list(self._orders.values())
+
+    def _close(self, order_hash: str):
+        self._closed_orders[order_hash] = self._orders.pop(order_hash).expiration
+        self._unavailable_amounts.pop(order_hash, None)
+
+    def _remove_expired(self, min_expiration: int):
+        for order_hash in [order_hash for order_hash, zrx_order in self._orders.items()
+                           if zrx_order.expiration <= min_expiration]:
+            self._close(order_hash)
+
+        self._closed_orders = {order_hash: expiration for order_hash, expiration in self._closed_orders.items()
+                               if expiration > min_expiration}
+
+    def _changed_order_hashes(self, from_block: int, to_block: int) -> set:
+        # `maker` is the first indexed argument of both events, `orderHash` is the last word of their data
+        logs = self.web3.manager.request_blocking("eth_getLogs", [{'address': self.zrx_exchange.address.address,
+                                                                   'fromBlock': hex(from_block),
+                                                                   'toBlock': hex(to_block),
+                                                                   'topics': [[self.LOG_FILL_TOPIC, self.LOG_CANCEL_TOPIC],
+                                                                              self._address_topic(self.our_address)]}])
+
+        def order_hash(log):
+            data = decode_hex(log['data']) if isinstance(log['data'], str) else log['data']
+            return encode_hex(data[-32:])
+
+        return set(order_hash(log) for log in logs)
+
+    @staticmethod
+    def _address_topic(address: Address) -> str:
+        return '0x' + address.address[2:].lower().rjust(64, '0')
+
+    def _unavailable_buy_amounts(self, order_hashes: list) -> list:
+        if len(order_hashes) == 0:
+            return []
+
+        batch = JsonRpcBatch(self.web3)
+        for order_hash in order_hashes:
+            batch.call(self.zrx_exchange.address, 'getUnavailableTakerTokenAmount(bytes32)',
+                       [decode_hex(order_hash)], ['uint256'])
+
+        return [Wad(amount) for amount in batch.execute()]
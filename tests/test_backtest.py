@@ -0,0 +1,164 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import pytest
+
+from market_maker_keeper.backtest import VirtualClock, SimulatedExchange, Backtest
+from market_maker_keeper.price_feed import Price
+from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.tick_file import Tick
+from pymaker.numeric import Wad
+from tests.band_config import BandConfig
+
+
+def tick(timestamp: float, price: float) -> Tick:
+    return Tick(timestamp, "test", Wad.from_number(price).value, Wad.from_number(price).value)
+
+
+class TestSimulatedExchange:
+    def setup_method(self):
+        self.clock = VirtualClock(1000.0)
+        self.exchange = SimulatedExchange(self.clock, Wad.from_number(1000), Wad.from_number(10), latency=0.5, fee=0.01)
+
+    def test_should_place_orders_after_latency(self):
+        # when
+        order = self.exchange.place_order(True, Wad.from_number(100), Wad.from_number(2))
+
+        # then
+        assert self.exchange.get_orders() == []
+        assert self.exchange.get_balances() == {'buy': Wad.from_number(1000), 'sell': Wad.from_number(8)}
+
+        # when
+        self.clock.advance_to(1000.5)
+        self.exchange.advance()
+
+        # then
+        assert self.exchange.get_orders() == [order]
+
+    def test_should_reject_orders_exceeding_free_balance(self):
+        # expect
+        assert self.exchange.place_order(False, Wad.from_number(100), Wad.from_number(11)) is None
+        assert self.exchange.orders_rejected == 1
+
+    def test_should_fill_crossed_orders_and_charge_fees(self):
+        # given
+        self.exchange.place_order(True, Wad.from_number(100), Wad.from_number(2))
+        self.exchange.place_order(False, Wad.from_number(90), Wad.from_number(1))
+        self.clock.advance_to(1001.0)
+
+        # when
+        self.exchange.match(Price(Wad.from_number(99), Wad.from_number(99)))
+
+        # then
+        assert len(self.exchange.fills) == 0
+
+        # when
+        self.exchange.match(Price(Wad.from_number(100), Wad.from_number(100)))
+
+        # then
+        assert len(self.exchange.fills) == 1
+        assert self.exchange.sell_balance == Wad.from_number(8)
+        assert self.exchange.buy_balance == Wad.from_number(1198)
+
+        # when
+        self.exchange.match(Price(Wad.from_number(90), Wad.from_number(90)))
+
+        # then
+        assert len(self.exchange.fills) == 2
+        assert self.exchange.sell_balance == Wad.from_number(8.99)
+        assert self.exchange.buy_balance == Wad.from_number(1108)
+        assert self.exchange.get_orders() == []
+
+    def test_should_still_fill_orders_being_cancelled(self):
+        # given
+        order = self.exchange.place_order(True, Wad.from_number(100), Wad.from_number(2))
+        self.clock.advance_to(1001.0)
+        self.exchange.advance()
+
+        # when
+        self.exchange.cancel_order(order.order_id)
+        self.exchange.match(Price(Wad.from_number(100), Wad.from_number(100)))
+
+        # then
+        assert len(self.exchange.fills) == 1
+        assert self.exchange.orders_cancelled == 0
+
+
+class TestBacktest:
+    def backtest(self, tmpdir, latency: float = 0.0) -> Backtest:
+        clock = VirtualClock(0.0)
+        exchange = SimulatedExchange(clock, Wad.from_number(1000), Wad.from_number(10), latency=latency)
+
+        return Backtest(ReloadableConfig(str(BandConfig.sample_config(tmpdir))), exchange, clock)
+
+    def test_should_place_orders_in_bands(self, tmpdir):
+        # given
+        backtest = self.backtest(tmpdir)
+
+        # when
+        report = backtest.run([tick(1000.0, 100.0), tick(1010.0, 100.0)])
+
+        # then
+        orders = backtest.exchange.get_orders()
+        assert len(orders) == 2
+        assert sorted(float(order.price) for order in orders) == [96.0, 104.0]
+        assert report['fills'] == 0
+        assert report['ordersPlaced'] == 2
+        assert report['pnl'] == 0.0
+
+    def test_should_fill_orders_and_replace_them(self, tmpdir):
+        # given
+        backtest = self.backtest(tmpdir, latency=0.2)
+
+        # when
+        report = backtest.run([tick(1000.0, 100.0), tick(1010.0, 104.0), tick(1020.0, 104.0)])
+
+        # then
+        assert report['fills'] == 1
+        assert report['soldAmount'] == 7.5
+        assert report['final']['sellBalance'] == 2.5
+        assert report['final']['buyBalance'] == 1780.0
+        assert report['ordersPlaced'] > 2
+        assert report['ordersCancelled'] > 0
+        assert report['pnl'] == pytest.approx(1780.0 + 2.5 * 104.0 - 2000.0)
+
+    def test_should_account_for_refreshes_when_fast_forwarding(self, tmpdir):
+        # given
+        backtest = self.backtest(tmpdir)
+
+        # when
+        report = backtest.run([tick(1000.0, 100.0), tick(1000.0 + 3 * 3600, 100.0)])
+
+        # then
+        assert report['apiCalls']['get_orders'] == pytest.approx(3600, abs=2)
+        assert report['synchronizations'] < 10
+
+    def test_should_process_a_month_of_ticks_quickly(self, tmpdir):
+        # given
+        backtest = self.backtest(tmpdir)
+        ticks = [tick(1000.0 + index * 60, 100.0 + (index % 50) * 0.05) for index in range(30 * 24 * 60)]
+
+        # when
+        start = time.time()
+        report = backtest.run(ticks)
+        elapsed = time.time() - start
+
+        # then
+        assert report['ticks'] == len(ticks)
+        assert elapsed < 60
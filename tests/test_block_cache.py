@@ -0,0 +1,184 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from market_maker_keeper.block_cache import BlockCache
+from pymaker import Address
+from pymaker.numeric import Wad
+
+
+class FakeEth:
+    def __init__(self):
+        self.blockNumber = 100
+        self.get_balance_calls = 0
+
+    def getBalance(self, address):
+        self.get_balance_calls += 1
+        return Wad.from_number(5).value
+
+
+class FakeWeb3:
+    def __init__(self):
+        self.eth = FakeEth()
+
+
+class Counter:
+    def __init__(self, value=42):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestBlockCache:
+    def test_should_make_each_call_only_once_per_block(self):
+        # given
+        web3 = FakeWeb3()
+        cache = BlockCache(web3, block_number_ttl=60.0)
+        counter = Counter()
+
+        # when
+        values = [cache.get('key', counter) for _ in range(10)]
+
+        # then
+        assert values == [42] * 10
+        assert counter.calls == 1
+        assert cache.hits == 9
+        assert cache.misses == 1
+        assert cache.hit_rate() == 0.9
+
+    def test_should_cache_different_keys_separately(self):
+        # given
+        cache = BlockCache(FakeWeb3(), block_number_ttl=60.0)
+        counter_1 = Counter(1)
+        counter_2 = Counter(2)
+
+        # expect
+        assert cache.get('key1', counter_1) == 1
+        assert cache.get('key2', counter_2) == 2
+        assert cache.get('key1', counter_1) == 1
+        assert counter_1.calls == 1
+        assert counter_2.calls == 1
+
+    def test_should_not_check_block_number_more_often_than_ttl(self):
+        # given
+        web3 = FakeWeb3()
+        cache = BlockCache(web3, block_number_ttl=60.0)
+        counter = Counter()
+        cache.get('key', counter)
+
+        # when
+        web3.eth.blockNumber = 101
+        cache.get('key', counter)
+
+        # then
+        assert cache.block_number() == 100
+        assert counter.calls == 1
+
+    def test_should_invalidate_values_when_new_block_arrives(self):
+        # given
+        web3 = FakeWeb3()
+        cache = BlockCache(web3, block_number_ttl=0.1)
+        counter = Counter()
+        cache.get('key', counter)
+
+        # when
+        web3.eth.blockNumber = 101
+        time.sleep(0.2)
+        counter.value = 43
+
+        # then
+        assert cache.get('key', counter) == 43
+        assert cache.block_number() == 101
+        assert counter.calls == 2
+
+    def test_should_keep_values_if_block_has_not_changed_after_ttl(self):
+        # given
+        web3 = FakeWeb3()
+        cache = BlockCache(web3, block_number_ttl=0.1)
+        counter = Counter()
+        cache.get('key', counter)
+
+        # when
+        time.sleep(0.2)
+
+        # then
+        assert cache.get('key', counter) == 42
+        assert counter.calls == 1
+
+    def test_should_check_block_straight_away_on_check_block(self):
+        # given
+        web3 = FakeWeb3()
+        cache = BlockCache(web3, block_number_ttl=60.0)
+        counter = Counter()
+        cache.get('key', counter)
+
+        # when
+        web3.eth.blockNumber = 101
+        block_number = cache.check_block()
+
+        # then
+        assert block_number == 101
+        assert cache.get('key', counter) == 42
+        assert counter.calls == 2
+
+    def test_should_forget_values_on_invalidate(self):
+        # given
+        cache = BlockCache(FakeWeb3(), block_number_ttl=60.0)
+        counter = Counter()
+        cache.get('key', counter)
+
+        # when
+        cache.invalidate()
+        cache.get('key', counter)
+
+        # then
+        assert counter.calls == 2
+
+    def test_should_not_store_value_if_new_block_arrived_during_call(self):
+        # given
+        web3 = FakeWeb3()
+        cache = BlockCache(web3, block_number_ttl=60.0)
+
+        def function():
+            web3.eth.blockNumber = 101
+            cache.check_block()
+            return 42
+
+        # when
+        cache.get('key', function)
+
+        # then
+        counter = Counter()
+        assert cache.get('key', counter) == 42
+        assert counter.calls == 1
+
+    def test_should_cache_eth_balance(self):
+        # given
+        web3 = FakeWeb3()
+        cache = BlockCache(web3, block_number_ttl=60.0)
+        address = Address('0x0101010101010101010101010101010101010101')
+
+        # when
+        balances = [cache.eth_balance(address) for _ in range(3)]
+
+        # then
+        assert balances == [Wad.from_number(5)] * 3
+        assert web3.eth.get_balance_calls == 1
@@ -0,0 +1,212 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import Future
+
+from market_maker_keeper.deposit_manager import DepositManager, FillRate
+from pymaker import Address
+from pymaker.numeric import Wad
+
+ETH = Address('0x0000000000000000000000000000000000000000')
+DAI = Address('0x0000000000000000000000000000000000000002')
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+
+class FakeBand:
+    def __init__(self, avg_amount, max_amount):
+        self.avg_amount = Wad.from_number(avg_amount)
+        self.max_amount = Wad.from_number(max_amount)
+
+
+class FakeBands:
+    def __init__(self):
+        self.buy_bands = [FakeBand(75, 100), FakeBand(25, 50)]
+        self.sell_bands = [FakeBand(7.5, 10)]
+
+
+class TestFillRate:
+    def test_should_be_zero_initially(self):
+        # given
+        fill_rate = FillRate(600.0, FakeClock())
+
+        # when
+        fill_rate.observe(Wad.from_number(10))
+
+        # expect
+        assert fill_rate.rate() == 0.0
+
+    def test_should_estimate_constant_rate(self):
+        # given
+        clock = FakeClock()
+        fill_rate = FillRate(600.0, clock)
+
+        # when
+        for balance in range(100, 40, -1):
+            fill_rate.observe(Wad.from_number(balance))
+            clock.time += 10
+
+        # then
+        assert 0.099 < fill_rate.rate() < 0.101
+
+    def test_should_ignore_balance_increases(self):
+        # given
+        clock = FakeClock()
+        fill_rate = FillRate(600.0, clock)
+
+        # when
+        fill_rate.observe(Wad.from_number(10))
+        clock.time += 10
+        fill_rate.observe(Wad.from_number(50))
+
+        # then
+        assert fill_rate.rate() == 0.0
+
+
+class TestDepositManager:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.deposits = []
+        self.futures = []
+        self.deposit_manager = DepositManager(lead_time=300.0, clock=self.clock)
+        self.deposit_manager.add_token(ETH, Wad.from_number(1), lambda amount: self.deposit(ETH, amount))
+        self.deposit_manager.add_token(DAI, Wad.from_number(40), lambda amount: self.deposit(DAI, amount))
+
+    def deposit(self, token, amount):
+        future = Future()
+        self.deposits.append((token, amount))
+        self.futures.append(future)
+        return future
+
+    def synchronize(self, eth_deposited, dai_deposited, timestamp=None):
+        return self.deposit_manager.synchronize(bands=FakeBands(),
+                                                buy_token=DAI,
+                                                sell_token=ETH,
+                                                deposited={ETH: Wad.from_number(eth_deposited),
+                                                           DAI: Wad.from_number(dai_deposited)},
+                                                depositable={ETH: Wad.from_number(50), DAI: Wad.from_number(1000)},
+                                                timestamp=timestamp)
+
+    def test_should_not_deposit_if_balances_above_band_avg_amounts(self):
+        # when
+        self.synchronize(eth_deposited=7.5, dai_deposited=100)
+
+        # then
+        assert self.deposits == []
+
+    def test_should_deposit_up_to_band_max_amounts_for_both_tokens_at_once(self):
+        # when
+        tokens = self.synchronize(eth_deposited=7, dai_deposited=99)
+
+        # then
+        assert tokens == [DAI, ETH]
+        assert self.deposits == [(DAI, Wad.from_number(51)), (ETH, Wad.from_number(3))]
+
+    def test_should_deposit_at_least_min_deposit(self):
+        # given
+        self.deposit_manager.add_token(DAI, Wad.from_number(60), lambda amount: self.deposit(DAI, amount))
+
+        # when
+        self.synchronize(eth_deposited=7.5, dai_deposited=99)
+
+        # then
+        assert self.deposits == [(DAI, Wad.from_number(60))]
+
+    def test_should_not_deposit_more_than_depositable(self):
+        # when
+        self.synchronize(eth_deposited=7, dai_deposited=0)
+
+        # then
+        assert self.deposits == [(DAI, Wad.from_number(150)), (ETH, Wad.from_number(3))]
+
+        # when
+        self.setup_method()
+        self.deposit_manager.synchronize(bands=FakeBands(), buy_token=DAI, sell_token=ETH,
+                                         deposited={ETH: Wad.from_number(7), DAI: Wad.from_number(100)},
+                                         depositable={ETH: Wad.from_number(0.5), DAI: Wad.from_number(0)})
+
+        # then
+        assert self.deposits == []
+
+    def test_should_count_pending_deposits_until_they_are_visible_in_balances(self):
+        # given
+        self.synchronize(eth_deposited=7, dai_deposited=100)
+        assert len(self.deposits) == 1
+
+        # when
+        self.clock.time += 10
+        self.synchronize(eth_deposited=7, dai_deposited=100)
+
+        # then
+        assert len(self.deposits) == 1
+        assert self.deposit_manager.pending_amount(ETH) == Wad.from_number(3)
+
+        # when
+        self.clock.time += 10
+        self.futures[0].set_result(True)
+        self.synchronize(eth_deposited=7, dai_deposited=100, timestamp=self.clock.time - 5)
+
+        # then
+        assert len(self.deposits) == 1
+        assert self.deposit_manager.pending_amount(ETH) == Wad.from_number(3)
+
+        # when
+        self.clock.time += 10
+        self.synchronize(eth_deposited=10, dai_deposited=100)
+
+        # then
+        assert len(self.deposits) == 1
+        assert self.deposit_manager.pending_amount(ETH) == Wad(0)
+
+    def test_should_retry_failed_deposits(self):
+        # given
+        self.synchronize(eth_deposited=7, dai_deposited=100)
+
+        # when
+        self.futures[0].set_result(False)
+        self.synchronize(eth_deposited=7, dai_deposited=100)
+
+        # then
+        assert len(self.deposits) == 2
+
+    def test_should_deposit_ahead_of_time_based_on_fill_rate(self):
+        # given
+        self.synchronize(eth_deposited=10, dai_deposited=100)
+        self.clock.time += 60
+
+        # when
+        self.synchronize(eth_deposited=9.5, dai_deposited=100)
+
+        # then
+        assert 0.008 < self.deposit_manager.fill_rate(ETH) < 0.009
+        assert len(self.deposits) == 1
+        assert self.deposits[0][0] == ETH
+        assert self.deposits[0][1] > Wad.from_number(3)
+
+    def test_should_wait_for_deposits(self):
+        # given
+        self.synchronize(eth_deposited=7, dai_deposited=100)
+        self.futures[0].set_result(True)
+
+        # expect
+        self.deposit_manager.wait_for_deposits()
@@ -16,6 +16,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import shutil
+import threading
+import time
+from argparse import Namespace
+from concurrent.futures import Future
 from functools import reduce
 
 import py
@@ -23,6 +27,12 @@ import pytest
 from mock import MagicMock
 
 from market_maker_keeper.etherdelta_market_maker_keeper import EtherDeltaMarketMakerKeeper
+from market_maker_keeper.etherdelta_order_tracker import TrackedOrder
+from market_maker_keeper.feed import EmptyFeed
+from market_maker_keeper.limit import History
+from market_maker_keeper.order_book import OrderBook
+from market_maker_keeper.price_feed import Price
+from market_maker_keeper.reloadable_config import ReloadableConfig
 from pymaker import Address
 from pymaker.deployment import Deployment
 from pymaker.etherdelta import EtherDelta
@@ -45,8 +55,16 @@ class TestEtherDeltaMarketMakerKeeper:
     def set_price(deployment: Deployment, price: Wad):
         DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(price.value).transact()
 
+    @staticmethod
+    def synchronize_orders(keeper: EtherDeltaMarketMakerKeeper):
+        # orders and balances get refreshed in background, so we wait for a refresh which has
+        # started after the previous synchronization and for all orders to get placed and cancelled
+        keeper.order_book_manager.wait_for_order_book_refresh()
+        keeper.synchronize_orders()
+        keeper.order_book_manager.wait_for_stable_order_book()
+
     def orders(self, keeper: EtherDeltaMarketMakerKeeper):
-        return list(filter(lambda order: order.remaining_sell_amount > Wad(0), keeper.our_orders))
+        return list(filter(lambda order: order.remaining_sell_amount > Wad(0), keeper.order_book_manager.get_order_book().orders))
 
     def orders_by_token(self, keeper: EtherDeltaMarketMakerKeeper, token_address: Address):
         return list(filter(lambda order: order.pay_token == token_address, self.orders(keeper)))
@@ -69,7 +87,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -77,8 +95,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert deployment.etherdelta.balance_of(deployment.our_address) > Wad(0)
@@ -86,7 +105,7 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         assert len(self.orders(keeper)) == 2
-        assert keeper.etherdelta_api.publish_order.call_count == 2
+        assert sum(len(call[0][0]) for call in keeper.etherdelta_api.publish_orders.call_args_list) == 2
 
         # and
         assert self.orders_by_token(keeper, deployment.sai.address)[0].maker == deployment.our_address
@@ -116,7 +135,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -129,8 +148,9 @@ class TestEtherDeltaMarketMakerKeeper:
         deployment.etherdelta.deposit(Wad.from_number(7)).transact()
 
         # when
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert deployment.etherdelta.balance_of(deployment.our_address) >= Wad.from_number(7.5)
@@ -149,7 +169,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -162,8 +182,9 @@ class TestEtherDeltaMarketMakerKeeper:
         deployment.etherdelta.deposit(Wad.from_number(8)).transact()
 
         # when
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert deployment.etherdelta.balance_of(deployment.our_address) == Wad.from_number(8)
@@ -182,7 +203,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -195,8 +216,9 @@ class TestEtherDeltaMarketMakerKeeper:
         deployment.etherdelta.deposit(Wad.from_number(16)).transact()
 
         # when
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert deployment.etherdelta.balance_of(deployment.our_address) >= Wad.from_number(17)
@@ -215,7 +237,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -223,8 +245,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         assert len(self.orders(keeper)) == 2
 
         # when
@@ -252,7 +275,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --cancel-on-shutdown"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -260,8 +283,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         assert len(self.orders(keeper)) == 2
 
         # when
@@ -289,7 +313,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --cancel-on-shutdown --withdraw-on-shutdown"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -297,8 +321,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         assert len(self.orders(keeper)) == 2
 
         # when
@@ -326,7 +351,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --cancel-on-shutdown --withdraw-on-shutdown"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -334,8 +359,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 1
@@ -361,7 +387,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -369,8 +395,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 1
@@ -380,8 +407,9 @@ class TestEtherDeltaMarketMakerKeeper:
         shutil.copyfile(second_config_file, config_file)
 
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 2
@@ -400,7 +428,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -410,11 +438,50 @@ class TestEtherDeltaMarketMakerKeeper:
         keeper.approve()
 
         # when
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
 
         # then
         assert len(self.orders(keeper)) == 0
 
+    def test_should_free_band_capacity_after_partial_fill(self, deployment: Deployment, tmpdir: py.path.local):
+        # given
+        config_file = BandConfig.sample_config(tmpdir)
+
+        # and
+        keeper = EtherDeltaMarketMakerKeeper(args=args(f"--eth-from {deployment.our_address} --config {config_file}"
+                                                       f" --tub-address {deployment.tub.address}"
+                                                       f" --etherdelta-address {deployment.etherdelta.address}"
+                                                       f" --etherdelta-socket https://127.0.0.1:99999/"
+                                                       f" --price-feed tub"
+                                                       f" --order-age 3600 --eth-reserve 10"
+                                                       f" --min-eth-deposit 1 --min-sai-deposit 400"),
+                                             web3=deployment.web3)
+        keeper.lifecycle = Lifecycle(web3=keeper.web3)
+        keeper.etherdelta_api.publish_orders = MagicMock()
+
+        # and
+        self.mint_tokens(deployment)
+        self.set_price(deployment, Wad.from_number(100))
+
+        # and
+        keeper.approve()
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
+        assert len(self.orders(keeper)) == 2
+        sai_order = self.orders_by_token(keeper, deployment.sai.address)[0]
+
+        # when
+        deployment.etherdelta.trade(TrackedOrder.unwrap(sai_order), Wad.from_number(26)/Wad.from_number(96)).transact()
+        # and
+        self.synchronize_orders(keeper)
+
+        # then
+        assert float(keeper.our_buy_orders(self.orders(keeper))[0].remaining_sell_amount) == pytest.approx(49)
+        assert len(self.orders(keeper)) == 3
+        assert self.orders(keeper)[2].pay_amount == Wad.from_number(26)
+        assert self.orders(keeper)[2].pay_token == deployment.sai.address
+
     def test_should_place_extra_order_only_if_order_brought_below_min(self, deployment: Deployment, tmpdir: py.path.local):
         # given
         config_file = BandConfig.sample_config(tmpdir)
@@ -429,7 +496,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -437,8 +504,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         assert len(self.orders(keeper)) == 2
         sai_order = self.orders_by_token(keeper, deployment.sai.address)[0]
 
@@ -447,21 +515,21 @@ class TestEtherDeltaMarketMakerKeeper:
         print(sai_order.buy_to_sell_price)
         deployment.etherdelta.trade(sai_order, Wad.from_number(20)/Wad.from_number(96)).transact()
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
         # then
         assert len(self.orders(keeper)) == 2
 
         # when
         deployment.etherdelta.trade(sai_order, Wad.from_number(5)/Wad.from_number(96)).transact()
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
         # then
         assert len(self.orders(keeper)) == 2
 
         # when
         deployment.etherdelta.trade(sai_order, Wad.from_number(1)/Wad.from_number(96)).transact()
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
         # then
         assert len(self.orders(keeper)) == 3
         assert self.orders(keeper)[2].pay_amount == Wad.from_number(26)
@@ -483,7 +551,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -491,37 +559,41 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         assert len(self.orders(keeper)) == 2
 
         # when [75+17 = 92]
-        keeper.our_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(17),
+        keeper.local_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(17),
                                                                     EtherDelta.ETH_TOKEN, Wad.from_number(0.1770805),
                                                                     1000000))
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         # then
         assert len(self.orders(keeper)) == 3
 
         # when [92+2 = 94]
-        keeper.our_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(2),
+        keeper.local_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(2),
                                                                     EtherDelta.ETH_TOKEN, Wad.from_number(0.020833),
                                                                     1000000))
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         # then
         assert len(self.orders(keeper)) == 4
 
         # when [94+7 = 101] --> above max!
-        keeper.our_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(7),
+        keeper.local_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(7),
                                                                     EtherDelta.ETH_TOKEN, Wad.from_number(0.072912),
                                                                     1000000))
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         # then
         assert len(self.orders(keeper)) == 4
         assert reduce(Wad.__add__, map(lambda order: order.pay_amount, self.orders_by_token(keeper, deployment.sai.address)), Wad(0)) \
@@ -541,7 +613,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -552,14 +624,15 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         # [one artificially created order above the max band threshold]
-        keeper.our_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(170),
+        keeper.local_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(170),
                                                                     EtherDelta.ETH_TOKEN, Wad.from_number(1.770805),
                                                                     1000000))
 
         # when
-        keeper.synchronize_orders()  # ... first call is so it can cancel the order
-        keeper.synchronize_orders()  # ... second call is so it can made deposits
-        keeper.synchronize_orders()  # ... third call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can cancel the order
+        self.synchronize_orders(keeper)  # ... second call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... third call is so the actual orders can get placed
 
         # then
         # [the artificial order gets cancelled, a new one gets created instead]
@@ -584,7 +657,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -592,37 +665,41 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         assert len(self.orders(keeper)) == 2
 
         # when [7.5+2.0 = 9.5]
-        keeper.our_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(2),
+        keeper.local_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(2),
                                                                     deployment.sai.address, Wad.from_number(208),
                                                                     1000000))
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         # then
         assert len(self.orders(keeper)) == 3
 
         # when [9.5+0.5 = 10]
-        keeper.our_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.5),
+        keeper.local_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.5),
                                                                     deployment.sai.address, Wad.from_number(52),
                                                                     1000000))
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         # then
         assert len(self.orders(keeper)) == 4
 
         # when [10+0.1 = 10.1] --> above max!
-        keeper.our_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.1),
+        keeper.local_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.1),
                                                                     deployment.sai.address, Wad.from_number(10.4),
                                                                     1000000))
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         # then
         assert len(self.orders(keeper)) == 4
         assert reduce(Wad.__add__, map(lambda order: order.pay_amount, self.orders_by_token(keeper, EtherDelta.ETH_TOKEN)), Wad(0)) \
@@ -642,7 +719,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -653,14 +730,15 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         # [one artificially created order above the max band threshold]
-        keeper.our_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(20),
+        keeper.local_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(20),
                                                                     deployment.sai.address, Wad.from_number(2080),
                                                                     1000000))
 
         # when
-        keeper.synchronize_orders()  # ... first call is so it can cancel the order
-        keeper.synchronize_orders()  # ... second call is so it can made deposits
-        keeper.synchronize_orders()  # ... third call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can cancel the order
+        self.synchronize_orders(keeper)  # ... second call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... third call is so the actual orders can get placed
 
         # then
         # [the artificial order gets cancelled, a new one gets created instead]
@@ -685,7 +763,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -693,19 +771,21 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         assert len(self.orders(keeper)) == 2
 
         # when
-        keeper.our_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(5), EtherDelta.ETH_TOKEN, Wad.from_number(0.0538), 1000000)) #price=92.936802973977695
-        keeper.our_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(5), EtherDelta.ETH_TOKEN, Wad.from_number(0.0505), 1000000)) #price=99.0
-        keeper.our_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.5), deployment.sai.address, Wad.from_number(50.5), 1000000)) #price=101
-        keeper.our_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.5), deployment.sai.address, Wad.from_number(53.5), 1000000)) #price=107
+        keeper.local_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(5), EtherDelta.ETH_TOKEN, Wad.from_number(0.0538), 1000000)) #price=92.936802973977695
+        keeper.local_orders.append(deployment.etherdelta.create_order(deployment.sai.address, Wad.from_number(5), EtherDelta.ETH_TOKEN, Wad.from_number(0.0505), 1000000)) #price=99.0
+        keeper.local_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.5), deployment.sai.address, Wad.from_number(50.5), 1000000)) #price=101
+        keeper.local_orders.append(deployment.etherdelta.create_order(EtherDelta.ETH_TOKEN, Wad.from_number(0.5), deployment.sai.address, Wad.from_number(53.5), 1000000)) #price=107
         assert len(self.orders(keeper)) == 6
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         # then
         assert len(self.orders(keeper)) == 2
 
@@ -723,7 +803,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -731,8 +811,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 2
@@ -765,7 +846,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -773,8 +854,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 2
@@ -796,8 +878,9 @@ class TestEtherDeltaMarketMakerKeeper:
         # when
         self.set_price(deployment, Wad.from_number(96))
         # and
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 2
@@ -832,7 +915,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -840,8 +923,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         # (an order at 2% gets placed)
@@ -854,8 +938,8 @@ class TestEtherDeltaMarketMakerKeeper:
         # when
         self.set_price(deployment, Wad.from_number(103.02))
         # and
-        keeper.synchronize_orders()
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
+        self.synchronize_orders(keeper)
 
         # then
         # (we are almost at -1%, but not yet there, so the order stays)
@@ -868,8 +952,8 @@ class TestEtherDeltaMarketMakerKeeper:
         # when
         self.set_price(deployment, Wad.from_number(103.04))
         # and
-        keeper.synchronize_orders()
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
+        self.synchronize_orders(keeper)
 
         # then
         # (we have gone over 1%, so the order gets cancellet and a new one gets placed at 2% again)
@@ -893,7 +977,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -901,15 +985,16 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         sai_order = self.orders_by_token(keeper, deployment.sai.address)[0]
         assert sai_order.pay_amount == Wad.from_number(75)
 
         # when
         deployment.etherdelta.trade(sai_order, sai_order.buy_amount).transact()
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
         # then
         sai_order = self.orders_by_token(keeper, deployment.sai.address)[0]
         assert sai_order.pay_amount == Wad.from_number(25)
@@ -917,7 +1002,7 @@ class TestEtherDeltaMarketMakerKeeper:
         # when
         deployment.etherdelta.trade(sai_order, sai_order.buy_amount).transact()
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
         # then
         assert len(self.orders_by_token(keeper, deployment.sai.address)) == 0
 
@@ -935,7 +1020,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -943,15 +1028,16 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # and
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         eth_order = self.orders_by_token(keeper, EtherDelta.ETH_TOKEN)[0]
         assert eth_order.pay_amount == Wad.from_number(7.5)
 
         # when
         deployment.etherdelta.trade(eth_order, eth_order.buy_amount).transact()
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
         # then
         eth_order = self.orders_by_token(keeper, EtherDelta.ETH_TOKEN)[0]
         assert eth_order.pay_amount == Wad.from_number(2.5)
@@ -959,7 +1045,7 @@ class TestEtherDeltaMarketMakerKeeper:
         # when
         deployment.etherdelta.trade(eth_order, eth_order.buy_amount).transact()
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
         # then
         assert len(self.orders_by_token(keeper, EtherDelta.ETH_TOKEN)) == 0
 
@@ -978,7 +1064,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -991,8 +1077,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 2
@@ -1002,7 +1089,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                                      # that's why `--min-eth-balance` is higher than 10
 
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
 
         # then
         assert len(self.orders(keeper)) == 0
@@ -1023,7 +1110,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -1035,8 +1122,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 2
@@ -1046,7 +1134,8 @@ class TestEtherDeltaMarketMakerKeeper:
                                                                      # that's why `--min-eth-balance` is higher than 10
 
         # and
-        keeper.synchronize_orders()
+        self.synchronize_orders(keeper)
+        keeper.wait_for_withdrawal()
 
         # then
         assert len(self.orders(keeper)) == 2
@@ -1068,7 +1157,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --gas-price 69000000000"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -1079,8 +1168,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
         keeper.shutdown()
 
         # then
@@ -1103,7 +1193,7 @@ class TestEtherDeltaMarketMakerKeeper:
                                                        f" --min-eth-deposit 1 --min-sai-deposit 400"),
                                              web3=deployment.web3)
         keeper.lifecycle = Lifecycle(web3=keeper.web3)
-        keeper.etherdelta_api.publish_order = MagicMock()
+        keeper.etherdelta_api.publish_orders = MagicMock()
 
         # and
         self.mint_tokens(deployment)
@@ -1115,8 +1205,9 @@ class TestEtherDeltaMarketMakerKeeper:
 
         # when
         keeper.approve()
-        keeper.synchronize_orders()  # ... first call is so it can made deposits
-        keeper.synchronize_orders()  # ... second call is so the actual orders can get placed
+        self.synchronize_orders(keeper)  # ... first call is so it can made deposits
+        keeper.deposit_manager.wait_for_deposits()
+        self.synchronize_orders(keeper)  # ... second call is so the actual orders can get placed
 
         # then
         assert len(self.orders(keeper)) == 0
@@ -1143,3 +1234,219 @@ class TestEtherDeltaMarketMakerKeeper:
         balance = Wad(deployment.web3.eth.getBalance(deployment.our_address.address))
         deployment.web3.eth.sendTransaction({'to': '0x0000011111000001111100000111110000011111',
                                              'value': (balance - amount_of_eth_to_leave).value})
+
+
+class FakeOrder:
+    def __init__(self, order_id: int, pay_token: Address, pay_amount: float, buy_token: Address, buy_amount: float,
+                 expires: int = 1000000):
+        self.order_id = order_id
+        self.pay_token = pay_token
+        self.pay_amount = Wad.from_number(pay_amount)
+        self.buy_token = buy_token
+        self.buy_amount = Wad.from_number(buy_amount)
+        self.expires = expires
+
+    @property
+    def sell_to_buy_price(self) -> Wad:
+        return self.buy_amount / self.pay_amount
+
+    @property
+    def buy_to_sell_price(self) -> Wad:
+        return self.pay_amount / self.buy_amount
+
+    @property
+    def remaining_sell_amount(self) -> Wad:
+        return self.pay_amount
+
+
+class NoNode:
+    """Fails the test if the keeper tries to talk to the node."""
+
+    def __getattr__(self, name):
+        raise Exception(f"The keeper should not access the node (tried to access `{name}`)")
+
+
+class FakeOrderBookManager:
+    def __init__(self, orders: list, balances: dict):
+        self.orders = orders
+        self.balances = balances
+        self.cancelled_orders = []
+        self.placed_orders = []
+        self.cancelled_all_orders = False
+
+    def get_order_book(self) -> OrderBook:
+        return OrderBook(orders=self.orders, balances=self.balances, orders_being_placed=False, orders_being_cancelled=False)
+
+    def cancel_orders(self, orders: list):
+        self.cancelled_orders.extend(orders)
+
+    def cancel_all_orders(self):
+        self.cancelled_all_orders = True
+
+    def place_orders(self, new_orders: list):
+        self.placed_orders.extend(new_orders)
+
+
+class FakeReceiptTracker:
+    def __init__(self):
+        self.transactions = []
+
+    def transact(self, transact, result_function=None, operation=None) -> Future:
+        future = Future()
+        self.transactions.append((transact, result_function, operation, future))
+        return future
+
+
+class FakeEtherDelta:
+    def withdraw(self, amount: Wad):
+        return 'withdraw', amount
+
+    def cancel_order(self, order):
+        return 'cancel_order', order
+
+
+class FakeDepositManager:
+    def __init__(self):
+        self.synchronized = False
+
+    def synchronize(self, **kwargs):
+        self.synchronized = True
+
+
+class FakeOrderTracker:
+    def __init__(self):
+        self.closed_orders = []
+
+    def update(self, orders: list, block_number: int) -> list:
+        return [order for order in orders if order not in self.closed_orders]
+
+    def with_remaining_amounts(self, orders: list) -> list:
+        return orders
+
+
+class FakePriceFeed:
+    def get_price(self) -> Price:
+        return Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(100))
+
+
+class FakeSai:
+    address = Address('0x0000000000000000000000000000000000000002')
+
+
+class TestEtherDeltaMarketMakerKeeperSynchronization:
+    BLOCK_NUMBER = 1000
+
+    @staticmethod
+    def create_keeper(tmpdir, orders: list, eth_balance: float = 20.0, eth_deposited: float = 100.0):
+        # the keeper gets created without calling `__init__`, so it can be checked that it does not call the node
+        keeper = EtherDeltaMarketMakerKeeper.__new__(EtherDeltaMarketMakerKeeper)
+        keeper.arguments = Namespace(order_expiry_threshold=0, order_no_cancel_threshold=5, order_age=100)
+        keeper.web3 = NoNode()
+        keeper.sai = FakeSai()
+        keeper.bands_config = ReloadableConfig(str(BandConfig.sample_config(tmpdir)))
+        keeper.spread_feed = EmptyFeed()
+        keeper.history = History()
+        keeper.price_feed = FakePriceFeed()
+        keeper.eth_reserve = Wad.from_number(10)
+        keeper.min_eth_balance = Wad.from_number(1)
+        keeper.etherdelta = FakeEtherDelta()
+        keeper.receipt_tracker = FakeReceiptTracker()
+        keeper.deposit_manager = FakeDepositManager()
+        keeper.order_tracker = FakeOrderTracker()
+        keeper.local_orders = list(orders)
+        keeper._lock = threading.Lock()
+        keeper._withdrawal = None
+        keeper.order_book_manager = FakeOrderBookManager(orders, {'timestamp': time.time(),
+                                                                  'block_number': TestEtherDeltaMarketMakerKeeperSynchronization.BLOCK_NUMBER,
+                                                                  'eth_deposited': Wad.from_number(eth_deposited),
+                                                                  'sai_deposited': Wad.from_number(1000),
+                                                                  'sai_balance': Wad(0),
+                                                                  'eth_balance': Wad.from_number(eth_balance)})
+        return keeper
+
+    def test_should_place_orders_from_the_order_book_snapshot(self, tmpdir):
+        # given
+        keeper = self.create_keeper(tmpdir, [])
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert len(keeper.order_book_manager.placed_orders) == 2
+        assert keeper.deposit_manager.synchronized
+
+    def test_should_cancel_orders_unless_about_to_expire(self, tmpdir):
+        # given
+        order_outside_bands = FakeOrder(1, FakeSai.address, 75, EtherDelta.ETH_TOKEN, 1.5)
+        order_about_to_expire = FakeOrder(2, FakeSai.address, 75, EtherDelta.ETH_TOKEN, 1.5, expires=self.BLOCK_NUMBER + 3)
+        keeper = self.create_keeper(tmpdir, [order_outside_bands, order_about_to_expire])
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert keeper.order_book_manager.cancelled_orders == [order_outside_bands]
+        assert keeper.order_book_manager.placed_orders == []
+
+    def test_should_cancel_orders_with_transactions_tracked_in_background(self, tmpdir):
+        # given
+        order = FakeOrder(1, FakeSai.address, 75, EtherDelta.ETH_TOKEN, 1.5)
+        keeper = self.create_keeper(tmpdir, [order])
+
+        # when
+        future = keeper.cancel_order_function(order)
+
+        # then
+        assert not future.done()
+        assert keeper.receipt_tracker.transactions[0][0] == ('cancel_order', order)
+        assert keeper.receipt_tracker.transactions[0][2] == 'cancel'
+
+        # when
+        receipt = MagicMock(successful=True)
+        assert keeper.receipt_tracker.transactions[0][1](receipt)
+
+        # then
+        assert keeper.local_orders == []
+
+    def test_should_withdraw_only_once_if_eth_balance_below_minimum(self, tmpdir):
+        # given
+        keeper = self.create_keeper(tmpdir, [], eth_balance=0.5)
+
+        # when
+        keeper.synchronize_orders()
+        keeper.synchronize_orders()
+
+        # then
+        assert len(keeper.receipt_tracker.transactions) == 1
+        assert keeper.receipt_tracker.transactions[0][0] == ('withdraw', Wad.from_number(10))
+        assert keeper.receipt_tracker.transactions[0][2] == 'deposit'
+        assert not keeper.order_book_manager.cancelled_all_orders
+        assert keeper.order_book_manager.placed_orders == []
+
+    def test_should_cancel_all_orders_if_eth_balance_below_minimum_and_cannot_withdraw(self, tmpdir):
+        # given
+        keeper = self.create_keeper(tmpdir, [], eth_balance=0.5, eth_deposited=5)
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert keeper.order_book_manager.cancelled_all_orders
+        assert keeper.receipt_tracker.transactions == []
+
+    def test_should_forget_expired_and_closed_orders(self, tmpdir):
+        # given
+        open_order = FakeOrder(1, FakeSai.address, 75, EtherDelta.ETH_TOKEN, 0.78)
+        expired_order = FakeOrder(2, FakeSai.address, 75, EtherDelta.ETH_TOKEN, 0.78, expires=self.BLOCK_NUMBER)
+        closed_order = FakeOrder(3, FakeSai.address, 75, EtherDelta.ETH_TOKEN, 0.78)
+        keeper = self.create_keeper(tmpdir, [open_order, expired_order, closed_order])
+        keeper.web3 = MagicMock()
+        keeper.web3.eth.blockNumber = self.BLOCK_NUMBER
+        keeper.order_tracker.closed_orders = [closed_order]
+
+        # when
+        orders = keeper.our_orders()
+
+        # then
+        assert orders == [open_order]
+        assert keeper.local_orders == [open_order]
@@ -0,0 +1,248 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from eth_abi import encode_abi, decode_abi
+from eth_utils import decode_hex, encode_hex, function_signature_to_4byte_selector
+
+from market_maker_keeper.etherdelta_order_tracker import EtherDeltaOrderTracker, TrackedOrder
+from pymaker import Address
+from pymaker.numeric import Wad
+
+ETHERDELTA_ADDRESS = Address('0x00000000000000000000000000000000000000ed')
+OUR_ADDRESS = Address('0x00000000000000000000000000000000000000aa')
+OTHER_ADDRESS = Address('0x00000000000000000000000000000000000000bb')
+ETH_TOKEN = Address('0x0000000000000000000000000000000000000000')
+SAI_TOKEN = Address('0x0000000000000000000000000000000000000002')
+
+AMOUNT_FILLED = function_signature_to_4byte_selector('amountFilled(address,uint256,address,uint256,uint256,uint256,'
+                                                     'address,uint8,bytes32,bytes32)')
+
+
+class FakeOrder:
+    def __init__(self, nonce, pay_token, pay_amount, buy_token, buy_amount, maker=OUR_ADDRESS):
+        self.maker = maker
+        self.pay_token = pay_token
+        self.pay_amount = Wad.from_number(pay_amount)
+        self.buy_token = buy_token
+        self.buy_amount = Wad.from_number(buy_amount)
+        self.expires = 1000
+        self.nonce = nonce
+        self.v = 27
+        self.r = bytes(32)
+        self.s = bytes(32)
+
+
+class FakeEtherDelta:
+    """Keeps the filled amounts of orders and all events, as the EtherDelta contract and the node would."""
+
+    def __init__(self):
+        self.block_number = 100
+        self.filled = {}
+        self.logs = []
+        self.calls = []
+
+    def _log(self, topic, types, values):
+        self.logs.append({'address': ETHERDELTA_ADDRESS.address,
+                          'topics': [topic],
+                          'data': encode_hex(encode_abi(types, values)),
+                          'blockNumber': hex(self.block_number),
+                          'logIndex': hex(len(self.logs)),
+                          'transactionHash': f"0x{len(self.logs):064x}"})
+
+    def trade(self, order: FakeOrder, amount: float, taker: Address = OTHER_ADDRESS):
+        self.filled[order.nonce] = self.filled.get(order.nonce, Wad(0)) + Wad.from_number(amount)
+        amount_give = order.pay_amount * Wad.from_number(amount) / order.buy_amount
+        self._log(EtherDeltaOrderTracker.TRADE_TOPIC, EtherDeltaOrderTracker.TRADE_TYPES,
+                  [order.buy_token.address, Wad.from_number(amount).value, order.pay_token.address, amount_give.value,
+                   order.maker.address, taker.address])
+
+    def cancel(self, order: FakeOrder):
+        self.filled[order.nonce] = order.buy_amount
+        self._log(EtherDeltaOrderTracker.CANCEL_TOPIC, EtherDeltaOrderTracker.CANCEL_TYPES,
+                  [order.buy_token.address, order.buy_amount.value, order.pay_token.address, order.pay_amount.value,
+                   order.expires, order.nonce, order.maker.address, order.v, order.r, order.s])
+
+    def request_blocking(self, method, params):
+        assert method == "eth_getLogs"
+        self.calls.append('eth_getLogs')
+
+        from_block, to_block = int(params[0]['fromBlock'], 16), int(params[0]['toBlock'], 16)
+        return [log for log in self.logs if from_block <= int(log['blockNumber'], 16) <= to_block]
+
+    def call(self, transaction):
+        data = decode_hex(transaction['data'])
+        assert data[:4] == AMOUNT_FILLED
+        self.calls.append('amountFilled')
+
+        nonce = decode_abi(['address', 'uint256', 'address', 'uint256', 'uint256', 'uint256'], data[4:4+6*32])[5]
+        return encode_hex(encode_abi(['uint256'], [self.filled.get(nonce, Wad(0)).value]))
+
+
+class FakeWeb3:
+    def __init__(self, etherdelta: FakeEtherDelta):
+        self.eth = etherdelta
+        self.manager = etherdelta
+        self.providers = [object()]
+
+
+class TestEtherDeltaOrderTracker:
+    def setup_method(self):
+        self.etherdelta = FakeEtherDelta()
+        self.tracker = EtherDeltaOrderTracker(FakeWeb3(self.etherdelta), ETHERDELTA_ADDRESS, OUR_ADDRESS)
+        self.sell_order_1 = FakeOrder(1, ETH_TOKEN, 1, SAI_TOKEN, 500)
+        self.sell_order_2 = FakeOrder(2, ETH_TOKEN, 1, SAI_TOKEN, 510)
+        self.buy_order = FakeOrder(3, SAI_TOKEN, 490, ETH_TOKEN, 1)
+        self.orders = [self.sell_order_1, self.sell_order_2, self.buy_order]
+
+    def update(self):
+        self.orders = self.tracker.update(self.orders, self.etherdelta.block_number)
+        return self.orders
+
+    def next_block(self):
+        self.etherdelta.block_number += 1
+
+    def test_should_not_fetch_events_if_no_new_block(self):
+        # given
+        self.update()
+
+        # when
+        self.update()
+
+        # then
+        assert self.etherdelta.calls == []
+
+    def test_should_remove_fully_filled_orders(self):
+        # given
+        self.update()
+
+        # when
+        self.next_block()
+        self.etherdelta.trade(self.sell_order_1, 500)
+
+        # then
+        assert self.update() == [self.sell_order_2, self.buy_order]
+        assert len(self.tracker.fills) == 1
+        assert self.tracker.fills[0]['buy_amount'] == Wad.from_number(500)
+        assert self.tracker.fills[0]['pay_amount'] == Wad.from_number(1)
+
+    def test_should_keep_partially_filled_orders_with_remaining_amounts(self):
+        # given
+        self.update()
+
+        # when
+        self.next_block()
+        self.etherdelta.trade(self.sell_order_2, 110)
+
+        # then
+        assert self.update() == [self.sell_order_1, self.sell_order_2, self.buy_order]
+        assert list(self.tracker.remaining_buy_amounts.values()) == [Wad.from_number(400)]
+
+    def test_should_read_filled_amounts_only_for_orders_of_the_traded_pair_in_one_batch(self):
+        # given
+        self.update()
+
+        # when
+        self.next_block()
+        self.etherdelta.trade(self.buy_order, 1)
+        self.update()
+
+        # then
+        assert self.orders == [self.sell_order_1, self.sell_order_2]
+        assert self.etherdelta.calls == ['eth_getLogs', 'amountFilled']
+
+    def test_should_remove_cancelled_orders_without_reading_filled_amounts(self):
+        # given
+        self.update()
+
+        # when
+        self.next_block()
+        self.etherdelta.cancel(self.sell_order_2)
+
+        # then
+        assert self.update() == [self.sell_order_1, self.buy_order]
+        assert self.etherdelta.calls == ['eth_getLogs']
+
+    def test_should_ignore_trades_and_cancels_of_other_makers(self):
+        # given
+        self.update()
+        other_order = FakeOrder(1, ETH_TOKEN, 1, SAI_TOKEN, 500, maker=OTHER_ADDRESS)
+
+        # when
+        self.next_block()
+        self.etherdelta.trade(other_order, 500)
+        self.etherdelta.cancel(other_order)
+
+        # then
+        assert self.update() == [self.sell_order_1, self.sell_order_2, self.buy_order]
+        assert len(self.tracker.fills) == 0
+
+    def test_should_record_fills_from_overlapping_blocks_only_once(self):
+        # given
+        self.update()
+        self.next_block()
+        self.etherdelta.trade(self.sell_order_1, 100)
+        self.update()
+
+        # when
+        self.next_block()
+        self.etherdelta.trade(self.sell_order_1, 100)
+        self.update()
+
+        # then
+        assert len(self.tracker.fills) == 2
+        assert list(self.tracker.remaining_buy_amounts.values()) == [Wad.from_number(300)]
+
+    def test_should_apply_remaining_amounts_to_partially_filled_orders(self):
+        # given
+        self.update()
+
+        # when
+        self.next_block()
+        self.etherdelta.trade(self.sell_order_2, 102)
+        orders = self.tracker.with_remaining_amounts(self.update())
+
+        # then
+        assert orders[0].remaining_buy_amount == self.sell_order_1.buy_amount
+        assert orders[0].remaining_sell_amount == self.sell_order_1.pay_amount
+        assert orders[2].remaining_sell_amount == self.buy_order.pay_amount
+        assert isinstance(orders[1], TrackedOrder)
+        assert orders[1].remaining_buy_amount == Wad.from_number(408)
+        assert orders[1].remaining_sell_amount == Wad.from_number(0.8)
+        assert orders[1].nonce == self.sell_order_2.nonce
+
+    def test_should_identify_orders_by_their_fields(self):
+        # given
+        self.update()
+
+        # when
+        orders = self.tracker.with_remaining_amounts(self.update())
+
+        # then
+        assert len(set(order.order_id for order in orders)) == 3
+        assert orders[0].order_id == self.tracker.with_remaining_amounts([self.sell_order_1])[0].order_id
+
+    def test_should_unwrap_tracked_orders(self):
+        # given
+        self.update()
+        self.next_block()
+        self.etherdelta.trade(self.sell_order_2, 102)
+
+        # when
+        orders = self.tracker.with_remaining_amounts(self.update())
+
+        # then
+        assert list(map(TrackedOrder.unwrap, orders)) == [self.sell_order_1, self.sell_order_2, self.buy_order]
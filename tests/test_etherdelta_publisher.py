@@ -0,0 +1,210 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+
+from market_maker_keeper.etherdelta_publisher import EtherDeltaPublisher, socket_io_url
+
+
+class FakeOrder:
+    def __init__(self, nonce: int):
+        self.nonce = nonce
+
+    def to_json(self):
+        return {'nonce': self.nonce}
+
+    def __repr__(self):
+        return f"FakeOrder({self.nonce})"
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def sent_orders(self):
+        return [json.loads(frame[2:])[1]['nonce'] for frame in self.sent if frame.startswith('42')]
+
+
+class FailingWebSocket(FakeWebSocket):
+    def __init__(self, fail_after: int):
+        super().__init__()
+        self.fail_after = fail_after
+
+    def send(self, data):
+        if len(self.sent) >= self.fail_after:
+            raise Exception("Connection is already closed")
+
+        super().send(data)
+
+
+class TestEtherDeltaPublisher:
+    def setup_method(self):
+        self.publisher = EtherDeltaPublisher("https://socket.etherdelta.com", number_of_attempts=2,
+                                             retry_interval=10, timeout=120)
+        # the background threads are not started, the tests drive the publisher themselves
+        self.publisher._started = True
+        self.ws = FakeWebSocket()
+
+    def connect(self):
+        self.publisher._on_message(self.ws, '0{"sid":"abc","pingInterval":25000,"pingTimeout":60000}')
+        self.publisher._on_message(self.ws, '40')
+
+    def result(self, status: str):
+        self.publisher._on_message(self.ws, '42' + json.dumps(['messageResult', [status, 'some message']]))
+
+    def test_should_build_socket_io_url(self):
+        # expect
+        assert socket_io_url("https://socket.etherdelta.com") == "wss://socket.etherdelta.com/socket.io/?EIO=3&transport=websocket"
+        assert socket_io_url("http://localhost:8080/") == "ws://localhost:8080/socket.io/?EIO=3&transport=websocket"
+
+    def test_should_send_all_orders_in_one_go(self):
+        # given
+        self.connect()
+
+        # when
+        self.publisher.publish_orders([FakeOrder(1), FakeOrder(2), FakeOrder(3)])
+        self.publisher._process(time.time())
+
+        # then
+        assert self.ws.sent_orders() == [1, 2, 3]
+        assert self.ws.sent[0] == '42' + json.dumps(['message', {'nonce': 1}])
+        assert self.publisher.pending_count() == 3
+
+        # when
+        self.result('success')
+        self.result('success')
+        self.result('success')
+
+        # then
+        assert self.publisher.pending_count() == 0
+
+    def test_should_wait_for_connection(self):
+        # given
+        self.publisher.publish_orders([FakeOrder(1)])
+        self.publisher._process(time.time())
+
+        # when
+        self.connect()
+        self.publisher._process(time.time())
+
+        # then
+        assert self.ws.sent_orders() == [1]
+
+    def test_should_retry_rejected_orders_after_retry_interval(self):
+        # given
+        self.connect()
+        self.publisher.publish_orders([FakeOrder(1), FakeOrder(2)])
+        self.publisher._process(time.time())
+
+        # when
+        self.result('error')
+        self.result('success')
+        self.publisher._process(time.time())
+
+        # then
+        assert self.ws.sent_orders() == [1, 2]
+
+        # when
+        self.publisher._process(time.time() + 11)
+
+        # then
+        assert self.ws.sent_orders() == [1, 2, 1]
+
+    def test_should_give_up_after_number_of_attempts(self):
+        # given
+        self.connect()
+        self.publisher.publish_orders([FakeOrder(1)])
+        self.publisher._process(time.time())
+        self.result('error')
+        self.publisher._process(time.time() + 11)
+
+        # when
+        self.result('error')
+        self.publisher._process(time.time() + 22)
+
+        # then
+        assert self.ws.sent_orders() == [1, 1]
+        assert self.publisher.pending_count() == 0
+
+    def test_should_send_orders_again_after_reconnect(self):
+        # given
+        self.connect()
+        self.publisher.publish_orders([FakeOrder(1), FakeOrder(2)])
+        self.publisher._process(time.time())
+        self.result('success')
+
+        # when
+        self.publisher._on_close()
+        self.ws = FakeWebSocket()
+        self.connect()
+        self.publisher._process(time.time())
+
+        # then
+        assert self.ws.sent_orders() == [2]
+
+    def test_should_reconnect_if_results_time_out(self):
+        # given
+        self.connect()
+        self.publisher.publish_orders([FakeOrder(1)])
+        self.publisher._process(time.time())
+
+        # when
+        self.publisher._process(time.time() + 120)
+
+        # then
+        assert self.ws.closed
+        assert self.publisher.pending_count() == 1
+
+    def test_should_ping_every_ping_interval(self):
+        # given
+        self.connect()
+
+        # when
+        self.publisher._process(time.time() + 30)
+
+        # then
+        assert self.ws.sent == ['2']
+
+    def test_should_not_lose_orders_if_sending_fails(self):
+        # given
+        self.ws = FailingWebSocket(fail_after=1)
+        self.connect()
+
+        # when
+        self.publisher.publish_orders([FakeOrder(1), FakeOrder(2), FakeOrder(3)])
+        self.publisher._process(time.time())
+
+        # then
+        assert self.ws.sent_orders() == [1]
+        assert self.ws.closed
+        assert self.publisher.pending_count() == 3
+
+        # when
+        self.ws = FakeWebSocket()
+        self.connect()
+        self.publisher._process(time.time())
+
+        # then
+        assert self.ws.sent_orders() == [1, 2, 3]
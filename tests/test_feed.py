@@ -15,10 +15,53 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+from argparse import Namespace
+
 from market_maker_keeper.feed import EmptyFeed
+from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.spread_feed import create_spread_feed
+from tests.helper import SilentWebSocketServer
 
 
 class TestEmptyFeed:
     def test_is_always_empty(self):
         # expect
         assert EmptyFeed().get() == ({}, 0.0)
+
+
+class TestWebSocketFeed:
+    def setup_method(self):
+        self.server = SilentWebSocketServer()
+
+    def teardown_method(self):
+        self.server.shutdown()
+
+    def wait_for_connections(self, connections: int, timeout: float = 10.0):
+        deadline = time.time() + timeout
+        while self.server.connections < connections and time.time() < deadline:
+            time.sleep(0.05)
+
+    def test_should_reconnect_if_spread_feed_silent(self):
+        # given
+        arguments = Namespace(spread_feed=self.server.url, spread_feed_expiry=120,
+                              websocket_hot_standby=False, websocket_stall_timeout=500)
+
+        # when
+        create_spread_feed(arguments)
+        self.wait_for_connections(2)
+
+        # then
+        assert self.server.connections >= 2
+
+    def test_should_reconnect_if_price_feed_silent(self):
+        # given
+        arguments = Namespace(price_feed=self.server.url, price_feed_expiry=120,
+                              websocket_hot_standby=False, websocket_stall_timeout=500)
+
+        # when
+        PriceFeedFactory.create_price_feed(arguments)
+        self.wait_for_connections(2)
+
+        # then
+        assert self.server.connections >= 2
@@ -0,0 +1,194 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from argparse import Namespace
+
+import pytest
+
+from market_maker_keeper.gas import GasPriceFactory, StationGasPrice, ReplacingGasPrice
+from pymaker.gas import DefaultGasPrice, FixedGasPrice, IncreasingGasPrice
+
+GWEI = 1000000000
+
+
+class FakeGasStation:
+    def __init__(self, fast_price):
+        self._fast_price = fast_price
+
+    def fast_price(self):
+        return self._fast_price
+
+    def fastest_price(self):
+        return self._fast_price * 2 if self._fast_price is not None else None
+
+
+def arguments(gas_config=None, gas_price=0):
+    return Namespace(rpc_host='localhost', rpc_port=8545, rpc_timeout=10,
+                     gas_price=gas_price, smart_gas_price=False, node_gas_price=False, gas_config=gas_config)
+
+
+class TestStationGasPrice:
+    def test_should_escalate_from_station_price(self):
+        # given
+        gas_price = StationGasPrice(FakeGasStation(20*GWEI), multiplier=1.5, increase_by=5*GWEI,
+                                    every_secs=30, max_increase=12*GWEI)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 30*GWEI
+        assert gas_price.get_gas_price(29) == 30*GWEI
+        assert gas_price.get_gas_price(30) == 35*GWEI
+        assert gas_price.get_gas_price(60) == 40*GWEI
+        assert gas_price.get_gas_price(90) == 42*GWEI
+
+    def test_should_use_configured_level(self):
+        # given
+        gas_price = StationGasPrice(FakeGasStation(20*GWEI), level='fastest', multiplier=1.0)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 40*GWEI
+
+    def test_should_fall_back_to_default_scenario_if_station_unavailable(self):
+        # given
+        gas_price = StationGasPrice(FakeGasStation(None))
+
+        # expect
+        assert gas_price.get_gas_price(0) == 50*GWEI
+        assert gas_price.get_gas_price(600) == 100*GWEI
+
+
+class TestReplacingGasPrice:
+    def test_should_raise_gas_price_with_each_replacement(self):
+        # given
+        gas_price = ReplacingGasPrice(FixedGasPrice(20*GWEI), multiplier=1.25, default_price_function=lambda: None)
+
+        # when
+        gas_price.replace()
+        gas_price.replace()
+
+        # then
+        assert gas_price.get_gas_price(0) == int(20*GWEI*1.25*1.25)
+
+    def test_should_bump_node_default_gas_price(self):
+        # given
+        gas_price = ReplacingGasPrice(DefaultGasPrice(), multiplier=1.5, default_price_function=lambda: 4*GWEI)
+
+        # expect
+        assert gas_price.get_gas_price(0) is None
+
+        # when
+        gas_price.replace()
+
+        # then
+        assert gas_price.get_gas_price(0) == 6*GWEI
+
+
+class TestGasPriceFactory:
+    def test_should_share_one_scenario_without_gas_config(self):
+        # when
+        gas_prices = GasPriceFactory().create_gas_prices(arguments(gas_price=70*GWEI))
+
+        # then
+        assert isinstance(gas_prices.cancel, FixedGasPrice)
+        assert gas_prices.cancel is gas_prices.place is gas_prices.deposit is gas_prices.approve
+
+    def test_should_create_separate_scenarios_per_operation_class(self, tmpdir):
+        # given
+        gas_config = tmpdir.join("gas.json")
+        gas_config.write(json.dumps({
+            "cancel": {"strategy": "increasing", "initialPrice": 40*GWEI, "increaseBy": 20*GWEI,
+                       "everySecs": 15, "maxPrice": 200*GWEI},
+            "approve": {"strategy": "fixed", "price": 2*GWEI},
+            "deposit": {"strategy": "default"}
+        }))
+
+        # when
+        gas_prices = GasPriceFactory().create_gas_prices(arguments(gas_config=str(gas_config), gas_price=9*GWEI))
+
+        # then
+        assert isinstance(gas_prices.cancel, IncreasingGasPrice)
+        assert gas_prices.cancel.get_gas_price(30) == 80*GWEI
+        assert gas_prices.approve.get_gas_price(0) == 2*GWEI
+        assert isinstance(gas_prices.deposit, DefaultGasPrice)
+
+        # and
+        # ...operation classes not present in the file use the scenario from the commandline
+        assert gas_prices.place.get_gas_price(0) == 9*GWEI
+
+    def test_should_use_scenario_from_the_commandline_if_no_strategy_configured(self, tmpdir):
+        # given
+        gas_config = tmpdir.join("gas.json")
+        gas_config.write(json.dumps({"cancel": {"replaceAfterBlocks": 3}}))
+
+        # when
+        gas_prices = GasPriceFactory().create_gas_prices(arguments(gas_config=str(gas_config), gas_price=9*GWEI))
+
+        # then
+        assert gas_prices.cancel.get_gas_price(0) == 9*GWEI
+        assert gas_prices.cancel is gas_prices.place
+        assert gas_prices.replacement_policy('cancel').after_blocks == 3
+
+    def test_should_not_create_scenario_from_the_commandline_if_not_used(self, tmpdir, monkeypatch):
+        # given
+        gas_config = tmpdir.join("gas.json")
+        gas_config.write(json.dumps({operation: {"strategy": "default"}
+                                     for operation in ['cancel', 'place', 'deposit', 'approve']}))
+
+        # and
+        def create_gas_price(arguments, web3=None):
+            raise Exception("Default scenario should not be created")
+
+        monkeypatch.setattr(GasPriceFactory, 'create_gas_price', staticmethod(create_gas_price))
+
+        # when
+        gas_prices = GasPriceFactory().create_gas_prices(arguments(gas_config=str(gas_config)))
+
+        # then
+        assert isinstance(gas_prices.cancel, DefaultGasPrice)
+
+    def test_should_reject_unknown_operation_classes(self, tmpdir):
+        # given
+        gas_config = tmpdir.join("gas.json")
+        gas_config.write(json.dumps({"kill": {"strategy": "default"}}))
+
+        # expect
+        with pytest.raises(Exception, match="Unknown operation class"):
+            GasPriceFactory().create_gas_prices(arguments(gas_config=str(gas_config)))
+
+    def test_should_reject_unknown_strategies(self, tmpdir):
+        # given
+        gas_config = tmpdir.join("gas.json")
+        gas_config.write(json.dumps({"cancel": {"strategy": "fastest"}}))
+
+        # expect
+        with pytest.raises(Exception, match="Unknown gas price strategy"):
+            GasPriceFactory().create_gas_prices(arguments(gas_config=str(gas_config)))
+
+    def test_should_read_replacement_policies(self, tmpdir):
+        # given
+        gas_config = tmpdir.join("gas.json")
+        gas_config.write(json.dumps({"cancel": {"strategy": "fixed", "price": 2*GWEI, "replaceAfterBlocks": 2,
+                                                "replaceMultiplier": 1.2}}))
+
+        # when
+        gas_prices = GasPriceFactory().create_gas_prices(arguments(gas_config=str(gas_config)))
+
+        # then
+        assert gas_prices.replacement_policy('cancel').after_blocks == 2
+        assert gas_prices.replacement_policy('cancel').multiplier == 1.2
+        assert gas_prices.replacement_policy('cancel').max_replacements == 5
+        assert gas_prices.replacement_policy('place') is None
@@ -0,0 +1,221 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from web3 import Web3, HTTPProvider
+from web3.providers.base import BaseProvider
+
+from market_maker_keeper.gas_station import NodeGasStation
+
+GWEI = 1000000000
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class FakeNode:
+    """Minimal JSON-RPC stand-in for an Ethereum node, serving on a random local port."""
+
+    def __init__(self, fee_history_supported: bool = True):
+        self.fee_history_supported = fee_history_supported
+        self.block_number = 0
+        self.blocks = {}
+        self.calls = []
+
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                response = json.dumps(node.handle(request)).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add_block(self, base_fee: int, gas_prices: list):
+        self.block_number += 1
+        self.blocks[self.block_number] = (base_fee, gas_prices)
+
+    def handle(self, request: dict) -> dict:
+        method, params = request['method'], request['params']
+        self.calls.append(method)
+
+        if method == 'eth_blockNumber':
+            result = hex(self.block_number)
+
+        elif method == 'eth_feeHistory' and self.fee_history_supported:
+            count, percentiles = int(params[0], 16), params[2]
+            numbers = [number for number in range(self.block_number - count + 1, self.block_number + 1)
+                       if number in self.blocks]
+            rewards, ratios = [], []
+            for number in numbers:
+                base_fee, gas_prices = self.blocks[number]
+                priority_fees = sorted(gas_price - base_fee for gas_price in gas_prices)
+                rewards.append([hex(priority_fees[max(int(len(priority_fees) * percentile / 100) - 1, 0)])
+                                if priority_fees else hex(0) for percentile in percentiles])
+                ratios.append(0.5 if gas_prices else 0.0)
+            base_fees = [hex(self.blocks[number][0]) for number in numbers] + [hex(self.blocks[numbers[-1]][0])]
+            result = {'oldestBlock': hex(numbers[0]), 'baseFeePerGas': base_fees,
+                      'gasUsedRatio': ratios, 'reward': rewards}
+
+        elif method == 'eth_getBlockByNumber':
+            number = int(params[0], 16)
+            if number in self.blocks:
+                base_fee, gas_prices = self.blocks[number]
+                result = {'number': hex(number), 'baseFeePerGas': hex(base_fee),
+                          'transactions': [{'gasPrice': hex(gas_price)} for gas_price in gas_prices]}
+            else:
+                result = None
+
+        else:
+            return {'jsonrpc': '2.0', 'id': request['id'],
+                    'error': {'code': -32601, 'message': f"the method {method} does not exist"}}
+
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(params=[True, False], ids=['fee_history', 'block_scan'])
+def node(request):
+    node = FakeNode(fee_history_supported=request.param)
+    for _ in range(4):
+        node.add_block(base_fee=10*GWEI, gas_prices=[(10 + i)*GWEI for i in range(1, 21)])
+
+    yield node
+    node.shutdown()
+
+
+def gas_station(node: FakeNode) -> NodeGasStation:
+    # long refresh interval so the background thread only does the initial fetch,
+    # the tests trigger subsequent refreshes on their own
+    station = NodeGasStation(web3=Web3(HTTPProvider(node.url, request_kwargs={'timeout': 1.0})),
+                             refresh_interval=3600.0, blocks=4)
+    wait_for(lambda: station.fast_price() is not None)
+    return station
+
+
+class TestNodeGasStation:
+    def test_should_calculate_percentile_prices(self, node):
+        # when
+        station = gas_station(node)
+
+        # then
+        assert station.safe_low_price() == 15*GWEI
+        assert station.standard_price() == 20*GWEI
+        assert station.fast_price() == 25*GWEI
+        assert station.fastest_price() == 29*GWEI
+
+    def test_should_return_eip1559_fees(self, node):
+        # when
+        station = gas_station(node)
+
+        # then
+        assert station.eip1559_fees('fast') == {'maxFeePerGas': 35*GWEI, 'maxPriorityFeePerGas': 15*GWEI}
+
+    def test_should_follow_new_blocks(self, node):
+        # given
+        station = gas_station(node)
+
+        # when
+        for _ in range(4):
+            node.add_block(base_fee=20*GWEI, gas_prices=[(20 + i)*GWEI for i in range(1, 21)])
+        station.refresh()
+
+        # then
+        assert station.fast_price() == 35*GWEI
+
+    def test_should_cache_prices_per_block(self, node):
+        # given
+        station = gas_station(node)
+        calls = len(node.calls)
+
+        # when
+        station.refresh()
+        station.refresh()
+
+        # then
+        assert node.calls[calls:] == ['eth_blockNumber', 'eth_blockNumber']
+
+    def test_should_fetch_each_block_only_once(self, node):
+        # given
+        station = gas_station(node)
+
+        # when
+        node.add_block(base_fee=10*GWEI, gas_prices=[(10 + i)*GWEI for i in range(1, 21)])
+        calls = len(node.calls)
+        station.refresh()
+
+        # then
+        assert node.calls[calls:].count('eth_getBlockByNumber') == (0 if node.fee_history_supported else 1)
+
+    def test_should_return_none_if_node_unavailable(self):
+        # given
+        node = FakeNode()
+        url = node.url
+        node.shutdown()
+
+        # when
+        station = NodeGasStation(web3=Web3(HTTPProvider(url, request_kwargs={'timeout': 1.0})), refresh_interval=3600.0)
+        time.sleep(0.5)
+
+        # then
+        assert station.fast_price() is None
+        assert station.eip1559_fees() is None
+
+    def test_should_query_node_through_any_provider(self):
+        # given
+        # ...a provider which is not an HTTP one, like the IPC and WebSocket providers
+        class InProcessProvider(BaseProvider):
+            def __init__(self, node: FakeNode):
+                self.node = node
+                self.request_ids = iter(range(1000))
+
+            def make_request(self, method, params):
+                return self.node.handle({'jsonrpc': '2.0', 'method': method, 'params': params,
+                                         'id': next(self.request_ids)})
+
+        node = FakeNode()
+        node.add_block(base_fee=10*GWEI, gas_prices=[(10 + i)*GWEI for i in range(1, 21)])
+        node.shutdown()
+
+        # when
+        station = NodeGasStation(web3=Web3(InProcessProvider(node)), refresh_interval=3600.0, blocks=1)
+        wait_for(lambda: station.fast_price() is not None)
+
+        # then
+        assert station.fast_price() == 25*GWEI
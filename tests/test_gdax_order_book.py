@@ -0,0 +1,196 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import random
+import time
+
+import pytest
+
+from market_maker_keeper import gdax_order_book
+from market_maker_keeper.gdax_order_book import GdaxOrderBook
+
+
+class TestGdaxOrderBook:
+    @pytest.fixture
+    def order_book(self) -> GdaxOrderBook:
+        order_book = GdaxOrderBook()
+        order_book.apply_snapshot(bids=[["99.00", "1.0"], ["100.00", "3.0"], ["98.00", "5.0"]],
+                                  asks=[["102.00", "2.0"], ["101.00", "1.0"], ["103.00", "4.0"]])
+        return order_book
+
+    def test_should_be_empty_before_snapshot(self):
+        # given
+        order_book = GdaxOrderBook()
+
+        # expect
+        assert(not order_book.initialized)
+        assert(order_book.best_bid() is None)
+        assert(order_book.best_ask() is None)
+        assert(order_book.mid_price() is None)
+        assert(order_book.microprice() is None)
+
+    def test_should_read_top_of_the_book_from_snapshot(self, order_book):
+        # expect
+        assert(order_book.initialized)
+        assert(order_book.best_bid() == (100.0, 3.0))
+        assert(order_book.best_ask() == (101.0, 1.0))
+        assert(order_book.depth() == (3, 3))
+
+    def test_should_calculate_mid_price_and_microprice(self, order_book):
+        # expect
+        assert(order_book.mid_price() == 100.5)
+
+        # and
+        # [the best bid is bigger, so the price leans towards the best ask]
+        assert(order_book.microprice() == (100.0 * 1.0 + 101.0 * 3.0) / 4.0)
+
+    def test_should_add_update_and_remove_levels(self, order_book):
+        # when
+        order_book.apply_update([["buy", "100.50", "2.0"], ["sell", "101.00", "0"]])
+
+        # then
+        assert(order_book.best_bid() == (100.5, 2.0))
+        assert(order_book.best_ask() == (102.0, 2.0))
+        assert(order_book.depth() == (4, 2))
+
+        # when
+        order_book.apply_update([["buy", "100.50", "0.5"], ["buy", "98.00", "0"]])
+
+        # then
+        assert(order_book.best_bid() == (100.5, 0.5))
+        assert(order_book.depth() == (3, 2))
+
+    def test_should_ignore_removal_of_nonexistent_level(self, order_book):
+        # when
+        order_book.apply_update([["buy", "97.00", "0"], ["sell", "110.00", "0"]])
+
+        # then
+        assert(order_book.depth() == (3, 3))
+
+    def test_should_calculate_depth_weighted_prices(self, order_book):
+        # when
+        bid_price, ask_price = order_book.depth_weighted_prices(4.0)
+
+        # then
+        assert(bid_price == (100.0 * 3.0 + 99.0 * 1.0) / 4.0)
+        assert(ask_price == (101.0 * 1.0 + 102.0 * 2.0 + 103.0 * 1.0) / 4.0)
+
+    def test_should_use_all_available_liquidity_if_depth_not_available(self, order_book):
+        # when
+        bid_price, ask_price = order_book.depth_weighted_prices(100.0)
+
+        # then
+        assert(bid_price == (100.0 * 3.0 + 99.0 * 1.0 + 98.0 * 5.0) / 9.0)
+        assert(ask_price == (101.0 * 1.0 + 102.0 * 2.0 + 103.0 * 4.0) / 7.0)
+
+
+class TestGdaxOrderBookReplay:
+    @staticmethod
+    def recorded_messages(number_of_messages: int) -> list:
+        generator = random.Random(1)
+
+        def level(offset: int) -> str:
+            return "%.2f" % (500.0 + offset / 100)
+
+        snapshot = json.dumps({"type": "snapshot",
+                               "product_id": "ETH-USD",
+                               "bids": [[level(-index), "%.8f" % generator.uniform(0.1, 50)] for index in range(1, 5001)],
+                               "asks": [[level(index), "%.8f" % generator.uniform(0.1, 50)] for index in range(1, 5001)]})
+
+        updates = []
+        for _ in range(number_of_messages):
+            side = generator.choice(["buy", "sell"])
+            offset = int(generator.expovariate(0.05)) + 1
+            size = "0" if generator.random() < 0.3 else "%.8f" % generator.uniform(0.1, 50)
+            updates.append(json.dumps({"type": "l2update",
+                                       "product_id": "ETH-USD",
+                                       "time": "2018-06-01T12:00:00.000Z",
+                                       "changes": [[side, level(-offset if side == "buy" else offset), size]]}))
+
+        return [snapshot] + updates
+
+    def test_should_apply_updates_without_sorting_the_book(self, monkeypatch):
+        # given
+        # [the `level2` channel of a busy GDAX product peaks at around 1000 messages per second,
+        #  so updates have to be applied in place instead of re-sorting the whole book each time]
+        messages = self.recorded_messages(5000)
+        order_book = GdaxOrderBook()
+
+        # and
+        sorts = []
+
+        def counting_sorted(iterable):
+            sorts.append(1)
+            return sorted(iterable)
+
+        monkeypatch.setattr(gdax_order_book, 'sorted', counting_sorted, raising=False)
+
+        # and
+        # [a naive model of the book, to check the result against]
+        bids, asks = {}, {}
+
+        # when
+        for message in messages:
+            message_obj = json.loads(message)
+            if message_obj['type'] == 'snapshot':
+                order_book.apply_snapshot(message_obj['bids'], message_obj['asks'])
+                bids = {float(price): float(size) for price, size in message_obj['bids']}
+                asks = {float(price): float(size) for price, size in message_obj['asks']}
+            else:
+                order_book.apply_update(message_obj['changes'])
+                order_book.microprice()
+                for side, price, size in message_obj['changes']:
+                    levels = bids if side == 'buy' else asks
+                    if float(size) > 0:
+                        levels[float(price)] = float(size)
+                    else:
+                        levels.pop(float(price), None)
+
+        # then
+        assert(len(sorts) == 2)
+
+        # and
+        assert(order_book.depth() == (len(bids), len(asks)))
+        assert(order_book.best_bid() == (max(bids), bids[max(bids)]))
+        assert(order_book.best_ask() == (min(asks), asks[min(asks)]))
+        assert(order_book.depth_weighted_prices(1000000.0) ==
+               pytest.approx((sum(price * size for price, size in bids.items()) / sum(bids.values()),
+                              sum(price * size for price, size in asks.items()) / sum(asks.values()))))
+
+    def test_should_replay_updates_well_above_peak_message_rate(self):
+        # given
+        # [a busy GDAX product peaks at around 1000 `level2` messages per second; the floor leaves
+        #  room for slow machines, the replay runs at well over 100000 messages per second on a laptop]
+        min_messages_per_second = 10000
+        messages = self.recorded_messages(20000)
+        order_book = GdaxOrderBook()
+
+        # and
+        snapshot = json.loads(messages[0])
+        order_book.apply_snapshot(snapshot['bids'], snapshot['asks'])
+
+        # when
+        # [decoding the message, applying it and reading the price, like the price feed does]
+        start = time.perf_counter()
+        for message in messages[1:]:
+            order_book.apply_update(json.loads(message)['changes'])
+            order_book.microprice()
+        elapsed = time.perf_counter() - start
+
+        # then
+        assert((len(messages) - 1) / elapsed > min_messages_per_second)
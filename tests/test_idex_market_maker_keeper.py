@@ -0,0 +1,192 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from market_maker_keeper.feed import EmptyFeed
+from market_maker_keeper.idex_market_maker_keeper import IdexMarketMakerKeeper
+from market_maker_keeper.limit import History
+from market_maker_keeper.order_book import OrderBook
+from market_maker_keeper.price_feed import Price
+from market_maker_keeper.reloadable_config import ReloadableConfig
+from pymaker import Address
+from pymaker.numeric import Wad
+from tests.band_config import BandConfig
+
+SAI_TOKEN = Address('0x0000000000000000000000000000000000000002')
+
+
+class FakeOrder:
+    def __init__(self, order_id: int, is_sell: bool, price: float, amount: float):
+        self.order_id = order_id
+        self.is_sell = is_sell
+        self.price = Wad.from_number(price)
+        self.amount = Wad.from_number(amount)
+
+    @property
+    def sell_to_buy_price(self) -> Wad:
+        return self.price
+
+    @property
+    def buy_to_sell_price(self) -> Wad:
+        return self.price
+
+    @property
+    def remaining_sell_amount(self) -> Wad:
+        return self.amount
+
+
+class FakeIDEXApi:
+    def __init__(self, orders: list):
+        self.orders = orders
+        self.placed_orders = []
+
+    def get_orders(self, pair: str) -> list:
+        assert pair == 'DAI_ETH'
+        return self.orders
+
+    def place_order(self, pay_token: Address, pay_amount: Wad, buy_token: Address, buy_amount: Wad):
+        self.placed_orders.append((pay_token, pay_amount, buy_token, buy_amount))
+
+
+class FakeOrderBookManager:
+    """Returns an order book built from `get_orders_function`, records all the calls made by the keeper."""
+
+    def __init__(self, get_orders_function, place_order_function, balances: dict):
+        self.get_orders_function = get_orders_function
+        self.place_order_function = place_order_function
+        self.balances = balances
+        self.orders_being_placed = False
+        self.orders_being_cancelled = False
+        self.cancelled_orders = []
+        self.cancelled_all_orders = False
+
+    def get_order_book(self) -> OrderBook:
+        return OrderBook(orders=self.get_orders_function(),
+                         balances=self.balances,
+                         orders_being_placed=self.orders_being_placed,
+                         orders_being_cancelled=self.orders_being_cancelled)
+
+    def cancel_orders(self, orders: list):
+        self.cancelled_orders.extend(orders)
+
+    def cancel_all_orders(self):
+        self.cancelled_all_orders = True
+
+    def place_orders(self, new_orders: list):
+        for new_order in new_orders:
+            self.place_order_function(new_order)
+
+
+class FakeDepositManager:
+    def __init__(self):
+        self.synchronized = False
+
+    def synchronize(self, **kwargs):
+        self.synchronized = True
+
+
+class FakePriceFeed:
+    def get_price(self) -> Price:
+        return Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(100))
+
+
+class FakeSai:
+    address = SAI_TOKEN
+
+
+class TestIdexMarketMakerKeeper:
+    @staticmethod
+    def create_keeper(tmpdir, orders: list, eth_balance: float = 20.0):
+        # the keeper gets created without calling `__init__`, so it does not need a node nor the IDEX API
+        keeper = IdexMarketMakerKeeper.__new__(IdexMarketMakerKeeper)
+        keeper.sai = FakeSai()
+        keeper.bands_config = ReloadableConfig(str(BandConfig.sample_config(tmpdir)))
+        keeper.spread_feed = EmptyFeed()
+        keeper.history = History()
+        keeper.price_feed = FakePriceFeed()
+        keeper.eth_reserve = Wad.from_number(10)
+        keeper.min_eth_balance = Wad.from_number(1)
+        keeper.deposit_manager = FakeDepositManager()
+        keeper.idex_api = FakeIDEXApi(orders)
+        keeper.order_book_manager = FakeOrderBookManager(keeper.our_orders, keeper.place_order_function,
+                                                         {'timestamp': time.time(),
+                                                          'api': {'ETH': {'available': '100.0'},
+                                                                  'DAI': {'available': '1000.0'}},
+                                                          'eth_deposited': Wad.from_number(100),
+                                                          'dai_deposited': Wad.from_number(1000),
+                                                          'sai_balance': Wad(0),
+                                                          'eth_balance': Wad.from_number(eth_balance)})
+        return keeper
+
+    def test_should_place_orders_in_all_bands(self, tmpdir):
+        # given
+        keeper = self.create_keeper(tmpdir, [])
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert(len(keeper.idex_api.placed_orders) == 2)
+        assert(keeper.deposit_manager.synchronized)
+
+    def test_should_cancel_all_orders_if_eth_balance_below_minimum(self, tmpdir):
+        # given
+        keeper = self.create_keeper(tmpdir, [FakeOrder(1, False, 96, 75)], eth_balance=0.5)
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert(keeper.order_book_manager.cancelled_all_orders)
+        assert(keeper.idex_api.placed_orders == [])
+        assert(not keeper.deposit_manager.synchronized)
+
+    def test_should_only_cancel_orders_if_some_are_cancellable(self, tmpdir):
+        # given
+        order_outside_bands = FakeOrder(1, False, 50, 75)
+        keeper = self.create_keeper(tmpdir, [order_outside_bands])
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert(keeper.order_book_manager.cancelled_orders == [order_outside_bands])
+        assert(keeper.idex_api.placed_orders == [])
+        assert(not keeper.deposit_manager.synchronized)
+
+    def test_should_not_place_orders_while_orders_are_being_placed(self, tmpdir):
+        # given
+        keeper = self.create_keeper(tmpdir, [])
+        keeper.order_book_manager.orders_being_placed = True
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert(keeper.idex_api.placed_orders == [])
+
+    def test_should_not_place_orders_while_orders_are_being_cancelled(self, tmpdir):
+        # given
+        keeper = self.create_keeper(tmpdir, [])
+        keeper.order_book_manager.orders_being_cancelled = True
+
+        # when
+        keeper.synchronize_orders()
+
+        # then
+        assert(keeper.idex_api.placed_orders == [])
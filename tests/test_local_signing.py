@@ -0,0 +1,205 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import rlp
+from bitcoin import ecdsa_raw_recover, encode_pubkey
+from ethereum.utils import big_endian_to_int, sha3
+
+from market_maker_keeper.local_signing import LocalAccount, SigningMiddleware
+
+# private key and transaction from the EIP-155 example
+PRIVATE_KEY = bytes.fromhex('46' * 32)
+ADDRESS = '0x9d8a62f656a8d1615c1294fd71e9cfb3e4855a4f'
+TRANSACTION = {'nonce': 9, 'gasPrice': 20000000000, 'gas': 21000,
+               'to': '0x3535353535353535353535353535353535353535', 'value': 1000000000000000000}
+
+
+def recover_address(message_hash: bytes, v: int, r: int, s: int) -> str:
+    public_key = ecdsa_raw_recover(message_hash, (v, r, s))
+    return '0x' + sha3(encode_pubkey(public_key, 'bin')[1:])[12:].hex()
+
+
+class FakeAccount:
+    address = '0x00000000000000000000000000000000000000aa'
+
+    def sign_transaction(self, transaction: dict, chain_id: int) -> str:
+        return f"signed:{transaction['nonce']}:{transaction['gasPrice']}:{chain_id}"
+
+    def sign_message(self, message: str) -> str:
+        return f"signature:{message}"
+
+
+class FakeNode:
+    def __init__(self):
+        self.pending_count = 10
+        self.raw_transactions = []
+        self.requests = []
+        self.reject_with = None
+
+    def make_request(self, method, params):
+        self.requests.append(method)
+
+        if method == 'eth_getTransactionCount':
+            return {'result': self.pending_count}
+        elif method == 'eth_gasPrice':
+            return {'result': 20000000000}
+        elif method == 'net_version':
+            return {'result': '42'}
+        elif method == 'eth_sendRawTransaction':
+            if self.reject_with is not None:
+                return {'error': {'code': -32010, 'message': self.reject_with}}
+
+            self.raw_transactions.append(params[0])
+            self.pending_count += 1
+            return {'result': '0x' + '00' * 32}
+        else:
+            return {'result': f"node:{method}"}
+
+
+class TestLocalAccount:
+    def test_should_derive_address_from_private_key(self):
+        # expect
+        assert LocalAccount(PRIVATE_KEY).address == ADDRESS
+
+    def test_should_sign_transactions_with_chain_id(self):
+        # when
+        raw_transaction = LocalAccount(PRIVATE_KEY).sign_transaction(TRANSACTION, 1)
+
+        # then
+        assert raw_transaction == '0xf86c098504a817c800825208943535353535353535353535353535353535353535880de0b6b3a7640000' \
+                                  '8025a028ef61340bd939bc2195fe537567866003e1a15d3c71ff63e1590620aa636276a067cbe9d8997f' \
+                                  '761aecb703304b3800ccf555c9f3dc64214b297fb1966a3b6d83'
+
+    def test_should_recover_sender_and_nonce_from_signed_transaction(self):
+        # given
+        chain_id = 42
+
+        # when
+        fields = rlp.decode(bytes.fromhex(LocalAccount(PRIVATE_KEY).sign_transaction(TRANSACTION, chain_id)[2:]))
+
+        # then
+        nonce, v, r, s = big_endian_to_int(fields[0]), big_endian_to_int(fields[6]), \
+                         big_endian_to_int(fields[7]), big_endian_to_int(fields[8])
+        assert nonce == 9
+        assert v in [chain_id*2 + 35, chain_id*2 + 36]
+
+        # and
+        message_hash = sha3(rlp.encode(fields[:6] + [chain_id, 0, 0]))
+        assert recover_address(message_hash, v - chain_id*2 - 8, r, s) == ADDRESS
+
+    def test_should_sign_messages_like_eth_sign(self):
+        # given
+        message = bytes.fromhex('0123456789abcdef')
+
+        # when
+        signature = bytes.fromhex(LocalAccount(PRIVATE_KEY).sign_message('0x' + message.hex())[2:])
+
+        # then
+        assert len(signature) == 65
+        assert signature[64] in [27, 28]
+
+        # and
+        message_hash = sha3(b"\x19Ethereum Signed Message:\n8" + message)
+        assert recover_address(message_hash, signature[64], big_endian_to_int(signature[0:32]),
+                               big_endian_to_int(signature[32:64])) == ADDRESS
+
+
+class TestSigningMiddleware:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.signing_middleware = SigningMiddleware([FakeAccount()], gap_check_interval=3600)
+        self.make_request = self.signing_middleware(self.node.make_request, None)
+
+    def test_should_sign_transactions_of_local_accounts(self):
+        # when
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address.upper().replace('0X', '0x'),
+                                                   'to': '0x00000000000000000000000000000000000000bb',
+                                                   'gas': 100000, 'gasPrice': 5000000000}])
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address,
+                                                   'to': '0x00000000000000000000000000000000000000bb',
+                                                   'gas': 100000}])
+
+        # then
+        assert self.node.raw_transactions == ['signed:10:5000000000:42', 'signed:11:20000000000:42']
+        assert 'eth_sendTransaction' not in self.node.requests
+
+    def test_should_keep_nonce_of_replacement_transactions(self):
+        # when
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address, 'gas': 100000,
+                                                   'gasPrice': 5000000000, 'nonce': 3}])
+
+        # then
+        assert self.node.raw_transactions == ['signed:3:5000000000:42']
+
+    def test_should_pass_other_accounts_and_calls_to_the_node(self):
+        # expect
+        assert self.make_request('eth_sendTransaction', [{'from': '0x00000000000000000000000000000000000000cc',
+                                                          'gas': 100000}]) == {'result': 'node:eth_sendTransaction'}
+        assert self.make_request('eth_blockNumber', []) == {'result': 'node:eth_blockNumber'}
+
+    def test_should_sign_messages_of_local_accounts(self):
+        # expect
+        assert self.make_request('eth_sign', [FakeAccount.address, '0x1234'])['result'] == 'signature:0x1234'
+
+    def test_should_reuse_nonce_if_transaction_rejected(self):
+        # given
+        self.node.reject_with = "insufficient funds for gas * price + value"
+
+        # when
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address, 'gas': 100000}])
+        self.node.reject_with = None
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address, 'gas': 100000}])
+
+        # then
+        assert self.node.raw_transactions == ['signed:10:20000000000:42']
+
+    def test_should_fill_nonce_gaps_after_nonce_rejected(self):
+        # given
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address, 'gas': 100000}])
+
+        # and
+        # ...some other process sent a transaction with nonce 11 in the meantime
+        self.node.pending_count = 12
+        self.node.reject_with = "nonce too low"
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address, 'gas': 100000}])
+        self.node.reject_with = None
+        self.make_request('eth_sendTransaction', [{'from': FakeAccount.address, 'gas': 100000}])
+
+        # when
+        # ...transaction with nonce 11 of the other process got dropped by the node
+        self.node.pending_count = 11
+        self.signing_middleware.fill_nonce_gaps()
+        self.signing_middleware.fill_nonce_gaps()
+
+        # then
+        assert self.node.raw_transactions == ['signed:10:20000000000:42',
+                                              'signed:12:20000000000:42',
+                                              'signed:11:20000000000:42']
+
+    def test_should_fill_nonce_gaps(self):
+        # given
+        for _ in range(3):
+            self.make_request('eth_sendTransaction', [{'from': FakeAccount.address, 'gas': 100000}])
+
+        # when
+        # ...transaction with nonce 11 got dropped by the node
+        self.node.pending_count = 11
+        self.signing_middleware.fill_nonce_gaps()
+        self.signing_middleware.fill_nonce_gaps()
+
+        # then
+        assert self.node.raw_transactions[-1] == 'signed:11:20000000000:42'
@@ -0,0 +1,156 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from market_maker_keeper.nonce_manager import NonceManager
+
+
+class FakeAccount:
+    def __init__(self, pending_count: int):
+        self.pending_count = pending_count
+        self.calls = 0
+
+    def get_transaction_count(self, block_identifier: str) -> int:
+        assert block_identifier == 'pending'
+        self.calls += 1
+        return self.pending_count
+
+
+class TestNonceManager:
+    def test_should_start_from_pending_transaction_count(self):
+        # given
+        account = FakeAccount(pending_count=7)
+        nonce_manager = NonceManager(account.get_transaction_count)
+
+        # expect
+        assert nonce_manager.next_nonce() == 7
+        assert nonce_manager.next_nonce() == 8
+        assert nonce_manager.next_nonce() == 9
+
+        # and
+        assert account.calls == 1
+
+    def test_should_hand_out_unique_nonces_concurrently(self):
+        # given
+        nonce_manager = NonceManager(FakeAccount(pending_count=0).get_transaction_count)
+        nonces = []
+
+        def take_nonces():
+            for _ in range(100):
+                nonces.append(nonce_manager.next_nonce())
+
+        # when
+        threads = [threading.Thread(target=take_nonces) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # then
+        assert sorted(nonces) == list(range(800))
+
+    def test_should_reuse_nonces_of_failed_transactions(self):
+        # given
+        nonce_manager = NonceManager(FakeAccount(pending_count=0).get_transaction_count)
+        nonce_manager.sent(nonce_manager.next_nonce())
+        failed_nonce = nonce_manager.next_nonce()
+        nonce_manager.sent(nonce_manager.next_nonce())
+
+        # when
+        nonce_manager.failed(failed_nonce)
+
+        # then
+        assert nonce_manager.next_nonce() == 1
+        assert nonce_manager.next_nonce() == 3
+
+    def test_should_fetch_nonce_from_node_again_after_reset(self):
+        # given
+        account = FakeAccount(pending_count=0)
+        nonce_manager = NonceManager(account.get_transaction_count)
+        nonce_manager.sent(nonce_manager.next_nonce())
+
+        # when
+        account.pending_count = 5
+        nonce_manager.reset()
+
+        # then
+        assert nonce_manager.next_nonce() == 5
+
+    def test_should_find_gaps(self):
+        # given
+        account = FakeAccount(pending_count=0)
+        nonce_manager = NonceManager(account.get_transaction_count)
+        for _ in range(3):
+            nonce_manager.sent(nonce_manager.next_nonce())
+
+        # when
+        # ...transaction with nonce 1 got lost
+        account.pending_count = 1
+
+        # then
+        assert nonce_manager.find_gap() is None
+        assert nonce_manager.find_gap() == 1
+
+        # when
+        account.pending_count = 3
+
+        # then
+        assert nonce_manager.find_gap() is None
+
+    def test_should_not_consider_gaps_gone_by_the_next_check_as_gaps(self):
+        # given
+        account = FakeAccount(pending_count=0)
+        nonce_manager = NonceManager(account.get_transaction_count)
+        for _ in range(3):
+            nonce_manager.sent(nonce_manager.next_nonce())
+
+        # when
+        # ...the node has not seen the transaction with nonce 2 yet
+        account.pending_count = 2
+        nonce_manager.find_gap()
+
+        # and
+        account.pending_count = 3
+
+        # then
+        assert nonce_manager.find_gap() is None
+        assert nonce_manager.find_gap() is None
+
+    def test_should_not_consider_nonces_in_flight_as_gaps(self):
+        # given
+        account = FakeAccount(pending_count=0)
+        nonce_manager = NonceManager(account.get_transaction_count)
+
+        # when
+        nonce_manager.next_nonce()
+
+        # then
+        assert nonce_manager.find_gap() is None
+
+    def test_should_carry_on_after_transactions_sent_by_other_processes(self):
+        # given
+        account = FakeAccount(pending_count=0)
+        nonce_manager = NonceManager(account.get_transaction_count)
+        nonce_manager.sent(nonce_manager.next_nonce())
+
+        # when
+        account.pending_count = 4
+        nonce_manager.find_gap()
+
+        # then
+        assert nonce_manager.next_nonce() == 4
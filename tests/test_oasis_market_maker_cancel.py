@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+
 from market_maker_keeper.oasis_market_maker_cancel import OasisMarketMakerCancel
 from pymaker import Address
 from pymaker.approval import directly
@@ -104,3 +106,119 @@ class TestOasisMarketMakerCancel:
         # then
         assert len(deployment.otc.get_orders()) == 0
         assert deployment.web3.eth.getBlock('latest', True)['transactions'][0]['gasPrice'] == some_gas_price
+
+    def test_should_cancel_orders_in_waves(self, deployment: Deployment):
+        # given
+        keeper = OasisMarketMakerCancel(args=args(f"--eth-from {deployment.web3.eth.defaultAccount} "
+                                             f"--oasis-address {deployment.otc.address} "
+                                             f"--wave-size 2"),
+                                        web3=deployment.web3)
+
+        # and
+        DSToken(web3=deployment.web3, address=deployment.gem.address).mint(Wad.from_number(1000)).transact()
+
+        # and
+        deployment.otc.approve([deployment.gem, deployment.sai], directly())
+        for index in range(0, 5):
+            deployment.otc.make(deployment.gem.address, Wad.from_number(1), deployment.sai.address, Wad.from_number(10 + index)).transact()
+        assert len(deployment.otc.get_orders()) == 5
+
+        # and
+        # [kills still pending get counted each time a new one is sent]
+        pending_kills = []
+        max_pending_kills = []
+        transact = keeper.receipt_tracker.transact
+
+        def counting_transact(*args, **kwargs):
+            pending_kills[:] = [future for future in pending_kills if not future.done()]
+            future = transact(*args, **kwargs)
+            pending_kills.append(future)
+            max_pending_kills.append(len(pending_kills))
+            return future
+
+        keeper.receipt_tracker.transact = counting_transact
+
+        # when
+        keeper.main()
+
+        # then
+        assert len(deployment.otc.get_orders()) == 0
+        assert keeper.receipt_tracker.statistics()['cancel']['count'] == 5
+        assert len(max_pending_kills) == 5
+        assert max(max_pending_kills) <= 2
+
+    def test_should_find_orders_scanning_in_ranges_of_blocks(self, deployment: Deployment):
+        # given
+        from_block = deployment.web3.eth.blockNumber
+        keeper = OasisMarketMakerCancel(args=args(f"--eth-from {deployment.web3.eth.defaultAccount} "
+                                             f"--oasis-address {deployment.otc.address} "
+                                             f"--from-block {from_block} "
+                                             f"--scan-blocks 2"),
+                                        web3=deployment.web3)
+
+        # and
+        DSToken(web3=deployment.web3, address=deployment.gem.address).mint(Wad.from_number(1000)).transact()
+
+        # and
+        deployment.otc.approve([deployment.gem, deployment.sai], directly())
+        for index in range(0, 5):
+            deployment.otc.make(deployment.gem.address, Wad.from_number(1), deployment.sai.address, Wad.from_number(10 + index)).transact()
+        assert len(deployment.otc.get_orders()) == 5
+
+        # and
+        get_logs_calls = []
+        request_blocking = deployment.web3.manager.request_blocking
+
+        def counting_request_blocking(method, params):
+            if method == 'eth_getLogs':
+                get_logs_calls.append(params[0])
+            return request_blocking(method, params)
+
+        deployment.web3.manager.request_blocking = counting_request_blocking
+
+        # when
+        try:
+            keeper.main()
+        finally:
+            deployment.web3.manager.request_blocking = request_blocking
+
+        # then
+        assert len(deployment.otc.get_orders()) == 0
+        assert len(get_logs_calls) > 1
+        assert all(int(call['toBlock'], 16) - int(call['fromBlock'], 16) < 2 for call in get_logs_calls)
+
+    def test_should_save_progress_and_resume_from_it(self, deployment: Deployment, tmpdir):
+        # given
+        state_file = str(tmpdir.join("state.json"))
+        arguments = args(f"--eth-from {deployment.web3.eth.defaultAccount} "
+                         f"--oasis-address {deployment.otc.address} "
+                         f"--state-file {state_file}")
+
+        # and
+        DSToken(web3=deployment.web3, address=deployment.gem.address).mint(Wad.from_number(1000)).transact()
+
+        # and
+        deployment.otc.approve([deployment.gem, deployment.sai], directly())
+        deployment.otc.make(deployment.gem.address, Wad.from_number(1), deployment.sai.address, Wad.from_number(10)).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(1), deployment.sai.address, Wad.from_number(11)).transact()
+
+        # when
+        OasisMarketMakerCancel(args=arguments, web3=deployment.web3).main()
+
+        # then
+        assert len(deployment.otc.get_orders()) == 0
+
+        # and
+        with open(state_file) as file:
+            state = json.load(file)
+        assert state['orderIds'] == []
+        assert state['lastBlock'] > 0
+
+        # when
+        deployment.otc.make(deployment.gem.address, Wad.from_number(1), deployment.sai.address, Wad.from_number(12)).transact()
+        keeper = OasisMarketMakerCancel(args=arguments, web3=deployment.web3)
+        keeper.main()
+
+        # then
+        assert len(deployment.otc.get_orders()) == 0
+        assert keeper.receipt_tracker.statistics()['cancel']['count'] == 1
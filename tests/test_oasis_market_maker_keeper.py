@@ -643,6 +643,61 @@ class TestOasisMarketMakerKeeper:
             for transaction in deployment.web3.eth.getBlock(block_number, full_transactions=True).transactions:
                 assert transaction.gasPrice == 70000000000
 
+    def test_should_use_gas_config_for_each_operation_class(self, deployment: Deployment, tmpdir):
+        # given
+        config_file = BandConfig.sample_config(tmpdir)
+
+        # and
+        gas_config_file = tmpdir.join("gas_config.json")
+        gas_config_file.write("""{"approve": {"strategy": "fixed", "price": 50000000000},
+                                  "place": {"strategy": "fixed", "price": 60000000000}}""")
+
+        # and
+        keeper = OasisMarketMakerKeeper(args=args(f"--eth-from {deployment.our_address} "
+                                                  f"--tub-address {deployment.tub.address} "
+                                                  f"--oasis-address {deployment.otc.address} "
+                                                  f"--buy-token-address {deployment.sai.address} "
+                                                  f"--sell-token-address {deployment.gem.address} "
+                                                  f"--price-feed tub "
+                                                  f"--config {config_file} "
+                                                  f"--gas-config {gas_config_file} "
+                                                  f"--gas-price 70000000000"),
+                                        web3=deployment.web3)
+        keeper.lifecycle = Lifecycle(web3=keeper.web3)
+
+        # and
+        self.mint_tokens(deployment)
+        self.set_price(deployment, Wad.from_number(100))
+
+        # when
+        start_block_number = deployment.web3.eth.blockNumber
+        keeper.approve()
+        approve_block_number = deployment.web3.eth.blockNumber
+
+        # then
+        for block_number in range(start_block_number+1, approve_block_number+1):
+            for transaction in deployment.web3.eth.getBlock(block_number, full_transactions=True).transactions:
+                assert transaction.gasPrice == 50000000000
+
+        # when
+        self.synchronize_orders_once(keeper)
+
+        # then
+        for block_number in range(approve_block_number+1, deployment.web3.eth.blockNumber+1):
+            for transaction in deployment.web3.eth.getBlock(block_number, full_transactions=True).transactions:
+                assert transaction.gasPrice == 60000000000
+
+        # when
+        self.set_price(deployment, Wad.from_number(200))
+        cancel_block_number = deployment.web3.eth.blockNumber
+        self.synchronize_orders_once(keeper)
+
+        # then
+        # ...cancellations use the `--gas-price`, as they are not present in the gas configuration file
+        assert any(transaction.gasPrice == 70000000000
+                   for block_number in range(cancel_block_number+1, deployment.web3.eth.blockNumber+1)
+                   for transaction in deployment.web3.eth.getBlock(block_number, full_transactions=True).transactions)
+
     def test_should_cancel_all_orders_but_not_terminate_if_eth_balance_below_minimum(self, deployment: Deployment, tmpdir):
         # given
         config_file = BandConfig.two_adjacent_bands_config(tmpdir)
@@ -854,6 +909,55 @@ class TestOasisMarketMakerKeeper:
         assert self.orders_by_token(deployment, deployment.gem)[0].buy_amount == Wad.from_number(780*2)
         assert self.orders_by_token(deployment, deployment.gem)[0].buy_token == deployment.sai.address
 
+    def test_should_use_less_gas_placing_orders_with_position_hints(self, deployment: Deployment, tmpdir):
+        # given
+        config_file = BandConfig.sample_config(tmpdir)
+
+        # and
+        keeper = OasisMarketMakerKeeper(args=args(f"--eth-from {deployment.our_address} "
+                                                  f"--tub-address {deployment.tub.address} "
+                                                  f"--oasis-address {deployment.otc.address} "
+                                                  f"--buy-token-address {deployment.sai.address} "
+                                                  f"--sell-token-address {deployment.gem.address} "
+                                                  f"--price-feed tub "
+                                                  f"--config {config_file}"),
+                                        web3=deployment.web3)
+        keeper.lifecycle = Lifecycle(web3=keeper.web3)
+
+        # and
+        self.mint_tokens(deployment)
+        keeper.approve()
+
+        # and
+        # a deep book of sell orders, each one priced worse than the previous one
+        for index in range(0, 20):
+            deployment.otc.make(pay_token=deployment.gem.address, pay_amount=Wad.from_number(0.1),
+                                buy_token=deployment.sai.address, buy_amount=Wad.from_number(10 + index),
+                                pos=0).transact()
+
+        # when
+        unhinted_receipt = deployment.otc.make(pay_token=deployment.gem.address, pay_amount=Wad.from_number(0.1),
+                                               buy_token=deployment.sai.address, buy_amount=Wad.from_number(40),
+                                               pos=0).transact()
+
+        # and
+        keeper.order_index.get_orders()
+        pos = keeper.order_index.insertion_position(pay_token=deployment.gem.address, pay_amount=Wad.from_number(0.1),
+                                                    buy_token=deployment.sai.address, buy_amount=Wad.from_number(40))
+        hinted_receipt = deployment.otc.make(pay_token=deployment.gem.address, pay_amount=Wad.from_number(0.1),
+                                             buy_token=deployment.sai.address, buy_amount=Wad.from_number(40),
+                                             pos=pos).transact()
+
+        # then
+        assert unhinted_receipt.successful
+        assert hinted_receipt.successful
+        assert pos != 0
+
+        # and
+        # the contract walked all the 20 orders without the hint, and only one or two of them with it,
+        # each order walked costing at least the four `SLOAD`s of the price comparison (800 gas)
+        assert unhinted_receipt.gas_used - hinted_receipt.gas_used >= 18 * 800
+
     @staticmethod
     def leave_only_some_eth(deployment: Deployment, amount_of_eth_to_leave: Wad):
         balance = Wad(deployment.web3.eth.getBalance(deployment.our_address.address))
@@ -0,0 +1,388 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from eth_abi import encode_abi, decode_abi
+from eth_utils import decode_hex, encode_hex, function_signature_to_4byte_selector
+
+from market_maker_keeper.oasis_order_index import OasisOrderIndex, OasisOrderReader
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import Order, LogMake, LogKill, LogTake
+
+OUR_ADDRESS = Address('0x00000000000000000000000000000000000000aa')
+OTHER_ADDRESS = Address('0x00000000000000000000000000000000000000bb')
+TOKEN_A = Address('0x0000000000000000000000000000000000000001')
+TOKEN_B = Address('0x0000000000000000000000000000000000000002')
+TOKEN_C = Address('0x0000000000000000000000000000000000000003')
+
+
+def event(cls, block_number: int, log_index: int, **kwargs):
+    result = cls.__new__(cls)
+    result.raw = {'blockNumber': block_number, 'logIndex': log_index, 'transactionHash': f"0x{block_number}{log_index}"}
+    for key, value in kwargs.items():
+        setattr(result, key, value)
+
+    return result
+
+
+class FakeEth:
+    """Blocks are identified by their number and the fork they belong to, `reorg()` starts a new fork."""
+
+    blockNumber = 100
+
+    def __init__(self):
+        self.forks = {}
+        self.block_requests = []
+
+    def block_hash(self, block_number: int) -> str:
+        return f"0x{block_number}-{self.forks.get(block_number, 0)}"
+
+    def getBlock(self, block_identifier):
+        self.block_requests.append(block_identifier)
+        block_number = self.blockNumber if block_identifier == 'latest' else block_identifier
+        return {'number': block_number,
+                'hash': self.block_hash(block_number),
+                'parentHash': self.block_hash(block_number - 1)}
+
+    def reorg(self, from_block: int):
+        for block_number in range(from_block, self.blockNumber + 1):
+            self.forks[block_number] = self.forks.get(block_number, 0) + 1
+
+
+class FakeWeb3:
+    eth = FakeEth()
+
+
+class FakeOtc:
+    """Keeps orders as of the latest block and all events, as MatchingMarket would."""
+
+    def __init__(self, web3: FakeWeb3):
+        self.web3 = web3
+        self.orders = {}
+        self.events = []
+        self.calls = []
+        self.log_index = 0
+
+    def order(self, order_id, maker, pay_token, pay_amount, buy_token, buy_amount):
+        return Order(market=self, order_id=order_id, maker=maker, pay_token=pay_token, pay_amount=Wad.from_number(pay_amount),
+                     buy_token=buy_token, buy_amount=Wad.from_number(buy_amount), timestamp=0)
+
+    def make(self, order_id, maker, pay_token, pay_amount, buy_token, buy_amount):
+        self.orders[order_id] = self.order(order_id, maker, pay_token, pay_amount, buy_token, buy_amount)
+        self.log_index += 1
+        self.events.append(event(LogMake, self.web3.eth.blockNumber, self.log_index, order_id=order_id, maker=maker,
+                                 pay_token=pay_token, pay_amount=Wad.from_number(pay_amount),
+                                 buy_token=buy_token, buy_amount=Wad.from_number(buy_amount), timestamp=0))
+
+    def kill(self, order_id):
+        order = self.orders.pop(order_id)
+        self.log_index += 1
+        self.events.append(event(LogKill, self.web3.eth.blockNumber, self.log_index, order_id=order_id, maker=order.maker,
+                                 pay_token=order.pay_token, buy_token=order.buy_token))
+
+    def take(self, order_id, take_amount):
+        order = self.orders[order_id]
+        pay_amount = order.pay_amount - Wad.from_number(take_amount)
+        buy_amount = order.buy_amount - order.buy_amount * Wad.from_number(take_amount) / order.pay_amount
+        self.orders[order_id] = Order(market=self, order_id=order_id, maker=order.maker, pay_token=order.pay_token,
+                                      pay_amount=pay_amount, buy_token=order.buy_token, buy_amount=buy_amount, timestamp=0)
+        if pay_amount == Wad(0):
+            del self.orders[order_id]
+
+        self.log_index += 1
+        self.events.append(event(LogTake, self.web3.eth.blockNumber, self.log_index, order_id=order_id, maker=order.maker,
+                                 taker=OTHER_ADDRESS, pay_token=order.pay_token, take_amount=Wad.from_number(take_amount),
+                                 buy_token=order.buy_token, give_amount=Wad(0)))
+
+    def get_orders(self, pay_token, buy_token):
+        self.calls.append('get_orders')
+        return [order for order in self.orders.values() if order.pay_token == pay_token and order.buy_token == buy_token]
+
+    def get_orders_by_id(self, order_ids):
+        self.calls.append('get_orders_by_id')
+        return [self.orders.get(order_id) for order_id in order_ids]
+
+    def _past(self, cls, number_of_past_blocks, event_filter):
+        self.calls.append('past_events')
+        return [e for e in self.events if isinstance(e, cls)
+                and e.raw['blockNumber'] > self.web3.eth.blockNumber - number_of_past_blocks
+                and e.maker.address == event_filter['maker']]
+
+    def past_make(self, number_of_past_blocks, event_filter=None):
+        return self._past(LogMake, number_of_past_blocks, event_filter)
+
+    def past_kill(self, number_of_past_blocks, event_filter=None):
+        return self._past(LogKill, number_of_past_blocks, event_filter)
+
+    def past_take(self, number_of_past_blocks, event_filter=None):
+        return self._past(LogTake, number_of_past_blocks, event_filter)
+
+
+class TestOasisOrderIndex:
+    def setup_method(self):
+        self.web3 = FakeWeb3()
+        self.web3.eth = FakeEth()
+        self.otc = FakeOtc(self.web3)
+        self.otc.make(1, OUR_ADDRESS, TOKEN_A, 10, TOKEN_B, 20)
+        self.otc.make(2, OTHER_ADDRESS, TOKEN_A, 10, TOKEN_B, 20)
+        self.otc.make(3, OUR_ADDRESS, TOKEN_B, 10, TOKEN_A, 5)
+        self.otc.make(4, OUR_ADDRESS, TOKEN_C, 10, TOKEN_A, 5)
+        self.order_index = OasisOrderIndex(self.web3, self.otc, OUR_ADDRESS, TOKEN_A, TOKEN_B, reader=self.otc)
+
+    def next_block(self):
+        self.web3.eth.blockNumber += 1
+
+    def order_ids(self):
+        return sorted(order.order_id for order in self.order_index.get_orders())
+
+    def test_should_scan_all_orders_initially(self):
+        # expect
+        assert self.order_ids() == [1, 3]
+        assert self.otc.calls == ['get_orders', 'get_orders']
+
+    def test_should_follow_new_and_killed_orders_using_events(self):
+        # given
+        self.order_ids()
+        self.otc.calls = []
+
+        # when
+        self.next_block()
+        self.otc.make(5, OUR_ADDRESS, TOKEN_B, 1, TOKEN_A, 1)
+        self.otc.make(6, OTHER_ADDRESS, TOKEN_B, 1, TOKEN_A, 1)
+        self.otc.kill(1)
+
+        # then
+        assert self.order_ids() == [3, 5]
+        assert 'get_orders' not in self.otc.calls
+
+    def test_should_update_taken_orders_and_record_fills(self):
+        # given
+        self.order_ids()
+
+        # when
+        self.next_block()
+        self.otc.take(1, 4)
+        self.otc.take(3, 10)
+
+        # then
+        assert self.order_ids() == [1]
+        assert self.order_index.get_orders()[0].pay_amount == Wad.from_number(6)
+        assert [fill.order_id for fill in self.order_index.fills] == [1, 3]
+
+    def test_should_apply_overlapping_events_only_once(self):
+        # given
+        self.order_ids()
+        self.next_block()
+        self.otc.take(1, 4)
+        self.order_ids()
+
+        # when
+        self.next_block()
+        self.otc.kill(3)
+
+        # then
+        assert self.order_ids() == [1]
+        assert len(self.order_index.fills) == 1
+
+    def test_should_not_query_anything_if_no_new_block(self):
+        # given
+        self.order_ids()
+        self.otc.calls = []
+
+        # when
+        self.order_ids()
+
+        # then
+        assert self.otc.calls == []
+
+    def test_should_scan_all_orders_again_periodically(self):
+        # given
+        self.order_ids()
+        self.otc.calls = []
+
+        # when
+        self.web3.eth.blockNumber += 1000
+
+        # then
+        assert self.order_ids() == [1, 3]
+        assert self.otc.calls == ['get_orders', 'get_orders']
+
+    def test_should_scan_all_orders_again_if_parent_of_latest_block_changed(self):
+        # given
+        self.order_ids()
+        self.otc.calls = []
+
+        # when
+        # [order #1 gets killed in a block which then gets reorganized out of the chain]
+        self.next_block()
+        self.otc.kill(1)
+        self.order_ids()
+        self.otc.orders[1] = self.otc.order(1, OUR_ADDRESS, TOKEN_A, 10, TOKEN_B, 20)
+        self.web3.eth.reorg(self.web3.eth.blockNumber)
+        self.next_block()
+        self.otc.calls = []
+
+        # then
+        assert self.order_ids() == [1, 3]
+        assert self.otc.calls == ['get_orders', 'get_orders']
+
+    def test_should_scan_all_orders_again_if_latest_block_replaced(self):
+        # given
+        self.order_ids()
+        self.otc.calls = []
+
+        # when
+        self.web3.eth.reorg(self.web3.eth.blockNumber)
+
+        # then
+        assert self.order_ids() == [1, 3]
+        assert self.otc.calls == ['get_orders', 'get_orders']
+
+    def test_should_scan_all_orders_again_if_last_seen_block_reorganized_many_blocks_ago(self):
+        # given
+        self.order_ids()
+        self.otc.calls = []
+
+        # when
+        self.web3.eth.reorg(self.web3.eth.blockNumber)
+        self.web3.eth.blockNumber += 5
+
+        # then
+        assert self.order_ids() == [1, 3]
+        assert self.otc.calls == ['get_orders', 'get_orders']
+        assert self.web3.eth.block_requests[-1] == 100
+
+    def test_should_not_scan_all_orders_again_without_reorganization(self):
+        # given
+        self.order_ids()
+        self.otc.calls = []
+
+        # when
+        self.web3.eth.blockNumber += 5
+        self.order_ids()
+        self.next_block()
+        self.order_ids()
+
+        # then
+        assert 'get_orders' not in self.otc.calls
+
+
+class FakeMatchingMarketEth:
+    """Answers `eth_call`s to `getBestOffer`, `getWorseOffer` and `offers`, as MatchingMarket would."""
+
+    def __init__(self, offers: dict, sorted_ids: list):
+        self.offers = offers
+        self.sorted_ids = sorted_ids
+        self.calls = []
+
+    def call(self, transaction):
+        data = decode_hex(transaction['data'])
+        selector, arguments = data[:4], data[4:]
+
+        if selector == function_signature_to_4byte_selector('getBestOffer(address,address)'):
+            self.calls.append('getBestOffer')
+            result = encode_abi(['uint256'], [self.sorted_ids[0] if self.sorted_ids else 0])
+
+        elif selector == function_signature_to_4byte_selector('getWorseOffer(uint256)'):
+            self.calls.append('getWorseOffer')
+            index = self.sorted_ids.index(decode_abi(['uint256'], arguments)[0]) + 1
+            result = encode_abi(['uint256'], [self.sorted_ids[index] if index < len(self.sorted_ids) else 0])
+
+        else:
+            self.calls.append('offers')
+            offer = self.offers.get(decode_abi(['uint256'], arguments)[0], (0, TOKEN_A.address, 0, TOKEN_B.address,
+                                                                             OTHER_ADDRESS.address, 0))
+            result = encode_abi(OasisOrderReader.OFFER_TYPES, list(offer))
+
+        return encode_hex(result)
+
+
+class FakeOtcAddress:
+    address = Address('0x0000000000000000000000000000000000000c0c')
+
+
+class TestOasisOrderReader:
+    def setup_method(self):
+        self.web3 = FakeWeb3()
+        self.web3.providers = [object()]
+        self.web3.eth = FakeMatchingMarketEth({5: (10, TOKEN_A.address, 20, TOKEN_B.address, OUR_ADDRESS.address, 1),
+                                               7: (30, TOKEN_A.address, 40, TOKEN_B.address, OTHER_ADDRESS.address, 2)},
+                                              [7, 5])
+        self.reader = OasisOrderReader(self.web3, FakeOtcAddress())
+
+    def test_should_walk_sorted_offers_and_read_them(self):
+        # when
+        orders = self.reader.get_orders(TOKEN_A, TOKEN_B)
+
+        # then
+        assert [order.order_id for order in orders] == [7, 5]
+        assert orders[1].maker == OUR_ADDRESS
+        assert orders[1].pay_amount == Wad(10)
+        assert orders[1].buy_token == TOKEN_B
+        assert self.web3.eth.calls == ['getBestOffer', 'getWorseOffer', 'getWorseOffer', 'offers', 'offers']
+
+    def test_should_return_none_for_orders_which_do_not_exist(self):
+        # expect
+        assert [order.order_id if order else None for order in self.reader.get_orders_by_id([5, 6])] == [5, None]
+
+
+class TestOasisOrderIndexInsertionPosition:
+    def setup_method(self):
+        self.web3 = FakeWeb3()
+        self.web3.eth = FakeEth()
+        self.otc = FakeOtc(self.web3)
+        self.otc.make(1, OUR_ADDRESS, TOKEN_A, 10, TOKEN_B, 20)
+        self.otc.make(2, OUR_ADDRESS, TOKEN_A, 10, TOKEN_B, 30)
+        self.otc.make(3, OUR_ADDRESS, TOKEN_A, 10, TOKEN_B, 40)
+        self.otc.make(4, OTHER_ADDRESS, TOKEN_A, 10, TOKEN_B, 25)
+        self.otc.make(5, OUR_ADDRESS, TOKEN_B, 10, TOKEN_A, 1)
+        self.order_index = OasisOrderIndex(self.web3, self.otc, OUR_ADDRESS, TOKEN_A, TOKEN_B, reader=self.otc)
+        self.order_index.get_orders()
+
+    def next_block(self):
+        self.web3.eth.blockNumber += 1
+
+    def position(self, pay_token, pay_amount, buy_token, buy_amount):
+        return self.order_index.insertion_position(pay_token, Wad.from_number(pay_amount),
+                                                   buy_token, Wad.from_number(buy_amount))
+
+    def test_should_hint_our_closest_order_priced_at_least_as_high(self):
+        # expect
+        assert self.position(TOKEN_A, 10, TOKEN_B, 35) == 2
+        assert self.position(TOKEN_A, 10, TOKEN_B, 21) == 1
+
+    def test_should_hint_order_with_the_same_price(self):
+        # expect
+        assert self.position(TOKEN_A, 5, TOKEN_B, 15) == 2
+
+    def test_should_hint_our_best_order_if_new_order_is_better_than_all_of_them(self):
+        # expect
+        assert self.position(TOKEN_A, 10, TOKEN_B, 10) == 1
+
+    def test_should_only_hint_orders_in_the_same_direction(self):
+        # expect
+        assert self.position(TOKEN_B, 10, TOKEN_A, 2) == 5
+        assert self.position(TOKEN_B, 10, TOKEN_A, 0.5) == 5
+
+    def test_should_not_hint_anything_without_orders_in_that_direction(self):
+        # given
+        self.next_block()
+        self.otc.kill(5)
+        self.order_index.get_orders()
+
+        # expect
+        assert self.position(TOKEN_B, 10, TOKEN_A, 2) == 0
@@ -0,0 +1,150 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from concurrent.futures import Future
+
+from market_maker_keeper.order_book import OrderBookManager
+
+
+class FakeOrder:
+    def __init__(self, order_id: int):
+        self.order_id = order_id
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestOrderBookManager:
+    def setup_method(self):
+        self.orders = [FakeOrder(1)]
+        self.futures = []
+
+        self.order_book_manager = OrderBookManager(refresh_frequency=1, max_workers=1)
+        self.order_book_manager.get_orders_with(lambda: list(self.orders))
+        self.order_book_manager.place_orders_with(self.place_order_function)
+        self.order_book_manager.cancel_orders_with(self.cancel_order_function)
+        self.order_book_manager.refresh_order_book()
+
+    def place_order_function(self, new_order_id):
+        future = Future()
+        self.futures.append((future, FakeOrder(new_order_id)))
+        return future
+
+    def cancel_order_function(self, order):
+        future = Future()
+        self.futures.append((future, True))
+        return future
+
+    def test_should_not_block_workers_while_futures_are_pending(self):
+        # when
+        self.order_book_manager.place_orders([2, 3, 4])
+
+        # then
+        # ...all three placements got submitted even though there is only one worker thread
+        wait_for(lambda: len(self.futures) == 3)
+        assert len(self.futures) == 3
+        assert self.order_book_manager.get_order_book().orders_being_placed
+
+    def test_should_add_placed_orders_when_futures_resolve(self):
+        # given
+        self.order_book_manager.place_orders([2, 3])
+        wait_for(lambda: len(self.futures) == 2)
+
+        # when
+        self.futures[0][0].set_result(self.futures[0][1])
+
+        # then
+        assert [order.order_id for order in self.order_book_manager.get_order_book().orders] == [1, 2]
+        assert self.order_book_manager.get_order_book().orders_being_placed
+
+        # when
+        self.futures[1][0].set_result(None)
+
+        # then
+        assert [order.order_id for order in self.order_book_manager.get_order_book().orders] == [1, 2]
+        assert not self.order_book_manager.get_order_book().orders_being_placed
+
+    def test_should_remove_cancelled_orders_when_futures_resolve(self):
+        # given
+        self.order_book_manager.cancel_orders([self.orders[0]])
+        wait_for(lambda: len(self.futures) == 1)
+
+        # then
+        assert self.order_book_manager.get_order_book().orders == []
+        assert self.order_book_manager.get_order_book().orders_being_cancelled
+
+        # when
+        self.futures[0][0].set_result(True)
+
+        # then
+        assert self.order_book_manager.get_order_book().orders == []
+        assert not self.order_book_manager.get_order_book().orders_being_cancelled
+
+    def test_should_bring_orders_back_if_cancellation_future_fails(self):
+        # given
+        self.order_book_manager.cancel_orders([self.orders[0]])
+        wait_for(lambda: len(self.futures) == 1)
+
+        # when
+        self.futures[0][0].set_exception(Exception("Transaction failed"))
+
+        # then
+        assert [order.order_id for order in self.order_book_manager.get_order_book().orders] == [1]
+        assert not self.order_book_manager.get_order_book().orders_being_cancelled
+
+
+class TestOrderBookManagerBatchCancellation:
+    def setup_method(self):
+        self.orders = [FakeOrder(order_id) for order_id in range(1, 6)]
+        self.batches = []
+
+        self.order_book_manager = OrderBookManager(refresh_frequency=1, max_workers=1)
+        self.order_book_manager.get_orders_with(lambda: list(self.orders))
+        self.order_book_manager.cancel_orders_in_batch_with(self.cancel_orders_function, max_batch_size=3)
+        self.order_book_manager.refresh_order_book()
+
+    def cancel_orders_function(self, orders):
+        future = Future()
+        self.batches.append(([order.order_id for order in orders], future))
+        return future
+
+    def test_should_cancel_orders_in_batches(self):
+        # when
+        self.order_book_manager.cancel_orders(self.orders)
+
+        # then
+        wait_for(lambda: len(self.batches) == 2)
+        assert [order_ids for order_ids, _ in self.batches] == [[1, 2, 3], [4, 5]]
+        assert self.order_book_manager.get_order_book().orders == []
+        assert self.order_book_manager.get_order_book().orders_being_cancelled
+
+    def test_should_remove_all_orders_of_a_batch_when_future_resolves(self):
+        # given
+        self.order_book_manager.cancel_orders(self.orders)
+        wait_for(lambda: len(self.batches) == 2)
+
+        # when
+        self.batches[0][1].set_result(True)
+        self.batches[1][1].set_result(False)
+
+        # then
+        assert [order.order_id for order in self.order_book_manager.get_order_book().orders] == [4, 5]
+        assert not self.order_book_manager.get_order_book().orders_being_cancelled
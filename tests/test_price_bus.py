@@ -0,0 +1,120 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import pytest
+
+from market_maker_keeper.price_bus import PriceBusWriter, PriceBusReader
+from market_maker_keeper.price_feed import BusPriceFeed
+from pymaker.numeric import Wad
+
+
+class TestPriceBus:
+    def test_should_not_read_anything_before_publisher_started(self, tmpdir):
+        # expect
+        assert PriceBusReader("eth_dai", str(tmpdir)).read() is None
+
+    def test_should_not_read_anything_before_first_publication(self, tmpdir):
+        # given
+        PriceBusWriter("eth_dai", str(tmpdir))
+
+        # expect
+        assert PriceBusReader("eth_dai", str(tmpdir)).read() is None
+
+    def test_should_read_published_prices(self, tmpdir):
+        # given
+        writer = PriceBusWriter("eth_dai", str(tmpdir))
+        reader = PriceBusReader("eth_dai", str(tmpdir))
+
+        # when
+        writer.write(Wad.from_number(512.25).value, Wad.from_number(513.75).value, 1528000000.5)
+
+        # then
+        assert reader.read() == (Wad.from_number(512.25).value, Wad.from_number(513.75).value, 1528000000.5)
+
+        # when
+        writer.write(None, Wad.from_number(514).value, 1528000001.5)
+
+        # then
+        assert reader.read() == (None, Wad.from_number(514).value, 1528000001.5)
+
+    def test_should_carry_on_with_sequence_after_publisher_restart(self, tmpdir):
+        # given
+        PriceBusWriter("eth_dai", str(tmpdir)).write(Wad.from_number(1).value, Wad.from_number(1).value, 1.0)
+
+        # when
+        PriceBusWriter("eth_dai", str(tmpdir)).write(Wad.from_number(2).value, Wad.from_number(2).value, 2.0)
+
+        # then
+        assert PriceBusReader("eth_dai", str(tmpdir)).read() == (Wad.from_number(2).value, Wad.from_number(2).value, 2.0)
+
+    def test_should_reject_invalid_names(self, tmpdir):
+        # expect
+        with pytest.raises(Exception):
+            PriceBusReader("../eth_dai", str(tmpdir))
+
+    def test_should_derive_valid_default_names_from_price_feeds(self, tmpdir):
+        # expect
+        assert PriceBusWriter.default_name("eth_dai") == "eth_dai"
+        assert PriceBusWriter.default_name("eth_dai-setzer") == "eth_dai-setzer"
+        assert PriceBusWriter.default_name("ws://localhost:8080/eth_dai") == "ws___localhost_8080_eth_dai"
+
+        # and
+        PriceBusWriter(PriceBusWriter.default_name("ws://localhost:8080/eth_dai"), str(tmpdir))
+
+
+class TestBusPriceFeed:
+    def test_should_return_published_price(self, tmpdir):
+        # given
+        writer = PriceBusWriter("eth_dai", str(tmpdir))
+        price_feed = BusPriceFeed("eth_dai", expiry=120, directory=str(tmpdir))
+
+        # when
+        writer.write(Wad.from_number(510).value, Wad.from_number(520).value, time.time())
+
+        # then
+        assert price_feed.get_price().buy_price == Wad.from_number(510)
+        assert price_feed.get_price().sell_price == Wad.from_number(520)
+
+    def test_should_expire_price(self, tmpdir):
+        # given
+        writer = PriceBusWriter("eth_dai", str(tmpdir))
+        price_feed = BusPriceFeed("eth_dai", expiry=120, directory=str(tmpdir))
+
+        # when
+        writer.write(Wad.from_number(510).value, Wad.from_number(520).value, time.time() - 121)
+
+        # then
+        assert price_feed.get_price().buy_price is None
+        assert price_feed.get_price().sell_price is None
+
+    def test_should_read_price_in_well_under_a_millisecond(self, tmpdir):
+        # given
+        writer = PriceBusWriter("eth_dai", str(tmpdir))
+        price_feed = BusPriceFeed("eth_dai", expiry=120, directory=str(tmpdir))
+        writer.write(Wad.from_number(510).value, Wad.from_number(520).value, time.time())
+        price_feed.get_price()
+
+        # when
+        start = time.time()
+        for _ in range(10000):
+            price_feed.get_price()
+        elapsed = time.time() - start
+
+        # then
+        assert elapsed / 10000 < 0.0001
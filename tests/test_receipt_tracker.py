@@ -0,0 +1,197 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+import time
+
+from market_maker_keeper.gas import OperationGasPrices, ReplacementPolicy
+from market_maker_keeper.receipt_tracker import ReceiptTracker
+from pymaker.gas import FixedGasPrice
+
+
+class FakeReceipt:
+    def __init__(self, successful: bool):
+        self.successful = successful
+
+
+class FakeTransact:
+    """Transaction getting mined the moment `mine()` is called."""
+
+    def __init__(self, receipt):
+        self.receipt = receipt
+        self.mined = threading.Event()
+        self.kwargs = None
+
+    def mine(self):
+        self.mined.set()
+
+    async def transact_async(self, **kwargs):
+        self.kwargs = kwargs
+        while not self.mined.is_set():
+            await asyncio.sleep(0.01)
+
+        return self.receipt
+
+
+class FakeEth:
+    def __init__(self):
+        self.blockNumber = 100
+        self.gasPrice = 1000
+
+
+class FakeWeb3:
+    def __init__(self):
+        self.eth = FakeEth()
+
+
+class TestReceiptTracker:
+    def test_should_resolve_future_with_receipt(self):
+        # given
+        receipt_tracker = ReceiptTracker()
+        transact = FakeTransact(FakeReceipt(successful=True))
+
+        # when
+        future = receipt_tracker.transact(transact, gas_price='gas_price')
+
+        # then
+        time.sleep(0.1)
+        assert not future.done()
+
+        # when
+        transact.mine()
+
+        # then
+        assert future.result(timeout=5) is transact.receipt
+        assert transact.kwargs == {'gas_price': 'gas_price'}
+
+    def test_should_apply_result_function(self):
+        # given
+        receipt_tracker = ReceiptTracker()
+        transact = FakeTransact(None)
+        transact.mine()
+
+        # when
+        future = receipt_tracker.transact(transact, result_function=lambda receipt: receipt is not None)
+
+        # then
+        assert future.result(timeout=5) is False
+
+    def test_should_track_many_transactions_at_once(self):
+        # given
+        receipt_tracker = ReceiptTracker()
+        transacts = [FakeTransact(FakeReceipt(successful=True)) for _ in range(50)]
+
+        # when
+        futures = [receipt_tracker.transact(transact) for transact in transacts]
+        time.sleep(0.1)
+
+        # then
+        assert receipt_tracker.pending_count() == 50
+
+        # when
+        for transact in transacts:
+            transact.mine()
+
+        # then
+        assert all(future.result(timeout=5).successful for future in futures)
+        assert receipt_tracker.pending_count() == 0
+
+
+class TestReceiptTrackerReplacements:
+    def setup_method(self):
+        self.web3 = FakeWeb3()
+        gas_price = FixedGasPrice(10000)
+        self.receipt_tracker = ReceiptTracker(web3=self.web3,
+                                              gas_prices=OperationGasPrices(cancel=gas_price, place=gas_price,
+                                                                            deposit=gas_price, approve=gas_price,
+                                                                            replacement_policies={
+                                                                                'cancel': ReplacementPolicy(after_blocks=3,
+                                                                                                            multiplier=1.5,
+                                                                                                            max_replacements=2)}),
+                                              watchdog_interval=3600.0)
+
+    def submit(self, operation: str):
+        transact = FakeTransact(FakeReceipt(successful=True))
+        future = self.receipt_tracker.transact(transact, operation=operation)
+        time.sleep(0.1)
+
+        return transact, future
+
+    def test_should_use_gas_price_of_operation_class(self):
+        # when
+        transact, _ = self.submit('place')
+
+        # then
+        assert transact.kwargs['gas_price'].get_gas_price(0) == 10000
+
+    def test_should_replace_transactions_pending_for_too_many_blocks(self):
+        # given
+        transact, _ = self.submit('cancel')
+
+        # when
+        self.receipt_tracker.replace_stuck_transactions(102)
+
+        # then
+        assert transact.kwargs['gas_price'].get_gas_price(0) == 10000
+
+        # when
+        self.receipt_tracker.replace_stuck_transactions(103)
+
+        # then
+        assert transact.kwargs['gas_price'].get_gas_price(0) == 15000
+
+        # when
+        self.receipt_tracker.replace_stuck_transactions(105)
+
+        # then
+        assert transact.kwargs['gas_price'].get_gas_price(0) == 15000
+
+        # when
+        self.receipt_tracker.replace_stuck_transactions(106)
+        self.receipt_tracker.replace_stuck_transactions(109)
+
+        # then
+        # ...as there can only be two replacements
+        assert transact.kwargs['gas_price'].get_gas_price(0) == 22500
+
+    def test_should_not_replace_transactions_without_policy(self):
+        # given
+        transact, _ = self.submit('place')
+
+        # when
+        self.receipt_tracker.replace_stuck_transactions(200)
+
+        # then
+        assert transact.kwargs['gas_price'].get_gas_price(0) == 10000
+
+    def test_should_report_statistics_per_operation_class(self):
+        # given
+        transact, future = self.submit('cancel')
+        self.receipt_tracker.replace_stuck_transactions(103)
+
+        # when
+        self.web3.eth.blockNumber = 104
+        transact.mine()
+        future.result(timeout=5)
+
+        # then
+        statistics = self.receipt_tracker.statistics()
+        assert list(statistics.keys()) == ['cancel']
+        assert statistics['cancel']['count'] == 1
+        assert statistics['cancel']['replacements'] == 1
+        assert statistics['cancel']['averageBlocks'] == 4
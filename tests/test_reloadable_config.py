@@ -14,11 +14,21 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
 from unittest.mock import MagicMock
 
+import _jsonnet
+
 from market_maker_keeper.reloadable_config import ReloadableConfig
 
 
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
 class TestReloadableConfig:
     @staticmethod
     def write_sample_config(tmpdir):
@@ -77,6 +87,7 @@ class TestReloadableConfig:
 
         # when
         self.write_advanced_config(tmpdir, "z")
+        wait_for(lambda: reloadable_config.get_config({})["a"] == "z")
         config = reloadable_config.get_config({})
 
         # then
@@ -86,6 +97,76 @@ class TestReloadableConfig:
         # [a log message that the config was reloaded gets generated]
         assert reloadable_config.logger.info.call_count == 2
 
+    def test_should_read_file_again_if_replaced(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_sample_config(tmpdir))
+        assert reloadable_config.get_config({})["a"] == "b"
+
+        # when
+        replacement = tmpdir.join("replacement.json")
+        replacement.write("""{"a": "x"}""")
+        os.rename(str(replacement), reloadable_config.filename)
+        wait_for(lambda: reloadable_config.get_config({})["a"] == "x")
+
+        # then
+        assert reloadable_config.get_config({})["a"] == "x"
+
+    def test_should_read_file_again_if_symlinked_directory_swapped(self, tmpdir):
+        # given
+        # [the layout of a Kubernetes ConfigMap volume: `config.json` -> `..data/config.json`,
+        #  `..data` -> `..2018_06_01`, updated by atomically renaming a new symlink over `..data`]
+        tmpdir.mkdir("..2018_06_01").join("config.json").write("""{"a": "b"}""")
+        os.symlink("..2018_06_01", str(tmpdir.join("..data")))
+        os.symlink(os.path.join("..data", "config.json"), str(tmpdir.join("config.json")))
+
+        reloadable_config = ReloadableConfig(str(tmpdir.join("config.json")))
+        assert reloadable_config.get_config({})["a"] == "b"
+
+        # when
+        tmpdir.mkdir("..2018_06_02").join("config.json").write("""{"a": "x"}""")
+        os.symlink("..2018_06_02", str(tmpdir.join("..data_tmp")))
+        os.rename(str(tmpdir.join("..data_tmp")), str(tmpdir.join("..data")))
+        wait_for(lambda: reloadable_config.get_config({})["a"] == "x")
+
+        # then
+        assert reloadable_config.get_config({})["a"] == "x"
+
+    def test_should_read_file_again_if_symlink_target_changed(self, tmpdir):
+        # given
+        target = tmpdir.mkdir("configs").join("config.json")
+        target.write("""{"a": "b"}""")
+        os.symlink(str(target), str(tmpdir.join("config.json")))
+
+        reloadable_config = ReloadableConfig(str(tmpdir.join("config.json")))
+        assert reloadable_config.get_config({})["a"] == "b"
+
+        # when
+        target.write("""{"a": "x"}""")
+        wait_for(lambda: reloadable_config.get_config({})["a"] == "x")
+
+        # then
+        assert reloadable_config.get_config({})["a"] == "x"
+
+    def test_should_keep_previous_config_if_file_becomes_invalid(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_advanced_config(tmpdir, "b"))
+        reloadable_config.logger = MagicMock()
+        assert reloadable_config.get_config({})["a"] == "b"
+
+        # when
+        tmpdir.join("advanced_config.json").write("""{"a": """)
+        wait_for(lambda: reloadable_config.logger.error.call_count > 0)
+
+        # then
+        assert reloadable_config.get_config({})["a"] == "b"
+
+        # when
+        self.write_advanced_config(tmpdir, "z")
+        wait_for(lambda: reloadable_config.get_config({})["a"] == "z")
+
+        # then
+        assert reloadable_config.get_config({})["a"] == "z"
+
     def test_should_import_spreads(self, tmpdir):
         # given
         spread_feed = {
@@ -136,3 +217,79 @@ class TestReloadableConfig:
         # [no log message that the config was reloaded gets generated]
         # [as it was only parsed again]
         assert reloadable_config.logger.info.call_count == 1
+
+    def test_should_reuse_configs_evaluated_for_the_same_spreads(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_spread_importing_config(tmpdir))
+
+        # when
+        for _ in range(3):
+            assert reloadable_config.get_config({"buySpread": "0.1", "sellSpread": "1.0"})["usedBuySpread"] == 0.2
+            assert reloadable_config.get_config({"buySpread": "0.2", "sellSpread": "1.0"})["usedBuySpread"] == 0.4
+
+        # then
+        assert reloadable_config.cache_misses == 2
+        assert reloadable_config.cache_hits == 4
+
+    def test_should_round_spreads_to_step(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_spread_importing_config(tmpdir), spread_feed_step=0.05)
+
+        # when
+        config_1 = reloadable_config.get_config({"buySpread": "0.101", "sellSpread": "0.99"})
+        config_2 = reloadable_config.get_config({"buySpread": "0.098", "sellSpread": "1.01"})
+
+        # then
+        assert config_1["usedBuySpread"] == 0.2
+        assert config_1["usedSellSpread"] == 3.0
+        assert config_2 == config_1
+        assert reloadable_config.cache_misses == 1
+        assert reloadable_config.cache_hits == 1
+
+    def test_should_not_reuse_configs_evaluated_before_file_changed(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_advanced_config(tmpdir, "b"))
+        assert reloadable_config.get_config({"buySpread": "0.1"})["a"] == "b"
+        assert reloadable_config.get_config({"buySpread": "0.2"})["a"] == "b"
+
+        # when
+        self.write_advanced_config(tmpdir, "z")
+        wait_for(lambda: reloadable_config.get_config({"buySpread": "0.2"})["a"] == "z")
+
+        # then
+        assert reloadable_config.get_config({"buySpread": "0.1"})["a"] == "z"
+
+    def test_should_keep_cached_configs_if_file_becomes_invalid(self, tmpdir):
+        # given
+        reloadable_config = ReloadableConfig(self.write_spread_importing_config(tmpdir))
+        reloadable_config.logger = MagicMock()
+        reloadable_config.get_config({"buySpread": "0.1", "sellSpread": "1.0"})
+        reloadable_config.get_config({"buySpread": "0.2", "sellSpread": "1.0"})
+
+        # when
+        tmpdir.join("spread_importing_config.json").write("""{"a": """)
+        wait_for(lambda: reloadable_config.logger.error.call_count > 0)
+
+        # then
+        assert reloadable_config.get_config({"buySpread": "0.1", "sellSpread": "1.0"})["usedBuySpread"] == 0.2
+        assert reloadable_config.cache_misses == 3
+        assert reloadable_config.cache_hits == 1
+
+    def test_should_evaluate_configs_without_holding_the_lock(self, tmpdir, monkeypatch):
+        # given
+        reloadable_config = ReloadableConfig(self.write_spread_importing_config(tmpdir))
+        evaluate_snippet = _jsonnet.evaluate_snippet
+        locked = []
+
+        def checking_evaluate_snippet(*args, **kwargs):
+            locked.append(reloadable_config._lock.locked())
+            return evaluate_snippet(*args, **kwargs)
+
+        monkeypatch.setattr(_jsonnet, 'evaluate_snippet', checking_evaluate_snippet)
+
+        # when
+        reloadable_config.get_config({"buySpread": "0.1", "sellSpread": "1.0"})
+        reloadable_config.get_config({"buySpread": "0.2", "sellSpread": "1.0"})
+
+        # then
+        assert locked == [False, False]
@@ -0,0 +1,202 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from eth_abi import encode_abi, decode_abi
+from eth_utils import decode_hex, encode_hex, function_signature_to_4byte_selector
+
+from market_maker_keeper.gas_station import RpcError
+from market_maker_keeper.rpc_batch import JsonRpcBatch
+from pymaker import Address
+from pymaker.numeric import Wad
+
+CONTRACT = Address('0x0000000000000000000000000000000000000c0c')
+ACCOUNT = Address('0x00000000000000000000000000000000000000aa')
+BALANCE_OF = function_signature_to_4byte_selector('balanceOf(address,address)')
+
+
+class FakeContract:
+    """`balanceOf(address,address)` returning `token + user` for the last byte of each address."""
+
+    def call(self, data: bytes) -> bytes:
+        if data[:4] != BALANCE_OF:
+            raise Exception("Unknown function")
+
+        token, user = decode_abi(['address', 'address'], data[4:])
+        return encode_abi(['uint256'], [int(token, 16) + int(user, 16)])
+
+
+class FakeNode:
+    """Minimal JSON-RPC stand-in for an Ethereum node, answering batch requests in reverse order."""
+
+    def __init__(self):
+        self.contract = FakeContract()
+        self.http_requests = 0
+        self.calls = []
+
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                response = json.dumps(node.handle(request)).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint_uri = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def get_request_kwargs(self):
+        return {'headers': {'Content-Type': 'application/json'}, 'timeout': 10}
+
+    def handle(self, request):
+        self.http_requests += 1
+        return list(reversed([self.handle_one(item) for item in request]))
+
+    def handle_one(self, request: dict) -> dict:
+        method, params = request['method'], request['params']
+        self.calls.append(method)
+
+        if method == 'eth_call' and params[0]['to'] == CONTRACT.address:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': encode_hex(self.contract.call(decode_hex(params[0]['data'])))}
+
+        elif method == 'eth_getBalance':
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': hex(Wad.from_number(3).value)}
+
+        else:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32000, 'message': 'execution reverted'}}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeWeb3:
+    def __init__(self, provider):
+        self.providers = [provider]
+
+
+class FakeEth:
+    """Non-HTTP provider path, calls made one by one through `web3.eth`."""
+
+    def __init__(self):
+        self.contract = FakeContract()
+        self.calls = []
+
+    def call(self, transaction):
+        self.calls.append('eth_call')
+        return encode_hex(self.contract.call(decode_hex(transaction['data'])))
+
+    def getBalance(self, address):
+        self.calls.append('eth_getBalance')
+        return Wad.from_number(3).value
+
+
+class TestJsonRpcBatch:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.batch = JsonRpcBatch(FakeWeb3(self.node))
+
+    def teardown_method(self):
+        self.node.stop()
+
+    def add_calls(self, batch: JsonRpcBatch, count: int):
+        for index in range(count):
+            batch.call(CONTRACT, 'balanceOf(address,address)', [f"0x{index:040x}", ACCOUNT.address], ['uint256'])
+
+    def test_should_make_all_calls_in_one_request(self):
+        # given
+        self.add_calls(self.batch, 5)
+        self.batch.eth_balance(ACCOUNT)
+
+        # when
+        results = self.batch.execute()
+
+        # then
+        assert results == [0xaa, 0xab, 0xac, 0xad, 0xae, Wad.from_number(3)]
+        assert self.node.http_requests == 1
+        assert self.node.calls == ['eth_call'] * 5 + ['eth_getBalance']
+
+    def test_should_return_indices_of_results(self):
+        # expect
+        assert self.batch.call(CONTRACT, 'balanceOf(address,address)', [ACCOUNT.address, ACCOUNT.address], ['uint256']) == 0
+        assert self.batch.eth_balance(ACCOUNT) == 1
+        assert len(self.batch) == 2
+
+    def test_should_split_large_batches(self):
+        # given
+        batch = JsonRpcBatch(FakeWeb3(self.node), max_batch_size=2)
+        self.add_calls(batch, 5)
+
+        # when
+        results = batch.execute()
+
+        # then
+        assert results == [0xaa, 0xab, 0xac, 0xad, 0xae]
+        assert self.node.http_requests == 3
+
+    def test_should_not_send_anything_if_empty(self):
+        # expect
+        assert self.batch.execute() == []
+        assert self.node.http_requests == 0
+
+    def test_should_start_from_scratch_after_execute(self):
+        # given
+        self.add_calls(self.batch, 2)
+        self.batch.execute()
+
+        # when
+        self.batch.eth_balance(ACCOUNT)
+
+        # then
+        assert self.batch.execute() == [Wad.from_number(3)]
+
+    def test_should_raise_error_if_any_call_failed(self):
+        # given
+        self.add_calls(self.batch, 2)
+        self.batch.call(Address('0x0000000000000000000000000000000000000bad'), 'foo()', [], ['uint256'])
+
+        # expect
+        with pytest.raises(RpcError):
+            self.batch.execute()
+
+    def test_should_make_calls_one_by_one_if_provider_can_not_batch(self):
+        # given
+        web3 = FakeWeb3(object())
+        web3.eth = FakeEth()
+        batch = JsonRpcBatch(web3)
+        self.add_calls(batch, 3)
+        batch.eth_balance(ACCOUNT)
+
+        # when
+        results = batch.execute()
+
+        # then
+        assert results == [0xaa, 0xab, 0xac, Wad.from_number(3)]
+        assert web3.eth.calls == ['eth_call'] * 3 + ['eth_getBalance']
@@ -0,0 +1,93 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from market_maker_keeper.supervised_websocket import Backoff, SupervisedWebSocket
+
+
+class TestBackoff:
+    def test_should_grow_exponentially_up_to_the_maximum(self):
+        # given
+        backoff = Backoff(1.0, 8.0)
+
+        # when
+        delays = [backoff.next_delay() for _ in range(6)]
+
+        # then
+        for delay, limit in zip(delays, [1.0, 2.0, 4.0, 8.0, 8.0, 8.0]):
+            assert limit / 2 <= delay <= limit
+
+    def test_should_start_over_after_reset(self):
+        # given
+        backoff = Backoff(1.0, 8.0)
+        for _ in range(5):
+            backoff.next_delay()
+
+        # when
+        backoff.reset()
+
+        # then
+        assert 0.5 <= backoff.next_delay() <= 1.0
+
+
+class TestSupervisedWebSocket:
+    def setup_method(self):
+        self.messages = []
+        self.websocket = SupervisedWebSocket(name="test",
+                                             url="ws://localhost:1",
+                                             on_open_function=lambda ws: None,
+                                             on_message_function=self.messages.append,
+                                             key_function=lambda message_obj: message_obj.get('sequence'),
+                                             connections=2)
+
+    def deliver(self, index: int, message: dict):
+        self.websocket._on_message(index, Backoff(1.0, 1.0), json.dumps(message))
+
+    def test_should_deliver_each_message_only_once(self):
+        # when
+        self.deliver(0, {'sequence': 1})
+        self.deliver(1, {'sequence': 1})
+        self.deliver(1, {'sequence': 2})
+        self.deliver(0, {'sequence': 2})
+        self.deliver(0, {'sequence': 3})
+
+        # then
+        assert self.messages == [{'sequence': 1}, {'sequence': 2}, {'sequence': 3}]
+
+    def test_should_drop_messages_older_than_the_last_delivered_one(self):
+        # when
+        self.deliver(0, {'sequence': 5})
+        self.deliver(1, {'sequence': 4})
+
+        # then
+        assert self.messages == [{'sequence': 5}]
+
+    def test_should_always_deliver_messages_without_a_key(self):
+        # when
+        self.deliver(0, {'type': 'heartbeat'})
+        self.deliver(1, {'type': 'heartbeat'})
+
+        # then
+        assert self.messages == [{'type': 'heartbeat'}, {'type': 'heartbeat'}]
+
+    def test_should_ignore_invalid_messages(self):
+        # when
+        self.websocket._on_message(0, Backoff(1.0, 1.0), "not a json")
+
+        # then
+        assert self.messages == []
@@ -0,0 +1,248 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+from market_maker_keeper.feed import ReplayFeed, RecordingFeed, Feed
+from market_maker_keeper.price_feed import FixedPriceFeed, RecordingPriceFeed, ReplayPriceFeed, WebSocketPriceFeed
+from market_maker_keeper.tick_file import TickFileWriter, TickFileReader, Tick, TickReplay, parse_replay_argument
+from pymaker.numeric import Wad
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeFeed(Feed):
+    def __init__(self, data: dict, timestamp: float):
+        self.data = data
+        self.timestamp = timestamp
+
+    def get(self):
+        return self.data, self.timestamp
+
+
+class NotifyingFeed(FakeFeed):
+    """Feed notifying about its updates, like `WebSocketFeed` does."""
+
+    def __init__(self):
+        super().__init__({}, 0.0)
+        self.on_update_function = None
+
+    def on_update(self, on_update_function):
+        self.on_update_function = on_update_function
+
+    def receive(self, data: dict, timestamp: float):
+        self.data, self.timestamp = data, timestamp
+        self.on_update_function()
+
+
+class TestTickFile:
+    def test_should_read_recorded_ticks(self, tmpdir):
+        # given
+        path = str(tmpdir.join("ticks"))
+        writer = TickFileWriter(path)
+
+        # when
+        writer.write_price("eth_dai", Wad.from_number(500).value, Wad.from_number(501).value, 1.0)
+        writer.write_data("spread", {"buySpread": "0.01", "sellSpread": "0.02", "comment": "x" * 200}, 2.0)
+        writer.write_price("eth_dai", None, Wad.from_number(502).value, 3.0)
+
+        # then
+        reader = TickFileReader(path)
+        assert reader.sources() == {0: "eth_dai", 1: "spread"}
+        assert list(reader.ticks()) == [
+            Tick(1.0, "eth_dai", buy_price=Wad.from_number(500).value, sell_price=Wad.from_number(501).value),
+            Tick(2.0, "spread", data={"buySpread": "0.01", "sellSpread": "0.02", "comment": "x" * 200}),
+            Tick(3.0, "eth_dai", buy_price=None, sell_price=Wad.from_number(502).value)
+        ]
+        assert len(list(reader.ticks("eth_dai"))) == 2
+
+    def test_should_keep_source_ids_and_drop_partial_records_after_restart(self, tmpdir):
+        # given
+        path = str(tmpdir.join("ticks"))
+        TickFileWriter(path).write_price("eth_dai", 1, 1, 1.0)
+        with open(path, "ab") as file:
+            file.write(b"partial")
+
+        # when
+        writer = TickFileWriter(path)
+        writer.write_price("btc_dai", 2, 2, 2.0)
+        writer.write_price("eth_dai", 3, 3, 3.0)
+
+        # then
+        reader = TickFileReader(path)
+        assert reader.sources() == {0: "eth_dai", 1: "btc_dai"}
+        assert [tick.buy_price for tick in reader.ticks("eth_dai")] == [1, 3]
+        assert os.path.getsize(path) == len(TickFileReader.MAGIC) + 5 * TickFileReader.RECORD.size
+
+    def test_should_parse_replay_argument(self):
+        # expect
+        assert parse_replay_argument("ticks") == ("ticks", None, 1.0)
+        assert parse_replay_argument("ticks:eth_dai") == ("ticks", "eth_dai", 1.0)
+        assert parse_replay_argument("ticks:eth_dai:10") == ("ticks", "eth_dai", 10.0)
+        assert parse_replay_argument("ticks::max") == ("ticks", None, None)
+        assert parse_replay_argument("ticks:wss://host:8080:2") == ("ticks", "wss://host:8080", 2.0)
+
+
+class TestTickReplay:
+    def ticks(self):
+        return [Tick(100.0, "a", 1, 1), Tick(110.0, "a", 2, 2), Tick(130.0, "a", 3, 3)]
+
+    def test_should_replay_in_real_time(self):
+        # given
+        clock = FakeClock(1000.0)
+        replay = TickReplay(self.ticks(), 1.0, clock)
+
+        # expect
+        assert replay.current().buy_price == 1
+        clock.now = 1009.0
+        assert replay.current().buy_price == 1
+        clock.now = 1010.0
+        assert replay.current().buy_price == 2
+        assert replay.age(replay.current()) == 0.0
+        clock.now = 1020.0
+        assert replay.current().buy_price == 2
+        assert replay.age(replay.current()) == 10.0
+        assert not replay.finished
+        clock.now = 1030.0
+        assert replay.current().buy_price == 3
+        assert replay.finished
+
+    def test_should_replay_faster(self):
+        # given
+        clock = FakeClock(1000.0)
+        replay = TickReplay(self.ticks(), 10.0, clock)
+
+        # when
+        clock.now = 1001.0
+
+        # then
+        assert replay.current().buy_price == 2
+
+    def test_should_replay_as_fast_as_possible(self):
+        # given
+        replay = TickReplay(self.ticks(), None)
+
+        # expect
+        assert [replay.current().buy_price for _ in range(4)] == [1, 2, 3, 3]
+        assert replay.finished
+
+
+class TestRecordingAndReplay:
+    def test_should_record_price_changes_and_replay_them(self, tmpdir):
+        # given
+        path = str(tmpdir.join("ticks"))
+        price_feed = RecordingPriceFeed(FixedPriceFeed(Wad.from_number(500)), TickFileWriter(path), "fixed")
+
+        # when
+        for _ in range(5):
+            price_feed.get_price()
+
+        price_feed.price_feed = FixedPriceFeed(Wad.from_number(510))
+        price_feed.get_price()
+
+        # then
+        replay_price_feed = ReplayPriceFeed(path, None, None)
+        assert replay_price_feed.get_price().buy_price == Wad.from_number(500)
+        assert replay_price_feed.get_price().sell_price == Wad.from_number(510)
+
+    def test_should_record_feed_updates_and_replay_them(self, tmpdir):
+        # given
+        path = str(tmpdir.join("ticks"))
+        feed = RecordingFeed(FakeFeed({"buySpread": "0.1"}, 100.0), TickFileWriter(path), "spread")
+
+        # when
+        feed.get()
+        feed.get()
+        feed.feed = FakeFeed({"buySpread": "0.2"}, 110.0)
+        feed.get()
+
+        # then
+        assert len(list(TickFileReader(path).ticks())) == 2
+
+        # when
+        clock = FakeClock(1000.0)
+        replay_feed = ReplayFeed(path, "spread", 1.0, clock)
+        clock.now = 1015.0
+
+        # then
+        assert replay_feed.get() == ({"buySpread": "0.2"}, 1010.0)
+
+    def test_should_record_every_feed_update_as_it_arrives(self, tmpdir):
+        # given
+        path = str(tmpdir.join("ticks"))
+        notifying_feed = NotifyingFeed()
+        feed = RecordingFeed(notifying_feed, TickFileWriter(path), "spread")
+
+        # and
+        updates = []
+        feed.on_update(lambda: updates.append(notifying_feed.timestamp))
+
+        # when
+        # [no reads in between, like when the keeper is busy or ticks less frequently than the feed updates]
+        notifying_feed.receive({"buySpread": "0.1"}, 100.0)
+        notifying_feed.receive({"buySpread": "0.2"}, 100.5)
+        notifying_feed.receive({"buySpread": "0.3"}, 101.0)
+
+        # then
+        assert [(tick.timestamp, tick.data) for tick in TickFileReader(path).ticks()] == \
+               [(100.0, {"buySpread": "0.1"}), (100.5, {"buySpread": "0.2"}), (101.0, {"buySpread": "0.3"})]
+
+        # and
+        assert updates == [100.0, 100.5, 101.0]
+
+    def test_should_record_every_price_update_as_it_arrives(self, tmpdir):
+        # given
+        path = str(tmpdir.join("ticks"))
+        notifying_feed = NotifyingFeed()
+        price_feed = RecordingPriceFeed(WebSocketPriceFeed(notifying_feed), TickFileWriter(path), "ws")
+
+        # when
+        notifying_feed.receive({"price": "500.0"}, 100.0)
+        notifying_feed.receive({"price": "501.0"}, 100.5)
+        notifying_feed.receive({"price": "501.0"}, 101.0)
+        notifying_feed.receive({"price": "502.0"}, 101.5)
+
+        # then
+        assert [tick.buy_price for tick in TickFileReader(path).ticks()] == \
+               [Wad.from_number(price).value for price in [500, 501, 502]]
+
+        # and
+        assert price_feed.get_price().buy_price == Wad.from_number(502)
+        assert len(list(TickFileReader(path).ticks())) == 3
+
+    def test_should_replay_quickly(self, tmpdir):
+        # given
+        path = str(tmpdir.join("ticks"))
+        writer = TickFileWriter(path)
+        for index in range(100000):
+            writer.write_price("eth_dai", index, index, float(index))
+
+        # when
+        start = time.time()
+        ticks = list(TickFileReader(path).ticks())
+        elapsed = time.time() - start
+
+        # then
+        assert len(ticks) == 100000
+        assert elapsed < 2.0
@@ -0,0 +1,316 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import socket
+import threading
+import time
+from argparse import Namespace
+
+import pytest
+from web3 import HTTPProvider
+
+from market_maker_keeper.web3_provider import IpcProvider, NewBlockWatcher, WebSocketProvider, create_provider
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class FakeIpcNode:
+    """Minimal stand-in for the IPC socket of an Ethereum node, writing each response in two halves."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.block_number = 100
+        self.connections = []
+        self.calls = []
+        self.silenced = []
+        self.lock = threading.Lock()
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(5)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+
+            self.connections.append(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        decoder = json.JSONDecoder()
+        buffer = ""
+        while True:
+            try:
+                chunk = connection.recv(65536)
+            except OSError:
+                return
+
+            if not chunk:
+                return
+
+            buffer += chunk.decode()
+            while buffer:
+                try:
+                    request, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    break
+
+                buffer = buffer[end:]
+                if connection in self.silenced:
+                    continue
+
+                response = [self.handle(item) for item in request] if isinstance(request, list) else self.handle(request)
+                try:
+                    self.write(connection, response)
+                except OSError:
+                    return
+
+    def handle(self, request: dict) -> dict:
+        self.calls.append(request['method'])
+
+        if request['method'] == 'eth_blockNumber':
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': hex(self.block_number)}
+
+        elif request['method'] == 'eth_subscribe':
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': '0xabcd'}
+
+        else:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32601, 'message': 'method not found'}}
+
+    def write(self, connection, message):
+        data = json.dumps(message).encode()
+        with self.lock:
+            connection.sendall(data[:len(data) // 2])
+            time.sleep(0.01)
+            connection.sendall(data[len(data) // 2:])
+
+    def new_head(self):
+        self.block_number += 1
+        for connection in self.connections:
+            self.write(connection, {'jsonrpc': '2.0', 'method': 'eth_subscription',
+                                    'params': {'subscription': '0xabcd',
+                                               'result': {'number': hex(self.block_number),
+                                                          'timestamp': hex(int(time.time()))}}})
+
+    def silence_connections(self):
+        # connections stay open, but requests sent over them do not get any response anymore
+        self.silenced = list(self.connections)
+
+    def drop_connections(self):
+        for connection in self.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+            connection.close()
+
+        self.connections = []
+
+    def stop(self):
+        self.server.close()
+        self.drop_connections()
+
+
+class TestIpcProvider:
+    def setup_method(self):
+        self.provider = None
+
+    def teardown_method(self):
+        if self.provider is not None:
+            self.provider.stop()
+
+        self.node.stop()
+
+    def start(self, tmpdir):
+        self.node = FakeIpcNode(str(tmpdir.join('node.ipc')))
+        self.provider = IpcProvider(self.node.path, timeout=2.0)
+
+    def test_should_make_requests_over_one_connection(self, tmpdir):
+        # given
+        self.start(tmpdir)
+
+        # when
+        responses = [self.provider.make_request('eth_blockNumber', []) for _ in range(3)]
+
+        # then
+        assert [response['result'] for response in responses] == ['0x64'] * 3
+        assert len(self.node.connections) == 1
+
+    def test_should_return_errors(self, tmpdir):
+        # given
+        self.start(tmpdir)
+
+        # expect
+        assert self.provider.make_request('eth_foo', [])['error']['code'] == -32601
+
+    def test_should_make_batch_requests(self, tmpdir):
+        # given
+        self.start(tmpdir)
+
+        # when
+        responses = self.provider.make_batch_request([('eth_blockNumber', []), ('eth_foo', []), ('eth_blockNumber', [])])
+
+        # then
+        assert [response.get('result') for response in responses] == ['0x64', None, '0x64']
+
+    def test_should_deliver_subscription_notifications(self, tmpdir):
+        # given
+        self.start(tmpdir)
+        heads = []
+        self.provider.subscribe(['newHeads'], heads.append)
+        wait_for(lambda: 'eth_subscribe' in self.node.calls)
+        time.sleep(0.1)
+
+        # when
+        self.node.new_head()
+
+        # then
+        wait_for(lambda: len(heads) == 1)
+        assert heads[0]['number'] == '0x65'
+
+    def test_should_reconnect_and_subscribe_again(self, tmpdir):
+        # given
+        self.start(tmpdir)
+        heads = []
+        self.provider.subscribe(['newHeads'], heads.append)
+        wait_for(lambda: 'eth_subscribe' in self.node.calls)
+
+        # when
+        self.node.drop_connections()
+        wait_for(lambda: self.node.calls.count('eth_subscribe') == 2)
+        time.sleep(0.1)
+        self.node.new_head()
+
+        # then
+        wait_for(lambda: len(heads) == 1)
+        assert self.node.calls.count('eth_subscribe') == 2
+        assert self.provider.make_request('eth_blockNumber', [])['result'] == '0x65'
+
+    def test_should_fail_if_not_connected(self, tmpdir):
+        # given
+        self.node = FakeIpcNode(str(tmpdir.join('node.ipc')))
+        self.provider = IpcProvider(str(tmpdir.join('other.ipc')), timeout=0.2)
+
+        # expect
+        with pytest.raises(ConnectionError):
+            self.provider.make_request('eth_blockNumber', [])
+
+    def test_should_ping_the_node_if_no_messages_received(self, tmpdir):
+        # given
+        self.node = FakeIpcNode(str(tmpdir.join('node.ipc')))
+        self.provider = IpcProvider(self.node.path, timeout=2.0, stall_timeout=0.4)
+
+        # when
+        self.provider.make_request('eth_blockNumber', [])
+        wait_for(lambda: 'net_version' in self.node.calls)
+
+        # then
+        assert 'net_version' in self.node.calls
+        assert len(self.node.connections) == 1
+
+    def test_should_reconnect_if_connection_stalled(self, tmpdir):
+        # given
+        self.node = FakeIpcNode(str(tmpdir.join('node.ipc')))
+        self.provider = IpcProvider(self.node.path, timeout=2.0, stall_timeout=0.4)
+        self.provider.subscribe(['newHeads'], lambda head: None)
+        wait_for(lambda: 'eth_subscribe' in self.node.calls)
+
+        # when
+        self.node.silence_connections()
+
+        # then
+        wait_for(lambda: self.node.calls.count('eth_subscribe') == 2)
+        assert self.node.calls.count('eth_subscribe') == 2
+        assert self.provider.make_request('eth_blockNumber', [])['result'] == '0x64'
+
+
+class FakeProvider(IpcProvider):
+    def __init__(self):
+        super().__init__('/dev/null')
+        self.callback = None
+
+    def subscribe(self, params, callback):
+        self.callback = callback
+
+
+class TestNewBlockWatcher:
+    def test_should_call_function_for_new_blocks(self):
+        # given
+        provider = FakeProvider()
+        calls = []
+        watcher = NewBlockWatcher(provider, lambda: calls.append(time.time()))
+        watcher.start()
+
+        # when
+        provider.callback({'number': '0x1', 'timestamp': hex(int(time.time()))})
+        wait_for(lambda: len(calls) == 1)
+        provider.callback({'number': '0x2', 'timestamp': hex(int(time.time()))})
+        wait_for(lambda: len(calls) == 2)
+        watcher.stop()
+
+        # then
+        assert len(calls) == 2
+        assert watcher.latency_statistics()['blocks'] == 2
+        assert watcher.latency_statistics()['max'] < 1.0
+
+    def test_should_coalesce_blocks_arriving_while_busy(self):
+        # given
+        provider = FakeProvider()
+        calls = []
+        watcher = NewBlockWatcher(provider, lambda: calls.append(time.sleep(0.3)))
+        watcher.start()
+
+        # when
+        provider.callback({'number': '0x1', 'timestamp': hex(int(time.time()))})
+        time.sleep(0.1)
+        for number in range(2, 6):
+            provider.callback({'number': hex(number), 'timestamp': hex(int(time.time()))})
+        time.sleep(1.0)
+        watcher.stop()
+
+        # then
+        assert len(calls) == 2
+
+
+class TestCreateProvider:
+    @staticmethod
+    def arguments(**kwargs):
+        return Namespace(**{'rpc_host': 'localhost', 'rpc_port': 8545, 'rpc_timeout': 10,
+                            'rpc_ipc_path': None, 'rpc_ws_url': None, **kwargs})
+
+    def test_should_use_http_by_default(self):
+        # expect
+        assert isinstance(create_provider(self.arguments()), HTTPProvider)
+
+    def test_should_use_ipc(self):
+        # expect
+        assert isinstance(create_provider(self.arguments(rpc_ipc_path='/tmp/geth.ipc')), IpcProvider)
+
+    def test_should_use_websocket(self):
+        # expect
+        assert isinstance(create_provider(self.arguments(rpc_ws_url='ws://localhost:8546')), WebSocketProvider)
+
+    def test_should_not_allow_both_ipc_and_websocket(self):
+        # expect
+        with pytest.raises(Exception):
+            create_provider(self.arguments(rpc_ipc_path='/tmp/geth.ipc', rpc_ws_url='ws://localhost:8546'))
@@ -0,0 +1,285 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from eth_utils import keccak
+
+from market_maker_keeper.zrx_exchange import LocalZrxExchange, RelayerFeeCache, PresignedOrders
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.zrx import Order
+
+EXCHANGE_ADDRESS = Address('0x12459c951127e0c374ff9105dda097662a027093')
+FEE_RECIPIENT = Address('0xa258b39954cef5cb142fd567a46cddb31a670124')
+OUR_ADDRESS = '0x00a329c0648769a73afac7f9381e08fb43dbea72'
+SIGNATURE_R = '0x' + '11' * 32
+SIGNATURE_S = '0x' + '22' * 32
+
+
+class FakeEth:
+    def __init__(self):
+        self.defaultAccount = OUR_ADDRESS
+
+
+class FakeManager:
+    def __init__(self, v: int):
+        self.v = v
+        self.requests = []
+
+    def request_blocking(self, method, params):
+        self.requests.append((method, params))
+        return SIGNATURE_R + SIGNATURE_S[2:] + '%02x' % self.v
+
+
+class FakeWeb3:
+    def __init__(self, v: int = 0):
+        self.eth = FakeEth()
+        self.manager = FakeManager(v)
+        self.calls = []
+
+
+def order(exchange, maker: Address, pay_amount=1, buy_amount=100, salt=1234):
+    return Order(exchange=exchange,
+                 maker=maker,
+                 taker=Address('0x0000000000000000000000000000000000000000'),
+                 maker_fee=Wad(0),
+                 taker_fee=Wad(0),
+                 pay_token=Address('0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2'),
+                 pay_amount=Wad.from_number(pay_amount),
+                 buy_token=Address('0x89d24a6b4ccb1b6faa2625fe562bdd9a23260359'),
+                 buy_amount=Wad.from_number(buy_amount),
+                 salt=salt,
+                 fee_recipient=FEE_RECIPIENT,
+                 expiration=1530000000,
+                 exchange_contract_address=exchange.address,
+                 ec_signature_r=None,
+                 ec_signature_s=None,
+                 ec_signature_v=None)
+
+
+class TestLocalZrxExchange:
+    def setup_method(self):
+        self.web3 = FakeWeb3()
+        self.exchange = LocalZrxExchange(web3=self.web3, address=EXCHANGE_ADDRESS)
+        self.maker = Address(self.web3.eth.defaultAccount)
+
+    def test_should_calculate_order_hash_like_the_exchange_contract(self):
+        # given
+        zrx_order = order(self.exchange, self.maker)
+
+        # when
+        order_hash = self.exchange.get_order_hash(zrx_order)
+
+        # then
+        expected_data = bytes.fromhex(EXCHANGE_ADDRESS.address[2:] + self.maker.address[2:] +
+                                      '0000000000000000000000000000000000000000' +
+                                      'c02aaa39b223fe8d0a0e5c4f27ead9083c756cc2' +
+                                      '89d24a6b4ccb1b6faa2625fe562bdd9a23260359' +
+                                      FEE_RECIPIENT.address[2:] +
+                                      '%064x' % 10**18 + '%064x' % (100 * 10**18) + '%064x' % 0 + '%064x' % 0 +
+                                      '%064x' % 1530000000 + '%064x' % 1234)
+
+        assert order_hash == '0x' + keccak(expected_data).hex()
+
+    def test_should_calculate_different_hashes_for_different_orders(self):
+        # expect
+        assert self.exchange.get_order_hash(order(self.exchange, self.maker, salt=1)) != \
+               self.exchange.get_order_hash(order(self.exchange, self.maker, salt=2))
+
+    def test_should_sign_order_hash_with_eth_sign(self):
+        # given
+        zrx_order = order(self.exchange, self.maker)
+
+        # when
+        signed_order = self.exchange.sign_order(zrx_order)
+
+        # then
+        assert self.web3.manager.requests == [("eth_sign", [OUR_ADDRESS, self.exchange.get_order_hash(zrx_order)])]
+        assert signed_order.ec_signature_r == SIGNATURE_R
+        assert signed_order.ec_signature_s == SIGNATURE_S
+        assert signed_order.ec_signature_v == 27
+
+        # and
+        assert zrx_order.ec_signature_v is None
+
+    def test_should_not_change_v_if_node_already_adds_27(self):
+        # given
+        exchange = LocalZrxExchange(web3=FakeWeb3(v=28), address=EXCHANGE_ADDRESS)
+
+        # when
+        signed_order = exchange.sign_order(order(exchange, self.maker))
+
+        # then
+        assert signed_order.ec_signature_v == 28
+
+    def test_should_cancel_many_orders_in_one_transaction(self):
+        # given
+        order_1 = order(self.exchange, self.maker, salt=1)
+        order_2 = order(self.exchange, self.maker, pay_amount=2, buy_amount=200, salt=2)
+
+        # when
+        transact = self.exchange.cancel_orders([order_1, order_2])
+
+        # then
+        assert transact.function_name == 'batchCancelOrders'
+        assert [addresses[0] for addresses in transact.parameters[0]] == [self.maker.address, self.maker.address]
+        assert [values[5] for values in transact.parameters[1]] == [1, 2]
+        assert transact.parameters[2] == [Wad.from_number(100).value, Wad.from_number(200).value]
+
+    def test_should_serve_unavailable_amounts_from_memory(self):
+        # given
+        order_1 = order(self.exchange, self.maker, salt=1)
+        order_2 = order(self.exchange, self.maker, salt=2)
+        order_3 = order(self.exchange, self.maker, salt=3)
+
+        # when
+        self.exchange.set_unavailable_amounts({self.exchange.get_order_hash(order_1): Wad.from_number(40)})
+        self.exchange.order_placed(order_2)
+
+        # then
+        assert self.exchange.get_unavailable_buy_amount(order_1) == Wad.from_number(40)
+        assert self.exchange.get_unavailable_buy_amount(order_2) == Wad(0)
+        assert self.web3.calls == []
+
+        # and
+        assert self.exchange.get_unavailable_buy_amount(order_3) == Wad(0)
+        assert self.web3.calls == ['getUnavailableTakerTokenAmount']
+
+
+class FakeRelayerApi:
+    def __init__(self, maker_fee=Wad(0)):
+        self.maker_fee = maker_fee
+        self.calls = 0
+
+    def calculate_fees(self, zrx_order):
+        self.calls += 1
+        zrx_order.fee_recipient = FEE_RECIPIENT
+        zrx_order.maker_fee = self.maker_fee
+        zrx_order.taker_fee = Wad(0)
+        return zrx_order
+
+
+class TestRelayerFeeCache:
+    def setup_method(self):
+        self.time = 1000.0
+        self.exchange = LocalZrxExchange(web3=FakeWeb3(), address=EXCHANGE_ADDRESS)
+        self.maker = Address(self.exchange.web3.eth.defaultAccount)
+
+    def clock(self):
+        return self.time
+
+    def test_should_reuse_zero_fees(self):
+        # given
+        relayer_api = FakeRelayerApi()
+        fee_cache = RelayerFeeCache(relayer_api, ttl=600, clock=self.clock)
+
+        # when
+        fee_cache.calculate_fees(order(self.exchange, self.maker, salt=1))
+        zrx_order = fee_cache.calculate_fees(order(self.exchange, self.maker, salt=2))
+
+        # then
+        assert relayer_api.calls == 1
+        assert zrx_order.fee_recipient == FEE_RECIPIENT
+        assert zrx_order.maker_fee == Wad(0)
+        assert zrx_order.taker_fee == Wad(0)
+
+    def test_should_request_fees_again_after_ttl(self):
+        # given
+        relayer_api = FakeRelayerApi()
+        fee_cache = RelayerFeeCache(relayer_api, ttl=600, clock=self.clock)
+        fee_cache.calculate_fees(order(self.exchange, self.maker, salt=1))
+
+        # when
+        self.time += 601
+        fee_cache.calculate_fees(order(self.exchange, self.maker, salt=2))
+
+        # then
+        assert relayer_api.calls == 2
+
+    def test_should_not_reuse_non_zero_fees(self):
+        # given
+        relayer_api = FakeRelayerApi(maker_fee=Wad.from_number(0.1))
+        fee_cache = RelayerFeeCache(relayer_api, ttl=600, clock=self.clock)
+
+        # when
+        fee_cache.calculate_fees(order(self.exchange, self.maker, salt=1))
+        fee_cache.calculate_fees(order(self.exchange, self.maker, salt=2))
+
+        # then
+        assert relayer_api.calls == 2
+
+
+class TestPresignedOrders:
+    def setup_method(self):
+        self.time = 1010.0
+        self.presigned_orders = PresignedOrders(expiration_step=60, clock=lambda: self.time)
+
+    def key(self, price=100, amount=1, expiration=1080):
+        return PresignedOrders.key(True, Wad.from_number(price), Wad.from_number(amount), expiration)
+
+    def test_should_round_expirations_up(self):
+        # expect
+        assert self.presigned_orders.expiration(60) == 1080
+        assert self.presigned_orders.expiration(50) == 1080
+
+        # when
+        self.time = 1020.0
+
+        # then
+        assert self.presigned_orders.expiration(60) == 1080
+        assert self.presigned_orders.expiration(61) == 1140
+
+    def test_should_return_presigned_order_only_once(self):
+        # given
+        self.presigned_orders.reserve(self.key())
+        self.presigned_orders.add(self.key(), 'signed order')
+
+        # expect
+        assert self.presigned_orders.take(self.key(price=101)) is None
+        assert self.presigned_orders.take(self.key(amount=2)) is None
+        assert self.presigned_orders.take(self.key(expiration=1140)) is None
+        assert self.presigned_orders.take(self.key()) == 'signed order'
+        assert self.presigned_orders.take(self.key()) is None
+
+    def test_should_reserve_keys_only_once(self):
+        # expect
+        assert self.presigned_orders.reserve(self.key())
+        assert not self.presigned_orders.reserve(self.key())
+        assert self.presigned_orders.take(self.key()) is None
+        assert len(self.presigned_orders) == 0
+
+    def test_should_release_reservation_if_signing_failed(self):
+        # given
+        self.presigned_orders.reserve(self.key())
+
+        # when
+        self.presigned_orders.add(self.key(), None)
+
+        # then
+        assert self.presigned_orders.reserve(self.key())
+
+    def test_should_remove_expired_orders(self):
+        # given
+        for expiration in [1080, 1140]:
+            self.presigned_orders.reserve(self.key(expiration=expiration))
+            self.presigned_orders.add(self.key(expiration=expiration), f"signed order {expiration}")
+
+        # when
+        self.presigned_orders.remove_expired(1140)
+
+        # then
+        assert len(self.presigned_orders) == 1
+        assert self.presigned_orders.take(self.key(expiration=1140)) == 'signed order 1140'
@@ -0,0 +1,224 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2017-2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from eth_abi import encode_abi
+from eth_utils import decode_hex, encode_hex, function_signature_to_4byte_selector
+
+from market_maker_keeper.zrx_exchange import LocalZrxExchange
+from market_maker_keeper.zrx_order_tracker import ZrxOrderTracker
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.zrx import Order
+
+EXCHANGE_ADDRESS = Address('0x12459c951127e0c374ff9105dda097662a027093')
+OUR_ADDRESS = Address('0x00000000000000000000000000000000000000aa')
+OTHER_ADDRESS = Address('0x00000000000000000000000000000000000000bb')
+WETH_TOKEN = Address('0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2')
+DAI_TOKEN = Address('0x89d24a6b4ccb1b6faa2625fe562bdd9a23260359')
+
+GET_UNAVAILABLE = function_signature_to_4byte_selector('getUnavailableTakerTokenAmount(bytes32)')
+
+
+class FakeNode:
+    """Keeps unavailable amounts of orders and `LogFill`/`LogCancel` events, as the 0x contract and the node would."""
+
+    def __init__(self):
+        self.blockNumber = 100
+        self.unavailable = {}
+        self.logs = []
+        self.calls = []
+
+    def _log(self, topic, maker: Address, order_hash: str):
+        self.logs.append({'address': EXCHANGE_ADDRESS.address,
+                          'topics': [topic, '0x' + maker.address[2:].rjust(64, '0')],
+                          'data': encode_hex(encode_abi(['address', 'uint256', 'bytes32'],
+                                                        [OTHER_ADDRESS.address, 1, decode_hex(order_hash)])),
+                          'blockNumber': hex(self.blockNumber),
+                          'logIndex': hex(len(self.logs))})
+
+    def fill(self, order_hash: str, amount: Wad, maker: Address = OUR_ADDRESS):
+        self.unavailable[order_hash] = self.unavailable.get(order_hash, Wad(0)) + amount
+        self._log(ZrxOrderTracker.LOG_FILL_TOPIC, maker, order_hash)
+
+    def cancel(self, order_hash: str, amount: Wad, maker: Address = OUR_ADDRESS):
+        self.unavailable[order_hash] = self.unavailable.get(order_hash, Wad(0)) + amount
+        self._log(ZrxOrderTracker.LOG_CANCEL_TOPIC, maker, order_hash)
+
+    def request_blocking(self, method, params):
+        assert method == "eth_getLogs"
+        self.calls.append('eth_getLogs')
+
+        from_block, to_block = int(params[0]['fromBlock'], 16), int(params[0]['toBlock'], 16)
+        return [log for log in self.logs if from_block <= int(log['blockNumber'], 16) <= to_block
+                and log['topics'][0] in params[0]['topics'][0] and log['topics'][1] == params[0]['topics'][1]]
+
+    def call(self, transaction):
+        data = decode_hex(transaction['data'])
+        assert data[:4] == GET_UNAVAILABLE
+        self.calls.append('getUnavailableTakerTokenAmount')
+
+        return encode_hex(encode_abi(['uint256'], [self.unavailable.get(encode_hex(data[4:36]), Wad(0)).value]))
+
+
+class FakeWeb3:
+    def __init__(self, node: FakeNode):
+        self.eth = node
+        self.manager = node
+        self.providers = [object()]
+        self.calls = []
+
+
+class TestZrxOrderTracker:
+    def setup_method(self):
+        self.node = FakeNode()
+        self.web3 = FakeWeb3(self.node)
+        self.zrx_exchange = LocalZrxExchange(web3=self.web3, address=EXCHANGE_ADDRESS)
+        self.tracker = ZrxOrderTracker(web3=self.web3, zrx_exchange=self.zrx_exchange, our_address=OUR_ADDRESS)
+        self.order_1 = self.order(salt=1)
+        self.order_2 = self.order(salt=2)
+
+    def order(self, salt: int, expiration: int = 2000):
+        return Order(exchange=self.zrx_exchange,
+                     maker=OUR_ADDRESS,
+                     taker=Address('0x0000000000000000000000000000000000000000'),
+                     maker_fee=Wad(0),
+                     taker_fee=Wad(0),
+                     pay_token=WETH_TOKEN,
+                     pay_amount=Wad.from_number(1),
+                     buy_token=DAI_TOKEN,
+                     buy_amount=Wad.from_number(500),
+                     salt=salt,
+                     fee_recipient=Address('0x0000000000000000000000000000000000000000'),
+                     expiration=expiration,
+                     exchange_contract_address=EXCHANGE_ADDRESS,
+                     ec_signature_r=None,
+                     ec_signature_s=None,
+                     ec_signature_v=None)
+
+    def hash(self, zrx_order) -> str:
+        return self.zrx_exchange.get_order_hash(zrx_order)
+
+    def update(self, min_expiration: int = 1000) -> list:
+        return self.tracker.update(self.node.blockNumber, min_expiration)
+
+    def test_should_not_read_amounts_of_orders_we_have_placed(self):
+        # given
+        self.tracker.order_placed(self.order_1)
+
+        # when
+        orders = self.update()
+
+        # then
+        assert orders == [self.order_1]
+        assert self.node.calls == []
+        assert self.zrx_exchange.get_unavailable_buy_amount(self.order_1) == Wad(0)
+
+    def test_should_read_amounts_of_new_relayer_orders_only_once(self):
+        # given
+        self.node.unavailable[self.hash(self.order_2)] = Wad.from_number(100)
+        self.tracker.add_orders([self.order_1, self.order_2])
+        self.update()
+
+        # when
+        self.node.blockNumber += 1
+        self.tracker.add_orders([self.order_1, self.order_2])
+        orders = self.update()
+
+        # then
+        assert orders == [self.order_1, self.order_2]
+        assert self.node.calls == ['getUnavailableTakerTokenAmount', 'getUnavailableTakerTokenAmount', 'eth_getLogs']
+        assert self.zrx_exchange.get_unavailable_buy_amount(self.order_2) == Wad.from_number(100)
+
+    def test_should_not_fetch_events_if_no_new_block(self):
+        # given
+        self.tracker.order_placed(self.order_1)
+        self.update()
+
+        # when
+        self.update()
+
+        # then
+        assert self.node.calls == []
+
+    def test_should_read_amounts_again_only_for_filled_orders(self):
+        # given
+        self.tracker.order_placed(self.order_1)
+        self.tracker.order_placed(self.order_2)
+        self.update()
+
+        # when
+        self.node.blockNumber += 1
+        self.node.fill(self.hash(self.order_2), Wad.from_number(200))
+        orders = self.update()
+
+        # then
+        assert orders == [self.order_1, self.order_2]
+        assert self.node.calls == ['eth_getLogs', 'getUnavailableTakerTokenAmount']
+        assert self.zrx_exchange.get_unavailable_buy_amount(self.order_2) == Wad.from_number(200)
+
+    def test_should_remove_fully_filled_and_cancelled_orders(self):
+        # given
+        self.tracker.order_placed(self.order_1)
+        self.tracker.order_placed(self.order_2)
+        self.update()
+
+        # when
+        self.node.blockNumber += 1
+        self.node.fill(self.hash(self.order_1), Wad.from_number(500))
+        self.node.cancel(self.hash(self.order_2), Wad.from_number(500))
+
+        # then
+        assert self.update() == []
+
+    def test_should_not_add_closed_orders_returned_by_the_relayer_again(self):
+        # given
+        self.tracker.order_placed(self.order_1)
+        self.update()
+        self.node.blockNumber += 1
+        self.node.cancel(self.hash(self.order_1), Wad.from_number(500))
+        self.update()
+
+        # when
+        self.node.calls = []
+        self.tracker.add_orders([self.order_1])
+
+        # then
+        assert self.update() == []
+        assert self.node.calls == []
+
+    def test_should_ignore_events_of_other_makers(self):
+        # given
+        self.tracker.order_placed(self.order_1)
+        self.update()
+
+        # when
+        self.node.blockNumber += 1
+        self.node.fill(self.hash(self.order_1), Wad.from_number(500), maker=OTHER_ADDRESS)
+
+        # then
+        assert self.update() == [self.order_1]
+        assert self.node.calls == ['eth_getLogs']
+
+    def test_should_drop_expired_orders(self):
+        # given
+        expiring_order = self.order(salt=3, expiration=1100)
+        self.tracker.order_placed(self.order_1)
+        self.tracker.order_placed(expiring_order)
+
+        # expect
+        assert self.update(min_expiration=1000) == [self.order_1, expiring_order]
+        assert self.update(min_expiration=1100) == [self.order_1]